@@ -1,605 +1,2221 @@
-import os
-import json
-import pickle
-from typing import List, Dict, Any
-import numpy as np
-import requests
-import fitz  # PyMuPDF
-import arxiv
-from sentence_transformers import SentenceTransformer
-import faiss
-import tiktoken
-from fastapi import FastAPI, Request, Form
-from fastapi.templating import Jinja2Templates
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse
-import uvicorn
-from pathlib import Path
-
-class ArxivRAGSystem:
-    def __init__(self, model_name: str = "all-MiniLM-L6-v2"):
-        """Initialize the RAG system with embedding model and FAISS index."""
-        self.model = SentenceTransformer(model_name)
-        self.encoder = tiktoken.get_encoding("cl100k_base")
-        self.papers = []
-        self.chunks = []
-        self.embeddings = None
-        self.faiss_index = None
-        self.chunk_to_paper = []  # Maps chunk index to paper index
-        
-    def download_arxiv_papers(self, category: str = "cs.CL", max_results: int = 50) -> List[Dict]:
-        """Download arXiv papers from specified category."""
-        print(f"Searching for {max_results} papers in {category}...")
-        
-        # Search for papers
-        search = arxiv.Search(
-            query=f"cat:{category}",
-            max_results=max_results,
-            sort_by=arxiv.SortCriterion.SubmittedDate
-        )
-        
-        papers = []
-        for result in search.results():
-            paper_info = {
-                'title': result.title,
-                'authors': [author.name for author in result.authors],
-                'summary': result.summary,
-                'pdf_url': result.pdf_url,
-                'published': result.published.strftime("%Y-%m-%d"),
-                'arxiv_id': result.entry_id.split('/')[-1]
-            }
-            papers.append(paper_info)
-            print(f"Found: {paper_info['title']}")
-        
-        self.papers = papers
-        return papers
-    
-    def download_pdf(self, pdf_url: str, filename: str) -> str:
-        """Download PDF from arXiv URL."""
-        try:
-            response = requests.get(pdf_url)
-            response.raise_for_status()
-            
-            pdf_path = f"downloads/{filename}.pdf"
-            os.makedirs("downloads", exist_ok=True)
-            
-            with open(pdf_path, 'wb') as f:
-                f.write(response.content)
-            
-            return pdf_path
-        except Exception as e:
-            print(f"Error downloading {pdf_url}: {e}")
-            return None
-    
-    def extract_text_from_pdf(self, pdf_path: str) -> str:
-        """Extract text from PDF using PyMuPDF."""
-        try:
-            doc = fitz.open(pdf_path)
-            text = ""
-            for page in doc:
-                text += page.get_text()
-            doc.close()
-            return text
-        except Exception as e:
-            print(f"Error extracting text from {pdf_path}: {e}")
-            return ""
-    
-    def clean_text(self, text: str) -> str:
-        """Clean and normalize text."""
-        # Remove extra whitespace
-        text = ' '.join(text.split())
-        # Remove special characters that might cause issues
-        text = text.replace('\x00', '')
-        return text
-    
-    def count_tokens(self, text: str) -> int:
-        """Count tokens using tiktoken."""
-        return len(self.encoder.encode(text))
-    
-    def chunk_text(self, text: str, max_tokens: int = 512, overlap: int = 50) -> List[str]:
-        """Split text into chunks with token limit."""
-        tokens = self.encoder.encode(text)
-        chunks = []
-        
-        if len(tokens) <= max_tokens:
-            chunks.append(self.encoder.decode(tokens))
-            return chunks
-        
-        step = max_tokens - overlap
-        for i in range(0, len(tokens), step):
-            chunk_tokens = tokens[i:i + max_tokens]
-            chunk_text = self.encoder.decode(chunk_tokens)
-            chunks.append(chunk_text)
-            
-            if i + max_tokens >= len(tokens):
-                break
-        
-        return chunks
-    
-    def process_papers(self):
-        """Download, extract, and chunk all papers."""
-        print("Processing papers...")
-        
-        for i, paper in enumerate(self.papers):
-            print(f"Processing paper {i+1}/{len(self.papers)}: {paper['title']}")
-            
-            # Download PDF
-            pdf_path = self.download_pdf(paper['pdf_url'], paper['arxiv_id'])
-            if not pdf_path:
-                continue
-            
-            # Extract text
-            text = self.extract_text_from_pdf(pdf_path)
-            if not text:
-                continue
-            
-            # Clean text
-            text = self.clean_text(text)
-            
-            # Chunk text
-            paper_chunks = self.chunk_text(text)
-            
-            # Add chunks with paper reference
-            for chunk in paper_chunks:
-                self.chunks.append(chunk)
-                self.chunk_to_paper.append(i)
-            
-            # Clean up downloaded PDF
-            try:
-                os.remove(pdf_path)
-            except:
-                pass
-        
-        print(f"Total chunks created: {len(self.chunks)}")
-    
-    def create_embeddings(self):
-        """Generate embeddings for all chunks."""
-        print("Generating embeddings...")
-        self.embeddings = self.model.encode(self.chunks, show_progress_bar=True)
-        print(f"Embeddings shape: {self.embeddings.shape}")
-    
-    def build_faiss_index(self):
-        """Build FAISS index for similarity search."""
-        print("Building FAISS index...")
-        dimension = self.embeddings.shape[1]
-        self.faiss_index = faiss.IndexFlatL2(dimension)
-        self.faiss_index.add(self.embeddings.astype('float32'))
-        print("FAISS index built successfully")
-    
-    def search(self, query: str, top_k: int = 5) -> List[Dict]:
-        """Search for relevant chunks given a query."""
-        # Encode query
-        query_embedding = self.model.encode([query])
-        
-        # Search FAISS index
-        distances, indices = self.faiss_index.search(
-            query_embedding.astype('float32'), top_k
-        )
-        
-        results = []
-        for i, (distance, idx) in enumerate(zip(distances[0], indices[0])):
-            if idx < len(self.chunks):
-                paper_idx = self.chunk_to_paper[idx]
-                results.append({
-                    'chunk': self.chunks[idx],
-                    'paper_title': self.papers[paper_idx]['title'],
-                    'paper_authors': self.papers[paper_idx]['authors'],
-                    'paper_summary': self.papers[paper_idx]['summary'],
-                    'paper_url': self.papers[paper_idx]['pdf_url'],
-                    'arxiv_id': self.papers[paper_idx]['arxiv_id'],
-                    'published': self.papers[paper_idx]['published'],
-                    'similarity_score': float(1 / (1 + distance)),
-                    'rank': i + 1
-                })
-        
-        return results
-    
-    def save_system(self, filename: str = "rag_system.pkl"):
-        """Save the RAG system to disk."""
-        data = {
-            'papers': self.papers,
-            'chunks': self.chunks,
-            'embeddings': self.embeddings,
-            'chunk_to_paper': self.chunk_to_paper
-        }
-        with open(filename, 'wb') as f:
-            pickle.dump(data, f)
-        print(f"System saved to {filename}")
-    
-    def load_system(self, filename: str = "rag_system.pkl"):
-        """Load the RAG system from disk."""
-        try:
-            with open(filename, 'rb') as f:
-                data = pickle.load(f)
-            
-            self.papers = data['papers']
-            self.chunks = data['chunks']
-            self.embeddings = data['embeddings']
-            self.chunk_to_paper = data['chunk_to_paper']
-            
-            # Rebuild FAISS index
-            self.build_faiss_index()
-            print(f"System loaded from {filename}")
-            return True
-        except FileNotFoundError:
-            print(f"File {filename} not found")
-            return False
-
-# Initialize FastAPI app
-app = FastAPI(title="arXiv CS.CL RAG System")
-templates = Jinja2Templates(directory="templates")
-
-# Create templates directory
-os.makedirs("templates", exist_ok=True)
-
-# Global RAG system instance
-rag_system = ArxivRAGSystem()
-
-@app.get("/", response_class=HTMLResponse)
-async def home(request: Request):
-    """Home page with search interface."""
-    return templates.TemplateResponse("index.html", {"request": request})
-
-@app.post("/search")
-async def search_papers(query: str = Form(...)):
-    """Search papers and return relevant chunks."""
-    if not rag_system.faiss_index:
-        return {"error": "RAG system not initialized. Please run the data collection first."}
-    
-    results = rag_system.search(query, top_k=5)
-    return {"query": query, "results": results}
-
-@app.post("/initialize")
-async def initialize_system():
-    """Initialize the RAG system by downloading and processing papers."""
-    try:
-        # Download papers
-        rag_system.download_arxiv_papers(category="cs.CL", max_results=50)
-        
-        # Process papers
-        rag_system.process_papers()
-        
-        # Create embeddings
-        rag_system.create_embeddings()
-        
-        # Build FAISS index
-        rag_system.build_faiss_index()
-        
-        # Save system
-        rag_system.save_system()
-        
-        return {"message": "System initialized successfully", "papers": len(rag_system.papers), "chunks": len(rag_system.chunks)}
-    except Exception as e:
-        return {"error": str(e)}
-
-@app.get("/status")
-async def get_status():
-    """Get system status."""
-    return {
-        "initialized": rag_system.faiss_index is not None,
-        "papers": len(rag_system.papers),
-        "chunks": len(rag_system.chunks) if rag_system.chunks else 0
-    }
-
-# Create HTML template
-html_template = """
-<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>arXiv CS.CL RAG System</title>
-    <style>
-        body {
-            font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-            max-width: 1200px;
-            margin: 0 auto;
-            padding: 20px;
-            background-color: #f5f5f5;
-        }
-        .container {
-            background: white;
-            padding: 30px;
-            border-radius: 10px;
-            box-shadow: 0 2px 10px rgba(0,0,0,0.1);
-        }
-        h1 {
-            color: #2c3e50;
-            text-align: center;
-            margin-bottom: 30px;
-        }
-        .search-section {
-            margin-bottom: 30px;
-        }
-        .search-box {
-            display: flex;
-            gap: 10px;
-            margin-bottom: 20px;
-        }
-        input[type="text"] {
-            flex: 1;
-            padding: 12px;
-            border: 2px solid #ddd;
-            border-radius: 5px;
-            font-size: 16px;
-        }
-        button {
-            padding: 12px 24px;
-            background-color: #3498db;
-            color: white;
-            border: none;
-            border-radius: 5px;
-            cursor: pointer;
-            font-size: 16px;
-        }
-        button:hover {
-            background-color: #2980b9;
-        }
-        .init-button {
-            background-color: #e74c3c;
-            margin-bottom: 20px;
-        }
-        .init-button:hover {
-            background-color: #c0392b;
-        }
-        .status {
-            background-color: #ecf0f1;
-            padding: 15px;
-            border-radius: 5px;
-            margin-bottom: 20px;
-        }
-        .results {
-            margin-top: 20px;
-        }
-        .result-item {
-            background-color: #f8f9fa;
-            padding: 20px;
-            margin-bottom: 15px;
-            border-radius: 5px;
-            border-left: 4px solid #3498db;
-        }
-        .paper-title {
-            font-weight: bold;
-            color: #2c3e50;
-            margin-bottom: 10px;
-            cursor: help;
-            position: relative;
-            border-bottom: 1px dotted #bdc3c7;
-        }
-        .paper-title:hover::after {
-            content: "📖 " attr(data-summary);
-            position: absolute;
-            bottom: 100%;
-            left: 0;
-            background: #34495e;
-            color: white;
-            padding: 15px;
-            border-radius: 8px;
-            font-size: 14px;
-            font-weight: normal;
-            max-width: 500px;
-            z-index: 1000;
-            box-shadow: 0 4px 20px rgba(0,0,0,0.3);
-            line-height: 1.4;
-        }
-        .paper-authors {
-            color: #7f8c8d;
-            margin-bottom: 10px;
-        }
-        .chunk-text {
-            background-color: white;
-            padding: 15px;
-            border-radius: 5px;
-            margin-top: 10px;
-            border: 1px solid #ddd;
-        }
-        .similarity-score {
-            color: #27ae60;
-            font-weight: bold;
-        }
-        .paper-actions {
-            margin-top: 15px;
-            display: flex;
-            gap: 10px;
-            flex-wrap: wrap;
-        }
-        .open-paper-btn {
-            background-color: #e67e22;
-            color: white;
-            padding: 8px 16px;
-            border: none;
-            border-radius: 5px;
-            cursor: pointer;
-            font-size: 14px;
-            text-decoration: none;
-            display: inline-block;
-        }
-        .open-paper-btn:hover {
-            background-color: #d35400;
-        }
-        .paper-meta {
-            display: flex;
-            gap: 15px;
-            margin-bottom: 15px;
-            flex-wrap: wrap;
-        }
-        .arxiv-id {
-            color: #7f8c8d;
-            font-size: 12px;
-            font-family: monospace;
-            background-color: #ecf0f1;
-            padding: 4px 8px;
-            border-radius: 3px;
-        }
-        .paper-date {
-            color: #7f8c8d;
-            font-size: 12px;
-            background-color: #ecf0f1;
-            padding: 4px 8px;
-            border-radius: 3px;
-        }
-        .loading {
-            text-align: center;
-            color: #7f8c8d;
-            font-style: italic;
-        }
-    </style>
-</head>
-<body>
-    <div class="container">
-        <h1>📚 arXiv CS.CL RAG System</h1>
-        
-        <div class="search-section">
-            <button class="init-button" onclick="initializeSystem()">🚀 Initialize System (Download 50 Papers)</button>
-            
-            <div class="status" id="status">
-                <strong>Status:</strong> <span id="statusText">Not initialized</span>
-            </div>
-            
-            <div class="search-box">
-                <input type="text" id="queryInput" placeholder="Enter your question about CS.CL papers..." />
-                <button onclick="searchPapers()">🔍 Search</button>
-            </div>
-            
-            <div style="text-align: center; color: #7f8c8d; font-size: 14px; margin-top: 10px;">
-                💡 <strong>Tip:</strong> Hover over paper titles to see summaries, click "Open Full Paper" to read the complete article
-            </div>
-        </div>
-        
-        <div id="results" class="results"></div>
-    </div>
-
-    <script>
-        // Check status on page load
-        window.onload = function() {
-            checkStatus();
-        };
-
-        async function checkStatus() {
-            try {
-                const response = await fetch('/status');
-                const data = await response.json();
-                updateStatus(data);
-            } catch (error) {
-                console.error('Error checking status:', error);
-            }
-        }
-
-        function updateStatus(data) {
-            const statusText = document.getElementById('statusText');
-            if (data.initialized) {
-                statusText.innerHTML = `✅ Initialized - ${data.papers} papers, ${data.chunks} chunks`;
-            } else {
-                statusText.innerHTML = `❌ Not initialized`;
-            }
-        }
-
-        async function initializeSystem() {
-            const button = event.target;
-            const originalText = button.textContent;
-            button.textContent = '⏳ Initializing...';
-            button.disabled = true;
-            
-            try {
-                const response = await fetch('/initialize', { method: 'POST' });
-                const data = await response.json();
-                
-                if (data.error) {
-                    alert('Error: ' + data.error);
-                } else {
-                    alert('System initialized successfully!');
-                    checkStatus();
-                }
-            } catch (error) {
-                alert('Error initializing system: ' + error);
-            } finally {
-                button.textContent = originalText;
-                button.disabled = false;
-            }
-        }
-
-        async function searchPapers() {
-            const query = document.getElementById('queryInput').value.trim();
-            if (!query) {
-                alert('Please enter a search query');
-                return;
-            }
-
-            const resultsDiv = document.getElementById('results');
-            resultsDiv.innerHTML = '<div class="loading">Searching...</div>';
-
-            try {
-                const formData = new FormData();
-                formData.append('query', query);
-
-                const response = await fetch('/search', {
-                    method: 'POST',
-                    body: formData
-                });
-
-                const data = await response.json();
-                
-                if (data.error) {
-                    resultsDiv.innerHTML = `<div class="error">${data.error}</div>`;
-                } else {
-                    displayResults(data);
-                }
-            } catch (error) {
-                resultsDiv.innerHTML = '<div class="error">Error performing search</div>';
-                console.error('Search error:', error);
-            }
-        }
-
-        function displayResults(data) {
-            const resultsDiv = document.getElementById('results');
-            
-            if (!data.results || data.results.length === 0) {
-                resultsDiv.innerHTML = '<div class="loading">No results found</div>';
-                return;
-            }
-
-            let html = `<h3>🔍 Search Results for: "${data.query}"</h3>`;
-            
-            data.results.forEach(result => {
-                html += `
-                    <div class="result-item">
-                        <div class="paper-title" data-summary="${result.paper_summary}">📄 ${result.paper_title}</div>
-                        <div class="paper-authors">👥 Authors: ${result.paper_authors.join(', ')}</div>
-                        <div class="paper-meta">
-                            <div class="arxiv-id">📚 arXiv ID: ${result.arxiv_id}</div>
-                            <div class="paper-date">📅 Published: ${result.published || 'N/A'}</div>
-                            <div class="similarity-score">🎯 Relevance: ${(result.similarity_score * 100).toFixed(1)}%</div>
-                        </div>
-                        <div class="chunk-text">${result.chunk}</div>
-                        <div class="paper-actions">
-                            <a href="${result.paper_url}" target="_blank" class="open-paper-btn">🔗 Open Full Paper</a>
-                        </div>
-                    </div>
-                `;
-            });
-            
-            resultsDiv.innerHTML = html;
-        }
-
-        // Allow Enter key to trigger search
-        document.getElementById('queryInput').addEventListener('keypress', function(e) {
-            if (e.key === 'Enter') {
-                searchPapers();
-            }
-        });
-    </script>
-</body>
-</html>
-"""
-
-# Create the HTML template file
-with open("templates/index.html", "w", encoding="utf-8") as f:
-    f.write(html_template)
-
-if __name__ == "__main__":
-    print("Starting arXiv CS.CL RAG System...")
-    print("1. First, visit http://localhost:8000")
-    print("2. Click 'Initialize System' to download and process 50 CS.CL papers")
-    print("3. Once initialized, you can search through the papers")
-    
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+import os
+import asyncio
+import copy
+import json
+import pickle
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import asynccontextmanager
+from typing import List, Dict, Any, Optional, Tuple
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+import faiss
+import tiktoken
+from embedding_cache import EmbeddingCache, content_hash
+from index_store import save_index, load_index
+from query_batcher import QueryBatcher
+from result_cache import ResultCache
+from index_factory import (build_index, prepare_vectors, similarity_from_distance, tune_index, resolve_params,
+                           supports_removal, supports_selector, search_parameters, uses_inner_product,
+                           index_memory_bytes, rescore, QUANTIZED_TYPES)
+from lexical_index import LexicalIndex, reciprocal_rank_fusion, weighted_fusion
+from chunker import SpanChunker
+from metadata_store import ChunkStore, PaperTable, append_array, group_hits
+from build_job import BuildJob, BuildRunner
+from embedding_engine import EmbeddingEngine, load_model, open_output
+from reranker import Reranker, DEFAULT_RERANK_MODEL
+from sharded_index import ShardedRAGSystem, DEFAULT_SHARDS
+from pdf_extract import PageExtractor, join_pages, span_pages
+from dedup import SimHasher, NearDuplicateIndex
+from filter_index import ChunkFilter, FilterIndex, normalize_filters
+from paper_index import normalize_rows, paper_text, select_papers
+from checkpoint import BuildCheckpoint
+from index_versions import BuildLock, current_dir, next_dir, publish
+from answer import AnswerGenerator, make_llm
+from metrics import (REGISTRY, HTTP_REQUEST_SECONDS, HTTP_REQUESTS, SEARCH_STREAM_SECONDS, ANSWER_SECONDS, stage,
+                     server_timing, hit_ratio, resident_memory_bytes)
+from fastapi import FastAPI, Request, Response, Form
+from fastapi.templating import Jinja2Templates
+from fastapi.staticfiles import StaticFiles
+from fastapi.responses import HTMLResponse, PlainTextResponse, StreamingResponse
+from starlette.concurrency import iterate_in_threadpool
+import uvicorn
+from pathlib import Path
+
+class ArxivRAGSystem:
+    def __init__(self, model_name: str = "all-MiniLM-L6-v2", cache_path: str = "embedding_cache.sqlite",
+                 index_type: str = "flat_ip", index_params: Optional[Dict[str, Any]] = None,
+                 chunking: str = "spans", respect_boundaries: bool = False,
+                 embedding_backend: str = "torch", embedding_processes: Optional[int] = None,
+                 rerank_model: Optional[str] = DEFAULT_RERANK_MODEL, rerank_budget_ms: float = 100.0,
+                 extract_processes: int = 0, dedup_distance: Optional[int] = 3):
+        """Initialize the RAG system with embedding model and FAISS index.
+        
+        `index_type` is one of index_factory.INDEX_TYPES; `index_params` overrides
+        nlist/nprobe/pq_m/pq_bits/hnsw_m/ef_construction/ef_search. `chunking` is
+        "spans" (offset-based chunks of the extracted text, optionally snapped to
+        sentence/section boundaries) or "legacy" (flatten, encode, decode per window).
+        `embedding_backend` is "torch", "onnx" or "onnx-int8" (see embedding_engine.py);
+        `embedding_processes` sizes the encode pool (default: half the cores, 0 = in-process).
+        The embedding model and tokenizer are loaded on first use (or by `warm_up`), and
+        the `rerank_model` cross-encoder on the first reranked search.
+        `extract_processes` > 0 runs PDF page extraction on a process pool of that size.
+        Chunks whose SimHash is within `dedup_distance` bits of an earlier chunk's are
+        near-duplicates and are neither embedded nor indexed (None disables dedup).
+        """
+        self.model_name = model_name
+        self.index_type = index_type
+        self.index_params = resolve_params(index_params)
+        self.embedding_engine = EmbeddingEngine(model_name, embedding_backend, processes=embedding_processes)
+        self.embedding_cache = EmbeddingCache(cache_path) if cache_path else None
+        self.chunking = chunking
+        self.respect_boundaries = respect_boundaries
+        # Tokenizer and chunker, created on first use and shared with spawned systems
+        self.resources: Dict[str, Any] = {}
+        self.resources_lock = threading.RLock()
+        self.page_extractor = PageExtractor(extract_processes)
+        self.dedup_distance = dedup_distance
+        self.simhasher = SimHasher()
+        self.rerank_model = rerank_model
+        self.rerank_budget_ms = rerank_budget_ms
+        self.reranker = None
+        self.reranker_lock = threading.Lock()
+        self.reset()
+    
+    def build_config(self) -> Dict[str, Any]:
+        """The settings that decide a build's chunks and vectors; a checkpoint is only resumed if they match."""
+        return {'model_name': self.model_name, 'embedding_backend': self.embedding_engine.backend,
+                'chunking': self.chunking, 'respect_boundaries': self.respect_boundaries,
+                'dedup_distance': self.dedup_distance}
+    
+    def reset(self):
+        """Clear all papers, chunks and indexes (the model and caches are kept)."""
+        self.papers = PaperTable()
+        self.chunks = ChunkStore()
+        self.embeddings = None
+        self.embeddings_scratch = None  # .npy file embeddings were streamed into, until saved
+        self.faiss_index = None
+        self.lexical_index = None
+        self.chunk_to_paper = np.zeros(0, dtype=np.int32)  # Maps chunk index to paper index (-1 once removed)
+        self.chunk_spans = np.zeros((0, 2), dtype=np.int64)  # (start, end) character offsets of each chunk in its paper's text
+        self.chunk_pages = np.zeros((0, 2), dtype=np.int32)  # (first, last) zero-based PDF page of each chunk (-1 if unknown)
+        self.chunk_fingerprints = np.zeros(0, dtype=np.uint64)  # SimHash of each chunk (None until computed for old indexes)
+        self.chunk_canonical = np.zeros(0, dtype=np.int64)  # Representative chunk of each chunk (itself unless a duplicate)
+        self.duplicates = {}  # Representative chunk ID -> IDs of its live duplicates
+        self.dedup_index = None  # NearDuplicateIndex over representative fingerprints, built on first use
+        self.filter_index = None  # FilterIndex over paper metadata, rebuilt after papers or chunks change
+        self.filter_lock = threading.Lock()
+        self.paper_embeddings = None  # Unit title + abstract embedding per paper, for two-tier search (see paper_index.py)
+        self.paper_lock = threading.Lock()
+        self.last_ingest_stats = None
+        self.last_dedup_stats = None
+        self.index_path = None
+        self.index_mmapped = False
+        self.index_dir = None  # Directory this system was last saved to or loaded from
+    
+    @property
+    def model(self):
+        """The sentence-transformers model (loaded by the embedding engine on first use)."""
+        return self.embedding_engine.model
+    
+    def shared_resource(self, name: str, create):
+        with self.resources_lock:
+            if name not in self.resources:
+                self.resources[name] = create()
+            return self.resources[name]
+    
+    @property
+    def encoder(self):
+        return self.shared_resource('encoder', lambda: tiktoken.get_encoding("cl100k_base"))
+    
+    @property
+    def span_chunker(self) -> SpanChunker:
+        return self.shared_resource('span_chunker',
+                                    lambda: SpanChunker(self.encoder, respect_boundaries=self.respect_boundaries))
+    
+    def spawn(self) -> 'ArxivRAGSystem':
+        """An empty system with the same configuration, sharing the loaded model and caches.
+        
+        Background builds fill a spawned system while this one keeps serving queries.
+        """
+        system = copy.copy(self)
+        system.reset()
+        return system
+    
+    @property
+    def papers(self) -> PaperTable:
+        return self._papers
+    
+    @papers.setter
+    def papers(self, papers):
+        # Paper records live in a columnar table; plain lists of dicts are converted
+        self._papers = papers if isinstance(papers, PaperTable) else PaperTable(papers)
+        
+    def paper_info(self, result) -> Dict:
+        """Convert an arxiv search result into the paper record used by the system."""
+        return {
+            'title': result.title,
+            'authors': [author.name for author in result.authors],
+            'summary': result.summary,
+            'pdf_url': result.pdf_url,
+            'published': result.published.strftime("%Y-%m-%d"),
+            'arxiv_id': result.entry_id.split('/')[-1],
+            'primary_category': result.primary_category,
+            'categories': list(result.categories)
+        }
+    
+    def list_arxiv_papers(self, category: str = "cs.CL", max_results: int = 50,
+                          query: Optional[str] = None) -> List[Dict]:
+        """List the latest arXiv papers in a category (or matching `query`) without touching the index."""
+        import arxiv
+        print(f"Searching for {max_results} papers in {query or category}...")
+        
+        # Search for papers
+        search = arxiv.Search(
+            query=query or f"cat:{category}",
+            max_results=max_results,
+            sort_by=arxiv.SortCriterion.SubmittedDate
+        )
+        
+        papers = []
+        for result in search.results():
+            paper_info = self.paper_info(result)
+            papers.append(paper_info)
+            print(f"Found: {paper_info['title']}")
+        return papers
+    
+    def fetch_papers(self, arxiv_ids: List[str]) -> List[Dict]:
+        """Look up paper records for specific arXiv IDs."""
+        import arxiv
+        search = arxiv.Search(id_list=list(arxiv_ids), max_results=len(arxiv_ids))
+        return [self.paper_info(result) for result in search.results()]
+    
+    def download_arxiv_papers(self, category: str = "cs.CL", max_results: int = 50) -> List[Dict]:
+        """Download arXiv papers from specified category."""
+        papers = self.list_arxiv_papers(category, max_results)
+        self.papers = papers
+        return papers
+    
+    def make_session(self, pool_size: int = 8) -> requests.Session:
+        """Create an HTTP session whose connection pool is shared by all download workers."""
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=3)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+    
+    def fetch_pdf(self, pdf_url: str, session: Optional[requests.Session] = None) -> Optional[bytes]:
+        """Download a PDF from arXiv into memory."""
+        try:
+            http = session or requests
+            with http.get(pdf_url, timeout=60) as response:
+                response.raise_for_status()
+                return response.content
+        except Exception as e:
+            print(f"Error downloading {pdf_url}: {e}")
+            return None
+    
+    def extract_pages(self, pdf) -> List[str]:
+        """Extract the text of each page of a PDF (bytes or a file path) using PyMuPDF."""
+        try:
+            return self.page_extractor.extract(pdf)
+        except Exception as e:
+            print(f"Error extracting text from PDF: {e}")
+            return []
+    
+    def extract_text_from_pdf(self, pdf) -> str:
+        """Extract text from PDF using PyMuPDF."""
+        return join_pages(self.extract_pages(pdf))[0]
+    
+    def clean_text(self, text: str) -> str:
+        """Clean and normalize text."""
+        # Remove extra whitespace
+        text = ' '.join(text.split())
+        # Remove special characters that might cause issues
+        text = text.replace('\x00', '')
+        return text
+    
+    def count_tokens(self, text: str) -> int:
+        """Count tokens using tiktoken."""
+        return len(self.encoder.encode(text))
+    
+    def chunk_text(self, text: str, max_tokens: int = 512, overlap: int = 50) -> List[str]:
+        """Split text into chunks with token limit."""
+        tokens = self.encoder.encode(text)
+        chunks = []
+        
+        if len(tokens) <= max_tokens:
+            chunks.append(self.encoder.decode(tokens))
+            return chunks
+        
+        step = max_tokens - overlap
+        for i in range(0, len(tokens), step):
+            chunk_tokens = tokens[i:i + max_tokens]
+            chunk_text = self.encoder.decode(chunk_tokens)
+            chunks.append(chunk_text)
+            
+            if i + max_tokens >= len(tokens):
+                break
+        
+        return chunks
+    
+    def chunk_paper(self, pages: List[str]) -> Tuple[List[str], List[Tuple[int, int]], np.ndarray]:
+        """Chunk a paper's extracted pages, returning the chunks, their character spans and page ranges."""
+        text, page_starts = join_pages(pages)
+        if self.chunking == "legacy":
+            chunks = self.chunk_text(self.clean_text(text))
+            return chunks, [(-1, -1)] * len(chunks), np.full((len(chunks), 2), -1, dtype=np.int32)
+        
+        # Spans index into the joined page text, so it is never re-flowed
+        spans = self.span_chunker.spans(text)
+        return [text[start:end] for start, end in spans], spans, span_pages(spans, page_starts)
+    
+    def process_papers(self):
+        """Download, extract, and chunk all papers."""
+        print("Processing papers...")
+        
+        paper_chunks = {}
+        for i, paper in enumerate(self.papers):
+            print(f"Processing paper {i+1}/{len(self.papers)}: {paper['title']}")
+            
+            # Download PDF into memory
+            pdf = self.fetch_pdf(paper['pdf_url'])
+            if not pdf:
+                continue
+            
+            # Extract text page by page
+            pages = self.extract_pages(pdf)
+            if not any(pages):
+                continue
+            
+            # Chunk text
+            paper_chunks[i] = self.chunk_paper(pages)
+        
+        self.append_chunks(paper_chunks)
+        print(f"Total chunks created: {len(self.chunks)}")
+    
+    def append_chunks(self, paper_chunks: Dict[int, Tuple[List[str], List[Tuple[int, int]], np.ndarray]]):
+        """Append {paper index: (chunks, spans, pages)} in paper order, growing each array once."""
+        chunks, paper_ids, spans, pages = [], [], [], []
+        for i in sorted(paper_chunks):
+            texts, text_spans, text_pages = paper_chunks[i]
+            chunks.extend(texts)
+            paper_ids.extend([i] * len(texts))
+            spans.extend(text_spans)
+            pages.append(text_pages)
+        if not chunks:
+            return
+        self.dedup_chunks(chunks)
+        self.chunks.extend(chunks)
+        self.chunk_to_paper = append_array(self.chunk_to_paper, paper_ids)
+        self.chunk_spans = append_array(self.chunk_spans, spans)
+        self.chunk_pages = append_array(self.chunk_pages, np.concatenate(pages))
+        self.filter_index = None
+    
+    def ensure_fingerprints(self) -> np.ndarray:
+        """SimHash fingerprints of all chunks, computing them for indexes saved without any."""
+        if self.chunk_fingerprints is None:
+            self.chunk_fingerprints = self.simhasher.fingerprints(self.chunks)
+        return self.chunk_fingerprints
+    
+    def near_duplicate_index(self) -> NearDuplicateIndex:
+        """The fingerprints of live representative chunks, indexed on first use after a load."""
+        if self.dedup_index is None:
+            fingerprints = self.ensure_fingerprints()
+            self.dedup_index = NearDuplicateIndex(self.dedup_distance or 0)
+            for chunk_id in self.indexed_chunk_ids().tolist():
+                self.dedup_index.add(chunk_id, int(fingerprints[chunk_id]))
+        return self.dedup_index
+    
+    def dedup_chunks(self, chunks: List[str]) -> Dict[str, Any]:
+        """Map each chunk about to be appended that nearly repeats an earlier chunk to it.
+        
+        Each chunk's SimHash (over word 3-shingles, see dedup.py) is looked up among the
+        representatives so far, including earlier chunks of this batch. A match within
+        `dedup_distance` bits makes the chunk a duplicate: it keeps its row, paper and
+        pages, but only the representative is embedded and indexed, and hits on the
+        representative list the duplicates' papers in `also_in`.
+        """
+        start = time.perf_counter()
+        first_chunk = len(self.chunks)
+        index = self.near_duplicate_index() if self.dedup_distance is not None else None
+        fingerprints = self.simhasher.fingerprints(chunks)
+        canonical = np.arange(first_chunk, first_chunk + len(chunks), dtype=np.int64)
+        exact = 0
+        if index is not None:
+            for j, fingerprint in enumerate(fingerprints.tolist()):
+                representative = index.find(fingerprint)
+                if representative is None:
+                    index.add(first_chunk + j, fingerprint)
+                    continue
+                canonical[j] = representative
+                self.duplicates.setdefault(representative, []).append(first_chunk + j)
+                text = chunks[representative - first_chunk] if representative >= first_chunk else self.chunks[representative]
+                exact += text == chunks[j]
+        self.chunk_fingerprints = append_array(self.ensure_fingerprints(), fingerprints)
+        self.chunk_canonical = append_array(self.chunk_canonical, canonical)
+        
+        n_chunks = len(chunks)
+        duplicates = int(np.count_nonzero(canonical != np.arange(first_chunk, first_chunk + n_chunks)))
+        stats = {
+            'chunks': n_chunks,
+            'duplicates': duplicates,
+            'exact': exact,
+            'ratio': duplicates / n_chunks if n_chunks else 0.0,
+            'seconds': time.perf_counter() - start
+        }
+        self.last_dedup_stats = stats
+        print(f"Dedup: {duplicates}/{n_chunks} chunks are duplicates ({exact} exact, "
+              f"{stats['ratio']:.1%}) in {stats['seconds']:.2f}s")
+        return stats
+    
+    def release_duplicates(self, removed_chunks: np.ndarray) -> np.ndarray:
+        """Forget removed chunks in the duplicate map.
+        
+        A removed representative hands over to its first surviving duplicate, which
+        already holds a copy of its vector; the returned promoted chunk IDs still have
+        to be added to FAISS and BM25.
+        """
+        removed = set(removed_chunks.tolist())
+        promoted = []
+        for chunk_id in removed_chunks.tolist():
+            representative = int(self.chunk_canonical[chunk_id])
+            if representative != chunk_id:
+                if representative not in removed:
+                    self.duplicates[representative].remove(chunk_id)
+                    if not self.duplicates[representative]:
+                        del self.duplicates[representative]
+                continue
+            if self.dedup_index is not None:
+                self.dedup_index.remove(chunk_id)
+            survivors = [i for i in self.duplicates.pop(chunk_id, []) if i not in removed]
+            if survivors:
+                successor = survivors[0]
+                self.chunk_canonical[survivors] = successor
+                if survivors[1:]:
+                    self.duplicates[successor] = survivors[1:]
+                if self.dedup_index is not None:
+                    self.dedup_index.add(successor, int(self.chunk_fingerprints[successor]))
+                promoted.append(successor)
+        return np.asarray(promoted, dtype=np.int64)
+    
+    def restore_duplicates(self):
+        """Rebuild the representative -> duplicates map from `chunk_canonical` after a load."""
+        self.duplicates = {}
+        self.dedup_index = None
+        ids = self.live_chunk_ids()
+        ids = ids[self.chunk_canonical[ids] != ids]
+        for chunk_id, representative in zip(ids.tolist(), self.chunk_canonical[ids].tolist()):
+            self.duplicates.setdefault(representative, []).append(chunk_id)
+    
+    def process_papers_pipelined(self, max_downloads: int = 8, extract_workers: int = 4,
+                                 max_pending: int = 16, paper_indices: Optional[List[int]] = None,
+                                 job: Optional[BuildJob] = None,
+                                 checkpoint: Optional[BuildCheckpoint] = None) -> Dict[str, Any]:
+        """Download, extract, and chunk all papers with overlapping network and CPU work.
+        
+        Downloads run in a bounded thread pool sharing one pooled HTTP session, and each
+        finished PDF is handed, still in memory, to a second pool for PyMuPDF extraction
+        (optionally on the extract process pool) and tokenization. At most `max_pending`
+        papers are in flight between the two stages, so a slow extractor throttles the
+        downloader instead of piling PDFs up in memory. Chunks are
+        appended in paper order, so the result is identical to `process_papers`.
+        `paper_indices` restricts the run to a subset of `self.papers`. A `job` gets one
+        unit of progress per paper, and cancelling it stops new downloads.
+        With a `checkpoint`, each paper's progress is journaled as it happens, only its
+        pending papers are processed and the chunks of papers it already holds are
+        appended along with the new ones.
+        """
+        if paper_indices is None:
+            paper_indices = checkpoint.pending() if checkpoint else list(range(len(self.papers)))
+        print(f"Processing papers (pipelined: {max_downloads} downloads, {extract_workers} extract workers)...")
+        
+        start = time.perf_counter()
+        stage_times = {'download': 0.0, 'extract': 0.0, 'chunk': 0.0}
+        stats_lock = threading.Lock()
+        slots = threading.BoundedSemaphore(max_pending)
+        paper_chunks = dict(checkpoint.chunked) if checkpoint else {}
+        extract_futures = []
+        
+        def add_time(stage, t0):
+            with stats_lock:
+                stage_times[stage] += time.perf_counter() - t0
+        
+        def extract(i, pdf):
+            try:
+                t0 = time.perf_counter()
+                pages = self.extract_pages(pdf)
+                add_time('extract', t0)
+                if not any(pages):
+                    if checkpoint:
+                        checkpoint.record(i, 'empty')
+                    return
+                if checkpoint:
+                    checkpoint.record(i, 'extracted')
+                
+                t0 = time.perf_counter()
+                paper_chunks[i] = self.chunk_paper(pages)
+                add_time('chunk', t0)
+                if checkpoint:
+                    checkpoint.record_chunks(i, *paper_chunks[i])
+            except Exception as e:
+                if checkpoint:
+                    checkpoint.record(i, 'failed', error=str(e))
+                raise
+            finally:
+                slots.release()
+                if job:
+                    job.advance()
+        
+        def fetch(i, paper):
+            try:
+                t0 = time.perf_counter()
+                pdf = self.fetch_pdf(paper['pdf_url'], session=session)
+                add_time('download', t0)
+                if not pdf:
+                    slots.release()
+                    if job:
+                        job.advance()
+                    return
+                if checkpoint:
+                    checkpoint.record(i, 'fetched')
+                future = extract_pool.submit(extract, i, pdf)
+            except Exception as e:
+                # The slot only passes to `extract` once it is submitted; free it here
+                # so a failed fetch or submit cannot stall the download loop
+                slots.release()
+                if checkpoint:
+                    checkpoint.record(i, 'failed', error=str(e))
+                if job:
+                    job.advance()
+                raise
+            extract_futures.append(future)
+            print(f"Downloaded paper {i+1}/{len(self.papers)}: {paper['title']}")
+        
+        with self.make_session(max_downloads) as session, \
+                ThreadPoolExecutor(max_downloads) as download_pool, \
+                ThreadPoolExecutor(extract_workers) as extract_pool:
+            download_futures = []
+            for i in paper_indices:
+                # Backpressure: wait for a free slot before starting another download
+                slots.acquire()
+                if job and job.cancel_requested.is_set():
+                    break
+                download_futures.append(download_pool.submit(fetch, i, self.papers[i]))
+            
+            wait(download_futures)
+            wait(extract_futures)
+            for future in download_futures + extract_futures:
+                if future.exception():
+                    print(f"Error processing paper: {future.exception()}")
+        if job:
+            job.check()
+        
+        # Append in paper order so the index matches the serial path
+        self.append_chunks(paper_chunks)
+        
+        elapsed = time.perf_counter() - start
+        stats = {
+            'papers': len(paper_chunks),
+            'chunks': len(self.chunks),
+            'seconds': elapsed,
+            'papers_per_sec': len(paper_chunks) / elapsed if elapsed > 0 else 0.0,
+            'stage_seconds': stage_times
+        }
+        self.last_ingest_stats = stats
+        
+        print(f"Total chunks created: {len(self.chunks)}")
+        print(f"Ingested {stats['papers']} papers in {elapsed:.1f}s ({stats['papers_per_sec']:.2f} papers/sec)")
+        print("Stage time (summed over workers): " +
+              ", ".join(f"{stage} {seconds:.1f}s" for stage, seconds in stage_times.items()))
+        return stats
+    
+    def embed_chunks(self, chunks: List[str], job: Optional[BuildJob] = None,
+                     out: Optional[np.ndarray] = None, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """Embed chunks, reusing vectors from the on-disk cache and encoding only the misses.
+        
+        Vectors are written into `out` (e.g. a memory-mapped .npy file) as each batch
+        finishes, and new ones are added to the cache batch by batch. With `rows`, only
+        those positions of `chunks` are embedded; the other rows of `out` are left as is.
+        """
+        dimension = self.embedding_engine.dimension
+        embeddings = np.empty((len(chunks), dimension), dtype='float32') if out is None else out
+        rows = list(range(len(chunks))) if rows is None else [int(row) for row in rows]
+        if not rows:
+            return embeddings
+        
+        missing = rows
+        missing_hashes = None
+        if self.embedding_cache is not None:
+            hashes = [content_hash(chunks[row], self.embedding_engine.cache_key) for row in rows]
+            cached = self.embedding_cache.get_many(list(set(hashes)))
+            missing, missing_hashes = [], []
+            for row, key in zip(rows, hashes):
+                if key in cached:
+                    embeddings[row] = cached[key]
+                else:
+                    missing.append(row)
+                    missing_hashes.append(key)
+            del cached
+            print(f"Embedding cache: {len(rows) - len(missing)} hits, {len(missing)} misses")
+            if job:
+                job.advance(len(rows) - len(missing))
+        
+        def on_batch(positions, vectors):
+            if missing_hashes:
+                self.embedding_cache.put_many([missing_hashes[p] for p in positions], vectors)
+            if job:
+                job.advance(len(positions))
+                job.check()
+        
+        if missing:
+            self.embedding_engine.encode([chunks[i] for i in missing], out=embeddings,
+                                         rows=np.asarray(missing), on_batch=on_batch)
+        return embeddings
+    
+    def create_embeddings(self, job: Optional[BuildJob] = None, out_path: Optional[str] = None,
+                          checkpoint: Optional[BuildCheckpoint] = None):
+        """Generate embeddings for all chunks.
+        
+        With `out_path`, embeddings are streamed into a memory-mapped .npy file there
+        instead of being held in RAM; `save_system` moves them into the index.
+        With a `checkpoint`, they are streamed into its file instead, one window at a
+        time, and windows committed by an earlier run are skipped.
+        Only representative chunks are encoded; each duplicate's row gets a copy of
+        its representative's vector, so it can take over if the representative is removed.
+        """
+        print("Generating embeddings...")
+        out = None
+        if checkpoint:
+            self.embeddings = self.embed_windows(checkpoint, job)
+        else:
+            if out_path:
+                out = open_output(out_path, len(self.chunks), self.embedding_engine.dimension)
+                self.embeddings_scratch = out_path
+            self.embeddings = self.embed_chunks(self.chunks, job, out, rows=self.indexed_chunk_ids())
+        duplicates = np.flatnonzero(self.chunk_canonical != np.arange(len(self.chunks)))
+        if len(duplicates):
+            self.embeddings[duplicates] = self.embeddings[self.chunk_canonical[duplicates]]
+        if out is not None:
+            out.flush()
+        print(f"Embeddings shape: {self.embeddings.shape}")
+    
+    def embed_windows(self, checkpoint: BuildCheckpoint, job: Optional[BuildJob] = None) -> np.ndarray:
+        """Embed the indexed chunks into the checkpoint's file, committing every `checkpoint.window` chunks."""
+        ids = self.indexed_chunk_ids()
+        out, start = checkpoint.open_embeddings(len(self.chunks), self.embedding_engine.dimension, ids)
+        self.embeddings_scratch = checkpoint.embeddings_path
+        if start:
+            print(f"Resuming embeddings at {start}/{len(ids)} chunks")
+            if job:
+                job.advance(start)
+        # A paper is embedded once the window holding its last indexed chunk is committed;
+        # papers whose chunks are all duplicates are done with the first window
+        papers = self.chunk_to_paper[ids]
+        last = np.flatnonzero(np.append(papers[1:] != papers[:-1], True))
+        unindexed = sorted(set(checkpoint.chunked) - set(papers.tolist()))
+        for begin in range(start, len(ids), checkpoint.window):
+            end = min(begin + checkpoint.window, len(ids))
+            self.embed_chunks(self.chunks, job, out, rows=ids[begin:end])
+            done = papers[last[(last >= begin) & (last < end)]].tolist()
+            checkpoint.commit_embeddings(out, end, done + (unindexed if begin == 0 else []))
+        return out
+    
+    def live_chunk_ids(self) -> np.ndarray:
+        """Stable IDs (row positions) of chunks that have not been removed."""
+        return np.flatnonzero(self.chunk_to_paper >= 0)
+    
+    def indexed_chunk_ids(self) -> np.ndarray:
+        """Live chunks that are their own representative: the ones in FAISS and BM25."""
+        ids = self.live_chunk_ids()
+        return ids[self.chunk_canonical[ids] == ids]
+    
+    def build_faiss_index(self):
+        """Build FAISS index for similarity search."""
+        print(f"Building FAISS index ({self.index_type})...")
+        # Chunk IDs are row positions and never reused, so removals don't shift other chunks
+        ids = self.indexed_chunk_ids()
+        vectors = prepare_vectors(self.embeddings[ids], self.index_type)
+        self.faiss_index = build_index(self.index_type, vectors, ids, self.index_params)
+        self.index_mmapped = False
+        print("FAISS index built successfully")
+    
+    def build_lexical_index(self):
+        """Build the BM25 inverted index over all live representative chunks."""
+        print("Building lexical index...")
+        ids = self.indexed_chunk_ids()
+        self.lexical_index = LexicalIndex()
+        self.lexical_index.add_documents(ids.tolist(), [self.chunks[i] for i in ids])
+        self.lexical_index.merge()
+        print(f"Lexical index built: {len(self.lexical_index.terms)} terms")
+    
+    def set_search_params(self, **params):
+        """Change search-time parameters (e.g. nprobe, ef_search) without rebuilding."""
+        self.index_params = resolve_params({**self.index_params, **params})
+        if self.faiss_index is not None:
+            tune_index(self.faiss_index, self.index_params)
+    
+    def add_papers(self, papers: List[Dict], job: Optional[BuildJob] = None) -> Dict[str, int]:
+        """Ingest new papers and embed only their chunks, leaving existing chunks untouched."""
+        papers = [paper for paper in papers if paper['arxiv_id'] not in self.papers.by_arxiv_id]
+        if not papers:
+            return {'papers': 0, 'chunks': 0}
+        
+        self.ensure_writable()
+        first_paper = len(self.papers)
+        first_chunk = len(self.chunks)
+        self.papers.extend(papers)
+        if job:
+            job.stage('ingest', len(papers))
+        self.process_papers_pipelined(paper_indices=list(range(first_paper, len(self.papers))), job=job)
+        
+        new_chunks = self.chunks[first_chunk:]
+        duplicates = 0
+        if new_chunks:
+            ids = np.arange(first_chunk, len(self.chunks), dtype='int64')
+            canonical = self.chunk_canonical[first_chunk:]
+            unique = np.flatnonzero(canonical == ids)
+            duplicates = len(ids) - len(unique)
+            if job:
+                job.stage('embed', len(unique))
+            vectors = self.embed_chunks(new_chunks, job, rows=unique)
+            for j in np.flatnonzero(canonical != ids):
+                representative = canonical[j]
+                vectors[j] = vectors[representative - first_chunk] if representative >= first_chunk \
+                    else self.embeddings[representative]
+            if job:
+                job.stage('index')
+            if self.embeddings is None:
+                self.embeddings = vectors
+            else:
+                self.embeddings = np.vstack([self.embeddings, vectors])
+            
+            if self.faiss_index is None:
+                self.build_faiss_index()
+                self.build_lexical_index()
+            else:
+                self.faiss_index.add_with_ids(prepare_vectors(vectors[unique], self.index_type), ids[unique])
+                if self.lexical_index is None:
+                    self.build_lexical_index()
+                else:
+                    self.lexical_index.add_documents(ids[unique].tolist(), [new_chunks[j] for j in unique])
+        
+        print(f"Added {len(papers)} papers ({len(new_chunks)} chunks, {duplicates} duplicates)")
+        return {'papers': len(papers), 'chunks': len(new_chunks), 'duplicates': duplicates}
+    
+    def remove_papers(self, arxiv_ids: List[str]) -> Dict[str, int]:
+        """Drop papers and their chunks from the index without re-embedding anything."""
+        self.ensure_writable()
+        removed_papers = {self.papers.by_arxiv_id[arxiv_id] for arxiv_id in set(arxiv_ids)
+                          if arxiv_id in self.papers.by_arxiv_id}
+        for i in removed_papers:
+            self.papers.mark_removed(i)
+        
+        removed_chunks = np.flatnonzero(np.isin(self.chunk_to_paper, list(removed_papers)))
+        removed_texts = [self.chunks[i] for i in removed_chunks] if self.lexical_index is not None else None
+        for i in removed_chunks:
+            self.chunks[i] = ''
+        self.chunk_to_paper[removed_chunks] = -1
+        # Duplicates of a removed representative stay searchable through a promoted one
+        promoted = self.release_duplicates(removed_chunks)
+        self.filter_index = None
+        if self.faiss_index is not None and len(removed_chunks):
+            if supports_removal(self.index_type):
+                self.faiss_index.remove_ids(removed_chunks.astype('int64'))
+                if len(promoted):
+                    self.faiss_index.add_with_ids(prepare_vectors(self.embeddings[promoted], self.index_type),
+                                                  promoted)
+            else:
+                # HNSW graphs don't support deletion; rebuild from the surviving embeddings
+                self.build_faiss_index()
+        if self.lexical_index is not None:
+            self.lexical_index.delete(removed_chunks.tolist(), removed_texts)
+            if len(promoted):
+                self.lexical_index.add_documents(promoted.tolist(), [self.chunks[i] for i in promoted])
+        
+        print(f"Removed {len(removed_papers)} papers ({len(removed_chunks)} chunks)")
+        return {'papers': len(removed_papers), 'chunks': len(removed_chunks)}
+    
+    def update_papers(self, add_ids: List[str] = (), remove_ids: List[str] = (),
+                      job: Optional[BuildJob] = None) -> Dict[str, Any]:
+        """Apply a delta of added and removed arXiv IDs to the live index."""
+        removed = self.remove_papers(remove_ids) if remove_ids else {'papers': 0, 'chunks': 0}
+        added = self.add_papers(self.fetch_papers(add_ids), job) if add_ids else {'papers': 0, 'chunks': 0}
+        return {'added': added, 'removed': removed}
+    
+    def sync_papers(self, papers: List[Dict], remove_missing: bool = True,
+                    job: Optional[BuildJob] = None) -> Dict[str, Any]:
+        """Bring the index in line with a fresh paper listing, touching only the delta."""
+        listed = {paper['arxiv_id'] for paper in papers}
+        stale = [arxiv_id for arxiv_id in self.papers.by_arxiv_id if arxiv_id not in listed]
+        removed = self.remove_papers(stale) if remove_missing and stale else {'papers': 0, 'chunks': 0}
+        added = self.add_papers(papers, job)
+        return {'added': added, 'removed': removed}
+    
+    def is_initialized(self) -> bool:
+        return self.faiss_index is not None
+    
+    def memory_usage(self) -> Dict[str, int]:
+        """Approximate bytes held per component (memory-mapped arrays count their full size)."""
+        usage = {
+            'embeddings': int(self.embeddings.nbytes) if self.embeddings is not None else 0,
+            'chunks': self.chunks.nbytes(),
+            # Fingerprints of an index saved without them are computed by the next build, not by a scrape
+            'chunk_metadata': int(self.chunk_to_paper.nbytes + self.chunk_spans.nbytes + self.chunk_pages.nbytes
+                                  + self.chunk_canonical.nbytes
+                                  + (self.chunk_fingerprints.nbytes if self.chunk_fingerprints is not None else 0)),
+            'paper_embeddings': int(self.paper_embeddings.nbytes) if self.paper_embeddings is not None else 0,
+            # Estimated from the vector count and code size: cheap, and touches no mapped pages
+            'faiss': index_memory_bytes(self.faiss_index) if self.faiss_index is not None else 0
+        }
+        return usage
+    
+    def paper_count(self) -> int:
+        """Number of papers currently in the index."""
+        return self.papers.live_count()
+    
+    def chunk_count(self) -> int:
+        """Number of chunks currently in the index."""
+        return len(self.live_chunk_ids())
+    
+    def duplicate_count(self) -> int:
+        """Number of live chunks served through a representative instead of being indexed."""
+        return self.chunk_count() - len(self.indexed_chunk_ids())
+    
+    def encode_queries(self, queries: List[str]) -> np.ndarray:
+        """Encode a batch of queries in one forward pass."""
+        return np.asarray(self.model.encode(queries), dtype='float32')
+    
+    def get_reranker(self) -> Reranker:
+        """The cross-encoder reranker, loaded on first use."""
+        with self.reranker_lock:
+            if self.reranker is None:
+                if not self.rerank_model:
+                    raise ValueError("Reranking is disabled (no rerank_model)")
+                print(f"Loading reranker {self.rerank_model}...")
+                self.reranker = Reranker(self.rerank_model, budget_ms=self.rerank_budget_ms)
+            return self.reranker
+    
+    def search_embeddings(self, query_embeddings: np.ndarray, top_k: int = 5, queries: Optional[List[str]] = None,
+                          mode: str = "dense", fusion: str = "rrf", alpha: float = 0.5,
+                          rerank: bool = False, filters: Optional[Tuple] = None,
+                          top_papers: int = 0) -> List[List[Dict]]:
+        """Search the index for a batch of query embeddings with a single FAISS call.
+        
+        `mode` is "dense", "lexical" (BM25 only) or "hybrid". Hybrid fuses the FAISS
+        and BM25 candidate lists with reciprocal rank fusion (`fusion="rrf"`) or a
+        weighted sum of normalized scores (`fusion="weighted"`, dense weight `alpha`).
+        Lexical modes need the query text in `queries` and fall back to dense search
+        when no lexical index has been built. With `rerank`, the top candidates of
+        every query are rescored by the cross-encoder in one batch (see reranker.py).
+        `filters` (from `normalize_filters`) restricts every search to the chunks of
+        matching papers, inside the FAISS and BM25 searches (see `select_chunks`).
+        With `top_papers`, the search is two-tier: each query first picks the
+        `top_papers` papers whose title and abstract embeddings are most similar, and
+        only their chunks are searched (see `coarse_filters`).
+        """
+        if rerank and queries is not None:
+            reranker = self.get_reranker()
+            hit_lists = self.search_embeddings(query_embeddings, max(top_k, reranker.depth), queries, mode, fusion, alpha,
+                                               filters=filters, top_papers=top_papers)
+            with stage('rerank'):
+                return [hits[:top_k] for hits in reranker.rerank_batch(queries, hit_lists)]
+        
+        chunk_filter = self.select_chunks(filters)
+        if chunk_filter is not None and not len(chunk_filter):
+            return [[] for _ in query_embeddings]
+        if top_papers > 0:
+            with stage('coarse'):
+                chunk_filters = self.coarse_filters(query_embeddings, top_papers, chunk_filter)
+            # Every query searches its own papers' chunks
+            return [self.search_filtered(query_embeddings[i:i + 1], top_k, queries[i:i + 1] if queries else None,
+                                         mode, fusion, alpha, query_filter)[0]
+                    for i, query_filter in enumerate(chunk_filters)]
+        return self.search_filtered(query_embeddings, top_k, queries, mode, fusion, alpha, chunk_filter)
+    
+    def search_filtered(self, query_embeddings: np.ndarray, top_k: int, queries: Optional[List[str]], mode: str,
+                        fusion: str, alpha: float, chunk_filter: Optional[ChunkFilter]) -> List[List[Dict]]:
+        """The first-stage search of `search_embeddings`, restricted to `chunk_filter` if given."""
+        if chunk_filter is not None and not len(chunk_filter):
+            return [[] for _ in query_embeddings]
+        query_embeddings = prepare_vectors(query_embeddings, self.index_type)
+        if mode == "dense" or queries is None or self.lexical_index is None:
+            with stage('faiss'):
+                similarities, indices = self.dense_search(query_embeddings, top_k, chunk_filter)
+            with stage('hydrate'):
+                return [self.hydrate_results(row_indices, row_similarities, chunk_filter)
+                        for row_similarities, row_indices in zip(similarities, indices)]
+        
+        # Fuse over a deeper candidate pool than we return
+        depth = max(4 * top_k, 50)
+        if mode == "hybrid":
+            with stage('faiss'):
+                _, indices = self.dense_search(query_embeddings, depth, chunk_filter)
+        
+        mask = chunk_filter.mask() if chunk_filter is not None else None
+        results = []
+        for i, (query, vector) in enumerate(zip(queries, query_embeddings)):
+            with stage('lexical'):
+                lexical_ids, lexical_scores = self.lexical_index.search(query, depth, mask=mask)
+            if mode == "lexical":
+                ids, fused = lexical_ids, lexical_scores
+            else:
+                with stage('fusion'):
+                    dense_ids = indices[i][indices[i] >= 0]
+                    if fusion == "weighted":
+                        ids, fused = weighted_fusion([(dense_ids, self.dense_similarity(vector, dense_ids)),
+                                                      (lexical_ids, lexical_scores)], [alpha, 1 - alpha])
+                    else:
+                        ids, fused = reciprocal_rank_fusion([dense_ids, lexical_ids])
+            ids, fused = ids[:top_k], fused[:top_k]
+            with stage('hydrate'):
+                hits = self.hydrate_results(ids, self.dense_similarity(vector, ids), chunk_filter)
+            for hit, score in zip(hits, fused):
+                hit['fusion_score' if mode == "hybrid" else 'bm25_score'] = float(score)
+            results.append(hits)
+        return results
+    
+    def dense_search(self, query_embeddings: np.ndarray, k: int,
+                     chunk_filter: Optional[ChunkFilter] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """FAISS search returning (similarities, chunk IDs), padded with -1 IDs.
+        
+        For quantized index types with `rescore` set, `rescore * k` candidates are
+        re-ranked with exact similarities computed from the float32 embeddings (the
+        memory-mapped embeddings.npy after loading, so only candidate rows are read).
+        With a `chunk_filter`, FAISS only considers the filtered chunk IDs (through an
+        ID selector); filters matching at most `exact_filter_limit` chunks skip the
+        index and compare the query with just those chunks' embeddings.
+        """
+        params = None
+        if chunk_filter is not None:
+            if len(chunk_filter) <= self.index_params['exact_filter_limit'] or not supports_selector(self.index_type):
+                return self.exact_search(query_embeddings, k, chunk_filter.ids)
+            params = search_parameters(self.faiss_index, self.index_params, chunk_filter.selector())
+        factor = self.index_params['rescore']
+        if not factor or self.index_type not in QUANTIZED_TYPES:
+            distances, indices = self.faiss_index.search(query_embeddings, k, params=params)
+            similarities = np.array([[similarity_from_distance(d, self.index_type) for d in row] for row in distances],
+                                    dtype='float32').reshape(distances.shape)
+            return similarities, indices
+        
+        _, candidates = self.faiss_index.search(query_embeddings, k * factor, params=params)
+        # Quantized types all search by cosine, so the stored embeddings are normalized as they are read
+        return rescore(self.embeddings, query_embeddings, candidates, k, normalize=True)
+    
+    def exact_search(self, query_embeddings: np.ndarray, k: int, ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Brute-force search over only the chunk IDs `ids`, shaped like `dense_search`'s result."""
+        similarities = np.full((len(query_embeddings), k), -np.inf, dtype='float32')
+        indices = np.full((len(query_embeddings), k), -1, dtype='int64')
+        if not len(ids):
+            return similarities, indices
+        # Sorted IDs, so rows of the memory-mapped embeddings are read in order
+        vectors = prepare_vectors(self.embeddings[ids], self.index_type)
+        for i, query_embedding in enumerate(query_embeddings):
+            exact = self.similarity(vectors, query_embedding)
+            top = np.argpartition(-exact, k - 1)[:k] if len(exact) > k else np.arange(len(exact))
+            order = top[np.argsort(-exact[top], kind='stable')]
+            similarities[i, :len(order)] = exact[order]
+            indices[i, :len(order)] = ids[order]
+        return similarities, indices
+    
+    def dense_similarity(self, query_embedding: np.ndarray, ids: np.ndarray) -> np.ndarray:
+        """Similarity between a prepared query vector and stored chunk embeddings."""
+        if not len(ids):
+            return np.zeros(0, dtype='float32')
+        return self.similarity(prepare_vectors(self.embeddings[np.asarray(ids)], self.index_type), query_embedding)
+    
+    def similarity(self, vectors: np.ndarray, query_embedding: np.ndarray) -> np.ndarray:
+        if uses_inner_product(self.index_type):
+            return vectors @ query_embedding
+        return 1 / (1 + ((vectors - query_embedding) ** 2).sum(axis=1))
+    
+    def build_filter_index(self) -> FilterIndex:
+        """Precompute the metadata filter indexes (dates, authors, categories, arXiv IDs) over the current papers."""
+        filter_index = FilterIndex(self.papers, self.chunk_to_paper, self.chunk_canonical)
+        with self.filter_lock:
+            self.filter_index = filter_index
+        return filter_index
+    
+    def select_chunks(self, filters: Optional[Tuple]) -> Optional[ChunkFilter]:
+        """The indexed chunks of papers matching normalized `filters`, or None without filters."""
+        if not filters:
+            return None
+        with stage('filter'):
+            return (self.filter_index or self.build_filter_index()).select(filters)
+    
+    def ensure_paper_embeddings(self) -> np.ndarray:
+        """Title + abstract embeddings of every paper, embedding only papers added since the last call.
+        
+        Indexes saved before two-tier search have none; they are computed on first use
+        (through the embedding cache) and saved with the next build.
+        """
+        with self.paper_lock:
+            done = 0 if self.paper_embeddings is None else len(self.paper_embeddings)
+            if done < len(self.papers):
+                texts = [paper_text(self.papers, i) for i in range(done, len(self.papers))]
+                print(f"Embedding {len(texts)} paper abstracts...")
+                vectors = normalize_rows(self.embed_chunks(texts))
+                self.paper_embeddings = vectors if not done else np.vstack([self.paper_embeddings, vectors])
+            return self.paper_embeddings
+    
+    def coarse_filters(self, query_embeddings: np.ndarray, top_papers: int,
+                       chunk_filter: Optional[ChunkFilter] = None) -> List[ChunkFilter]:
+        """For each query, a filter over the chunks of its `top_papers` best matching papers.
+        
+        Papers are ranked by cosine similarity between the query and their title and
+        abstract; only papers with live chunks that `chunk_filter` (the metadata
+        filters) lets through are candidates. The chunk search that follows costs time
+        proportional to the selected papers' chunks, not to the corpus.
+        """
+        filter_index = self.filter_index or self.build_filter_index()
+        vectors = self.ensure_paper_embeddings()[:filter_index.n_papers]
+        allowed = np.diff(filter_index.chunk_offsets) > 0
+        if chunk_filter is not None:
+            allowed &= chunk_filter.paper_mask[:-1]
+        return [ChunkFilter(filter_index.chunks_of(papers), papers, filter_index.n_papers, filter_index.size)
+                for papers in select_papers(vectors, query_embeddings, top_papers, allowed)]
+    
+    def hydrate_results(self, indices: np.ndarray, similarities,
+                        chunk_filter: Optional[ChunkFilter] = None) -> List[Dict]:
+        """Turn ranked chunk IDs and their similarity scores into result dicts.
+        
+        Hits reference their paper by `paper_id`; use `papers_for` or `group_by_paper`
+        to attach paper metadata once per paper instead of once per hit. Chunks with
+        known page numbers carry `pages`, the one-based [first, last] PDF pages they span.
+        When near-duplicates of the chunk occur in other papers, `also_in` lists those paper IDs.
+        If a `chunk_filter` excludes the representative's paper, the hit shows the
+        duplicate from a paper the filter matches instead.
+        """
+        results = []
+        for i, (idx, similarity) in enumerate(zip(indices, similarities)):
+            # FAISS pads with -1 when fewer than top_k chunks are indexed
+            if 0 <= idx < len(self.chunks):
+                representative = chunk_id = int(idx)
+                if chunk_filter is not None and not chunk_filter.allows_paper(self.chunk_to_paper[chunk_id]):
+                    chunk_id = next((j for j in self.duplicates.get(representative, ())
+                                     if chunk_filter.allows_paper(self.chunk_to_paper[j])), chunk_id)
+                hit = {
+                    'chunk_id': chunk_id,
+                    'chunk': self.chunks[chunk_id],
+                    'paper_id': int(self.chunk_to_paper[chunk_id]),
+                    'similarity_score': float(similarity),
+                    'rank': i + 1
+                }
+                if chunk_id < len(self.chunk_pages) and self.chunk_pages[chunk_id][0] >= 0:
+                    hit['pages'] = [int(page) + 1 for page in self.chunk_pages[chunk_id]]
+                if representative in self.duplicates:
+                    copies = [representative, *self.duplicates[representative]]
+                    others = {int(self.chunk_to_paper[j]) for j in copies} - {hit['paper_id']}
+                    if others:
+                        hit['also_in'] = sorted(others)
+                results.append(hit)
+        
+        return results
+    
+    def papers_for(self, hits: List[Dict]) -> Dict[int, Dict]:
+        """Metadata of each paper referenced by `hits` (including `also_in`), keyed by paper ID."""
+        paper_ids = [paper_id for hit in hits for paper_id in [hit['paper_id'], *hit.get('also_in', ())]]
+        return {paper_id: self.papers.metadata(paper_id) for paper_id in paper_ids}
+    
+    def spans_for(self, hits: List[Dict]) -> List[Optional[Tuple[int, int]]]:
+        """Character span of each hit's chunk in its paper's text (None for legacy, unspanned chunks)."""
+        spans = []
+        for hit in hits:
+            start, end = (int(offset) for offset in self.chunk_spans[hit['chunk_id']])
+            spans.append((start, end) if start >= 0 else None)
+        return spans
+    
+    def group_by_paper(self, hits: List[Dict], offset: int = 0, limit: int = 10) -> Dict[str, Any]:
+        """Group ranked hits by paper (ordered by each paper's best hit) and return one page."""
+        return group_hits(hits, self.papers.metadata, offset, limit)
+    
+    def search(self, query: str, top_k: int = 5, mode: str = "dense", fusion: str = "rrf",
+               rerank: bool = False, filters: Optional[Tuple] = None, top_papers: int = 0) -> List[Dict]:
+        """Search for relevant chunks given a query (see `search_embeddings` for `filters` and `top_papers`)."""
+        return self.search_embeddings(self.encode_queries([query]), top_k, [query], mode, fusion, rerank=rerank,
+                                      filters=filters, top_papers=top_papers)[0]
+    
+    def ensure_writable(self):
+        """Swap a memory-mapped (read-only) FAISS index for an in-memory copy before mutating it."""
+        if self.index_mmapped:
+            self.faiss_index = faiss.read_index(self.index_path)
+            tune_index(self.faiss_index, self.index_params)
+            self.index_mmapped = False
+    
+    def save_system(self, directory: str = "rag_index"):
+        """Save the RAG system to disk."""
+        save_index(directory, self.papers, self.chunks, self.embeddings, self.chunk_to_paper,
+                   self.faiss_index, lexical_index=self.lexical_index, chunk_spans=self.chunk_spans,
+                   chunk_pages=self.chunk_pages, chunk_fingerprints=self.ensure_fingerprints(),
+                   chunk_canonical=self.chunk_canonical, paper_embeddings=self.ensure_paper_embeddings(),
+                   extra={'model_name': self.model_name, 'index_type': self.index_type,
+                          'index_params': self.index_params, 'chunking': self.chunking,
+                          'embedding_backend': self.embedding_engine.backend})
+        self.index_dir = directory
+        if self.embeddings_scratch:
+            # Serve from the saved copy and drop the streamed scratch file
+            self.embeddings = np.load(os.path.join(directory, 'embeddings.npy'), mmap_mode='r')
+            os.remove(self.embeddings_scratch)
+            self.embeddings_scratch = None
+        # Builds end here, so the filter indexes are ready before the system is swapped in
+        self.build_filter_index()
+        print(f"System saved to {directory}")
+    
+    def load_system(self, directory: str = "rag_index", mmap: bool = True):
+        """Load the RAG system from disk.
+        
+        Embeddings, chunk text and the FAISS index are memory-mapped, so loading is
+        near-instant and worker processes share the pages through the OS cache.
+        """
+        if directory.endswith('.pkl'):
+            return self.load_pickle(directory)
+        if not os.path.exists(os.path.join(directory, 'manifest.json')):
+            print(f"Index {directory} not found")
+            return False
+        
+        data = load_index(directory, mmap=mmap)
+        if data['manifest'].get('model_name') not in (None, self.model_name):
+            print(f"Warning: index was built with {data['manifest']['model_name']}, not {self.model_name}")
+        if data['manifest'].get('embedding_backend', 'torch') != self.embedding_engine.backend:
+            print(f"Warning: index was embedded with the {data['manifest'].get('embedding_backend', 'torch')} backend, "
+                  f"not {self.embedding_engine.backend}")
+        
+        self.papers = data['papers']
+        self.chunks = data['chunks']
+        self.embeddings = data['embeddings']
+        self.chunk_to_paper = data['chunk_to_paper']
+        self.chunk_spans = data['chunk_spans']
+        self.chunk_pages = data['chunk_pages']
+        self.chunk_fingerprints = data['chunk_fingerprints']
+        self.chunk_canonical = data['chunk_canonical']
+        self.paper_embeddings = data['paper_embeddings']
+        self.restore_duplicates()
+        self.faiss_index = data['faiss_index']
+        self.lexical_index = data['lexical_index']
+        self.index_path = data['index_path']
+        self.index_mmapped = data['index_mmapped']
+        # Indexes saved before index types existed are flat L2
+        self.index_type = data['manifest'].get('index_type', 'flat_l2')
+        self.index_params = resolve_params(data['manifest'].get('index_params'))
+        tune_index(self.faiss_index, self.index_params)
+        self.index_dir = directory
+        self.build_filter_index()
+        print(f"System loaded from {directory}")
+        return True
+    
+    def load_pickle(self, filename: str = "rag_system.pkl"):
+        """Load a system saved by older versions as a single pickle."""
+        try:
+            with open(filename, 'rb') as f:
+                data = pickle.load(f)
+            
+            self.papers = data['papers']
+            self.chunks = ChunkStore.from_strings(data['chunks'])
+            self.embeddings = data['embeddings']
+            self.chunk_to_paper = np.asarray(data['chunk_to_paper'], dtype=np.int32)
+            self.chunk_spans = np.full((len(self.chunks), 2), -1, dtype=np.int64)
+            self.chunk_pages = np.full((len(self.chunks), 2), -1, dtype=np.int32)
+            self.chunk_fingerprints = None
+            self.chunk_canonical = np.arange(len(self.chunks), dtype=np.int64)
+            self.paper_embeddings = None
+            self.restore_duplicates()
+            
+            # Rebuild FAISS index
+            self.build_faiss_index()
+            self.build_lexical_index()
+            print(f"System loaded from {filename}")
+            return True
+        except FileNotFoundError:
+            print(f"File {filename} not found")
+            return False
+
+# Load the embedding model (and tokenizer) during startup instead of on the first request
+WARM_UP_ON_STARTUP = os.environ.get("RAG_WARM_UP_ON_STARTUP", "0") == "1"
+
+# Server processes (`uvicorn --workers`) share the published index versions on disk; each one checks
+# the version pointers every INDEX_POLL_SECONDS (0 disables) and swaps in versions built elsewhere
+WORKERS = int(os.environ.get("RAG_WORKERS", "1"))
+INDEX_POLL_SECONDS = float(os.environ.get("RAG_INDEX_POLL_SECONDS", "2"))
+
+# Global RAG system: one independently built index per shard (see sharded_index.py). Importing
+# this module only builds cheap objects; models, the embedding cache database and saved indexes
+# are opened in the lifespan hook below or on first use
+rag_system = ShardedRAGSystem(ArxivRAGSystem(), DEFAULT_SHARDS)
+startup_stats: Dict[str, Any] = {'started_at': None, 'startup_seconds': None, 'shards_loaded': 0, 'warm_up': None}
+
+# Concurrent /search requests are batched and run off the event loop; repeated and
+# paraphrased queries are answered from a result cache that is dropped whenever a build is swapped in
+query_batcher = QueryBatcher(lambda: rag_system, max_batch_size=32, max_wait_ms=2.0, max_workers=2,
+                             result_cache=ResultCache(max_size=1024, ttl=300.0, threshold=0.95))
+
+# Index builds run one at a time in the background, and one at a time across processes sharing
+# `rag_shards/` (a file lock); searches keep using `rag_system` until the swap
+build_runner = BuildRunner()
+build_lock = BuildLock(os.path.join(rag_system.root, ".build.lock"))
+swap_lock = threading.Lock()
+
+# Answers are generated from the top ANSWER_HITS chunks, packed into a prompt of at most RAG_ANSWER_BUDGET
+# tokens (counted with the LLM's tiktoken encoding). RAG_LLM_BACKEND=stub answers locally without a model;
+# openai streams from any OpenAI-compatible server (RAG_LLM_URL, RAG_LLM_MODEL, RAG_LLM_API_KEY)
+ANSWER_HITS = 20
+LLM_BACKEND = os.environ.get("RAG_LLM_BACKEND", "stub")
+answer_generator = AnswerGenerator(
+    make_llm(LLM_BACKEND, **({'base_url': os.environ.get("RAG_LLM_URL", "https://api.openai.com/v1"),
+                              'model': os.environ.get("RAG_LLM_MODEL", "gpt-4o-mini"),
+                              'api_key': os.environ.get("RAG_LLM_API_KEY") or os.environ.get("OPENAI_API_KEY")}
+                             if LLM_BACKEND == "openai" else {})),
+    encoding=os.environ.get("RAG_LLM_ENCODING", "cl100k_base"),
+    budget_tokens=int(os.environ.get("RAG_ANSWER_BUDGET", "3000")))
+
+def write_template(path: str = "templates/index.html"):
+    """Write the web page, unless the file already has the current contents."""
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            if f.read() == html_template:
+                return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(html_template)
+
+def warm_up(rerank: bool = False) -> Dict[str, float]:
+    """Load the embedding model and tokenizer (and the reranker with `rerank`), then run one
+    search so the served indexes are paged in; returns the seconds spent on each."""
+    seconds = {}
+    system = rag_system
+    start = time.perf_counter()
+    vectors = system.base.encode_queries(["warm-up query"])
+    seconds['model'] = time.perf_counter() - start
+    start = time.perf_counter()
+    system.base.span_chunker
+    seconds['tokenizer'] = time.perf_counter() - start
+    if rerank and system.base.rerank_model:
+        start = time.perf_counter()
+        system.base.get_reranker()
+        seconds['reranker'] = time.perf_counter() - start
+    if system.is_initialized():
+        start = time.perf_counter()
+        system.search_embeddings(vectors, 1, ["warm-up query"], mode="hybrid")
+        seconds['search'] = time.perf_counter() - start
+    return {name: round(value, 3) for name, value in seconds.items()}
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Startup: write the web page and load the saved shards (memory-mapped, so this is quick).
+    
+    The models load on the first search, on POST /warmup, or here with RAG_WARM_UP_ON_STARTUP=1.
+    """
+    start = time.perf_counter()
+    startup_stats['started_at'] = time.time()
+    write_template()
+    startup_stats['shards_loaded'] = await asyncio.to_thread(rag_system.load)
+    print(f"Loaded {startup_stats['shards_loaded']} saved shards")
+    if WARM_UP_ON_STARTUP:
+        startup_stats['warm_up'] = await asyncio.to_thread(warm_up)
+    startup_stats['startup_seconds'] = round(time.perf_counter() - start, 3)
+    print(f"Startup took {startup_stats['startup_seconds']}s")
+    watcher = asyncio.create_task(watch_index_versions(INDEX_POLL_SECONDS)) if INDEX_POLL_SECONDS > 0 else None
+    yield
+    if watcher:
+        watcher.cancel()
+    rag_system.base.embedding_engine.close()
+    rag_system.base.page_extractor.close()
+    if rag_system.base.embedding_cache is not None:
+        rag_system.base.embedding_cache.close()
+
+app = FastAPI(title="arXiv CS.CL RAG System", lifespan=lifespan)
+templates = Jinja2Templates(directory="templates")
+
+def build_full(job: BuildJob, base: ArxivRAGSystem, papers: List[Dict], directory: str = "rag_index",
+               checkpoint_window: int = 4096) -> Tuple[ArxivRAGSystem, Dict[str, Any]]:
+    """Process and index a paper listing from scratch into a new system published as the first
+    version of `directory` (see `publish_system`).
+    
+    Progress is checkpointed in `<directory>.build/` (see checkpoint.py), so a build that
+    crashed, was killed or was cancelled skips the finished work the next time it runs.
+    Embeddings are committed every `checkpoint_window` chunks.
+    """
+    system = base.spawn()
+    checkpoint = BuildCheckpoint(f"{directory}.build", system.build_config(), window=checkpoint_window)
+    try:
+        system.papers = checkpoint.open(papers)
+        pending = checkpoint.pending()
+        job.stage('ingest', len(pending))
+        system.process_papers_pipelined(paper_indices=pending, job=job, checkpoint=checkpoint)
+        # Progress counts the representative chunks only; duplicates are not encoded
+        job.stage('embed', len(system.indexed_chunk_ids()))
+        system.create_embeddings(job, checkpoint=checkpoint)
+        job.stage('index')
+        system.build_faiss_index()
+        system.build_lexical_index()
+        job.stage('save')
+        publish_system(system, directory)
+    finally:
+        # Kept on failure or cancellation: the next build of this directory resumes from it
+        checkpoint.close()
+    summary = checkpoint.summary()
+    checkpoint.remove()
+    return system, {'added': {'papers': system.paper_count(), 'chunks': system.chunk_count(),
+                              'duplicates': system.duplicate_count()}, 'checkpoint': summary}
+
+def publish_system(system: ArxivRAGSystem, directory: str):
+    """Save `system` as a new immutable version of `directory` and point `directory` at it.
+    
+    Every server process sharing `directory` swaps the version in on its next poll
+    (see `refresh_index`) and memory-maps the same files.
+    """
+    version = next_dir(directory)
+    system.save_system(version)
+    publish(directory, version)
+    print(f"Published {version}")
+
+def build_delta(job: BuildJob, current: ArxivRAGSystem, directory: str, papers: Optional[List[Dict]] = None,
+                add: List[Dict] = (), remove_ids: List[str] = (),
+                remove_missing: bool = False) -> Tuple[ArxivRAGSystem, Dict[str, Any]]:
+    """Apply an incremental update to a private copy of a saved index and publish it as a new
+    version of `directory`; the version being served is never modified.
+    
+    With `papers`, the papers of that fresh listing that are not indexed yet are added
+    (like re-running /initialize), and with `remove_missing` indexed papers missing
+    from it are removed; otherwise the `add` papers and `remove_ids` are applied.
+    """
+    system = current.spawn()
+    job.stage('load')
+    if not system.load_system(current.index_dir):
+        raise RuntimeError(f"Saved index {current.index_dir} not found")
+    if papers is not None:
+        delta = system.sync_papers(papers, remove_missing=remove_missing, job=job)
+    else:
+        removed = system.remove_papers(remove_ids) if remove_ids else {'papers': 0, 'chunks': 0}
+        delta = {'added': system.add_papers(list(add), job), 'removed': removed}
+    job.stage('save')
+    publish_system(system, directory)
+    return system, delta
+
+def build_shards(job: BuildJob, sharded: ShardedRAGSystem, names: List[str],
+                 remove_missing: bool = False) -> Tuple[ShardedRAGSystem, Dict[str, Any]]:
+    """List and (re)build each shard: from scratch the first time, incrementally afterwards
+    (see `build_delta` for `remove_missing`)."""
+    deltas = {}
+    for name in names:
+        job.prefix = f"{name}/"
+        job.stage('list')
+        papers = sharded.list_shard(name)
+        current = sharded.shards.get(name)
+        if current is not None and current.index_dir:
+            system, deltas[name] = build_delta(job, current, sharded.shard_dir(name), papers=papers,
+                                               remove_missing=remove_missing)
+        else:
+            system, deltas[name] = build_full(job, sharded.base, papers, sharded.shard_dir(name))
+        sharded = sharded.with_shard(name, system)
+    return sharded, {'shards': deltas}
+
+def update_shards(job: BuildJob, sharded: ShardedRAGSystem, add_ids: List[str],
+                  remove_ids: List[str]) -> Tuple[ShardedRAGSystem, Dict[str, Any]]:
+    """Add papers to the shard of their category and remove papers from whichever shards hold them."""
+    plan = {name: ([], ids) for name, ids in sharded.shards_containing(remove_ids).items()}
+    if add_ids:
+        job.stage('fetch')
+        for paper in sharded.base.fetch_papers(add_ids):
+            plan.setdefault(sharded.shard_for(paper), ([], []))[0].append(paper)
+    deltas = {}
+    for name, (add, remove) in plan.items():
+        job.prefix = f"{name}/"
+        current = sharded.shards.get(name)
+        if current is not None and current.index_dir:
+            system, deltas[name] = build_delta(job, current, sharded.shard_dir(name), add=add,
+                                               remove_ids=remove)
+        else:
+            system, deltas[name] = build_full(job, sharded.base, add, sharded.shard_dir(name))
+        sharded = sharded.with_shard(name, system)
+    return sharded, {'shards': deltas}
+
+def install_system(result: Tuple[ShardedRAGSystem, Dict[str, Any]]) -> Dict[str, Any]:
+    """Swap a finished build in; in-flight searches finish on the system they started with."""
+    global rag_system
+    system, delta = result
+    with swap_lock:
+        rag_system = system
+        if query_batcher.result_cache is not None:
+            query_batcher.result_cache.use(system)
+    return {"papers": system.paper_count(), "chunks": system.chunk_count(), **delta}
+
+def refresh_index() -> List[str]:
+    """Swap in the shard versions published by another process since ours were loaded;
+    returns the names of the shards that changed."""
+    global rag_system
+    current = rag_system
+    refreshed = current.refresh()
+    if refreshed is current:
+        return []
+    changed = [name for name, system in refreshed.shards.items() if current.shards.get(name) is not system]
+    with swap_lock:
+        # A local build swapped in meanwhile: it is at least as new
+        if rag_system is not current:
+            return []
+        rag_system = refreshed
+        if query_batcher.result_cache is not None:
+            query_batcher.result_cache.use(refreshed)
+    print(f"Swapped in published versions of {', '.join(changed)}")
+    return changed
+
+async def watch_index_versions(interval: float):
+    """Poll the version pointers (one small read per shard) while no local build is running."""
+    while True:
+        await asyncio.sleep(interval)
+        if build_runner.job is not None and build_runner.job.running:
+            continue
+        try:
+            await asyncio.to_thread(refresh_index)
+        except Exception as e:
+            # E.g. a version pruned while it was being opened: the next poll picks up the newer one
+            print(f"Index refresh failed: {e}")
+
+def start_build(name: str, stages: List[str], build) -> Dict[str, Any]:
+    if not build_lock.acquire():
+        return {"error": f"A build is already running in another server process (pid {build_lock.owner()})",
+                "build": build_runner.status()}
+    
+    def locked_build(job: BuildJob):
+        # Start from what other processes published, then hold the lock until ours is published
+        try:
+            refresh_index()
+            return build(job)
+        finally:
+            build_lock.release()
+    
+    try:
+        job = build_runner.start(name, stages, locked_build, install_system)
+    except RuntimeError as e:
+        build_lock.release()
+        return {"error": str(e), "build": build_runner.status()}
+    return {"message": f"{name.capitalize()} started", "build": job.status()}
+
+def parse_ids(value: str) -> List[str]:
+    """Split a comma or space separated form field."""
+    return value.replace(',', ' ').split()
+
+def index_metrics():
+    """Size and memory gauges of the served shards, computed when /metrics is scraped."""
+    system = rag_system
+    samples = [({'shard': name, 'kind': 'papers'}, shard.paper_count()) for name, shard in system.shards.items()]
+    samples += [({'shard': name, 'kind': 'chunks'}, shard.chunk_count()) for name, shard in system.shards.items()]
+    samples += [({'shard': name, 'kind': 'duplicates'}, shard.duplicate_count())
+                for name, shard in system.shards.items()]
+    return samples
+
+def memory_metrics():
+    samples = [({'shard': name, 'component': component}, size)
+               for name, usage in rag_system.memory_usage().items() for component, size in usage.items()]
+    return samples + [({'shard': '', 'component': 'process_rss'}, resident_memory_bytes())]
+
+def cache_metrics():
+    """(hits, misses) of the query embedding, rerank score and chunk embedding caches."""
+    reranker = rag_system.reranker
+    embedding_cache = rag_system.base.embedding_cache
+    caches = {'query_embedding': query_batcher.embedding_cache,
+              'search_result': query_batcher.result_cache,
+              'rerank': reranker.cache if reranker else None,
+              'chunk_embedding': embedding_cache}
+    return {name: (cache.hits, cache.misses) for name, cache in caches.items() if cache is not None}
+
+REGISTRY.collected('rag_index_size', 'Papers, chunks and duplicate chunks per shard', index_metrics)
+REGISTRY.collected('rag_memory_bytes', 'Bytes held per shard and component, and process RSS', memory_metrics)
+REGISTRY.collected('rag_cache_hits_total', 'Cache hits', lambda: [({'cache': name}, hits) for name, (hits, _)
+                                                                   in cache_metrics().items()], kind='counter')
+REGISTRY.collected('rag_cache_misses_total', 'Cache misses', lambda: [({'cache': name}, misses) for name, (_, misses)
+                                                                       in cache_metrics().items()], kind='counter')
+REGISTRY.collected('rag_cache_hit_ratio', 'Cache hit ratio since start',
+                   lambda: [({'cache': name}, hit_ratio(*counts)) for name, counts in cache_metrics().items()])
+REGISTRY.collected('rag_build_running', '1 while a background build is running',
+                   lambda: [({}, int(bool(build_runner.job and build_runner.job.running)))])
+
+@app.middleware("http")
+async def record_request(request: Request, call_next):
+    """Count and time every request by route (not raw path, to keep label cardinality bounded)."""
+    start = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get('route')
+    path = route.path if route is not None else 'unmatched'
+    HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, method=request.method, path=path)
+    HTTP_REQUESTS.inc(method=request.method, path=path, status=response.status_code)
+    return response
+
+@app.get("/", response_class=HTMLResponse)
+async def home(request: Request):
+    """Home page with search interface."""
+    return templates.TemplateResponse("index.html", {"request": request})
+
+# Upper bound on chunks retrieved for one /search page
+MAX_SEARCH_HITS = 200
+
+def search_options(mode: str, shards: str, published_from: str, published_to: str, authors: str,
+                   categories: str, arxiv_ids: str) -> Tuple[Optional[Tuple[str, ...]], Optional[Tuple]]:
+    """Validate the /search form; returns the shard selection and normalized filters or raises ValueError."""
+    if not rag_system.is_initialized():
+        raise ValueError("RAG system not initialized. Please run the data collection first.")
+    if mode not in ("dense", "lexical", "hybrid"):
+        raise ValueError(f"Unknown search mode: {mode}")
+    selected = tuple(rag_system.select(parse_ids(shards))) if shards.strip() else None
+    filters = normalize_filters(published_from, published_to, authors.split(','), parse_ids(categories),
+                                parse_ids(arxiv_ids))
+    return selected, filters
+
+def page_depth(group: bool, offset: int, limit: int) -> int:
+    """Chunks to retrieve for a page; grouped searches over-fetch, since several hits usually share a paper."""
+    return min((3 if group else 1) * (offset + limit), MAX_SEARCH_HITS)
+
+def result_page(system, hits: List[Dict], group: bool, offset: int, limit: int) -> Dict[str, Any]:
+    if group:
+        return system.group_by_paper(hits, offset, limit)
+    results = hits[offset:offset + limit]
+    return {"results": results, "papers": system.papers_for(results)}
+
+@app.post("/search")
+async def search_papers(response: Response, query: str = Form(...), mode: str = Form("hybrid"),
+                        group: bool = Form(False), offset: int = Form(0), limit: int = Form(5),
+                        rerank: bool = Form(False), shards: str = Form(""), timing: bool = Form(False),
+                        published_from: str = Form(""), published_to: str = Form(""), authors: str = Form(""),
+                        categories: str = Form(""), arxiv_ids: str = Form(""), top_papers: int = Form(0)):
+    """Search papers and return relevant chunks (mode: dense, lexical or hybrid; optionally reranked).
+    
+    Hits carry a `paper_id`; each paper's metadata is sent once in `papers`. With
+    `group`, hits are grouped per paper and `offset`/`limit` page over papers,
+    otherwise they page over chunks. `shards` (comma separated) restricts the
+    search to some shards; by default all are searched. With `timing`, a
+    Server-Timing header breaks the request down by stage.
+    
+    Only chunks of papers matching every given filter are searched: published
+    between `published_from` and `published_to` (YYYY, YYYY-MM or YYYY-MM-DD,
+    inclusive), by any of `authors` (comma separated, case-insensitive), in any of
+    `categories` or with any of `arxiv_ids` (comma or space separated).
+    
+    With `top_papers` > 0 the search is two-tier: the query is first matched
+    against paper titles and abstracts, and only the chunks of the `top_papers`
+    best papers (per shard) are searched.
+    """
+    start = time.perf_counter()
+    try:
+        selected, filters = search_options(mode, shards, published_from, published_to, authors, categories,
+                                           arxiv_ids)
+    except ValueError as e:
+        return {"error": str(e)}
+    top_papers = max(top_papers, 0)
+    offset = max(offset, 0)
+    limit = min(max(limit, 1), 50)
+    
+    # Resolve paper IDs against the system that produced the hits, even if a build swapped in meanwhile
+    system, hits, timings = await query_batcher.search_traced(query, top_k=page_depth(group, offset, limit),
+                                                              mode=mode, rerank=rerank, shards=selected,
+                                                              filters=filters, top_papers=top_papers)
+    result = {"query": query, "mode": mode, **result_page(system, hits, group, offset, limit)}
+    if filters:
+        result["filters"] = dict(filters)
+    if top_papers:
+        result["top_papers"] = top_papers
+    if timing:
+        # Result cache hits never reach a batch
+        batch_size = timings.pop('batch_size', None)
+        timings['total'] = time.perf_counter() - start
+        header = server_timing(timings)
+        if batch_size:
+            header += f", batch;desc=\"{batch_size} queries\""
+        response.headers['Server-Timing'] = header
+    return result
+
+def stream_event(name: str, data: Dict[str, Any], fmt: str) -> str:
+    """One event as an NDJSON line ({"event": name, ...}) or a server-sent event."""
+    if fmt == "sse":
+        return f"event: {name}\ndata: {json.dumps(data)}\n\n"
+    return json.dumps({"event": name, **data}) + "\n"
+
+async def answer_events(system, question: str, hits: List[Dict], start: float, budget: Optional[int] = None):
+    """Pack the context of `hits` and generate the answer: yields `sources` (the numbered papers
+    and packing stats), one `token` event per generated piece, then `answer` with the token usage
+    and latency since `start`.
+    """
+    t0 = time.perf_counter()
+    packed = await asyncio.to_thread(
+        lambda: answer_generator.pack(question, hits, system.spans_for(hits), system.papers_for(hits), budget))
+    yield "sources", {"sources": packed["sources"], "usage": packed["stats"]}
+    t1 = time.perf_counter()
+    parts = []
+    async for text in iterate_in_threadpool(answer_generator.stream(packed)):
+        parts.append(text)
+        yield "token", {"text": text}
+    usage = answer_generator.record(packed, "".join(parts), time.perf_counter() - t1)
+    total = time.perf_counter() - start
+    ANSWER_SECONDS.observe(total, stage='total')
+    yield "answer", {"answer": "".join(parts), "usage": {**packed["stats"], **usage},
+                     "timings_ms": {"search": round((t0 - start) * 1000, 2),
+                                    "pack": packed["stats"]["pack_ms"], "generate": usage["generate_ms"],
+                                    "total": round(total * 1000, 2)}}
+
+async def stream_search(query: str, mode: str, group: bool, offset: int, limit: int, rerank: bool,
+                        selected: Optional[Tuple[str, ...]], filters: Optional[Tuple], fmt: str,
+                        answer: bool = False, top_papers: int = 0):
+    """The events of a streamed search.
+    
+    `start` goes out before searching. The first-stage (batched, cached) results
+    follow as one `hit` event per chunk, with the metadata of papers not sent yet,
+    or one `group` event per paper. With `rerank`, the cross-encoder runs after
+    that and `reranked` replaces them with the final page. With `answer`, the
+    top ANSWER_HITS chunks are then packed and answered (`sources`, `token`...,
+    `answer`; see `answer_events`). `done` ends the stream with the stage timings
+    and the server-side milliseconds to the first result.
+    """
+    start = time.perf_counter()
+    yield stream_event("start", {"query": query, "mode": mode, "group": group, "rerank": rerank,
+                                 "answer": answer, "filters": dict(filters or ()), "top_papers": top_papers}, fmt)
+    SEARCH_STREAM_SECONDS.observe(time.perf_counter() - start, milestone='first_byte')
+    try:
+        top_k = page_depth(group, offset, limit)
+        reranker = await asyncio.to_thread(rag_system.base.get_reranker) if rerank else None
+        depth = max(top_k, reranker.depth) if reranker else top_k
+        if answer:
+            depth = max(depth, ANSWER_HITS)
+        system, hits, timings = await query_batcher.search_traced(query, top_k=depth, mode=mode, rerank=False,
+                                                                  shards=selected, filters=filters,
+                                                                  top_papers=top_papers)
+        timings.pop('batch_size', None)
+        page = result_page(system, hits[:top_k], group, offset, limit)
+        if group:
+            events = [("group", {"group": paper}) for paper in page["papers"]]
+        else:
+            sent = set()
+            events = []
+            for hit in page["results"]:
+                papers = {paper_id: metadata for paper_id, metadata in system.papers_for([hit]).items()
+                          if paper_id not in sent}
+                sent.update(papers)
+                events.append(("hit", {"hit": hit, "papers": papers, "final": reranker is None}))
+        first_result = None
+        for name, data in events:
+            yield stream_event(name, data, fmt)
+            if first_result is None:
+                first_result = time.perf_counter() - start
+                SEARCH_STREAM_SECONDS.observe(first_result, milestone='first_result')
+        
+        if reranker:
+            t0 = time.perf_counter()
+            with stage('rerank'):
+                # Copies: the first-stage hits may be the result cache's own
+                reranked = await asyncio.to_thread(reranker.rerank_batch, [query], [[dict(hit) for hit in hits]])
+            timings['rerank'] = time.perf_counter() - t0
+            yield stream_event("reranked", result_page(system, reranked[0][:top_k], group, offset, limit), fmt)
+            if first_result is None:
+                first_result = time.perf_counter() - start
+        
+        if answer:
+            context = (reranked[0] if reranker else hits)[:ANSWER_HITS]
+            async for name, data in answer_events(system, query, context, start):
+                yield stream_event(name, data, fmt)
+    except Exception as e:
+        yield stream_event("error", {"error": str(e)}, fmt)
+        return
+    total = time.perf_counter() - start
+    SEARCH_STREAM_SECONDS.observe(total, milestone='done')
+    yield stream_event("done", {"hits": len(events), **({"total": page["total"]} if group else {}),
+                                "first_result_ms": round(first_result * 1000, 2) if first_result is not None else None,
+                                "total_ms": round(total * 1000, 2),
+                                "timings_ms": {name: round(seconds * 1000, 2) for name, seconds in timings.items()}},
+                       fmt)
+
+@app.post("/search/stream")
+async def search_papers_stream(query: str = Form(...), mode: str = Form("hybrid"), group: bool = Form(False),
+                               offset: int = Form(0), limit: int = Form(5), rerank: bool = Form(False),
+                               shards: str = Form(""), published_from: str = Form(""), published_to: str = Form(""),
+                               authors: str = Form(""), categories: str = Form(""), arxiv_ids: str = Form(""),
+                               format: str = Form("ndjson"), answer: bool = Form(False),
+                               top_papers: int = Form(0)):
+    """Like /search, but stream the results as NDJSON lines or (`format=sse`) server-sent events.
+    
+    Events: start, then hit (or group) per result, reranked (the final page, with
+    `rerank`), sources, token and answer (with `answer`), and done or error (see
+    `stream_search`). Invalid requests get a plain JSON error instead of a stream.
+    """
+    if format not in ("ndjson", "sse"):
+        return {"error": f"Unknown stream format: {format} (ndjson or sse)"}
+    try:
+        selected, filters = search_options(mode, shards, published_from, published_to, authors, categories,
+                                           arxiv_ids)
+    except ValueError as e:
+        return {"error": str(e)}
+    events = stream_search(query, mode, group, max(offset, 0), min(max(limit, 1), 50), rerank, selected, filters,
+                           format, answer, max(top_papers, 0))
+    media_type = "text/event-stream" if format == "sse" else "application/x-ndjson"
+    # No caching or proxy buffering, so every event reaches the client as soon as it is written
+    return StreamingResponse(events, media_type=media_type,
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.post("/answer")
+async def answer_question(query: str = Form(...), mode: str = Form("hybrid"), rerank: bool = Form(False),
+                          top_k: int = Form(ANSWER_HITS), budget: int = Form(0), shards: str = Form(""),
+                          published_from: str = Form(""), published_to: str = Form(""), authors: str = Form(""),
+                          categories: str = Form(""), arxiv_ids: str = Form(""), top_papers: int = Form(0)):
+    """Answer a question from the `top_k` best chunks, with numbered sources to cite.
+    
+    Overlapping chunks of a paper are merged and repeated sentences dropped before
+    the context is cut at `budget` prompt tokens (0: RAG_ANSWER_BUDGET). The
+    response reports the prompt and completion tokens and the time spent
+    searching, packing and generating. Takes the /search filters and `top_papers`; /search/stream
+    with `answer` streams the answer instead.
+    """
+    start = time.perf_counter()
+    try:
+        selected, filters = search_options(mode, shards, published_from, published_to, authors, categories,
+                                           arxiv_ids)
+    except ValueError as e:
+        return {"error": str(e)}
+    try:
+        system, hits, _ = await query_batcher.search_traced(query, top_k=min(max(top_k, 1), MAX_SEARCH_HITS),
+                                                            mode=mode, rerank=rerank, shards=selected,
+                                                            filters=filters, top_papers=max(top_papers, 0))
+        result = {}
+        async for name, data in answer_events(system, query, hits, start, budget if budget > 0 else None):
+            if name != "token":
+                result.update(data)
+    except Exception as e:
+        return {"error": str(e)}
+    return {"query": query, "mode": mode, **result}
+
+@app.post("/initialize")
+async def initialize_system(shards: str = Form(""), remove_missing: bool = Form(False)):
+    """Start a background build of all shards (or the comma separated `shards`); poll /status for progress.
+    
+    The first run downloads and indexes everything; later runs only ingest papers
+    that are new since the last build and keep every paper already indexed. With
+    `remove_missing`, indexed papers that are not in the latest listing (only the
+    newest `max_results` papers of each shard) are removed as well. Searches are
+    served from the current index until the new one is swapped in.
+    """
+    try:
+        names = rag_system.select(parse_ids(shards))
+    except ValueError as e:
+        return {"error": str(e)}
+    stages = [f"{name}/{stage}" for name in names for stage in ('list', 'ingest', 'embed', 'index', 'save')]
+    return start_build("initialize", stages + ['swap'], lambda job: build_shards(job, rag_system, names, remove_missing))
+
+@app.post("/update")
+async def update_system(add: str = Form(""), remove: str = Form("")):
+    """Incrementally add and remove papers by arXiv ID (comma or space separated) in the background.
+    
+    Added papers go to the shard of their primary category.
+    """
+    if not rag_system.is_initialized():
+        return {"error": "RAG system not initialized. Please run the data collection first."}
+    add_ids, remove_ids = parse_ids(add), parse_ids(remove)
+    return start_build("update", ['fetch'], lambda job: update_shards(job, rag_system, add_ids, remove_ids))
+
+@app.post("/build/cancel")
+async def cancel_build():
+    """Cancel the running build; the current index stays in service."""
+    if not build_runner.cancel():
+        return {"error": "No build is running"}
+    return {"message": "Cancellation requested", "build": build_runner.status()}
+
+@app.post("/warmup")
+async def warm_up_system(rerank: bool = Form(False)):
+    """Load the models (the cross-encoder too with `rerank`) and page in the indexes before real traffic."""
+    startup_stats['warm_up'] = await asyncio.to_thread(warm_up, rerank)
+    return {"message": "Warm-up finished", "seconds": startup_stats['warm_up']}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Counters, histograms and gauges in the Prometheus text format."""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/status")
+async def get_status():
+    """Get system status."""
+    return {
+        "initialized": rag_system.is_initialized(),
+        "papers": rag_system.paper_count(),
+        "chunks": rag_system.chunk_count(),
+        "duplicates": rag_system.duplicate_count(),
+        "shards": rag_system.stats(),
+        "search": query_batcher.stats(),
+        "build": build_runner.status(),
+        "rerank": rag_system.reranker.stats() if rag_system.reranker else None,
+        "answer": answer_generator.stats(),
+        "startup": {**startup_stats, "model_loaded": rag_system.base.embedding_engine.model_loaded},
+        "pid": os.getpid()
+    }
+
+# Create HTML template
+html_template = """
+<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>arXiv CS.CL RAG System</title>
+    <style>
+        body {
+            font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
+            max-width: 1200px;
+            margin: 0 auto;
+            padding: 20px;
+            background-color: #f5f5f5;
+        }
+        .container {
+            background: white;
+            padding: 30px;
+            border-radius: 10px;
+            box-shadow: 0 2px 10px rgba(0,0,0,0.1);
+        }
+        h1 {
+            color: #2c3e50;
+            text-align: center;
+            margin-bottom: 30px;
+        }
+        .search-section {
+            margin-bottom: 30px;
+        }
+        .search-box {
+            display: flex;
+            gap: 10px;
+            margin-bottom: 20px;
+        }
+        input[type="text"] {
+            flex: 1;
+            padding: 12px;
+            border: 2px solid #ddd;
+            border-radius: 5px;
+            font-size: 16px;
+        }
+        select {
+            padding: 12px;
+            border: 2px solid #ddd;
+            border-radius: 5px;
+            font-size: 16px;
+        }
+        button {
+            padding: 12px 24px;
+            background-color: #3498db;
+            color: white;
+            border: none;
+            border-radius: 5px;
+            cursor: pointer;
+            font-size: 16px;
+        }
+        button:hover {
+            background-color: #2980b9;
+        }
+        .init-button {
+            background-color: #e74c3c;
+            margin-bottom: 20px;
+        }
+        .init-button:hover {
+            background-color: #c0392b;
+        }
+        .status {
+            background-color: #ecf0f1;
+            padding: 15px;
+            border-radius: 5px;
+            margin-bottom: 20px;
+        }
+        .results {
+            margin-top: 20px;
+        }
+        .answer-box {
+            background-color: #eef7ee;
+            padding: 20px;
+            margin-bottom: 20px;
+            border-radius: 5px;
+            border-left: 4px solid #27ae60;
+            white-space: pre-wrap;
+        }
+        .answer-sources, .answer-usage {
+            color: #7f8c8d;
+            font-size: 13px;
+            margin-top: 10px;
+            white-space: normal;
+        }
+        .result-item {
+            background-color: #f8f9fa;
+            padding: 20px;
+            margin-bottom: 15px;
+            border-radius: 5px;
+            border-left: 4px solid #3498db;
+        }
+        .paper-title {
+            font-weight: bold;
+            color: #2c3e50;
+            margin-bottom: 10px;
+            cursor: help;
+            position: relative;
+            border-bottom: 1px dotted #bdc3c7;
+        }
+        .paper-title:hover::after {
+            content: "📖 " attr(data-summary);
+            position: absolute;
+            bottom: 100%;
+            left: 0;
+            background: #34495e;
+            color: white;
+            padding: 15px;
+            border-radius: 8px;
+            font-size: 14px;
+            font-weight: normal;
+            max-width: 500px;
+            z-index: 1000;
+            box-shadow: 0 4px 20px rgba(0,0,0,0.3);
+            line-height: 1.4;
+        }
+        .paper-authors {
+            color: #7f8c8d;
+            margin-bottom: 10px;
+        }
+        .chunk-text {
+            background-color: white;
+            padding: 15px;
+            border-radius: 5px;
+            margin-top: 10px;
+            border: 1px solid #ddd;
+        }
+        .similarity-score {
+            color: #27ae60;
+            font-weight: bold;
+        }
+        .paper-actions {
+            margin-top: 15px;
+            display: flex;
+            gap: 10px;
+            flex-wrap: wrap;
+        }
+        .open-paper-btn {
+            background-color: #e67e22;
+            color: white;
+            padding: 8px 16px;
+            border: none;
+            border-radius: 5px;
+            cursor: pointer;
+            font-size: 14px;
+            text-decoration: none;
+            display: inline-block;
+        }
+        .open-paper-btn:hover {
+            background-color: #d35400;
+        }
+        .paper-meta {
+            display: flex;
+            gap: 15px;
+            margin-bottom: 15px;
+            flex-wrap: wrap;
+        }
+        .arxiv-id {
+            color: #7f8c8d;
+            font-size: 12px;
+            font-family: monospace;
+            background-color: #ecf0f1;
+            padding: 4px 8px;
+            border-radius: 3px;
+        }
+        .paper-date {
+            color: #7f8c8d;
+            font-size: 12px;
+            background-color: #ecf0f1;
+            padding: 4px 8px;
+            border-radius: 3px;
+        }
+        .loading {
+            text-align: center;
+            color: #7f8c8d;
+            font-style: italic;
+        }
+    </style>
+</head>
+<body>
+    <div class="container">
+        <h1>📚 arXiv CS.CL RAG System</h1>
+        
+        <div class="search-section">
+            <button class="init-button" id="initButton" onclick="initializeSystem()">🚀 Initialize System (Download 50 Papers)</button>
+            <button id="cancelButton" onclick="cancelBuild()" style="display: none;">✖ Cancel Build</button>
+            
+            <div class="status" id="status">
+                <strong>Status:</strong> <span id="statusText">Not initialized</span>
+            </div>
+            
+            <div class="search-box">
+                <input type="text" id="queryInput" placeholder="Enter your question about CS.CL papers..." />
+                <select id="modeSelect" title="Retrieval mode">
+                    <option value="hybrid">Hybrid</option>
+                    <option value="dense">Semantic</option>
+                    <option value="lexical">Keyword</option>
+                </select>
+                <label title="Rerank the top candidates with a cross-encoder"><input type="checkbox" id="rerankCheck" /> Rerank</label>
+                <label title="Generate an answer from the top results, citing its sources"><input type="checkbox" id="answerCheck" /> Answer</label>
+                <select id="shardSelect" title="Search only one shard">
+                    <option value="">All shards</option>
+                </select>
+                <button onclick="searchPapers()">🔍 Search</button>
+            </div>
+            
+            <div class="search-box" title="Only search papers matching every filter that is filled in">
+                <input type="text" id="publishedFromInput" placeholder="Published from (YYYY-MM)" />
+                <input type="text" id="publishedToInput" placeholder="Published to (YYYY-MM)" />
+                <input type="text" id="authorsInput" placeholder="Authors (comma separated)" />
+                <input type="text" id="categoriesInput" placeholder="Categories, e.g. cs.LG" />
+                <select id="topPapersSelect" title="Two-tier search: match paper abstracts first, then search only the best papers' chunks">
+                    <option value="0">All papers</option>
+                    <option value="5">Top 5 papers</option>
+                    <option value="20">Top 20 papers</option>
+                    <option value="50">Top 50 papers</option>
+                </select>
+            </div>
+            
+            <div style="text-align: center; color: #7f8c8d; font-size: 14px; margin-top: 10px;">
+                💡 <strong>Tip:</strong> Hover over paper titles to see summaries, click "Open Full Paper" to read the complete article
+            </div>
+        </div>
+        
+        <div id="results" class="results"></div>
+    </div>
+
+    <script>
+        // Check status on page load
+        window.onload = function() {
+            checkStatus();
+        };
+
+        async function checkStatus() {
+            try {
+                const response = await fetch('/status');
+                const data = await response.json();
+                updateStatus(data);
+            } catch (error) {
+                console.error('Error checking status:', error);
+            }
+        }
+
+        let buildPoller = null;
+        let lastBuildState = null;
+
+        function describeBuild(build) {
+            let text = `⏳ ${build.job}: ${build.stage || 'starting'} (stage ${build.stage_index}/${build.stages.length})`;
+            if (build.total) {
+                text += ` - ${build.done}/${build.total}`;
+            }
+            if (build.eta_seconds !== null && build.eta_seconds !== undefined) {
+                text += `, ~${Math.ceil(build.eta_seconds)}s left in stage`;
+            }
+            return text;
+        }
+
+        function updateStatus(data) {
+            const statusText = document.getElementById('statusText');
+            let text = data.initialized
+                ? `✅ Initialized - ${data.papers} papers, ${data.chunks} chunks`
+                : `❌ Not initialized`;
+            const build = data.build;
+            const building = build && (build.state === 'running' || build.state === 'pending');
+            if (building) {
+                text += `<br>${describeBuild(build)}`;
+            } else if (build && build.state !== lastBuildState && lastBuildState === 'running') {
+                if (build.state === 'failed') {
+                    alert('Build failed: ' + build.error);
+                } else if (build.state === 'succeeded') {
+                    alert('System initialized successfully!');
+                }
+            }
+            lastBuildState = build ? build.state : null;
+            statusText.innerHTML = text;
+            updateShards(data.shards || {});
+
+            document.getElementById('initButton').disabled = building;
+            document.getElementById('cancelButton').style.display = building ? 'inline-block' : 'none';
+            if (building && !buildPoller) {
+                buildPoller = setInterval(checkStatus, 1000);
+            } else if (!building && buildPoller) {
+                clearInterval(buildPoller);
+                buildPoller = null;
+            }
+        }
+
+        function updateShards(shards) {
+            const select = document.getElementById('shardSelect');
+            const known = Array.from(select.options).map(option => option.value);
+            Object.entries(shards).forEach(([name, shard]) => {
+                if (!known.includes(name)) {
+                    select.add(new Option(name, name));
+                }
+                select.querySelector(`option[value="${name}"]`).textContent = `${name} (${shard.papers} papers)`;
+            });
+        }
+
+        async function initializeSystem() {
+            try {
+                const response = await fetch('/initialize', { method: 'POST' });
+                const data = await response.json();
+                
+                if (data.error) {
+                    alert('Error: ' + data.error);
+                }
+                lastBuildState = 'running';
+                checkStatus();
+            } catch (error) {
+                alert('Error initializing system: ' + error);
+            }
+        }
+
+        async function cancelBuild() {
+            try {
+                await fetch('/build/cancel', { method: 'POST' });
+                checkStatus();
+            } catch (error) {
+                console.error('Error cancelling build:', error);
+            }
+        }
+
+        async function searchPapers() {
+            const query = document.getElementById('queryInput').value.trim();
+            if (!query) {
+                alert('Please enter a search query');
+                return;
+            }
+
+            const resultsDiv = document.getElementById('results');
+            resultsDiv.innerHTML = '<div class="loading">Searching...</div>';
+
+            try {
+                const formData = new FormData();
+                formData.append('query', query);
+                formData.append('mode', document.getElementById('modeSelect').value);
+                formData.append('rerank', document.getElementById('rerankCheck').checked);
+                formData.append('answer', document.getElementById('answerCheck').checked);
+                formData.append('shards', document.getElementById('shardSelect').value);
+                formData.append('published_from', document.getElementById('publishedFromInput').value);
+                formData.append('published_to', document.getElementById('publishedToInput').value);
+                formData.append('authors', document.getElementById('authorsInput').value);
+                formData.append('categories', document.getElementById('categoriesInput').value);
+                formData.append('top_papers', document.getElementById('topPapersSelect').value);
+
+                const search = { results: [], papers: {}, started: performance.now(), firstResult: null };
+                const response = await fetch('/search/stream', {
+                    method: 'POST',
+                    body: formData
+                });
+
+                // Invalid requests get a plain JSON error instead of a stream
+                if (!(response.headers.get('content-type') || '').includes('ndjson')) {
+                    const data = await response.json();
+                    resultsDiv.innerHTML = `<div class="error">${data.error || 'Error performing search'}</div>`;
+                    return;
+                }
+
+                // One JSON event per line; render each as soon as it arrives
+                const reader = response.body.getReader();
+                const decoder = new TextDecoder();
+                let buffer = '';
+                while (true) {
+                    const { done, value } = await reader.read();
+                    if (done) {
+                        break;
+                    }
+                    buffer += decoder.decode(value, { stream: true });
+                    const lines = buffer.split('\\n');
+                    buffer = lines.pop();
+                    lines.filter(line => line.trim()).forEach(line => handleSearchEvent(search, JSON.parse(line)));
+                }
+            } catch (error) {
+                resultsDiv.innerHTML = '<div class="error">Error performing search</div>';
+                console.error('Search error:', error);
+            }
+        }
+
+        function handleSearchEvent(search, event) {
+            const resultsDiv = document.getElementById('results');
+            const progress = document.getElementById('searchProgress');
+            if (event.event === 'start') {
+                resultsDiv.innerHTML = `<h3>🔍 Search Results for: "${event.query}"</h3>
+                    ${event.answer ? '<div class="answer-box" id="answerBox"><div class="loading">Generating answer...</div></div>' : ''}
+                    <div id="resultList"></div>
+                    <div class="loading" id="searchProgress">Searching...</div>`;
+            } else if (event.event === 'hit') {
+                if (search.firstResult === null) {
+                    search.firstResult = performance.now() - search.started;
+                }
+                Object.assign(search.papers, event.papers);
+                search.results.push(event.hit);
+                document.getElementById('resultList').insertAdjacentHTML('beforeend', renderResult(event.hit, search.papers));
+                progress.textContent = event.final ? 'Searching...' : 'Reranking...';
+            } else if (event.event === 'reranked') {
+                // The reranked page replaces the first-stage results
+                Object.assign(search.papers, event.papers);
+                search.results = event.results;
+                document.getElementById('resultList').innerHTML =
+                    event.results.map(result => renderResult(result, search.papers)).join('');
+            } else if (event.event === 'sources') {
+                // The answer streams in token by token above its numbered sources
+                search.answer = '';
+                document.getElementById('answerBox').innerHTML = `<span id="answerText"></span>
+                    <div class="answer-sources">${event.sources.map(source =>
+                        `[${source.number}] <a href="${source.pdf_url}" target="_blank">${source.title}</a>`).join('<br>')}</div>
+                    <div class="answer-usage" id="answerUsage"></div>`;
+            } else if (event.event === 'token') {
+                search.answer += event.text;
+                document.getElementById('answerText').textContent = search.answer;
+            } else if (event.event === 'answer') {
+                document.getElementById('answerUsage').textContent =
+                    `${event.usage.prompt_tokens} prompt tokens (budget ${event.usage.budget_tokens}), ` +
+                    `${event.usage.completion_tokens} completion tokens, answered in ${Math.round(event.timings_ms.total)} ms`;
+            } else if (event.event === 'done') {
+                if (search.results.length === 0) {
+                    resultsDiv.innerHTML = '<div class="loading">No results found</div>';
+                    return;
+                }
+                progress.textContent = `First result in ${Math.round(search.firstResult)} ms, ` +
+                    `all results in ${Math.round(performance.now() - search.started)} ms`;
+            } else if (event.event === 'error') {
+                resultsDiv.innerHTML = `<div class="error">${event.error}</div>`;
+            }
+        }
+
+        function renderResult(result, papers) {
+            const paper = papers[result.paper_id];
+            return `
+                    <div class="result-item">
+                        <div class="paper-title" data-summary="${paper.summary}">📄 ${paper.title}</div>
+                        <div class="paper-authors">👥 Authors: ${paper.authors.join(', ')}</div>
+                        <div class="paper-meta">
+                            <div class="arxiv-id">📚 arXiv ID: ${paper.arxiv_id}</div>
+                            <div class="paper-shard">🗂️ Shard: ${result.shard || 'N/A'}</div>
+                            <div class="paper-date">📅 Published: ${paper.published || 'N/A'}</div>
+                            <div class="similarity-score">🎯 Relevance: ${(result.similarity_score * 100).toFixed(1)}%</div>
+                        </div>
+                        <div class="chunk-text">${result.chunk}</div>
+                        ${result.pages ? `<div class="chunk-pages">📃 ${result.pages[0] === result.pages[1] ? `Page ${result.pages[0]}` : `Pages ${result.pages[0]}-${result.pages[1]}`}</div>` : ''}
+                        ${result.also_in ? `<div class="chunk-also-in">📑 Also in: ${result.also_in.map(id => papers[id].title).join('; ')}</div>` : ''}
+                        <div class="paper-actions">
+                            <a href="${paper.pdf_url}" target="_blank" class="open-paper-btn">🔗 Open Full Paper</a>
+                        </div>
+                    </div>
+                `;
+        }
+
+        // Allow Enter key to trigger search
+        document.getElementById('queryInput').addEventListener('keypress', function(e) {
+            if (e.key === 'Enter') {
+                searchPapers();
+            }
+        });
+    </script>
+</body>
+</html>
+"""
+
+if __name__ == "__main__":
+    print("Starting arXiv CS.CL RAG System...")
+    print("1. First, visit http://localhost:8000")
+    print("2. Click 'Initialize System' to download and process 50 CS.CL papers")
+    print("3. Once initialized, you can search through the papers")
+    
+    if WORKERS > 1:
+        # Worker processes import the app by name; they share the saved indexes through the page cache
+        uvicorn.run(f"{Path(__file__).stem}:app", host="0.0.0.0", port=8000, workers=WORKERS,
+                    app_dir=str(Path(__file__).parent))
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8000)
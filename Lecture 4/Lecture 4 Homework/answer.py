@@ -0,0 +1,383 @@
+import argparse
+import json
+import re
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import numpy as np
+from dedup import WORD, SimHasher, NearDuplicateIndex
+from metrics import ANSWER_PROMPT_TOKENS, ANSWER_SECONDS
+
+# Local, deterministic stub (tests and offline runs) or any OpenAI-compatible chat completions server
+LLM_BACKENDS = ('stub', 'openai')
+
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+PROMPT_TEMPLATE = ("Answer the question using only the numbered sources below. Cite the sources you use in "
+                   "square brackets, e.g. [1]. If the sources do not answer the question, say so.\n\n"
+                   "Sources:\n{context}\n\nQuestion: {question}\nAnswer:")
+
+
+def split_sentences(text: str, max_words: int = 60) -> List[str]:
+    """Sentences of `text`; runs of more than `max_words` words without a full stop (tables,
+    equations, captions in PDF text) are cut into pieces of `max_words` words."""
+    sentences = []
+    for sentence in SENTENCE_END.split(" ".join(text.split())):
+        words = sentence.split(" ")
+        sentences.extend(" ".join(words[i:i + max_words]) for i in range(0, len(words), max_words) if sentence)
+    return sentences
+
+
+def merge_passages(hits: List[Dict], spans: List[Optional[Tuple[int, int]]]) -> List[Dict]:
+    """Merge hits of the same paper whose character spans overlap or touch into passages.
+
+    Chunks are slices of their paper's text, so the part of a chunk past the end
+    of the passage so far is exactly the text that follows it. Hits without a
+    span (legacy chunking) stay passages of their own. Passages are returned in
+    order of their best hit's rank.
+    """
+    by_paper: Dict[Any, List] = {}
+    for rank, (hit, span) in enumerate(zip(hits, spans)):
+        by_paper.setdefault(hit['paper_id'], []).append((span, rank, hit))
+    passages = []
+    for paper_id, items in by_paper.items():
+        current = None
+        for span, rank, hit in sorted(items, key=lambda item: (item[0] is None, item[0] or (0, 0))):
+            if span is not None and current is not None and span[0] <= current['span'][1]:
+                if span[1] > current['span'][1]:
+                    current['text'] += hit['chunk'][current['span'][1] - span[0]:]
+                    current['span'] = (current['span'][0], span[1])
+                current['rank'] = min(current['rank'], rank)
+                current['chunk_ids'].append(hit['chunk_id'])
+                if 'pages' in hit and current['pages']:
+                    current['pages'] = [min(current['pages'][0], hit['pages'][0]),
+                                        max(current['pages'][1], hit['pages'][1])]
+                continue
+            current = {'paper_id': paper_id, 'text': hit['chunk'], 'span': span, 'rank': rank,
+                       'chunk_ids': [hit['chunk_id']], 'pages': hit.get('pages')}
+            passages.append(current)
+            if span is None:
+                current = None
+    return sorted(passages, key=lambda passage: passage['rank'])
+
+
+class ContextPacker:
+    """Pack retrieved chunks into a prompt of at most `budget_tokens` tokens.
+
+    1. Hits of the same paper whose spans overlap or touch become one passage, so
+       the chunk overlap is sent once.
+    2. Passages are taken best-ranked first, sentence by sentence (see
+       `split_sentences`). A sentence
+       whose normalized text was already taken, or (with at least
+       `min_sentence_words` words) whose SimHash is within `sentence_distance`
+       bits of a taken one, is dropped.
+    3. Packing stops at the first sentence that no longer fits the budget.
+    4. The kept text is laid out per paper as numbered sources, in order of each
+       paper's best hit, and each paper's passages in reading order, so the model
+       can cite [n].
+
+    Tokens are counted with the model's tiktoken encoding, and the final prompt
+    is re-counted as a whole, so the budget holds exactly.
+    """
+
+    def __init__(self, encoder, budget_tokens: int = 3000, template: str = PROMPT_TEMPLATE,
+                 sentence_distance: int = 3, min_sentence_words: int = 6):
+        self.encoder = encoder
+        self.budget_tokens = budget_tokens
+        self.template = template
+        self.sentence_distance = sentence_distance
+        self.min_sentence_words = min_sentence_words
+        self.simhasher = SimHasher()
+
+    def count(self, text: str) -> int:
+        return len(self.encoder.encode(text, disallowed_special=()))
+
+    def pack(self, question: str, hits: List[Dict], spans: List[Optional[Tuple[int, int]]],
+             papers: Dict[Any, Dict], budget_tokens: Optional[int] = None) -> Dict[str, Any]:
+        """Build the prompt for `question` from ranked `hits` (with their chunk `spans` and `papers` metadata)."""
+        budget = budget_tokens or self.budget_tokens
+        passages = merge_passages(hits, spans)
+        available = budget - self.count(self.template.format(context="", question=question))
+        seen = set()
+        near = NearDuplicateIndex(self.sentence_distance)
+        sources: Dict[Any, int] = {}
+        used = 0
+        sentences = dropped = 0
+        truncated = False
+        for passage in passages:
+            passage['sentences'] = []
+            paper_id = passage['paper_id']
+            # A paper's header is paid for with its first kept sentence
+            header = 0 if paper_id in sources else self.count(self.source_header(len(sources) + 1, papers[paper_id]))
+            for sentence in split_sentences(passage['text']):
+                sentences += 1
+                words = WORD.findall(sentence.lower())
+                key = " ".join(words)
+                if not key or key in seen:
+                    dropped += 1
+                    continue
+                fingerprint = self.simhasher.fingerprint(sentence) if len(words) >= self.min_sentence_words else None
+                if fingerprint is not None and near.find(fingerprint) is not None:
+                    dropped += 1
+                    continue
+                cost = self.count(" " + sentence) + header + (2 if not passage['sentences'] else 0)
+                if used + cost > available:
+                    truncated = True
+                    break
+                used += cost
+                header = 0
+                seen.add(key)
+                if fingerprint is not None:
+                    near.add(len(seen), fingerprint)
+                passage['sentences'].append(sentence)
+                sources.setdefault(paper_id, len(sources) + 1)
+            if truncated:
+                break
+
+        kept = [passage for passage in passages if passage.get('sentences')]
+        while True:
+            context, cited = self.layout(kept, sources, papers)
+            prompt = self.template.format(context=context, question=question)
+            prompt_tokens = self.count(prompt)
+            if prompt_tokens <= budget or not kept:
+                break
+            # Piecewise counts can be off by a token where pieces meet: drop the last sentence taken
+            truncated = True
+            last = max(kept, key=lambda passage: passage['rank'])
+            last['sentences'].pop()
+            if not last['sentences']:
+                kept.remove(last)
+        return {
+            'prompt': prompt,
+            'context': context,
+            'sources': cited,
+            'stats': {
+                'hits': len(hits),
+                'passages': len(kept),
+                'merged_chunks': len(hits) - len(passages),
+                'sentences': sentences,
+                'dropped_sentences': dropped,
+                'truncated': truncated,
+                'context_tokens': self.count(context),
+                'prompt_tokens': prompt_tokens,
+                'budget_tokens': budget
+            }
+        }
+
+    @staticmethod
+    def source_header(number: int, paper: Dict[str, Any]) -> str:
+        return f"[{number}] {paper.get('title', '')} (arXiv:{paper.get('arxiv_id', '')})"
+
+    def layout(self, kept: List[Dict], sources: Dict[Any, int], papers: Dict[Any, Dict]) -> Tuple[str, List[Dict]]:
+        """The context text and the cited sources, numbered in order of each paper's best hit."""
+        blocks, cited = [], []
+        for paper_id, number in sorted(sources.items(), key=lambda item: item[1]):
+            paper_passages = sorted((passage for passage in kept if passage['paper_id'] == paper_id),
+                                    key=lambda passage: (passage['span'] or (passage['rank'], 0))[0])
+            if not paper_passages:
+                continue
+            lines = [self.source_header(len(cited) + 1, papers[paper_id])]
+            for passage in paper_passages:
+                pages = passage['pages']
+                where = f"(p. {pages[0]}) " if pages and pages[0] == pages[1] else \
+                    f"(pp. {pages[0]}-{pages[1]}) " if pages else ""
+                lines.append(where + " ".join(passage['sentences']))
+            blocks.append("\n".join(lines))
+            paper = papers[paper_id]
+            cited.append({'number': len(cited) + 1, 'paper_id': paper_id, 'title': paper.get('title'),
+                          'arxiv_id': paper.get('arxiv_id'), 'pdf_url': paper.get('pdf_url'),
+                          'passages': [{'chunk_ids': passage['chunk_ids'], 'pages': passage['pages']}
+                                       for passage in paper_passages]})
+        return "\n\n".join(blocks), cited
+
+
+class StubLLM:
+    """Deterministic local backend: "answers" with the first sentence of every source, cited.
+
+    Needs no model or network, so tests and offline benchmarks exercise the
+    whole answer path; tokens are streamed word by word.
+    """
+
+    name = 'stub'
+
+    def generate(self, prompt: str, max_tokens: int = 256) -> Iterator[str]:
+        context = prompt.split("Sources:\n", 1)[-1].rsplit("\n\nQuestion:", 1)[0]
+        parts = []
+        for block in context.split("\n\n"):
+            lines = block.split("\n")
+            number = re.match(r"\[(\d+)\]", lines[0])
+            if number and len(lines) > 1:
+                first = split_sentences(re.sub(r"^\(pp?\. [\d-]+\) ", "", lines[1]))
+                parts.append(f"{first[0] if first else ''} [{number.group(1)}]")
+        words = (" ".join(parts) or "The sources do not answer the question.").split(" ")
+        for i, word in enumerate(words[:max_tokens]):
+            yield word if i == 0 else " " + word
+
+
+class OpenAIChatLLM:
+    """Any OpenAI-compatible chat completions server (OpenAI, vLLM, llama.cpp, Ollama), streamed."""
+
+    name = 'openai'
+
+    def __init__(self, model: str = "gpt-4o-mini", base_url: str = "https://api.openai.com/v1",
+                 api_key: Optional[str] = None, temperature: float = 0.0, timeout: float = 60.0):
+        self.model = model
+        self.base_url = base_url.rstrip('/')
+        self.api_key = api_key
+        self.temperature = temperature
+        self.timeout = timeout
+
+    def generate(self, prompt: str, max_tokens: int = 256) -> Iterator[str]:
+        import requests
+        headers = {'Authorization': f"Bearer {self.api_key}"} if self.api_key else {}
+        body = {'model': self.model, 'messages': [{'role': 'user', 'content': prompt}], 'max_tokens': max_tokens,
+                'temperature': self.temperature, 'stream': True}
+        with requests.post(f"{self.base_url}/chat/completions", json=body, headers=headers, stream=True,
+                           timeout=self.timeout) as response:
+            response.raise_for_status()
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data: "):
+                    continue
+                if line == "data: [DONE]":
+                    break
+                choices = json.loads(line[len("data: "):]).get('choices') or [{}]
+                text = (choices[0].get('delta') or {}).get('content')
+                if text:
+                    yield text
+
+
+def make_llm(backend: str = 'stub', **options):
+    """An LLM backend by name; `options` go to its constructor (model, base_url, api_key, ...)."""
+    if backend == 'stub':
+        return StubLLM()
+    if backend == 'openai':
+        return OpenAIChatLLM(**options)
+    raise ValueError(f"Unknown LLM backend {backend!r}; choose from {LLM_BACKENDS}")
+
+
+class AnswerGenerator:
+    """Pack the context of a search into a token budget and generate a cited answer.
+
+    The tiktoken `encoding` should be the LLM's (cl100k_base for the GPT-4 family,
+    o200k_base for GPT-4o); it is loaded on first use. Prompt tokens and latency
+    of every answer are recorded in the metrics and in `stats()`.
+    """
+
+    def __init__(self, llm, encoding: str = "cl100k_base", budget_tokens: int = 3000, max_answer_tokens: int = 256):
+        self.llm = llm
+        self.encoding = encoding
+        self.budget_tokens = budget_tokens
+        self.max_answer_tokens = max_answer_tokens
+        self._packer: Optional[ContextPacker] = None
+        self.lock = threading.Lock()
+        self.answers = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.seconds = 0.0
+
+    @property
+    def packer(self) -> ContextPacker:
+        with self.lock:
+            if self._packer is None:
+                import tiktoken
+                self._packer = ContextPacker(tiktoken.get_encoding(self.encoding), self.budget_tokens)
+            return self._packer
+
+    def pack(self, question: str, hits: List[Dict], spans, papers: Dict[Any, Dict],
+             budget_tokens: Optional[int] = None) -> Dict[str, Any]:
+        start = time.perf_counter()
+        packed = self.packer.pack(question, hits, spans, papers, budget_tokens)
+        seconds = time.perf_counter() - start
+        ANSWER_SECONDS.observe(seconds, stage='pack')
+        packed['stats']['pack_ms'] = round(seconds * 1000, 2)
+        return packed
+
+    def stream(self, packed: Dict[str, Any]) -> Iterator[str]:
+        """Generate an answer to a packed prompt, token by token."""
+        return self.llm.generate(packed['prompt'], self.max_answer_tokens)
+
+    def record(self, packed: Dict[str, Any], answer: str, seconds: float) -> Dict[str, Any]:
+        """Account for a finished answer; returns its token usage and generation time."""
+        usage = {'prompt_tokens': packed['stats']['prompt_tokens'], 'completion_tokens': self.packer.count(answer),
+                 'generate_ms': round(seconds * 1000, 2)}
+        ANSWER_PROMPT_TOKENS.observe(usage['prompt_tokens'])
+        ANSWER_SECONDS.observe(seconds, stage='generate')
+        with self.lock:
+            self.answers += 1
+            self.prompt_tokens += usage['prompt_tokens']
+            self.completion_tokens += usage['completion_tokens']
+            self.seconds += seconds
+        return usage
+
+    def answer(self, question: str, hits: List[Dict], spans, papers: Dict[Any, Dict],
+               budget_tokens: Optional[int] = None) -> Dict[str, Any]:
+        """Pack and generate in one call (runs the LLM to completion)."""
+        packed = self.pack(question, hits, spans, papers, budget_tokens)
+        start = time.perf_counter()
+        text = "".join(self.stream(packed))
+        usage = self.record(packed, text, time.perf_counter() - start)
+        return {'answer': text, 'sources': packed['sources'], 'usage': {**packed['stats'], **usage}}
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'backend': self.llm.name,
+            'encoding': self.encoding,
+            'budget_tokens': self.budget_tokens,
+            'answers': self.answers,
+            'avg_prompt_tokens': round(self.prompt_tokens / self.answers, 1) if self.answers else None,
+            'avg_completion_tokens': round(self.completion_tokens / self.answers, 1) if self.answers else None,
+            'avg_generate_ms': round(self.seconds * 1000 / self.answers, 2) if self.answers else None
+        }
+
+
+def benchmark(system, queries: List[str], top_k: int = 20, budget_tokens: int = 3000) -> Dict[str, Any]:
+    """Prompt tokens of naive top-k concatenation vs the packed context, on a loaded index."""
+    generator = AnswerGenerator(StubLLM(), budget_tokens=budget_tokens)
+    packer = generator.packer
+    rows = []
+    for query in queries:
+        start = time.perf_counter()
+        hits = system.search(query, top_k, mode="hybrid")
+        search_seconds = time.perf_counter() - start
+        papers = system.papers_for(hits)
+        naive = packer.count(packer.template.format(context="\n\n".join(hit['chunk'] for hit in hits),
+                                                    question=query))
+        result = generator.answer(query, hits, system.spans_for(hits), papers, budget_tokens)
+        rows.append({'naive_tokens': naive, **result['usage'],
+                     'total_ms': search_seconds * 1000 + result['usage']['pack_ms'] + result['usage']['generate_ms']})
+    summary = {key: round(float(np.mean([row[key] for row in rows])), 2)
+               for key in ('naive_tokens', 'prompt_tokens', 'merged_chunks', 'dropped_sentences', 'pack_ms',
+                           'generate_ms', 'total_ms')}
+    summary['truncated'] = round(float(np.mean([row['truncated'] for row in rows])), 3)
+    summary['over_budget'] = sum(row['prompt_tokens'] > budget_tokens for row in rows)
+    return {'queries': len(rows), 'top_k': top_k, 'budget_tokens': budget_tokens, **summary}
+
+
+if __name__ == "__main__":
+    from benchmark import load_app_module
+
+    parser = argparse.ArgumentParser(description="Prompt tokens of naive vs packed answer context on a saved index")
+    parser.add_argument("--index", default="rag_shards/cs.CL", help="Saved index directory")
+    parser.add_argument("--queries", type=int, default=50, help="Queries sampled from chunk text")
+    parser.add_argument("-k", "--top-k", type=int, default=20, help="Retrieved chunks per question")
+    parser.add_argument("--budget", type=int, nargs="+", default=[1000, 3000], help="Prompt token budgets")
+    parser.add_argument("--output", default="answer_benchmark.json")
+    args = parser.parse_args()
+
+    system = load_app_module().rag_system.base.spawn()
+    if not system.load_system(args.index):
+        raise SystemExit(f"No index at {args.index}")
+    rng = np.random.default_rng(0)
+    queries = []
+    for chunk_id in rng.choice(system.indexed_chunk_ids(), args.queries):
+        words = system.chunks[chunk_id].split()
+        start = int(rng.integers(0, max(len(words) - 8, 1)))
+        queries.append(" ".join(words[start:start + 8]))
+    results = [benchmark(system, queries, args.top_k, budget) for budget in args.budget]
+    for row in results:
+        print(f"budget {row['budget_tokens']}: naive {row['naive_tokens']:.0f} tokens -> packed "
+              f"{row['prompt_tokens']:.0f} ({row['merged_chunks']:.1f} chunks merged, "
+              f"{row['dropped_sentences']:.1f} sentences dropped, pack {row['pack_ms']:.2f}ms)")
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
@@ -0,0 +1,630 @@
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import numpy as np
+import faiss
+import fitz  # PyMuPDF
+import httpx
+from index_versions import current_dir, next_dir, publish
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "RAG with arXiv Papers.py")
+
+
+def load_app_module(path: str = APP_PATH):
+    """Import the app script (its file name is not a module name) for the benchmark and evaluation scripts."""
+    spec = importlib.util.spec_from_file_location("rag_app", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+WORDS = ["language", "model", "token", "attention", "retrieval", "benchmark", "we", "propose", "a", "novel",
+         "method", "for", "the", "transformer", "dataset", "results", "show", "that", "translation", "speech",
+         "parsing", "embedding", "corpus", "evaluation", "pretraining", "alignment", "instruction", "reasoning"]
+
+
+def synthetic_pdfs(n_papers: int = 20, pages: int = 8, seed: int = 0) -> List[bytes]:
+    """Multi-page PDFs of random sentences, generated in memory."""
+    rng = np.random.default_rng(seed)
+    pdfs = []
+    for i in range(n_papers):
+        doc = fitz.open()
+        for page_number in range(pages):
+            sentences = [" ".join(rng.choice(WORDS, int(rng.integers(8, 20)))).capitalize() + "."
+                         for _ in range(40)]
+            page = doc.new_page()
+            page.insert_textbox(page.rect + (40, 40, -40, -40), f"Paper {i}, page {page_number + 1}\n" +
+                                " ".join(sentences), fontsize=8)
+        pdfs.append(doc.tobytes())
+        doc.close()
+    return pdfs
+
+
+def load_pdfs(pdf_dir: str) -> List[bytes]:
+    pdfs = []
+    for name in sorted(os.listdir(pdf_dir)):
+        if name.endswith('.pdf'):
+            with open(os.path.join(pdf_dir, name), 'rb') as f:
+                pdfs.append(f.read())
+    return pdfs
+
+
+class PDFServer:
+    """Serve in-memory PDFs as http://127.0.0.1:<port>/<i>.pdf, so ingestion runs without arXiv."""
+
+    def __init__(self, pdfs: List[bytes]):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                try:
+                    data = pdfs[int(self.path.strip('/').split('.')[0])]
+                except (ValueError, IndexError):
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/pdf')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def fixture_papers(n_papers: int, base_url: str) -> List[Dict[str, Any]]:
+    return [{'title': f"Synthetic paper {i}", 'authors': [f"Author {i}", "Benchmark Author"],
+             'summary': f"Fixture paper {i} for the benchmark suite.", 'pdf_url': f"{base_url}/{i}.pdf",
+             'published': "2024-01-01", 'arxiv_id': f"bench.{i:05d}"} for i in range(n_papers)]
+
+
+def timed(stages: Dict[str, Dict], name: str, fn: Callable, items: Optional[int] = None, unit: str = "items"):
+    """Run `fn()`, recording its wall time (and throughput if `items` is given) under `stages[name]`."""
+    start = time.perf_counter()
+    result = fn()
+    seconds = time.perf_counter() - start
+    stages[name] = {'seconds': round(seconds, 4)}
+    if items is not None:
+        stages[name][f'{unit}_per_sec'] = round(items / seconds, 2) if seconds > 0 else None
+    print(f"{name}: {seconds:.3f}s" + (f" ({items} {unit})" if items is not None else ""))
+    return result
+
+
+def run_stages(app, pdfs: List[bytes], directory: str, index_type: Optional[str] = None):
+    """Build an index from `pdfs` stage by stage; returns the reloaded system and per-stage timings.
+
+    Extraction and chunking are first timed on their own (single thread), then the
+    pipelined ingestion the app uses (local download + extract + chunk) builds the system.
+    """
+    base = app.rag_system.base
+    system = base.spawn()
+    system.embedding_cache = None  # Time real embedding, not cache reads
+    if index_type:
+        system.index_type = index_type
+    stages = {}
+    megabytes = sum(len(pdf) for pdf in pdfs) / 2**20
+
+    pages = timed(stages, 'extract', lambda: [system.extract_pages(pdf) for pdf in pdfs], len(pdfs), 'papers')
+    stages['extract']['pdf_megabytes'] = round(megabytes, 2)
+    chunked = timed(stages, 'chunk', lambda: [system.chunk_paper(paper_pages) for paper_pages in pages],
+                    sum(len(paper_pages) for paper_pages in pages), 'pages')
+
+    server = PDFServer(pdfs)
+    try:
+        system.papers = fixture_papers(len(pdfs), server.url)
+        ingest = timed(stages, 'ingest', system.process_papers_pipelined, len(pdfs), 'papers')
+        stages['ingest']['stage_seconds'] = {stage: round(seconds, 4)
+                                             for stage, seconds in ingest['stage_seconds'].items()}
+    finally:
+        server.close()
+    n_chunks = len(system.chunks)
+    assert n_chunks == sum(len(chunks) for chunks, _, _ in chunked), "pipelined and serial chunking differ"
+    stages['ingest']['dedup'] = {key: round(value, 4) for key, value in system.last_dedup_stats.items()}
+    # Only representative chunks are embedded and indexed
+    n_indexed = len(system.indexed_chunk_ids())
+
+    timed(stages, 'embed', system.create_embeddings, n_indexed, 'chunks')
+    timed(stages, 'index_faiss', system.build_faiss_index, n_indexed, 'chunks')
+    timed(stages, 'index_lexical', system.build_lexical_index, n_indexed, 'chunks')
+    timed(stages, 'save', lambda: system.save_system(directory), n_chunks, 'chunks')
+    loaded = base.spawn()
+    timed(stages, 'load', lambda: loaded.load_system(directory), n_chunks, 'chunks')
+    corpus = {'papers': len(pdfs), 'pages': sum(len(paper_pages) for paper_pages in pages), 'chunks': n_chunks,
+              'duplicates': n_chunks - n_indexed, 'pdf_megabytes': round(megabytes, 2), 'index_type': system.index_type}
+    return loaded, stages, corpus
+
+
+def sample_queries(system, n: int = 100, words: int = 6, seed: int = 0) -> List[str]:
+    """Queries made of short word windows taken from random chunks."""
+    rng = np.random.default_rng(seed)
+    queries = []
+    for chunk_id in rng.integers(0, len(system.chunks), n):
+        tokens = system.chunks[chunk_id].split()
+        start = int(rng.integers(0, max(len(tokens) - words, 1)))
+        queries.append(" ".join(tokens[start:start + words]))
+    return queries
+
+
+def latency_summary(seconds: List[float]) -> Dict[str, float]:
+    if not seconds:
+        return {'count': 0}
+    ms = np.asarray(seconds) * 1000
+    return {'count': len(ms), 'mean_ms': round(float(ms.mean()), 2),
+            'p50_ms': round(float(np.percentile(ms, 50)), 2), 'p95_ms': round(float(np.percentile(ms, 95)), 2),
+            'p99_ms': round(float(np.percentile(ms, 99)), 2), 'max_ms': round(float(ms.max()), 2)}
+
+
+async def load_test(client: httpx.AsyncClient, queries: List[str], concurrency: int, n_requests: int,
+                    mode: str = "hybrid", rerank: bool = False, status_every: int = 10) -> Dict[str, Any]:
+    """`concurrency` clients issue `n_requests` requests back to back; every `status_every`-th one is GET /status."""
+    latencies = {'search': [], 'status': []}
+    errors = 0
+    counter = iter(range(n_requests))
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            endpoint = 'status' if status_every and i % status_every == status_every - 1 else 'search'
+            start = time.perf_counter()
+            try:
+                if endpoint == 'status':
+                    response = await client.get('/status')
+                else:
+                    response = await client.post('/search', data={'query': queries[i % len(queries)], 'mode': mode,
+                                                                  'rerank': str(rerank).lower()})
+                ok = response.status_code == 200 and 'error' not in response.json()
+            except httpx.HTTPError:
+                ok = False
+            latencies[endpoint].append(time.perf_counter() - start)
+            errors += not ok
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    seconds = time.perf_counter() - start
+    result = {'concurrency': concurrency, 'requests': n_requests, 'mode': mode, 'rerank': rerank,
+              'seconds': round(seconds, 3), 'qps': round(n_requests / seconds, 2), 'errors': errors,
+              'search': latency_summary(latencies['search']), 'status': latency_summary(latencies['status'])}
+    print(f"concurrency {concurrency:>3}: {result['qps']:.1f} req/s, search p50 {result['search'].get('p50_ms')}ms "
+          f"p95 {result['search'].get('p95_ms')}ms p99 {result['search'].get('p99_ms')}ms, {errors} errors")
+    return result
+
+
+async def run_load(app, queries: List[str], levels: List[int], n_requests: int, mode: str, rerank: bool,
+                   status_every: int, url: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Drive the app in-process (ASGI transport) or a running server at `url`."""
+    transport = None if url else httpx.ASGITransport(app=app.app)
+    async with httpx.AsyncClient(transport=transport, base_url=url or "http://benchmark", timeout=60) as client:
+        # Warm up the batcher, the embedding cache and lazily loaded models
+        print("Warm-up:")
+        await load_test(client, queries, 1, min(len(queries), 10), mode, rerank, 0)
+        return [await load_test(client, queries, level, n_requests, mode, rerank, status_every) for level in levels]
+
+
+def start_server(workdir: str, index_dir: Optional[str] = None, shard: str = "cs.CL",
+                 env: Optional[Dict[str, str]] = None, app_path: str = APP_PATH,
+                 workers: int = 1) -> Tuple[subprocess.Popen, str]:
+    """Start the app as a uvicorn process (with `workers` worker processes) in `workdir`, serving
+    `index_dir` as the saved index of `shard`."""
+    if index_dir:
+        target = os.path.join(workdir, "rag_shards", shard)
+        shutil.rmtree(target, ignore_errors=True)
+        shutil.copytree(index_dir, target)
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    app_dir = os.path.dirname(app_path)
+    if workers > 1:
+        # Worker processes import the app by module name
+        code = (f"import uvicorn; uvicorn.run({os.path.splitext(os.path.basename(app_path))[0] + ':app'!r}, "
+                f"app_dir={app_dir!r}, host='127.0.0.1', port={port}, workers={workers}, log_level='warning')")
+    else:
+        code = (f"import sys, uvicorn; sys.path.insert(0, {app_dir!r}); "
+                f"from benchmark import load_app_module; "
+                f"uvicorn.run(load_app_module({app_path!r}).app, host='127.0.0.1', port={port}, log_level='warning')")
+    process = subprocess.Popen([sys.executable, "-c", code], cwd=workdir, env={**os.environ, **(env or {})})
+    return process, f"http://127.0.0.1:{port}"
+
+
+def wait_until_ready(process: subprocess.Popen, url: str, start: float, timeout: float = 300.0):
+    """Poll GET /status until the server answers."""
+    while True:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode} during startup")
+        if time.perf_counter() - start > timeout:
+            raise TimeoutError("Server did not start in time")
+        try:
+            if httpx.get(f"{url}/status", timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            time.sleep(0.02)
+
+
+def time_to_first_request(workdir: str, index_dir: Optional[str] = None, shard: str = "cs.CL",
+                          query: str = "attention model", warm_up: bool = False, app_path: str = APP_PATH,
+                          timeout: float = 300.0) -> Dict[str, Any]:
+    """Start the app as a fresh uvicorn process in `workdir` and time its first responses.
+
+    `index_dir` is copied in as the saved index of `shard`, so the server loads it at
+    startup. Reports the seconds from process start until GET /status answers and until
+    the first /search returns, the first and second search latencies, and whether the
+    first search found results. `warm_up` sets RAG_WARM_UP_ON_STARTUP=1.
+    """
+    start = time.perf_counter()
+    process, url = start_server(workdir, index_dir, shard, {'RAG_WARM_UP_ON_STARTUP': "1" if warm_up else "0"},
+                                app_path)
+    try:
+        wait_until_ready(process, url, start, timeout)
+        ready = time.perf_counter() - start
+        searches = []
+        for text in (query, query + " results"):
+            search_start = time.perf_counter()
+            response = httpx.post(f"{url}/search", data={'query': text, 'mode': "hybrid"}, timeout=timeout)
+            searches.append((time.perf_counter() - search_start, response.json()))
+        first_done = ready + searches[0][0]
+    finally:
+        process.terminate()
+        process.wait()
+    result = {'warm_up_on_startup': warm_up, 'ready_seconds': round(ready, 3),
+              'time_to_first_search_seconds': round(first_done, 3),
+              'first_search_ms': round(searches[0][0] * 1000, 2), 'second_search_ms': round(searches[1][0] * 1000, 2),
+              'first_search_ok': bool(searches[0][1].get('results'))}
+    print(f"startup (warm-up {'on' if warm_up else 'off'}): ready {result['ready_seconds']}s, first search "
+          f"{result['first_search_ms']}ms, second {result['second_search_ms']}ms")
+    return result
+
+
+def timed_search(client: httpx.Client, query: str, data: Dict[str, str]) -> float:
+    start = time.perf_counter()
+    client.post('/search', data={'query': query, **data}).raise_for_status()
+    return time.perf_counter() - start
+
+
+def stream_latency(url: str, queries: List[str], n_requests: int = 100, mode: str = "hybrid",
+                   rerank: bool = False) -> Dict[str, Any]:
+    """Time-to-first-byte, time-to-first-result and total latency of POST /search/stream,
+    next to the latency of the same queries on POST /search.
+
+    Requests are sent one at a time over a real socket (the in-process ASGI transport
+    buffers whole responses, so it can't see streaming).
+    """
+    data = {'mode': mode, 'rerank': str(rerank).lower()}
+    timings = {'first_byte': [], 'first_result': [], 'total': [], 'search': []}
+    with httpx.Client(base_url=url, timeout=60) as client:
+        for i in range(n_requests):
+            query = queries[i % len(queries)]
+            # The endpoint asked second may get a result cache hit, so alternate which goes first
+            if i % 2 == 0:
+                timings['search'].append(timed_search(client, query, data))
+
+            start = time.perf_counter()
+            first_byte = first_result = None
+            with client.stream('POST', '/search/stream', data={'query': query, **data}) as response:
+                response.raise_for_status()
+                for line in response.iter_lines():
+                    now = time.perf_counter() - start
+                    first_byte = first_byte if first_byte is not None else now
+                    if first_result is None and line and json.loads(line)['event'] in ('hit', 'group'):
+                        first_result = now
+            timings['total'].append(time.perf_counter() - start)
+            timings['first_byte'].append(first_byte)
+            if first_result is not None:
+                timings['first_result'].append(first_result)
+            if i % 2 == 1:
+                timings['search'].append(timed_search(client, query, data))
+    result = {'mode': mode, 'rerank': rerank, **{name: latency_summary(seconds) for name, seconds in timings.items()}}
+    print(f"stream ({mode}{', rerank' if rerank else ''}): first byte p50 {result['first_byte'].get('p50_ms')}ms, "
+          f"first result p50 {result['first_result'].get('p50_ms')}ms, total p50 {result['total'].get('p50_ms')}ms "
+          f"(/search p50 {result['search'].get('p50_ms')}ms)")
+    return result
+
+
+def journal_state(checkpoint_dir: str) -> Dict[str, int]:
+    """Papers chunked and chunks embedded so far, read from a build checkpoint's journal."""
+    state = {'papers_chunked': 0, 'chunks_embedded': 0}
+    try:
+        with open(os.path.join(checkpoint_dir, "papers.jsonl"), encoding="utf-8") as f:
+            lines = f.read().split("\n")[:-1]  # A torn last line has no newline yet
+    except OSError:
+        return state
+    for line in lines:
+        record = json.loads(line)
+        if record.get('stage') == 'chunked':
+            state['papers_chunked'] += 1
+        elif 'embedded' in record:
+            state['chunks_embedded'] = record['embedded']
+    return state
+
+
+def process_memory(pid: int) -> Dict[str, int]:
+    """Resident (RSS) and proportional (PSS: shared pages split between their users) bytes of a process."""
+    memory = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            key, _, value = line.partition(':')
+            if key in ('Rss', 'Pss'):
+                memory[key.lower()] = int(value.split()[0]) * 1024
+    return memory
+
+
+def worker_pids(pid: int) -> List[int]:
+    """PIDs of the direct children of `pid` (uvicorn's worker processes)."""
+    children = []
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    if int(f.read().rsplit(')', 1)[1].split()[1]) == pid:
+                        children.append(int(entry))
+            except (OSError, IndexError, ValueError):
+                continue
+    return children
+
+
+def shared_workers(workdir: str, index_dir: str, shard: str, queries: List[str], workers: int = 4,
+                   poll_seconds: float = 0.5, timeout: float = 300.0) -> Dict[str, Any]:
+    """Serve one index from 1 and from `workers` uvicorn workers, and publish a new version to the latter.
+
+    Reports the workers' summed RSS and PSS after every worker has served searches. The
+    index files are memory-mapped by all workers, so they count once in PSS; the
+    models are still loaded per worker. Then a copy of the index is published as a new
+    version and the time until every worker serves it is measured.
+    """
+    rows = []
+    for n in (1, workers):
+        server_dir = os.path.join(workdir, f"workers_{n}")
+        os.makedirs(server_dir)
+        start = time.perf_counter()
+        process, url = start_server(server_dir, index_dir, shard, {'RAG_WORKERS': str(n),
+                                                                     'RAG_INDEX_POLL_SECONDS': str(poll_seconds)},
+                                    workers=n)
+        try:
+            wait_until_ready(process, url, start, timeout)
+            # Enough requests that every worker loads its model and pages in the index
+            pids = set()
+            with httpx.Client(timeout=timeout) as client:
+                for i in range(max(40, 20 * n)):
+                    client.post(f"{url}/search", data={'query': queries[i % len(queries)], 'mode': "hybrid"})
+                    pids.add(client.get(f"{url}/status").json()['pid'])
+            processes = worker_pids(process.pid) if n > 1 else [process.pid]
+            memory = [process_memory(pid) for pid in processes]
+            row = {'workers': n, 'workers_seen': len(pids),
+                   'rss_mb': round(sum(m['rss'] for m in memory) / 2 ** 20, 1),
+                   'pss_mb': round(sum(m['pss'] for m in memory) / 2 ** 20, 1)}
+            if n > 1:
+                root = os.path.join(server_dir, "rag_shards", shard)
+                version = next_dir(root)
+                shutil.copytree(current_dir(root), version)
+                published = time.perf_counter()
+                publish(root, version)
+                serving = {}
+                with httpx.Client(timeout=timeout) as client:
+                    while len(serving) < len(pids) or not all(serving.values()):
+                        if time.perf_counter() - published > timeout:
+                            raise TimeoutError("Workers did not pick up the published version")
+                        status = client.get(f"{url}/status").json()
+                        serving[status['pid']] = status['shards'][shard]['version'] == os.path.basename(version)
+                row['publish_visible_seconds'] = round(time.perf_counter() - published, 3)
+            rows.append(row)
+        finally:
+            process.terminate()
+            process.wait()
+        print(f"{n} worker(s): RSS {row['rss_mb']} MB, PSS {row['pss_mb']} MB" +
+              (f", new version served by all after {row['publish_visible_seconds']}s" if n > 1 else ""))
+    return {'poll_seconds': poll_seconds, 'runs': rows}
+
+
+def run_build(papers_path: str, directory: str, window: int, kill_at: Optional[str] = None,
+              app_path: str = APP_PATH, timeout: float = 600.0) -> Dict[str, Any]:
+    """Run `build_full` in a fresh process, SIGKILLing it once it is midway through `kill_at`.
+
+    `kill_at` is "ingest" (half the papers chunked) or "embed" (the first embedding window
+    committed). The embedding cache is off, so a restart really re-encodes what was lost.
+    """
+    code = (f"import json, sys; sys.path.insert(0, {os.path.dirname(app_path)!r}); "
+            f"from benchmark import load_app_module; from build_job import BuildJob; "
+            f"app = load_app_module({app_path!r}); base = app.rag_system.base; base.embedding_cache = None; "
+            f"papers = json.load(open({papers_path!r})); "
+            f"app.build_full(BuildJob('build', []), base, papers, {directory!r}, checkpoint_window={window})")
+    with open(papers_path) as f:
+        n_papers = len(json.load(f))
+    checkpoint_dir = f"{directory}.build"
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "-c", code], stdout=subprocess.DEVNULL)
+    killed = False
+    while process.poll() is None:
+        if time.perf_counter() - start > timeout:
+            process.kill()
+            raise TimeoutError("Build did not finish in time")
+        state = journal_state(checkpoint_dir)
+        if (kill_at == 'ingest' and state['papers_chunked'] >= n_papers // 2) or \
+                (kill_at == 'embed' and state['chunks_embedded'] > 0):
+            process.kill()
+            killed = True
+        time.sleep(0.005)
+    seconds = time.perf_counter() - start
+    if not killed and process.returncode != 0:
+        raise RuntimeError(f"Build exited with code {process.returncode}")
+    leg = {'kill_at': kill_at, 'killed': killed, 'seconds': round(seconds, 3), **journal_state(checkpoint_dir)}
+    print(f"build{f' (kill mid-{kill_at})' if kill_at else ''}: {leg['seconds']}s, " +
+          (f"killed with {leg['papers_chunked']} papers chunked, {leg['chunks_embedded']} chunks embedded"
+           if killed else "finished"))
+    return leg
+
+
+def same_index(a: str, b: str) -> bool:
+    """Whether two saved indexes hold the same chunks, paper mapping and (nearly) the same vectors."""
+    a, b = current_dir(a), current_dir(b)
+    for name in ("chunks.bin", "chunk_to_paper.npy", "chunk_canonical.npy", "chunk_pages.npy"):
+        with open(os.path.join(a, name), "rb") as f, open(os.path.join(b, name), "rb") as g:
+            if f.read() != g.read():
+                return False
+    return np.allclose(np.load(os.path.join(a, "embeddings.npy")), np.load(os.path.join(b, "embeddings.npy")),
+                       atol=1e-5)
+
+
+def resume_after_kill(pdfs: List[bytes], workdir: str, window: int = 64) -> Dict[str, Any]:
+    """Time an uninterrupted build against one killed mid-ingest, then mid-embedding, then resumed.
+
+    Both builds run in fresh processes on the same locally served PDFs; the resumed
+    index must match the uninterrupted one.
+    """
+    server = PDFServer(pdfs)
+    try:
+        papers_path = os.path.join(workdir, "papers.json")
+        with open(papers_path, "w") as f:
+            json.dump(fixture_papers(len(pdfs), server.url), f)
+        reference, resumed = os.path.join(workdir, "uninterrupted"), os.path.join(workdir, "resumed")
+        full = run_build(papers_path, reference, window)
+        legs = [run_build(papers_path, resumed, window, kill_at) for kill_at in ('ingest', 'embed', None)]
+    finally:
+        server.close()
+    result = {'window': window, 'uninterrupted_seconds': full['seconds'], 'legs': legs,
+              'resumed_total_seconds': round(sum(leg['seconds'] for leg in legs), 3),
+              'final_leg_seconds': legs[-1]['seconds'], 'identical': same_index(reference, resumed),
+              'checkpoint_removed': not os.path.exists(f"{resumed}.build")}
+    print(f"resume: uninterrupted {result['uninterrupted_seconds']}s, killed twice and resumed "
+          f"{result['resumed_total_seconds']}s in total (last leg {result['final_leg_seconds']}s), "
+          f"identical index: {result['identical']}")
+    return result
+
+
+def environment() -> Dict[str, Any]:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S"), 'git_commit': commit, 'python': platform.python_version(),
+            'platform': platform.platform(), 'cpus': os.cpu_count(), 'numpy': np.__version__,
+            'faiss': getattr(faiss, '__version__', None)}
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float = 0.2) -> List[str]:
+    """Stage times and latencies that got more than `tolerance` worse than `baseline` (and QPS that dropped)."""
+    regressions = []
+    for name, stage in results.get('stages', {}).items():
+        before = baseline.get('stages', {}).get(name, {}).get('seconds')
+        if before and stage['seconds'] > before * (1 + tolerance):
+            regressions.append(f"stage {name}: {before:.3f}s -> {stage['seconds']:.3f}s")
+    previous = {row['concurrency']: row for row in baseline.get('load', [])}
+    for row in results.get('load', []):
+        before = previous.get(row['concurrency'])
+        if not before:
+            continue
+        if row['qps'] < before['qps'] * (1 - tolerance):
+            regressions.append(f"concurrency {row['concurrency']} qps: {before['qps']} -> {row['qps']}")
+        for key in ('p50_ms', 'p95_ms', 'p99_ms'):
+            old, new = before['search'].get(key), row['search'].get(key)
+            if old and new and new > old * (1 + tolerance):
+                regressions.append(f"concurrency {row['concurrency']} search {key}: {old} -> {new}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="End-to-end stage timings and /search load test, fully offline")
+    parser.add_argument("--pdf-dir", help="Directory of fixture PDFs (default: synthetic PDFs)")
+    parser.add_argument("--papers", type=int, default=20, help="Synthetic papers to generate")
+    parser.add_argument("--pages", type=int, default=8, help="Pages per synthetic paper")
+    parser.add_argument("--index-type", help="Index type to build (default: the app's)")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32], help="Concurrent clients per run")
+    parser.add_argument("--requests", type=int, default=500, help="Requests per concurrency level")
+    parser.add_argument("--mode", default="hybrid", choices=["dense", "lexical", "hybrid"])
+    parser.add_argument("--rerank", action="store_true")
+    parser.add_argument("--result-cache", action="store_true",
+                        help="Keep the app's result cache on (off by default: the sampled queries repeat)")
+    parser.add_argument("--status-every", type=int, default=10, help="Every n-th request is GET /status (0: never)")
+    parser.add_argument("--url", help="Load-test a running server instead of the in-process app "
+                                      "(it must already be initialized; stage timings still run locally)")
+    parser.add_argument("--skip-load", action="store_true", help="Only time the build stages")
+    parser.add_argument("--startup", action="store_true",
+                        help="Also time a fresh server process to its first /status and /search, "
+                             "with lazy and startup model loading")
+    parser.add_argument("--stream", action="store_true",
+                        help="Also measure time to first byte, first result and last event of /search/stream "
+                             "on a server process (or --url), next to /search")
+    parser.add_argument("--resume", action="store_true",
+                        help="Also kill a build process mid-ingest and mid-embedding, resume it from its "
+                             "checkpoint and compare it with an uninterrupted build")
+    parser.add_argument("--resume-window", type=int, default=64,
+                        help="Chunks per committed embedding window in the --resume builds")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="Also compare the memory of 1 and this many uvicorn workers sharing the index, "
+                             "and time how long a published version takes to reach all of them")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", help="Earlier results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown vs the baseline (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    app = load_app_module()
+    pdfs = load_pdfs(args.pdf_dir) if args.pdf_dir else synthetic_pdfs(args.papers, args.pages)
+    workdir = tempfile.mkdtemp(prefix="rag_benchmark_")
+    try:
+        system, stages, corpus = run_stages(app, pdfs, os.path.join(workdir, "index"), args.index_type)
+        results = {'environment': environment(), 'corpus': corpus, 'stages': stages, 'load': [],
+                   'result_cache': args.result_cache}
+        if args.startup:
+            server_dir = os.path.join(workdir, "server")
+            os.makedirs(server_dir)
+            shard = next(iter(app.rag_system.specs))
+            results['startup'] = [time_to_first_request(server_dir, os.path.join(workdir, "index"), shard,
+                                                         warm_up=warm_up) for warm_up in (False, True)]
+        if args.stream:
+            queries = sample_queries(system)
+            process = None
+            url = args.url
+            if not url:
+                server_dir = os.path.join(workdir, "stream_server")
+                os.makedirs(server_dir)
+                process, url = start_server(server_dir, os.path.join(workdir, "index"),
+                                            next(iter(app.rag_system.specs)))
+            try:
+                if process:
+                    wait_until_ready(process, url, time.perf_counter())
+                stream_latency(url, queries, 10, args.mode, args.rerank)  # Warm-up
+                results['stream'] = stream_latency(url, queries, min(args.requests, 200), args.mode, args.rerank)
+            finally:
+                if process:
+                    process.terminate()
+                    process.wait()
+        if args.workers > 1:
+            results['workers'] = shared_workers(workdir, os.path.join(workdir, "index"),
+                                                next(iter(app.rag_system.specs)), sample_queries(system),
+                                                args.workers)
+        if args.resume:
+            results['resume'] = resume_after_kill(pdfs, workdir, args.resume_window)
+        if not args.skip_load:
+            # Serve the freshly loaded (memory-mapped) index as the app's only shard
+            app.rag_system = app.rag_system.with_shard(next(iter(app.rag_system.specs)), system)
+            if not args.result_cache:
+                app.query_batcher.result_cache = None
+            queries = sample_queries(system)
+            results['load'] = asyncio.run(run_load(app, queries, args.concurrency, args.requests, args.mode,
+                                                   args.rerank, args.status_every, args.url))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        results['regressions'] = regressions
+        print("\n".join(f"REGRESSION {line}" for line in regressions) or "No regressions against the baseline")
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
@@ -0,0 +1,176 @@
+import threading
+import time
+import traceback
+from typing import Any, Callable, Dict, List, Optional
+from metrics import BUILD_STAGE_SECONDS, BUILDS
+
+
+class BuildCancelled(Exception):
+    """Raised inside a build when its job has been cancelled."""
+
+
+class BuildJob:
+    """Progress and cancellation state of one background build.
+
+    The build function reports progress with `stage(name, total)` and
+    `advance(n)` (safe to call from worker threads) and calls `check()` at safe
+    points, which raises `BuildCancelled` once `cancel()` has been requested.
+    Builds that repeat the same steps per part (e.g. per shard) set `prefix`, which
+    is prepended to stage names.
+    """
+
+    def __init__(self, name: str, stages: List[str]):
+        self.name = name
+        self.stages = list(stages)
+        self.state = 'pending'  # pending, running, succeeded, failed or cancelled
+        self.current = None
+        self.prefix = ''
+        self.done = 0
+        self.total = 0
+        self.error = None
+        self.result_summary: Dict[str, Any] = {}
+        self.started_at = None
+        self.finished_at = None
+        self.stage_started_at = None
+        self.stage_seconds: Dict[str, float] = {}
+        self.lock = threading.Lock()
+        self.cancel_requested = threading.Event()
+
+    def stage(self, name: str, total: int = 0):
+        """Enter a new stage with `total` units of work (0 if unknown)."""
+        self.check()
+        name = self.prefix + name
+        now = time.perf_counter()
+        with self.lock:
+            if self.current is not None:
+                self.finish_stage(now)
+            if name not in self.stages:
+                self.stages.append(name)
+            self.current = name
+            self.done = 0
+            self.total = total
+            self.stage_started_at = now
+        print(f"[{self.name}] {name}" + (f" ({total})" if total else ""))
+
+    def finish_stage(self, now: float):
+        """Record the time of the current stage (per-part prefixes are dropped in the histogram)."""
+        seconds = now - self.stage_started_at
+        self.stage_seconds[self.current] = seconds
+        BUILD_STAGE_SECONDS.observe(seconds, job=self.name, stage=self.current.rsplit('/', 1)[-1])
+
+    def set_total(self, total: int):
+        with self.lock:
+            self.total = total
+
+    def advance(self, n: int = 1):
+        with self.lock:
+            self.done += n
+
+    def check(self):
+        if self.cancel_requested.is_set():
+            raise BuildCancelled(f"{self.name} cancelled")
+
+    def cancel(self):
+        self.cancel_requested.set()
+
+    @property
+    def running(self) -> bool:
+        return self.state in ('pending', 'running')
+
+    def eta_seconds(self) -> Optional[float]:
+        """Remaining time in the current stage, extrapolated from its progress so far."""
+        if not self.total or not self.done or self.state != 'running':
+            return None
+        elapsed = time.perf_counter() - self.stage_started_at
+        return elapsed / self.done * max(self.total - self.done, 0)
+
+    def status(self) -> Dict[str, Any]:
+        with self.lock:
+            now = self.finished_at or time.perf_counter()
+            stage_index = self.stages.index(self.current) if self.current in self.stages else -1
+            status = {
+                'job': self.name,
+                'state': self.state,
+                'stage': self.current,
+                'stage_index': stage_index + 1,
+                'stages': list(self.stages),
+                'done': self.done,
+                'total': self.total,
+                'stage_progress': self.done / self.total if self.total else None,
+                'elapsed_seconds': now - self.started_at if self.started_at else 0.0,
+                'stage_seconds': dict(self.stage_seconds),
+                'cancel_requested': self.cancel_requested.is_set()
+            }
+        status['eta_seconds'] = self.eta_seconds()
+        if self.error:
+            status['error'] = self.error
+        if self.result_summary:
+            status['result'] = self.result_summary
+        return status
+
+
+class BuildRunner:
+    """Run at most one build at a time on a background thread.
+
+    `build(job)` does all the work on objects that are not yet being served and
+    returns the finished result; `on_success(result)` then installs it (a single
+    reference assignment, so readers see either the old or the new system). A
+    failed or cancelled build leaves the served system untouched.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.job: Optional[BuildJob] = None
+        self.thread: Optional[threading.Thread] = None
+
+    def start(self, name: str, stages: List[str], build: Callable[[BuildJob], Any],
+              on_success: Callable[[Any], Optional[Dict[str, Any]]]) -> BuildJob:
+        """Start a build; raises RuntimeError if one is already running."""
+        with self.lock:
+            if self.job is not None and self.job.running:
+                raise RuntimeError(f"A build is already running ({self.job.name}, stage {self.job.current})")
+            job = BuildJob(name, stages)
+            self.job = job
+            self.thread = threading.Thread(target=self.run, args=(job, build, on_success),
+                                           name=f"build-{name}", daemon=True)
+            self.thread.start()
+            return job
+
+    def run(self, job: BuildJob, build: Callable[[BuildJob], Any],
+            on_success: Callable[[Any], Optional[Dict[str, Any]]]):
+        job.started_at = time.perf_counter()
+        job.state = 'running'
+        try:
+            result = build(job)
+            job.check()
+            job.prefix = ''
+            job.stage('swap')
+            job.result_summary = on_success(result) or {}
+            job.state = 'succeeded'
+        except BuildCancelled:
+            job.state = 'cancelled'
+            print(f"[{job.name}] cancelled")
+        except Exception as e:
+            job.error = str(e)
+            job.state = 'failed'
+            traceback.print_exc()
+        finally:
+            job.finished_at = time.perf_counter()
+            if job.current is not None:
+                job.finish_stage(job.finished_at)
+            BUILDS.inc(job=job.name, state=job.state)
+
+    def cancel(self) -> bool:
+        """Request cancellation of the running build; returns False if none is running."""
+        job = self.job
+        if job is None or not job.running:
+            return False
+        job.cancel()
+        return True
+
+    def wait(self, timeout: Optional[float] = None):
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def status(self) -> Optional[Dict[str, Any]]:
+        return self.job.status() if self.job else None
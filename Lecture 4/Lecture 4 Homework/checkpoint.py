@@ -0,0 +1,215 @@
+import json
+import os
+import shutil
+import threading
+import time
+import zlib
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+from embedding_engine import open_output
+
+# Bump whenever the journal layout changes so old checkpoints are discarded instead of misread
+CHECKPOINT_VERSION = 1
+
+# Per-paper stages in the order a paper passes them; `empty` and `failed` are final too
+STAGES = ('fetched', 'extracted', 'chunked', 'embedded')
+
+
+def write_json_atomic(path: str, data: Any):
+    """Write JSON to a temp file, fsync it and rename it over `path`."""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def ids_checksum(ids: np.ndarray) -> int:
+    return zlib.crc32(np.ascontiguousarray(ids, dtype=np.int64).tobytes())
+
+
+class BuildCheckpoint:
+    """Durable progress of one full build, so a crashed, killed or cancelled build resumes.
+
+    Lives in `<index dir>.build/`:
+    - manifest.json: the build configuration and the paper listing being built,
+      written once (atomically). A checkpoint made with a different configuration
+      is discarded; a resumed build uses the listing it started with.
+    - papers.jsonl: an append-only journal, fsynced per record. Each paper moves
+      through fetched -> extracted -> chunked (the record carries its chunks,
+      spans and pages) -> embedded, or ends as `empty` (no text) or `failed`.
+      A torn last line from a kill is cut off on open.
+    - embeddings.npy: the memory-mapped embedding matrix, filled in windows of
+      `window` indexed chunks. After each window is flushed to disk the journal
+      records the new watermark, so a restart only encodes the rest.
+
+    PDFs and page texts are never written to disk, so a paper that was fetched or
+    extracted but not chunked before a crash is downloaded again. A paper that
+    was in flight `max_attempts` times without being chunked (e.g. a PDF that
+    kills the extractor) is marked failed and skipped; failed downloads are
+    retried on every restart until chunking is over.
+    """
+
+    def __init__(self, directory: str, config: Dict[str, Any], window: int = 4096, max_attempts: int = 3):
+        self.directory = directory
+        self.config = config
+        self.window = window
+        self.max_attempts = max_attempts
+        self.lock = threading.Lock()
+        self.journal = None
+        self.papers: List[Dict] = []
+        self.status: Dict[int, str] = {}  # Paper index -> latest stage
+        self.attempts: Dict[int, int] = {}  # Paper index -> times fetched without being chunked
+        self.chunked: Dict[int, Tuple[List[str], List[Tuple[int, int]], np.ndarray]] = {}
+        self.layout: Optional[Dict[str, int]] = None  # Chunk layout the embeddings belong to
+        self.embedded = 0  # Indexed chunks whose vectors are durably on disk
+        self.resumed: Dict[str, int] = {}
+
+    @property
+    def manifest_path(self) -> str:
+        return os.path.join(self.directory, 'manifest.json')
+
+    @property
+    def journal_path(self) -> str:
+        return os.path.join(self.directory, 'papers.jsonl')
+
+    @property
+    def embeddings_path(self) -> str:
+        return os.path.join(self.directory, 'embeddings.npy')
+
+    def open(self, papers: List[Dict]) -> List[Dict]:
+        """Resume a compatible checkpoint or start a new one; returns the paper listing to build."""
+        manifest = None
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, encoding='utf-8') as f:
+                manifest = json.load(f)
+            if manifest.get('version') != CHECKPOINT_VERSION or manifest.get('config') != self.config:
+                print(f"Checkpoint {self.directory} was made with another configuration; starting over")
+                manifest = None
+        if manifest is None:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            os.makedirs(self.directory)
+            manifest = {'version': CHECKPOINT_VERSION, 'config': self.config, 'papers': list(papers),
+                        'created': time.strftime("%Y-%m-%dT%H:%M:%S")}
+            write_json_atomic(self.manifest_path, manifest)
+        self.papers = manifest['papers']
+        listed = {paper['arxiv_id'] for paper in self.papers}
+        new = sum(paper['arxiv_id'] not in listed for paper in papers)
+        if new:
+            print(f"{new} papers listed since this build started are left to the next update")
+        self.replay()
+        self.journal = open(self.journal_path, 'a', encoding='utf-8')
+
+        # Papers left in flight by the last run have used up one more attempt
+        for i, stage in list(self.status.items()):
+            if stage in ('fetched', 'extracted') and self.attempts.get(i, 0) >= self.max_attempts:
+                self.record(i, 'failed', error=f"not chunked after {self.attempts[i]} attempts")
+        self.resumed = self.counts()
+        if self.status:
+            print(f"Resuming build from {self.directory}: " +
+                  ", ".join(f"{count} {stage}" for stage, count in self.resumed.items() if count) +
+                  f", {self.embedded} chunks embedded")
+        return self.papers
+
+    def replay(self):
+        """Read the journal back, cutting off a record torn by a crash."""
+        if not os.path.exists(self.journal_path):
+            return
+        with open(self.journal_path, 'rb') as f:
+            data = f.read()
+        end = data.rfind(b'\n') + 1
+        if end < len(data):
+            with open(self.journal_path, 'r+b') as f:
+                f.truncate(end)
+        for line in data[:end].splitlines():
+            record = json.loads(line)
+            if 'layout' in record:
+                self.layout = record['layout']
+                self.embedded = 0
+            elif 'embedded' in record:
+                self.embedded = record['embedded']
+                for i in record['papers']:
+                    self.status[i] = 'embedded'
+            else:
+                self.apply(record)
+
+    def apply(self, record: Dict[str, Any]):
+        i, stage = record['paper'], record['stage']
+        if stage == 'fetched':
+            self.attempts[i] = self.attempts.get(i, 0) + 1
+        elif stage == 'chunked':
+            self.chunked[i] = (record['chunks'], [tuple(span) for span in record['spans']],
+                               np.asarray(record['pages'], dtype=np.int32).reshape(-1, 2))
+        self.status[i] = stage
+
+    def append(self, record: Dict[str, Any]):
+        with self.lock:
+            self.journal.write(json.dumps(record, ensure_ascii=False) + '\n')
+            self.journal.flush()
+            os.fsync(self.journal.fileno())
+
+    def record(self, i: int, stage: str, **data):
+        """Journal that paper `i` reached `stage` (thread-safe)."""
+        record = {'paper': i, 'stage': stage, **data}
+        self.append(record)
+        with self.lock:
+            self.apply(record)
+
+    def record_chunks(self, i: int, chunks: List[str], spans, pages: np.ndarray):
+        self.record(i, 'chunked', chunks=list(chunks), spans=[[int(start), int(end)] for start, end in spans],
+                    pages=np.asarray(pages).tolist())
+
+    def pending(self) -> List[int]:
+        """Papers still to ingest (none once embedding has started, so chunk IDs stay fixed)."""
+        if self.layout is not None:
+            return []
+        done = ('chunked', 'embedded', 'empty', 'failed')
+        return [i for i in range(len(self.papers)) if self.status.get(i) not in done]
+
+    def open_embeddings(self, n_rows: int, dimension: int, ids: np.ndarray) -> Tuple[np.memmap, int]:
+        """The embedding matrix and how many of `ids` already have durable vectors.
+
+        Saved vectors are only reused if they belong to exactly this chunk layout.
+        """
+        layout = {'rows': n_rows, 'dimension': dimension, 'indexed': len(ids), 'checksum': ids_checksum(ids)}
+        if layout == self.layout and os.path.exists(self.embeddings_path):
+            out = np.load(self.embeddings_path, mmap_mode='r+')
+            if out.shape == (n_rows, dimension):
+                return out, self.embedded
+        out = open_output(self.embeddings_path, n_rows, dimension)
+        self.layout = layout
+        self.embedded = 0
+        self.append({'layout': layout})
+        return out, 0
+
+    def commit_embeddings(self, out: np.memmap, watermark: int, papers: List[int]):
+        """Flush the vectors of the first `watermark` indexed chunks, then journal them and
+        the `papers` they completed."""
+        out.flush()
+        self.append({'embedded': watermark, 'papers': papers})
+        with self.lock:
+            self.embedded = watermark
+            for i in papers:
+                self.status[i] = 'embedded'
+
+    def counts(self) -> Dict[str, int]:
+        with self.lock:
+            stages = list(self.status.values())
+        counts = {stage: stages.count(stage) for stage in STAGES + ('empty', 'failed')}
+        counts['pending'] = len(self.papers) - len(stages)
+        return counts
+
+    def summary(self) -> Dict[str, Any]:
+        return {'directory': self.directory, 'resumed': self.resumed, 'papers': self.counts(),
+                'embedded_chunks': self.embedded}
+
+    def close(self):
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+
+    def remove(self):
+        """Delete the checkpoint once the finished index is saved."""
+        self.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
@@ -0,0 +1,185 @@
+import argparse
+import json
+import os
+import re
+import time
+from typing import Iterator, List, Optional, Tuple
+import numpy as np
+
+# A sentence ends at ., ! or ? followed by whitespace and an upper-case letter or digit
+SENTENCE_BOUNDARY = re.compile(r"[.!?][\"')\]]?\s+(?=[A-Z0-9])")
+# Numbered section headings on their own line ("3 Method", "4.2 Results") or common unnumbered ones
+SECTION_BOUNDARY = re.compile(
+    r"\n(?=(?:\d+(?:\.\d+)*\.?\s+[A-Z][^\n]{0,80}|Abstract|References|Acknowledg(?:e)?ments|Appendix)\s*\n)"
+)
+
+
+class SpanChunker:
+    """Token-window chunker that returns character spans instead of decoded strings.
+
+    Texts are tokenized (in batches with `encode_ordinary_batch`, or one at a time
+    from worker threads, since tiktoken releases the GIL). Each window of
+    `max_tokens` tokens, overlapping by `overlap`, is mapped back to a
+    (start, end) character span of the original text from per-token byte lengths,
+    so no window is ever decoded. With `respect_boundaries`, a window end is pulled
+    back to the last section heading (in the second half of the window) or
+    sentence end (in the last quarter), when there is one.
+    """
+
+    def __init__(self, encoder, max_tokens: int = 512, overlap: int = 50,
+                 respect_boundaries: bool = False, num_threads: int = 8):
+        if overlap >= max_tokens:
+            raise ValueError("overlap must be smaller than max_tokens")
+        self.encoder = encoder
+        self.max_tokens = max_tokens
+        self.overlap = overlap
+        self.respect_boundaries = respect_boundaries
+        self.num_threads = num_threads
+        self.token_bytes = self.token_byte_lengths(encoder)
+
+    @staticmethod
+    def token_byte_lengths(encoder) -> np.ndarray:
+        """UTF-8 byte length of every token in the vocabulary (computed once)."""
+        lengths = np.zeros(encoder.max_token_value + 1, dtype=np.int32)
+        for token in range(len(lengths)):
+            try:
+                lengths[token] = len(encoder.decode_single_token_bytes(token))
+            except KeyError:
+                pass
+        return lengths
+
+    def token_char_starts(self, text: str, tokens: List[int]) -> np.ndarray:
+        """Character offset at which each token starts, plus len(text) at the end."""
+        byte_ends = np.cumsum(self.token_bytes[np.asarray(tokens, dtype=np.int64)], dtype=np.int64)
+        byte_starts = np.concatenate([[0], byte_ends])
+        if text.isascii():
+            return byte_starts
+        # Map byte offsets to character offsets; tokens may split a multi-byte character,
+        # in which case the token is attributed to the character it starts in
+        codepoints = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32)
+        char_bytes = 1 + (codepoints >= 0x80) + (codepoints >= 0x800) + (codepoints >= 0x10000)
+        char_byte_starts = np.concatenate([[0], np.cumsum(char_bytes, dtype=np.int64)])
+        return np.searchsorted(char_byte_starts, byte_starts, side='right') - 1
+
+    def boundary_tokens(self, text: str, char_starts: np.ndarray, pattern: re.Pattern) -> np.ndarray:
+        """Indices of the first token after each boundary match."""
+        ends = np.fromiter((m.end() for m in pattern.finditer(text)), dtype=np.int64)
+        return np.unique(np.searchsorted(char_starts[:-1], ends, side='left'))
+
+    def windows(self, n_tokens: int, sections: Optional[np.ndarray] = None,
+                sentences: Optional[np.ndarray] = None) -> Iterator[Tuple[int, int]]:
+        """Yield (first_token, end_token) windows, matching the original chunk_text stepping."""
+        if n_tokens <= self.max_tokens:
+            yield 0, n_tokens
+            return
+        step = self.max_tokens - self.overlap
+        start = 0
+        while True:
+            end = min(start + self.max_tokens, n_tokens)
+            if self.respect_boundaries and end < n_tokens:
+                end = self.snap(start, end, sections, self.max_tokens // 2) or \
+                      self.snap(start, end, sentences, 3 * self.max_tokens // 4) or end
+            yield start, end
+            if start + self.max_tokens >= n_tokens:
+                return
+            start = max(end - self.overlap, start + 1) if self.respect_boundaries else start + step
+
+    def snap(self, start: int, end: int, boundaries: Optional[np.ndarray], min_length: int) -> Optional[int]:
+        if boundaries is None or not len(boundaries):
+            return None
+        i = np.searchsorted(boundaries, end, side='right') - 1
+        if i >= 0 and boundaries[i] >= start + min_length:
+            return int(boundaries[i])
+        return None
+
+    def spans_from_tokens(self, text: str, tokens: List[int]) -> List[Tuple[int, int]]:
+        char_starts = self.token_char_starts(text, tokens)
+        sections = sentences = None
+        if self.respect_boundaries:
+            sections = self.boundary_tokens(text, char_starts, SECTION_BOUNDARY)
+            sentences = self.boundary_tokens(text, char_starts, SENTENCE_BOUNDARY)
+        return [(int(char_starts[first]), int(char_starts[end]))
+                for first, end in self.windows(len(tokens), sections, sentences)]
+
+    def spans(self, text: str) -> List[Tuple[int, int]]:
+        """Character spans of the chunks of a single text."""
+        return self.spans_from_tokens(text, self.encoder.encode_ordinary(text))
+
+    def chunk_batch(self, texts: List[str], doc_ids: Optional[List[int]] = None) -> List[Tuple[int, int, int]]:
+        """(doc_id, start, end) spans for a batch of texts, tokenized in parallel."""
+        doc_ids = list(range(len(texts))) if doc_ids is None else doc_ids
+        all_tokens = self.encoder.encode_ordinary_batch(texts, num_threads=self.num_threads)
+        return [(doc_id, start, end)
+                for doc_id, text, tokens in zip(doc_ids, texts, all_tokens)
+                for start, end in self.spans_from_tokens(text, tokens)]
+
+
+def legacy_chunks(encoder, text: str, max_tokens: int = 512, overlap: int = 50) -> List[str]:
+    """The original flatten + encode + decode-per-window chunker, kept for benchmarking."""
+    text = ' '.join(text.split()).replace('\x00', '')
+    tokens = encoder.encode(text)
+    if len(tokens) <= max_tokens:
+        return [encoder.decode(tokens)]
+    chunks = []
+    for i in range(0, len(tokens), max_tokens - overlap):
+        chunks.append(encoder.decode(tokens[i:i + max_tokens]))
+        if i + max_tokens >= len(tokens):
+            break
+    return chunks
+
+
+def load_texts(pdf_dir: Optional[str], n_synthetic: int = 200) -> List[str]:
+    if pdf_dir:
+        import fitz  # PyMuPDF
+        texts = []
+        for name in sorted(os.listdir(pdf_dir)):
+            if name.endswith('.pdf'):
+                with fitz.open(os.path.join(pdf_dir, name)) as doc:
+                    texts.append("".join(page.get_text() for page in doc))
+        return texts
+    rng = np.random.default_rng(0)
+    words = ["language", "model", "token", "attention", "retrieval", "benchmark", "we", "propose",
+             "a", "novel", "method", "for", "the", "transformer", "dataset", "results", "show", "that"]
+    texts = []
+    for _ in range(n_synthetic):
+        sentences = [" ".join(rng.choice(words, int(rng.integers(8, 25)))).capitalize() + "."
+                     for _ in range(400)]
+        texts.append("\n".join(" ".join(sentences[i:i + 5]) for i in range(0, len(sentences), 5)))
+    return texts
+
+
+def benchmark(texts: List[str], encoder, max_tokens: int = 512, overlap: int = 50) -> dict:
+    """Chunking throughput (MB/s of input text) of the legacy chunker vs the span chunker."""
+    megabytes = sum(len(text.encode('utf-8')) for text in texts) / 2**20
+    results = {'documents': len(texts), 'megabytes': round(megabytes, 2)}
+
+    start = time.perf_counter()
+    legacy = [legacy_chunks(encoder, text, max_tokens, overlap) for text in texts]
+    results['legacy_mb_per_sec'] = round(megabytes / (time.perf_counter() - start), 2)
+    results['legacy_chunks'] = sum(len(chunks) for chunks in legacy)
+
+    chunker = SpanChunker(encoder, max_tokens, overlap)
+    start = time.perf_counter()
+    spans = chunker.chunk_batch(texts)
+    results['spans_mb_per_sec'] = round(megabytes / (time.perf_counter() - start), 2)
+    results['span_chunks'] = len(spans)
+
+    chunker = SpanChunker(encoder, max_tokens, overlap, respect_boundaries=True)
+    start = time.perf_counter()
+    spans = chunker.chunk_batch(texts)
+    results['spans_boundaries_mb_per_sec'] = round(megabytes / (time.perf_counter() - start), 2)
+    results['span_boundary_chunks'] = len(spans)
+    return results
+
+
+if __name__ == "__main__":
+    import tiktoken
+
+    parser = argparse.ArgumentParser(description="Chunking throughput: legacy decode-per-window vs span chunker")
+    parser.add_argument("--pdf-dir", help="Directory of PDFs to chunk (default: synthetic text)")
+    parser.add_argument("--max-tokens", type=int, default=512)
+    parser.add_argument("--overlap", type=int, default=50)
+    args = parser.parse_args()
+
+    encoder = tiktoken.get_encoding("cl100k_base")
+    print(json.dumps(benchmark(load_texts(args.pdf_dir), encoder, args.max_tokens, args.overlap), indent=2))
@@ -0,0 +1,96 @@
+import hashlib
+import re
+from typing import Dict, Iterable, List, Optional
+import numpy as np
+
+WORD = re.compile(r"\w+")
+SHINGLE_SIZE = 3
+
+
+def _mix(h: np.ndarray) -> np.ndarray:
+    """splitmix64 finalizer: spreads every input bit over all 64 output bits (wraps mod 2**64)."""
+    h = (h ^ (h >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    h = (h ^ (h >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return h ^ (h >> np.uint64(31))
+
+
+class SimHasher:
+    """64-bit SimHash of a text over its word 3-shingles.
+
+    Words get a stable 64-bit hash (blake2b, cached per word, so fingerprints are
+    the same across processes and can be saved). Shingle hashes are combined and
+    mixed in numpy, and each fingerprint bit is the majority vote of that bit over
+    all shingles. Texts sharing most shingles end up a few bits apart.
+    """
+
+    def __init__(self, shingle_size: int = SHINGLE_SIZE):
+        self.shingle_size = shingle_size
+        self.word_hashes: Dict[str, int] = {}
+        self.bit_positions = np.arange(64, dtype=np.uint64)
+
+    def hash_words(self, words: List[str]) -> np.ndarray:
+        hashes = self.word_hashes
+        for word in set(words) - hashes.keys():
+            hashes[word] = int.from_bytes(hashlib.blake2b(word.encode('utf-8'), digest_size=8).digest(), 'little')
+        return np.fromiter((hashes[word] for word in words), dtype=np.uint64, count=len(words))
+
+    def fingerprint(self, text: str) -> int:
+        words = WORD.findall(text.lower())
+        if not words:
+            return 0
+        h = self.hash_words(words)
+        shingles = _mix(h[:len(h) - self.shingle_size + 1]) if len(h) >= self.shingle_size else _mix(h[:1])
+        for offset in range(1, min(self.shingle_size, len(h))):
+            shingles = _mix(shingles ^ h[offset:offset + len(shingles)])
+        votes = ((shingles[:, None] >> self.bit_positions) & np.uint64(1)).sum(axis=0)
+        set_bits = self.bit_positions[votes * 2 > len(shingles)]
+        return int(np.bitwise_or.reduce(np.uint64(1) << set_bits)) if len(set_bits) else 0
+
+    def fingerprints(self, texts: Iterable[str]) -> np.ndarray:
+        return np.fromiter((self.fingerprint(text) for text in texts), dtype=np.uint64)
+
+
+class NearDuplicateIndex:
+    """Fingerprints of representative chunks, searchable by Hamming distance.
+
+    The 64 bits are split into `max_distance + 1` bands, each with a hash table
+    from band value to chunk IDs. Two fingerprints at most `max_distance` bits
+    apart agree on at least one whole band (pigeonhole), so only chunks sharing a
+    band with the query are compared.
+    """
+
+    def __init__(self, max_distance: int = 3):
+        self.max_distance = max_distance
+        n_bands = max_distance + 1
+        edges = [64 * i // n_bands for i in range(n_bands + 1)]
+        self.bands = [(start, (1 << (end - start)) - 1) for start, end in zip(edges, edges[1:])]
+        self.tables: List[Dict[int, List[int]]] = [{} for _ in self.bands]
+        self.fingerprints: Dict[int, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.fingerprints)
+
+    def add(self, chunk_id: int, fingerprint: int):
+        self.fingerprints[chunk_id] = fingerprint
+        for table, (shift, mask) in zip(self.tables, self.bands):
+            table.setdefault((fingerprint >> shift) & mask, []).append(chunk_id)
+
+    def remove(self, chunk_id: int):
+        fingerprint = self.fingerprints.pop(chunk_id, None)
+        if fingerprint is None:
+            return
+        for table, (shift, mask) in zip(self.tables, self.bands):
+            key = (fingerprint >> shift) & mask
+            table[key].remove(chunk_id)
+            if not table[key]:
+                del table[key]
+
+    def find(self, fingerprint: int) -> Optional[int]:
+        """The closest indexed chunk within `max_distance` bits (lowest ID on ties), if any."""
+        best = None
+        for table, (shift, mask) in zip(self.tables, self.bands):
+            for chunk_id in table.get((fingerprint >> shift) & mask, ()):
+                distance = (self.fingerprints[chunk_id] ^ fingerprint).bit_count()
+                if distance <= self.max_distance and (best is None or (distance, chunk_id) < best):
+                    best = (distance, chunk_id)
+        return best[1] if best else None
@@ -0,0 +1,72 @@
+import hashlib
+import sqlite3
+import threading
+from typing import Dict, List
+import numpy as np
+
+
+def content_hash(text: str, model_name: str) -> str:
+    """Hash a chunk together with the model name so a model change never reuses stale vectors."""
+    return hashlib.sha1(f"{model_name}\0{text}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """On-disk cache of chunk embeddings keyed by content hash (SQLite, one row per chunk).
+
+    The database is opened (and created) on first use, not on construction.
+    """
+
+    def __init__(self, path: str = "embedding_cache.sqlite"):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = None
+        self.hits = 0
+        self.misses = 0
+
+    def connection(self) -> sqlite3.Connection:
+        """The open database; call with the lock held."""
+        if self.conn is None:
+            self.conn = sqlite3.connect(self.path, check_same_thread=False)
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (hash TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+            )
+            self.conn.commit()
+        return self.conn
+
+    def get_many(self, hashes: List[str]) -> Dict[str, np.ndarray]:
+        """Return the cached vectors for whichever hashes are present."""
+        found = {}
+        with self.lock:
+            # Stay well below SQLite's bound-parameter limit
+            for start in range(0, len(hashes), 500):
+                batch = hashes[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self.connection().execute(
+                    f"SELECT hash, vector FROM embeddings WHERE hash IN ({placeholders})", batch
+                )
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32)
+            self.hits += len(found)
+            self.misses += len(hashes) - len(found)
+        return found
+
+    def put_many(self, hashes: List[str], vectors: np.ndarray):
+        """Store one float32 vector per hash."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self.lock:
+            conn = self.connection()
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (hash, vector) VALUES (?, ?)",
+                [(key, vector.tobytes()) for key, vector in zip(hashes, vectors)]
+            )
+            conn.commit()
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.connection().execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
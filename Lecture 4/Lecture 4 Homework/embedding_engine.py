@@ -0,0 +1,241 @@
+import argparse
+import json
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from typing import TYPE_CHECKING, Callable, Dict, Iterator, List, Optional, Tuple
+import numpy as np
+
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
+
+# torch: the regular PyTorch model. onnx / onnx-int8: ONNX Runtime through
+# sentence-transformers' ONNX backend (needs `pip install optimum[onnxruntime]`).
+BACKENDS = ('torch', 'onnx', 'onnx-int8')
+
+# Dynamically quantized (int8) ONNX export published with all-MiniLM-L6-v2; the AVX2
+# variant runs on any x86-64 CPU of the last decade
+ONNX_INT8_FILE = "onnx/model_quint8_avx2.onnx"
+
+# Encoding fewer chunks than this in worker processes costs more in model loading than it saves
+MIN_POOL_TEXTS = 2048
+
+
+def load_model(model_name: str, backend: str = 'torch', onnx_file: Optional[str] = None,
+               device: Optional[str] = None) -> 'SentenceTransformer':
+    """Load a sentence-transformers model with the given backend (ONNX runs on CPU).
+
+    sentence-transformers (and torch) are imported here, so importing this module stays cheap.
+    """
+    from sentence_transformers import SentenceTransformer
+    if backend == 'torch':
+        return SentenceTransformer(model_name, device=device)
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown embedding backend {backend!r}; choose from {BACKENDS}")
+    file_name = onnx_file or (ONNX_INT8_FILE if backend == 'onnx-int8' else None)
+    model_kwargs = {'file_name': file_name} if file_name else None
+    try:
+        return SentenceTransformer(model_name, device='cpu', backend='onnx', model_kwargs=model_kwargs)
+    except ImportError as e:
+        raise ImportError(f"The {backend} backend needs `pip install optimum[onnxruntime]` ({e})") from e
+
+
+def length_buckets(texts: List[str], batch_size: int) -> List[np.ndarray]:
+    """Split positions into batches of similar-length texts, so little of each batch is padding."""
+    order = np.argsort([len(text) for text in texts], kind='stable')
+    return [order[start:start + batch_size] for start in range(0, len(order), batch_size)]
+
+
+# Per-process state of the encode pool
+_worker_model = None
+
+
+def _init_worker(model_name: str, backend: str, onnx_file: Optional[str], threads: int):
+    global _worker_model
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+    _worker_model = load_model(model_name, backend, onnx_file, device='cpu')
+
+
+def _encode_worker(positions: np.ndarray, texts: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    return positions, np.asarray(_worker_model.encode(texts, batch_size=len(texts)), dtype='float32')
+
+
+class EmbeddingEngine:
+    """CPU embedding engine: length-bucketed batches, optional process pool, streamed output.
+
+    Texts are sorted by length and cut into batches, so each batch is padded only to
+    its own longest text. Batches run either in this process or on a pool of
+    `processes` workers (each with its own model copy and cores / processes torch
+    threads). Finished batches are written straight into the output array, which
+    may be a memory-mapped .npy file, with at most `max_in_flight` batches held in
+    memory, so peak RAM does not grow with the corpus. Unless a `model` is passed
+    in, it is loaded on first use.
+    """
+
+    def __init__(self, model_name: str = "all-MiniLM-L6-v2", backend: str = 'torch', batch_size: int = 64,
+                 processes: Optional[int] = None, model: Optional['SentenceTransformer'] = None,
+                 onnx_file: Optional[str] = None, max_in_flight: Optional[int] = None):
+        self.model_name = model_name
+        self.backend = backend
+        self.batch_size = batch_size
+        self.onnx_file = onnx_file
+        cores = os.cpu_count() or 1
+        # Default: one worker per two cores, each running two intra-op threads
+        self.processes = max(1, cores // 2) if processes is None else processes
+        self.threads_per_process = max(1, cores // max(self.processes, 1))
+        self.max_in_flight = max_in_flight or 2 * max(self.processes, 1)
+        self.loaded_model = model
+        self.model_lock = threading.Lock()
+        self.pool: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def model(self) -> 'SentenceTransformer':
+        if self.loaded_model is None:
+            with self.model_lock:
+                if self.loaded_model is None:
+                    start = time.perf_counter()
+                    self.loaded_model = load_model(self.model_name, self.backend, self.onnx_file)
+                    print(f"Loaded {self.model_name} ({self.backend}) in {time.perf_counter() - start:.1f}s")
+        return self.loaded_model
+
+    @property
+    def model_loaded(self) -> bool:
+        return self.loaded_model is not None
+
+    @property
+    def dimension(self) -> int:
+        return self.model.get_sentence_embedding_dimension()
+
+    @property
+    def cache_key(self) -> str:
+        """Model identity used for embedding-cache keys; quantized vectors never mix with fp32 ones."""
+        return self.model_name if self.backend == 'torch' else f"{self.model_name}/{self.backend}"
+
+    def start_pool(self) -> ProcessPoolExecutor:
+        if self.pool is None:
+            # Spawn rather than fork: forked children inherit torch and FAISS thread pools in a bad state
+            self.pool = ProcessPoolExecutor(
+                self.processes, mp_context=multiprocessing.get_context('spawn'), initializer=_init_worker,
+                initargs=(self.model_name, self.backend, self.onnx_file, self.threads_per_process))
+        return self.pool
+
+    def iter_batches(self, texts: List[str]) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """Yield (positions, vectors) per batch, in completion order."""
+        batches = length_buckets(texts, self.batch_size)
+        if self.processes <= 1 or len(texts) < MIN_POOL_TEXTS:
+            for positions in batches:
+                batch = [texts[i] for i in positions]
+                yield positions, np.asarray(self.model.encode(batch, batch_size=len(batch)), dtype='float32')
+            return
+
+        pool = self.start_pool()
+        pending = set()
+        for positions in batches:
+            if len(pending) >= self.max_in_flight:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+            pending.add(pool.submit(_encode_worker, positions, [texts[i] for i in positions]))
+        for future in wait(pending).done:
+            yield future.result()
+
+    def encode(self, texts: List[str], out: Optional[np.ndarray] = None, rows: Optional[np.ndarray] = None,
+               on_batch: Optional[Callable[[np.ndarray, np.ndarray], None]] = None) -> np.ndarray:
+        """Encode `texts` into `out[rows]` (a new array if `out` is None).
+
+        `on_batch(positions, vectors)` is called after each batch, e.g. to fill a
+        cache, report progress or check for cancellation.
+        """
+        if out is None:
+            out = np.empty((len(texts), self.dimension), dtype='float32')
+        rows = np.arange(len(texts)) if rows is None else np.asarray(rows)
+        for positions, vectors in self.iter_batches(texts):
+            out[rows[positions]] = vectors
+            if on_batch:
+                on_batch(positions, vectors)
+        return out
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+
+def open_output(path: str, n_rows: int, dimension: int) -> np.memmap:
+    """Create a float32 .npy file of the final size and map it for writing."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    return np.lib.format.open_memmap(path, mode='w+', dtype=np.float32, shape=(n_rows, dimension))
+
+
+def cosine_drift(reference: np.ndarray, vectors: np.ndarray) -> Dict[str, float]:
+    """Per-row cosine similarity between two embeddings of the same texts."""
+    a = reference / np.maximum(np.linalg.norm(reference, axis=1, keepdims=True), 1e-12)
+    b = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    cosine = (a * b).sum(axis=1)
+    return {'mean_cosine': round(float(cosine.mean()), 6), 'min_cosine': round(float(cosine.min()), 6),
+            'p1_cosine': round(float(np.percentile(cosine, 1)), 6)}
+
+
+def benchmark(texts: List[str], model_name: str = "all-MiniLM-L6-v2", backends: List[str] = BACKENDS,
+              processes: Optional[int] = None, batch_size: int = 64) -> List[Dict]:
+    """Chunks/sec of each backend, plus cosine drift against the fp32 torch embeddings.
+
+    The `baseline` row is the original single `model.encode(chunks)` call.
+    """
+    rows = []
+    model = load_model(model_name, 'torch')
+    start = time.perf_counter()
+    reference = np.asarray(model.encode(texts), dtype='float32')
+    seconds = time.perf_counter() - start
+    rows.append({'backend': 'baseline', 'processes': 1, 'chunks_per_sec': round(len(texts) / seconds, 1)})
+    print(f"baseline: {rows[-1]['chunks_per_sec']} chunks/sec")
+
+    for backend in backends:
+        try:
+            engine = EmbeddingEngine(model_name, backend, batch_size, processes,
+                                     model=model if backend == 'torch' else None)
+        except ImportError as e:
+            print(f"Skipping {backend}: {e}")
+            continue
+        # Warm the pool up first so worker start-up isn't counted as throughput
+        engine.encode(texts[:engine.processes * batch_size])
+        start = time.perf_counter()
+        vectors = engine.encode(texts)
+        seconds = time.perf_counter() - start
+        engine.close()
+        row = {'backend': backend, 'processes': engine.processes if len(texts) >= MIN_POOL_TEXTS else 1,
+               'chunks_per_sec': round(len(texts) / seconds, 1), **cosine_drift(reference, vectors)}
+        rows.append(row)
+        print(f"{backend}: {row['chunks_per_sec']} chunks/sec, mean cosine vs fp32 {row['mean_cosine']:.4f} "
+              f"(min {row['min_cosine']:.4f})")
+    return rows
+
+
+if __name__ == "__main__":
+    import tiktoken
+    from chunker import SpanChunker, load_texts
+
+    parser = argparse.ArgumentParser(description="Embedding throughput and quantization drift per backend")
+    parser.add_argument("--pdf-dir", help="Directory of PDFs to chunk and embed (default: synthetic text)")
+    parser.add_argument("--model", default="all-MiniLM-L6-v2")
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=BACKENDS)
+    parser.add_argument("--processes", type=int, default=None, help="Encode workers (default: cores / 2)")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--limit", type=int, default=5000, help="Maximum number of chunks to embed")
+    parser.add_argument("--output", default="embedding_benchmark.json")
+    args = parser.parse_args()
+
+    texts = load_texts(args.pdf_dir)
+    chunker = SpanChunker(tiktoken.get_encoding("cl100k_base"))
+    chunks = [texts[doc][start:end] for doc, start, end in chunker.chunk_batch(texts)][:args.limit]
+    print(f"Embedding {len(chunks)} chunks")
+    results = benchmark(chunks, args.model, args.backends, args.processes, args.batch_size)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
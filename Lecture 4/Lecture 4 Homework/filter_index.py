@@ -0,0 +1,304 @@
+import argparse
+import json
+import re
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import numpy as np
+import faiss
+
+# Searches may filter on these paper fields; values are matched against the paper table
+FILTER_FIELDS = ('date_from', 'date_to', 'authors', 'categories', 'arxiv_ids')
+
+ARXIV_VERSION = re.compile(r"v\d+$")
+
+
+def parse_date(value: str, end: bool = False) -> np.datetime64:
+    """A YYYY, YYYY-MM or YYYY-MM-DD date as a day; with `end`, the last day of that year or month."""
+    try:
+        date = np.datetime64(value.strip())
+    except ValueError:
+        raise ValueError(f"Invalid date {value!r}: use YYYY, YYYY-MM or YYYY-MM-DD")
+    if end:
+        return (date + 1).astype('datetime64[D]') - 1
+    return date.astype('datetime64[D]')
+
+
+def base_arxiv_id(arxiv_id: str) -> str:
+    """An arXiv ID without its version suffix ("2401.12345v2" -> "2401.12345")."""
+    return ARXIV_VERSION.sub('', arxiv_id.strip())
+
+
+def sorted_unique(ids: np.ndarray) -> np.ndarray:
+    """Sort and deduplicate IDs (np.unique is several times slower on large int arrays)."""
+    ids = np.sort(ids)
+    return ids[np.concatenate(([True], ids[1:] != ids[:-1]))] if len(ids) else ids
+
+
+def normalize_filters(date_from: Optional[str] = None, date_to: Optional[str] = None,
+                      authors: Iterable[str] = (), categories: Iterable[str] = (),
+                      arxiv_ids: Iterable[str] = ()) -> Optional[Tuple[Tuple[str, Any], ...]]:
+    """Validate search filters into a hashable tuple of (field, value) pairs, or None if nothing is filtered.
+
+    Dates are inclusive and may be partial ("2024-06" from the first, to the last
+    day of June). A paper matches a list filter if it matches any of its values
+    (any of the authors, categories or arXiv IDs); different fields must all match.
+    Raises ValueError for malformed dates.
+    """
+    filters = {
+        'date_from': str(parse_date(date_from)) if date_from and date_from.strip() else None,
+        'date_to': str(parse_date(date_to, end=True)) if date_to and date_to.strip() else None,
+        'authors': tuple(sorted({author.strip().lower() for author in authors if author.strip()})),
+        'categories': tuple(sorted({category.strip() for category in categories if category.strip()})),
+        'arxiv_ids': tuple(sorted({base_arxiv_id(arxiv_id) for arxiv_id in arxiv_ids if arxiv_id.strip()}))
+    }
+    pairs = tuple((field, filters[field]) for field in FILTER_FIELDS if filters[field])
+    return pairs or None
+
+
+class ChunkFilter:
+    """The chunks a filter lets through, in the forms FAISS, BM25 and hit hydration need.
+
+    `ids` are the sorted IDs of matching indexed chunks: the representatives of every
+    chunk of a matching paper, so a passage whose representative sits in another paper
+    is still found. `paper_mask` flags the matching papers (its last entry, read for
+    the -1 of removed chunks, is always False). The chunk bitmap and the FAISS
+    selector over it are built on first use and shared by every query of a batch.
+    """
+
+    def __init__(self, ids: np.ndarray, papers: np.ndarray, n_papers: int, size: int):
+        self.ids = ids
+        self.paper_mask = np.zeros(n_papers + 1, dtype=bool)
+        self.paper_mask[papers] = True
+        self.size = size
+        self.bitmap: Optional[np.ndarray] = None
+        self.bits: Optional[np.ndarray] = None
+        self.id_selector = None
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def mask(self) -> np.ndarray:
+        """One bool per chunk ID, True for the chunks that may be returned."""
+        if self.bitmap is None:
+            bitmap = np.zeros(self.size, dtype=bool)
+            bitmap[self.ids] = True
+            self.bitmap = bitmap
+        return self.bitmap
+
+    def selector(self) -> faiss.IDSelector:
+        """A FAISS ID selector over the bitmap packed to one bit per chunk ID."""
+        if self.id_selector is None:
+            # The selector only points at the packed bits, so they are kept alive here
+            self.bits = np.packbits(self.mask(), bitorder='little')
+            self.id_selector = faiss.IDSelectorBitmap(len(self.bits), faiss.swig_ptr(self.bits))
+        return self.id_selector
+
+    def allows_paper(self, paper_id: int) -> bool:
+        return bool(self.paper_mask[paper_id])
+
+
+class FilterIndex:
+    """Precomputed lookups from paper metadata to the chunk IDs searched by FAISS and BM25.
+
+    Live papers are kept sorted by publication date (a date range is two binary
+    searches) and in inverted lists per lower-cased author, per category (primary
+    and cross-listed) and per version-less arXiv ID. Every paper's chunks are
+    grouped in one CSR array (`chunk_offsets[p]:chunk_offsets[p + 1]` slices
+    `paper_chunks`), already mapped to their representatives, so a filter costs
+    time proportional to the papers and chunks it matches, not to the corpus.
+    The index is a snapshot: systems rebuild it whenever papers or chunks change.
+    """
+
+    def __init__(self, papers, chunk_to_paper: np.ndarray, chunk_canonical: np.ndarray):
+        self.n_papers = len(papers)
+        self.size = len(chunk_to_paper)
+        live = np.frombuffer(bytes(papers.removed), dtype=np.uint8) == 0
+
+        published = [papers.value(i, 'published') or 'NaT' for i in range(self.n_papers)]
+        dates = np.array(published, dtype='datetime64[D]')
+        dated = np.flatnonzero(live & ~np.isnat(dates))
+        self.date_order = dated[np.argsort(dates[dated], kind='stable')]
+        self.sorted_dates = dates[self.date_order]
+
+        self.authors = self.inverted(live, lambda i: {name.lower() for name in papers.value(i, 'authors') or ()})
+        # Either column may be missing from listings that never had it
+        primary = papers.columns.get('primary_category') or [None] * self.n_papers
+        listed = papers.columns.get('categories') or [None] * self.n_papers
+        self.categories = self.inverted(live, lambda i: {primary[i], *(listed[i] or ())})
+        self.arxiv_ids = self.inverted(live, lambda i: {base_arxiv_id(papers.value(i, 'arxiv_id'))})
+
+        chunk_ids = np.flatnonzero(chunk_to_paper >= 0)
+        owners = chunk_to_paper[chunk_ids]
+        order = np.argsort(owners, kind='stable')
+        self.paper_chunks = np.asarray(chunk_canonical[chunk_ids[order]], dtype=np.int64)
+        self.chunk_offsets = np.zeros(self.n_papers + 1, dtype=np.int64)
+        np.cumsum(np.bincount(owners, minlength=self.n_papers), out=self.chunk_offsets[1:])
+
+    def inverted(self, live: np.ndarray, keys) -> Dict[str, np.ndarray]:
+        """Map each key returned by `keys(paper_id)` to the sorted IDs of the live papers having it."""
+        lists: Dict[str, List[int]] = {}
+        for paper_id in np.flatnonzero(live).tolist():
+            for key in keys(paper_id):
+                if key:
+                    lists.setdefault(key, []).append(paper_id)
+        return {key: np.asarray(ids, dtype=np.int64) for key, ids in lists.items()}
+
+    def lookup(self, lists: Dict[str, np.ndarray], keys: Iterable[str]) -> np.ndarray:
+        found = [lists[key] for key in keys if key in lists]
+        return sorted_unique(np.concatenate(found)) if found else np.zeros(0, dtype=np.int64)
+
+    def matching_papers(self, filters) -> np.ndarray:
+        """Sorted IDs of the live papers matching every field of the (normalized) filters."""
+        filters = dict(filters)
+        selected = []
+        if filters.get('date_from') or filters.get('date_to'):
+            start = np.searchsorted(self.sorted_dates, np.datetime64(filters['date_from']), side='left') \
+                if filters.get('date_from') else 0
+            end = np.searchsorted(self.sorted_dates, np.datetime64(filters['date_to']), side='right') \
+                if filters.get('date_to') else len(self.sorted_dates)
+            selected.append(np.sort(self.date_order[start:end]))
+        for field, lists in (('authors', self.authors), ('categories', self.categories),
+                             ('arxiv_ids', self.arxiv_ids)):
+            if filters.get(field):
+                selected.append(self.lookup(lists, filters[field]))
+        # Intersect from the smallest set
+        selected.sort(key=len)
+        papers = selected[0] if selected else np.zeros(0, dtype=np.int64)
+        for other in selected[1:]:
+            papers = np.intersect1d(papers, other, assume_unique=True)
+        return papers
+
+    def chunks_of(self, papers: np.ndarray) -> np.ndarray:
+        """Sorted, unique indexed chunk IDs of the given papers (a vectorized CSR gather)."""
+        starts = self.chunk_offsets[papers]
+        counts = self.chunk_offsets[papers + 1] - starts
+        total = int(counts.sum())
+        if not total:
+            return np.zeros(0, dtype=np.int64)
+        positions = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(total)
+        return sorted_unique(self.paper_chunks[positions])
+
+    def select(self, filters) -> ChunkFilter:
+        papers = self.matching_papers(filters)
+        return ChunkFilter(self.chunks_of(papers), papers, self.n_papers, self.size)
+
+    def stats(self) -> Dict[str, int]:
+        return {'papers': len(self.date_order), 'authors': len(self.authors), 'categories': len(self.categories)}
+
+
+def synthetic_papers(n_papers: int, n_authors: int = 5000, seed: int = 0) -> List[Dict[str, Any]]:
+    """Paper records with Zipf-distributed authors and dates spread over five years."""
+    rng = np.random.default_rng(seed)
+    days = rng.integers(0, 5 * 365, n_papers)
+    papers = []
+    for i in range(n_papers):
+        authors = np.minimum(rng.zipf(1.5, size=int(rng.integers(1, 6))), n_authors)
+        papers.append({'title': f"Paper {i}", 'authors': [f"Author {a}" for a in authors], 'summary': '',
+                       'pdf_url': '', 'published': str(np.datetime64('2020-01-01') + int(days[i])),
+                       'arxiv_id': f"{2000 + i // 100000}.{i % 100000:05d}v1",
+                       'primary_category': 'cs.CL' if i % 4 else 'cs.LG', 'categories': ['cs.CL', 'cs.LG']})
+    return papers
+
+
+def benchmark(n_papers: int = 10_000, chunks_per_paper: int = 20, index_types: List[str] = ('flat_ip', 'hnsw'),
+              n_queries: int = 100, k: int = 10, dimension: int = 384, exact_limit: int = 10_000) -> List[Dict]:
+    """Latency and recall of filtered search for filters of increasing selectivity.
+
+    Each filter is run three ways: inside the FAISS search with the bitmap ID
+    selector, as an exact scan of only the matching chunks (what the system does
+    below `exact_filter_limit` matches), and as the old post-filter of an
+    unfiltered search over-fetching 4 x k. Recall is against an exact search of the
+    matching chunks; `full_pages` is the fraction of queries that got k hits.
+    """
+    from index_factory import build_index, resolve_params, search_parameters, synthetic_corpus
+    from metadata_store import PaperTable
+
+    papers = PaperTable(synthetic_papers(n_papers))
+    chunk_to_paper = np.repeat(np.arange(n_papers, dtype=np.int32), chunks_per_paper)
+    n_chunks = len(chunk_to_paper)
+    print(f"Generating {n_chunks} x {dimension} synthetic vectors...")
+    vectors = synthetic_corpus(n_chunks, dimension)
+    queries = synthetic_corpus(n_queries, dimension, seed=1)
+
+    start = time.perf_counter()
+    filter_index = FilterIndex(papers, chunk_to_paper, np.arange(n_chunks, dtype=np.int64))
+    build_seconds = time.perf_counter() - start
+    filters = {
+        'one_author': normalize_filters(authors=['Author 300']),
+        'one_month': normalize_filters(date_from='2023-06', date_to='2023-06'),
+        'frequent_author': normalize_filters(authors=['Author 1']),
+        'one_year': normalize_filters(date_from='2024'),
+        'cs.LG_primary_or_listed': normalize_filters(categories=['cs.LG']),
+    }
+
+    results = []
+    for index_type in index_types:
+        index_params = resolve_params({})
+        index = build_index(index_type, vectors, params=index_params)
+        for name, spec in filters.items():
+            start = time.perf_counter()
+            chunk_filter = filter_index.select(spec)
+            params = search_parameters(index, index_params, chunk_filter.selector())
+            select_seconds = time.perf_counter() - start
+            allowed = chunk_filter.mask()
+            subset = vectors[chunk_filter.ids]
+
+            timings = {'selector': [], 'exact': [], 'post_filter': []}
+            recall = {'selector': [], 'post_filter': []}
+            full = {'selector': 0, 'exact': 0, 'post_filter': 0}
+            for query in queries:
+                t0 = time.perf_counter()
+                scores = subset @ query
+                top = np.argsort(-scores)[:k]
+                truth = chunk_filter.ids[top]
+                timings['exact'].append(time.perf_counter() - t0)
+                full['exact'] += len(truth) == k
+
+                t0 = time.perf_counter()
+                _, ids = index.search(query[None, :], k, params=params)
+                timings['selector'].append(time.perf_counter() - t0)
+                found = ids[0][ids[0] >= 0]
+
+                t0 = time.perf_counter()
+                _, over = index.search(query[None, :], 4 * k)
+                kept = over[0][(over[0] >= 0)]
+                kept = kept[allowed[kept]][:k]
+                timings['post_filter'].append(time.perf_counter() - t0)
+
+                for method, hits in (('selector', found), ('post_filter', kept)):
+                    full[method] += len(hits) == k
+                    if len(truth):
+                        recall[method].append(len(set(hits.tolist()) & set(truth.tolist())) / len(truth))
+
+            row = {'index_type': index_type, 'filter': name, 'matching_chunks': len(chunk_filter),
+                   'selectivity': round(len(chunk_filter) / n_chunks, 5),
+                   'select_ms': round(select_seconds * 1000, 3),
+                   'system_uses': 'exact' if len(chunk_filter) <= exact_limit else 'selector'}
+            for method, values in timings.items():
+                row[f'{method}_p50_ms'] = round(float(np.percentile(values, 50)) * 1000, 3)
+                row[f'{method}_full_pages'] = round(full[method] / n_queries, 3)
+            for method, values in recall.items():
+                row[f'{method}_recall@{k}'] = round(float(np.mean(values)), 4) if values else None
+            results.append(row)
+            print(json.dumps(row))
+        del index
+    print(f"Filter index over {n_papers} papers / {n_chunks} chunks built in {build_seconds:.3f}s")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Filtered search latency: FAISS ID selector vs exact scan vs post-filter")
+    parser.add_argument("--papers", type=int, default=10_000)
+    parser.add_argument("--chunks-per-paper", type=int, default=20)
+    parser.add_argument("--types", nargs="+", default=['flat_ip', 'hnsw'])
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--exact-limit", type=int, default=10_000)
+    parser.add_argument("--output", default="filter_benchmark.json")
+    args = parser.parse_args()
+
+    rows = benchmark(args.papers, args.chunks_per_paper, args.types, args.queries, args.k,
+                     exact_limit=args.exact_limit)
+    with open(args.output, "w") as f:
+        json.dump(rows, f, indent=2)
+    print(f"Results written to {args.output}")
@@ -0,0 +1,327 @@
+import argparse
+import json
+import math
+import os
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+import numpy as np
+import faiss
+
+# flat_l2 is the original brute-force L2 index; every other type searches
+# normalized vectors by inner product, i.e. cosine similarity. sq_fp16, sq_int8
+# and pq are brute-force scans over compressed codes (2 bytes, 1 byte and
+# pq_m * pq_bits / 8 bytes per vector instead of 4 bytes per dimension).
+INDEX_TYPES = ('flat_l2', 'flat_ip', 'ivf_flat', 'ivf_pq', 'hnsw', 'sq_fp16', 'sq_int8', 'pq')
+
+# Index types whose scores are approximate and benefit from exact rescoring
+QUANTIZED_TYPES = ('ivf_pq', 'sq_fp16', 'sq_int8', 'pq')
+
+DEFAULT_PARAMS = {
+    'nlist': 1024,          # IVF: number of coarse clusters (capped for small corpora)
+    'nprobe': 16,           # IVF: clusters visited per query
+    'pq_m': 16,             # IVF-PQ: sub-quantizers (must divide the dimension)
+    'pq_bits': 8,           # IVF-PQ: bits per sub-quantizer code
+    'hnsw_m': 32,           # HNSW: graph neighbours per node (M)
+    'ef_construction': 200, # HNSW: candidate list size while building
+    'ef_search': 64,        # HNSW: candidate list size while searching
+    'rescore': 0,           # Re-rank rescore * k candidates with exact float vectors (0 = off)
+    'exact_filter_limit': 10_000  # Filtered searches matching at most this many chunks scan them exactly
+}
+
+
+def resolve_params(params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Fill in defaults for any parameter that was not given."""
+    unknown = set(params or {}) - set(DEFAULT_PARAMS)
+    if unknown:
+        raise ValueError(f"Unknown index parameters: {sorted(unknown)}")
+    return {**DEFAULT_PARAMS, **(params or {})}
+
+
+def uses_inner_product(index_type: str) -> bool:
+    return index_type != 'flat_l2'
+
+
+def supports_removal(index_type: str) -> bool:
+    """HNSW graphs can't delete nodes; removing chunks from them needs a rebuild."""
+    return index_type != 'hnsw'
+
+
+def supports_selector(index_type: str) -> bool:
+    """IndexPQ rejects search parameters, so filters can't restrict its search to some IDs."""
+    return index_type != 'pq'
+
+
+def prepare_vectors(vectors: np.ndarray, index_type: str) -> np.ndarray:
+    """Return float32 vectors in the form the index expects (L2-normalized for cosine)."""
+    vectors = np.array(vectors, dtype='float32', order='C')
+    if uses_inner_product(index_type):
+        faiss.normalize_L2(vectors)
+    return vectors
+
+
+def similarity_from_distance(distance: float, index_type: str) -> float:
+    """Convert a FAISS distance into the similarity score shown to users."""
+    if uses_inner_product(index_type):
+        return float(distance)
+    return float(1 / (1 + distance))
+
+
+def create_index(index_type: str, dimension: int, n_vectors: int,
+                 params: Optional[Dict[str, Any]] = None) -> faiss.Index:
+    """Create an untrained index of the given type, sized for `n_vectors`."""
+    params = resolve_params(params)
+    if index_type == 'flat_l2':
+        return faiss.IndexFlatL2(dimension)
+    if index_type == 'flat_ip':
+        return faiss.IndexFlatIP(dimension)
+    if index_type in ('sq_fp16', 'sq_int8'):
+        qtype = faiss.ScalarQuantizer.QT_fp16 if index_type == 'sq_fp16' else faiss.ScalarQuantizer.QT_8bit
+        return faiss.IndexScalarQuantizer(dimension, qtype, faiss.METRIC_INNER_PRODUCT)
+    if index_type == 'pq':
+        if dimension % params['pq_m']:
+            raise ValueError(f"pq_m={params['pq_m']} must divide the embedding dimension {dimension}")
+        pq_bits = max(1, min(params['pq_bits'], int(math.log2(max(n_vectors, 2)))))
+        return faiss.IndexPQ(dimension, params['pq_m'], pq_bits, faiss.METRIC_INNER_PRODUCT)
+    if index_type == 'hnsw':
+        index = faiss.IndexHNSWFlat(dimension, params['hnsw_m'], faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = params['ef_construction']
+        return index
+    if index_type in ('ivf_flat', 'ivf_pq'):
+        # FAISS wants ~39 training points per centroid; shrink nlist for small corpora
+        nlist = max(1, min(params['nlist'], n_vectors // 39, int(4 * math.sqrt(max(n_vectors, 1)))))
+        quantizer = faiss.IndexFlatIP(dimension)
+        if index_type == 'ivf_flat':
+            return faiss.IndexIVFFlat(quantizer, dimension, nlist, faiss.METRIC_INNER_PRODUCT)
+        if dimension % params['pq_m']:
+            raise ValueError(f"pq_m={params['pq_m']} must divide the embedding dimension {dimension}")
+        # Each PQ codebook needs at least 2**bits training points
+        pq_bits = max(1, min(params['pq_bits'], int(math.log2(max(n_vectors, 2)))))
+        return faiss.IndexIVFPQ(quantizer, dimension, nlist, params['pq_m'], pq_bits,
+                                faiss.METRIC_INNER_PRODUCT)
+    raise ValueError(f"Unknown index type {index_type!r}; choose from {INDEX_TYPES}")
+
+
+def train_index(index: faiss.Index, vectors: np.ndarray, max_train: int = 100_000, seed: int = 0):
+    """Train the index on (a sample of) the vectors if the index type needs training."""
+    if index.is_trained or len(vectors) == 0:
+        return
+    if len(vectors) > max_train:
+        sample = np.random.default_rng(seed).choice(len(vectors), max_train, replace=False)
+        vectors = vectors[np.sort(sample)]
+    index.train(vectors)
+
+
+def tune_index(index: faiss.Index, params: Optional[Dict[str, Any]] = None):
+    """Apply search-time parameters (nprobe, efSearch) to an index, looking through ID maps."""
+    params = resolve_params(params)
+    inner = faiss.downcast_index(index.index) if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)) else index
+    try:
+        faiss.extract_index_ivf(inner).nprobe = params['nprobe']
+    except (RuntimeError, TypeError):
+        pass
+    if isinstance(inner, faiss.IndexHNSW):
+        inner.hnsw.efSearch = params['ef_search']
+
+
+def search_parameters(index: faiss.Index, params: Optional[Dict[str, Any]],
+                      selector: faiss.IDSelector) -> faiss.SearchParameters:
+    """Parameters restricting `index.search` to the IDs accepted by `selector`.
+
+    Search parameters replace the ones set by `tune_index`, so nprobe and efSearch
+    are passed again. ID maps translate the selector to their external IDs.
+    """
+    params = resolve_params(params)
+    inner = faiss.downcast_index(index.index) if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)) else index
+    try:
+        faiss.extract_index_ivf(inner)
+        return faiss.SearchParametersIVF(sel=selector, nprobe=params['nprobe'])
+    except (RuntimeError, TypeError):
+        pass
+    if isinstance(inner, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=params['ef_search'])
+    return faiss.SearchParameters(sel=selector)
+
+
+def build_index(index_type: str, vectors: np.ndarray, ids: Optional[np.ndarray] = None,
+                params: Optional[Dict[str, Any]] = None) -> faiss.Index:
+    """Create, train, tune and fill an index keyed by chunk ID; `vectors` must already be prepared."""
+    index = create_index(index_type, vectors.shape[1], len(vectors), params)
+    train_index(index, vectors)
+    # IVF lists store IDs natively (and IndexIDMap2 can't follow their removals);
+    # flat and HNSW indexes need an explicit ID map
+    if not index_type.startswith('ivf'):
+        index = faiss.IndexIDMap2(index)
+    tune_index(index, params)
+    if ids is None:
+        ids = np.arange(len(vectors), dtype='int64')
+    index.add_with_ids(vectors, ids.astype('int64'))
+    return index
+
+
+def rescore(vectors: np.ndarray, queries: np.ndarray, candidates: np.ndarray, k: int, normalize: bool = False):
+    """Re-rank each query's candidate IDs by exact inner product with full-precision vectors.
+
+    `vectors` may be a memory-mapped matrix: only the candidate rows are read, in
+    ascending order. With `normalize`, the rows read are L2-normalized first (for
+    raw embeddings searched by cosine). Returns (scores, ids) shaped like
+    `index.search`, padded with -1.
+    """
+    scores = np.full((len(queries), k), -np.inf, dtype='float32')
+    ids = np.full((len(queries), k), -1, dtype='int64')
+    for i, (query, row) in enumerate(zip(queries, candidates)):
+        row = np.unique(row[row >= 0])
+        if not len(row):
+            continue
+        rows = np.array(vectors[row], dtype='float32', order='C')
+        if normalize:
+            faiss.normalize_L2(rows)
+        exact = rows @ query
+        order = np.argsort(-exact, kind='stable')[:k]
+        scores[i, :len(order)] = exact[order]
+        ids[i, :len(order)] = row[order]
+    return scores, ids
+
+
+def index_memory_bytes(index: faiss.Index) -> int:
+    """Approximate bytes held by an index, computed from its vector count and code layout.
+
+    Unlike serializing, this reads no vectors (and never pages in a memory-mapped
+    index), so it can run on every metrics scrape.
+    """
+    index = faiss.downcast_index(index)
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        # The int64 ID of each vector, plus IndexIDMap2's reverse hash map
+        per_vector = 8 + (32 if isinstance(index, faiss.IndexIDMap2) else 0)
+        return index.ntotal * per_vector + index_memory_bytes(index.index)
+    if isinstance(index, faiss.IndexHNSW):
+        hnsw = index.hnsw
+        links = 4 * hnsw.neighbors.size() + 4 * hnsw.levels.size() + 8 * hnsw.offsets.size()
+        return links + index_memory_bytes(index.storage)
+    if isinstance(index, faiss.IndexIVF):
+        # Inverted lists hold each vector's code and int64 ID
+        size = index.ntotal * (index.code_size + 8) + index_memory_bytes(index.quantizer)
+        if isinstance(index, faiss.IndexIVFPQ):
+            size += 4 * index.pq.centroids.size()
+        return size
+    size = index.ntotal * index.code_size
+    if isinstance(index, faiss.IndexPQ):
+        size += 4 * index.pq.centroids.size()
+    elif isinstance(index, faiss.IndexScalarQuantizer):
+        size += 4 * index.sq.trained.size()
+    return size
+
+
+def synthetic_corpus(n_vectors: int, dimension: int = 384, n_clusters: int = 256,
+                     seed: int = 0, batch: int = 100_000) -> np.ndarray:
+    """Clustered, normalized random vectors that roughly mimic sentence embeddings.
+    
+    The cluster centres are fixed, so corpora and query sets drawn with different
+    seeds come from the same distribution.
+    """
+    centers = np.random.default_rng(12345).standard_normal((n_clusters, dimension)).astype('float32')
+    rng = np.random.default_rng(seed)
+    vectors = np.empty((n_vectors, dimension), dtype='float32')
+    for start in range(0, n_vectors, batch):
+        end = min(start + batch, n_vectors)
+        labels = rng.integers(0, n_clusters, end - start)
+        vectors[start:end] = centers[labels] + 0.6 * rng.standard_normal((end - start, dimension), dtype='float32')
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+def benchmark(sizes: List[int], index_types: List[str] = ('flat_ip', 'ivf_flat', 'ivf_pq', 'hnsw',
+                                                           'sq_fp16', 'sq_int8', 'pq'),
+              dimension: int = 384, n_queries: int = 200, k: int = 10,
+              params: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    """Compare index types on synthetic corpora.
+
+    Reports build time, recall@k against the exact flat inner-product search,
+    single-query latency p50/p99, serialized index size and bytes per vector.
+    Quantized types are measured a second time with exact rescoring of
+    `rescore` * k candidates read from a memory-mapped float32 copy of the corpus,
+    as the RAG system does with its embeddings.npy.
+    """
+    params = resolve_params(params)
+    results = []
+    for n_vectors in sizes:
+        print(f"Generating {n_vectors} x {dimension} synthetic vectors...")
+        vectors = synthetic_corpus(n_vectors, dimension)
+        queries = synthetic_corpus(n_queries, dimension, seed=1)
+
+        exact = faiss.IndexFlatIP(dimension)
+        exact.add(vectors)
+        _, truth = exact.search(queries, k)
+        del exact
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            np.save(os.path.join(tmp_dir, 'vectors.npy'), vectors)
+            mapped = np.load(os.path.join(tmp_dir, 'vectors.npy'), mmap_mode='r')
+
+            for index_type in index_types:
+                start = time.perf_counter()
+                index = build_index(index_type, vectors, params=params)
+                build_seconds = time.perf_counter() - start
+                memory = int(faiss.serialize_index(index).size)
+
+                factors = [0]
+                if params['rescore'] and index_type in QUANTIZED_TYPES:
+                    factors.append(params['rescore'])
+                for factor in factors:
+                    latencies = []
+                    found = np.empty((n_queries, k), dtype='int64')
+                    for i in range(n_queries):
+                        t0 = time.perf_counter()
+                        _, ids = index.search(queries[i:i + 1], k * factor if factor else k)
+                        if factor:
+                            _, ids = rescore(mapped, queries[i:i + 1], ids, k, normalize=True)
+                        latencies.append(time.perf_counter() - t0)
+                        found[i] = ids[0]
+
+                    recall = np.mean([len(set(found[i]) & set(truth[i])) / k for i in range(n_queries)])
+                    row = {
+                        'vectors': n_vectors,
+                        'index_type': index_type,
+                        'rescore': factor,
+                        'build_seconds': round(build_seconds, 3),
+                        f'recall@{k}': round(float(recall), 4),
+                        'latency_p50_ms': round(float(np.percentile(latencies, 50)) * 1000, 3),
+                        'latency_p99_ms': round(float(np.percentile(latencies, 99)) * 1000, 3),
+                        'memory_mb': round(memory / 2**20, 2),
+                        'bytes_per_vector': round(memory / n_vectors, 1)
+                    }
+                    results.append(row)
+                    print(f"{n_vectors:>9} {index_type:<9} rescore={factor:<3} recall@{k}={row[f'recall@{k}']:.3f} "
+                          f"p50={row['latency_p50_ms']:.2f}ms p99={row['latency_p99_ms']:.2f}ms "
+                          f"mem={row['memory_mb']:.1f}MB ({row['bytes_per_vector']:.0f} B/vector) "
+                          f"build={row['build_seconds']:.1f}s")
+                del index
+            del mapped
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recall/latency/memory benchmark for FAISS index types")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--types", nargs="+", default=['flat_ip', 'ivf_flat', 'ivf_pq', 'hnsw', 'sq_fp16', 'sq_int8', 'pq'],
+                        choices=INDEX_TYPES)
+    parser.add_argument("--dimension", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--nlist", type=int, default=DEFAULT_PARAMS['nlist'])
+    parser.add_argument("--nprobe", type=int, default=DEFAULT_PARAMS['nprobe'])
+    parser.add_argument("--ef-search", type=int, default=DEFAULT_PARAMS['ef_search'])
+    parser.add_argument("--hnsw-m", type=int, default=DEFAULT_PARAMS['hnsw_m'])
+    parser.add_argument("--pq-m", type=int, default=DEFAULT_PARAMS['pq_m'])
+    parser.add_argument("--rescore", type=int, default=4,
+                        help="Also measure quantized types with exact rescoring of rescore * k candidates (0 = off)")
+    parser.add_argument("--output", default="index_benchmark.json")
+    args = parser.parse_args()
+
+    rows = benchmark(args.sizes, args.types, args.dimension, args.queries, args.k,
+                     params={'nlist': args.nlist, 'nprobe': args.nprobe,
+                             'ef_search': args.ef_search, 'hnsw_m': args.hnsw_m,
+                             'pq_m': args.pq_m, 'rescore': args.rescore})
+    with open(args.output, "w") as f:
+        json.dump(rows, f, indent=2)
+    print(f"Results written to {args.output}")
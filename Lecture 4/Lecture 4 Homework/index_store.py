@@ -0,0 +1,160 @@
+import json
+import os
+import shutil
+from typing import Any, Dict, Optional, Tuple
+import numpy as np
+import faiss
+from lexical_index import LexicalIndex
+from metadata_store import ChunkStore, PaperTable
+
+# Bump whenever the directory layout changes so old readers refuse new data
+FORMAT_VERSION = 1
+
+# Map the flat index codes straight from the file where the installed FAISS supports it
+MMAP_FLAGS = getattr(faiss, 'IO_FLAG_MMAP_IFC', None)
+
+
+def write_chunks(directory: str, chunks) -> None:
+    """Write chunk text as a single blob with an int64 offsets array."""
+    offsets = np.zeros(len(chunks) + 1, dtype=np.int64)
+    with open(os.path.join(directory, 'chunks.bin'), 'wb') as f:
+        position = 0
+        for i, chunk in enumerate(chunks):
+            data = chunk.encode('utf-8')
+            f.write(data)
+            position += len(data)
+            offsets[i + 1] = position
+    np.save(os.path.join(directory, 'chunk_offsets.npy'), offsets)
+
+
+def read_chunks(directory: str) -> ChunkStore:
+    """Memory-map the chunk blob written by `write_chunks`."""
+    offsets = np.load(os.path.join(directory, 'chunk_offsets.npy'), mmap_mode='r')
+    blob_path = os.path.join(directory, 'chunks.bin')
+    if os.path.getsize(blob_path) == 0:
+        blob = np.zeros(0, dtype=np.uint8)
+    else:
+        blob = np.memmap(blob_path, dtype=np.uint8, mode='r')
+    return ChunkStore(blob, offsets)
+
+
+def read_spans(directory: str, n_chunks: int, mmap_mode: Optional[str]) -> np.ndarray:
+    """Chunk character spans; indexes written before spans existed get (-1, -1)."""
+    path = os.path.join(directory, 'chunk_spans.npy')
+    if not os.path.exists(path):
+        return np.full((n_chunks, 2), -1, dtype=np.int64)
+    return np.load(path, mmap_mode=mmap_mode)
+
+
+def read_pages(directory: str, n_chunks: int, mmap_mode: Optional[str]) -> np.ndarray:
+    """Chunk page ranges; indexes written before pages were tracked get (-1, -1)."""
+    path = os.path.join(directory, 'chunk_pages.npy')
+    if not os.path.exists(path):
+        return np.full((n_chunks, 2), -1, dtype=np.int32)
+    return np.load(path, mmap_mode=mmap_mode)
+
+
+def read_dedup(directory: str, n_chunks: int, mmap_mode: Optional[str]) -> Tuple[Optional[np.ndarray], np.ndarray]:
+    """Chunk SimHash fingerprints and representatives.
+
+    Indexes written before dedup get no fingerprints (None, computed when needed)
+    and every chunk as its own representative.
+    """
+    fingerprints_path = os.path.join(directory, 'chunk_fingerprints.npy')
+    canonical_path = os.path.join(directory, 'chunk_canonical.npy')
+    if not os.path.exists(canonical_path):
+        return None, np.arange(n_chunks, dtype=np.int64)
+    return np.load(fingerprints_path, mmap_mode=mmap_mode), np.load(canonical_path, mmap_mode=mmap_mode)
+
+
+def save_index(directory: str, papers: PaperTable, chunks, embeddings: np.ndarray,
+               chunk_to_paper, faiss_index, lexical_index: Optional[LexicalIndex] = None,
+               chunk_spans=None, chunk_pages=None, chunk_fingerprints=None, chunk_canonical=None,
+               paper_embeddings=None, extra: Optional[Dict[str, Any]] = None) -> str:
+    """Write the system in the versioned on-disk layout.
+
+    Everything is written to a sibling temp directory first and renamed into place,
+    so a reader never sees a half-written index.
+    """
+    tmp_dir = directory.rstrip('/\\') + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    np.save(os.path.join(tmp_dir, 'embeddings.npy'), np.ascontiguousarray(embeddings, dtype=np.float32))
+    np.save(os.path.join(tmp_dir, 'chunk_to_paper.npy'), np.asarray(chunk_to_paper, dtype=np.int32))
+    if chunk_spans is None or not len(chunk_spans):
+        chunk_spans = np.full((len(chunks), 2), -1, dtype=np.int64)
+    np.save(os.path.join(tmp_dir, 'chunk_spans.npy'), np.asarray(chunk_spans, dtype=np.int64).reshape(-1, 2))
+    if chunk_pages is None or not len(chunk_pages):
+        chunk_pages = np.full((len(chunks), 2), -1, dtype=np.int32)
+    np.save(os.path.join(tmp_dir, 'chunk_pages.npy'), np.asarray(chunk_pages, dtype=np.int32).reshape(-1, 2))
+    if chunk_canonical is not None and chunk_fingerprints is not None:
+        np.save(os.path.join(tmp_dir, 'chunk_fingerprints.npy'), np.asarray(chunk_fingerprints, dtype=np.uint64))
+        np.save(os.path.join(tmp_dir, 'chunk_canonical.npy'), np.asarray(chunk_canonical, dtype=np.int64))
+    if paper_embeddings is not None:
+        np.save(os.path.join(tmp_dir, 'paper_embeddings.npy'), np.asarray(paper_embeddings, dtype=np.float32))
+    write_chunks(tmp_dir, chunks)
+    with open(os.path.join(tmp_dir, 'papers.json'), 'w', encoding='utf-8') as f:
+        json.dump(papers.to_columns(), f, ensure_ascii=False)
+    faiss.write_index(faiss_index, os.path.join(tmp_dir, 'faiss.index'))
+    if lexical_index is not None:
+        lexical_index.save(tmp_dir)
+
+    manifest = {
+        'format_version': FORMAT_VERSION,
+        'papers': len(papers),
+        'chunks': len(chunks),
+        'dimension': int(embeddings.shape[1]),
+        **(extra or {})
+    }
+    with open(os.path.join(tmp_dir, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+
+    old_dir = directory.rstrip('/\\') + '.old'
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if os.path.exists(directory):
+        os.rename(directory, old_dir)
+    os.rename(tmp_dir, directory)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    return directory
+
+
+def load_index(directory: str, mmap: bool = True) -> Dict[str, Any]:
+    """Open an index directory; large arrays are memory-mapped and paged in on demand."""
+    with open(os.path.join(directory, 'manifest.json'), encoding='utf-8') as f:
+        manifest = json.load(f)
+    if manifest.get('format_version') != FORMAT_VERSION:
+        raise ValueError(f"Unsupported index format version {manifest.get('format_version')} in {directory}")
+
+    mmap_mode = 'r' if mmap else None
+    # Small per-chunk arrays are copy-on-write so incremental updates can still edit them
+    meta_mode = 'c' if mmap else None
+    with open(os.path.join(directory, 'papers.json'), encoding='utf-8') as f:
+        papers = PaperTable.from_columns(json.load(f))
+
+    fingerprints, canonical = read_dedup(directory, manifest['chunks'], meta_mode)
+    index_path = os.path.join(directory, 'faiss.index')
+    paper_path = os.path.join(directory, 'paper_embeddings.npy')
+    mmapped = mmap and MMAP_FLAGS is not None
+    if mmapped:
+        faiss_index = faiss.read_index(index_path, MMAP_FLAGS | faiss.IO_FLAG_READ_ONLY)
+    else:
+        faiss_index = faiss.read_index(index_path)
+
+    return {
+        'manifest': manifest,
+        'papers': papers,
+        'chunks': read_chunks(directory),
+        'embeddings': np.load(os.path.join(directory, 'embeddings.npy'), mmap_mode=mmap_mode),
+        'chunk_to_paper': np.load(os.path.join(directory, 'chunk_to_paper.npy'), mmap_mode=meta_mode),
+        'chunk_spans': read_spans(directory, manifest['chunks'], meta_mode),
+        'chunk_pages': read_pages(directory, manifest['chunks'], meta_mode),
+        'chunk_fingerprints': fingerprints,
+        'chunk_canonical': canonical,
+        # Indexes saved before two-tier search have no paper embeddings (computed when needed)
+        'paper_embeddings': np.load(paper_path, mmap_mode=mmap_mode) if os.path.exists(paper_path) else None,
+        'faiss_index': faiss_index,
+        'lexical_index': LexicalIndex.load(directory, mmap=mmap) if LexicalIndex.exists(directory) else None,
+        'index_path': index_path,
+        'index_mmapped': mmapped
+    }
@@ -0,0 +1,123 @@
+import os
+import re
+import shutil
+from typing import List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: builds are only serialized within one process
+    fcntl = None
+
+# File in a shard directory naming the published version; replaced atomically on publish
+POINTER = 'CURRENT'
+VERSIONS = 'versions'
+VERSION = re.compile(r"^v\d{6,}$")
+
+# Published versions kept on disk: the current one, plus the previous one for workers still switching over
+KEEP_VERSIONS = 2
+
+
+def versions(root: str) -> List[str]:
+    """Names of the saved versions under `root`, oldest first."""
+    directory = os.path.join(root, VERSIONS)
+    if not os.path.isdir(directory):
+        return []
+    return sorted((name for name in os.listdir(directory) if VERSION.match(name)), key=lambda name: int(name[1:]))
+
+
+def read_pointer(root: str) -> Optional[str]:
+    try:
+        with open(os.path.join(root, POINTER), encoding='utf-8') as f:
+            name = f.read().strip()
+    except FileNotFoundError:
+        return None
+    return name if VERSION.match(name) else None
+
+
+def current_dir(root: str) -> Optional[str]:
+    """The index directory to serve for `root`: the version its pointer names, or `root` itself
+    for an index saved before versioning (None if there is neither)."""
+    name = read_pointer(root)
+    if name:
+        return os.path.join(root, VERSIONS, name)
+    if os.path.exists(os.path.join(root, 'manifest.json')):
+        return root
+    return None
+
+
+def next_dir(root: str) -> str:
+    """Directory for the next version of `root` (not created)."""
+    existing = versions(root)
+    number = int(existing[-1][1:]) + 1 if existing else 1
+    return os.path.join(root, VERSIONS, f"v{number:06d}")
+
+
+def publish(root: str, directory: str, keep: int = KEEP_VERSIONS):
+    """Make the saved version `directory` the one served from `root`, then prune old versions.
+
+    The pointer is written to a temp file, fsynced and renamed over the old one, so
+    readers see either the previous version or the new one.
+    """
+    tmp_path = os.path.join(root, f"{POINTER}.{os.getpid()}.tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(os.path.basename(directory) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, os.path.join(root, POINTER))
+    prune(root, keep)
+
+
+def prune(root: str, keep: int = KEEP_VERSIONS):
+    """Delete all but the `keep` newest versions, never the published one.
+
+    Workers that still map files of a deleted version keep reading them (POSIX
+    unlink semantics) until they switch; on Windows the deletion is skipped.
+    """
+    current = read_pointer(root)
+    for name in versions(root)[:-keep]:
+        if name != current:
+            shutil.rmtree(os.path.join(root, VERSIONS, name), ignore_errors=True)
+
+
+class BuildLock:
+    """A non-blocking exclusive lock on a file, so one process at a time builds and publishes.
+
+    The lock is an flock: the OS drops it when the holder exits, so a killed build
+    never leaves a stale lock behind. The holder's PID is written into the file.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file = None
+
+    def acquire(self) -> bool:
+        """Take the lock; returns False if another process (or build) holds it."""
+        if fcntl is None:
+            return True
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        f = open(self.path, 'a+', encoding='utf-8')
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            return False
+        f.seek(0)
+        f.truncate()
+        f.write(str(os.getpid()))
+        f.flush()
+        self.file = f
+        return True
+
+    def owner(self) -> Optional[int]:
+        """PID of the process that last took the lock, if known."""
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                return int(f.read().strip() or 0) or None
+        except (OSError, ValueError):
+            return None
+
+    def release(self):
+        if self.file is not None:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+            self.file.close()
+            self.file = None
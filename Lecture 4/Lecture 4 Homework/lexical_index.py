@@ -0,0 +1,427 @@
+import argparse
+import json
+import math
+import os
+import re
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+
+# Keeps model names, versioned IDs and acronyms in one piece: "gpt-4", "2401.12345", "bert"
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[.\-_][a-z0-9]+)*")
+
+STOPWORDS = frozenset("""
+a an and are as at be by for from has have in into is it its of on or that the their this
+to was were which with we our can not also these those than then there such been using used
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+
+class LexicalIndex:
+    """BM25 inverted index over chunks, keyed by the same stable chunk IDs as FAISS.
+
+    Postings live in three flat arrays (CSR layout): `offsets[t]:offsets[t+1]`
+    slices `docs` (int32 chunk IDs, ascending) and `tfs` (uint16 term counts) for
+    term `t`. New chunks go into small per-term tails that are merged into the
+    flat arrays once they grow past `merge_ratio` of the base, so incremental adds
+    don't rewrite the whole index. Removed chunks are tombstoned in `deleted` and
+    their postings dropped at the next merge; `df` counts only live chunks per term,
+    so idf stays right in between. Chunks may be added under IDs below ones already
+    indexed (a promoted duplicate); the merge then re-sorts the postings, since
+    pruned search binary-searches them.
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75, merge_ratio: float = 0.1):
+        self.k1 = k1
+        self.b = b
+        self.merge_ratio = merge_ratio
+        self.vocab: Dict[str, int] = {}
+        self.terms: List[str] = []
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.docs = np.zeros(0, dtype=np.int32)
+        self.tfs = np.zeros(0, dtype=np.uint16)
+        self.max_tf = np.zeros(0, dtype=np.uint16)
+        self.doc_lengths = np.zeros(0, dtype=np.int32)
+        self.deleted = np.zeros(0, dtype=bool)
+        self.df = np.zeros(0, dtype=np.int64)  # Live chunks containing each term
+        self.dead_postings = False  # Postings of deleted chunks still in the arrays
+        self.unordered = False  # Tails hold IDs below earlier postings of their term
+        self.pending: Dict[int, Tuple[List[int], List[int]]] = {}
+        self.pending_count = 0
+        self.total_length = 0
+        self.live_docs = 0
+
+    def __len__(self) -> int:
+        return self.live_docs
+
+    # ---- building -------------------------------------------------------------
+
+    def add_documents(self, doc_ids: List[int], texts: List[str]):
+        """Index chunks under the given IDs (IDs not indexed before, in any order)."""
+        if not len(doc_ids):
+            return
+        if min(doc_ids) < len(self.doc_lengths) or any(a >= b for a, b in zip(doc_ids, doc_ids[1:])):
+            self.unordered = True
+        size = max(doc_ids) + 1
+        if size > len(self.doc_lengths):
+            self.doc_lengths = np.concatenate([self.doc_lengths, np.zeros(size - len(self.doc_lengths), dtype=np.int32)])
+            self.deleted = np.concatenate([self.deleted, np.ones(size - len(self.deleted), dtype=bool)])
+
+        added_terms = []
+        for doc_id, text in zip(doc_ids, texts):
+            tokens = tokenize(text)
+            self.doc_lengths[doc_id] = len(tokens)
+            self.deleted[doc_id] = False
+            self.total_length += len(tokens)
+            self.live_docs += 1
+            for term, tf in Counter(tokens).items():
+                term_id = self.vocab.get(term)
+                if term_id is None:
+                    term_id = self.vocab[term] = len(self.terms)
+                    self.terms.append(term)
+                tail_docs, tail_tfs = self.pending.setdefault(term_id, ([], []))
+                tail_docs.append(doc_id)
+                tail_tfs.append(min(tf, 65535))
+                added_terms.append(term_id)
+                self.pending_count += 1
+        if len(self.df) < len(self.terms):
+            self.df = np.concatenate([self.df, np.zeros(len(self.terms) - len(self.df), dtype=np.int64)])
+        np.add.at(self.df, added_terms, 1)
+
+        if self.pending_count > self.merge_ratio * max(len(self.docs), 1):
+            self.merge()
+
+    def merge(self):
+        """Fold the pending tails into the flat posting arrays, dropping the postings of deleted chunks."""
+        if not self.pending and not self.dead_postings and not self.unordered:
+            return
+        n_terms = len(self.terms)
+        counts = np.zeros(n_terms, dtype=np.int64)
+        counts[:len(self.offsets) - 1] = np.diff(self.offsets)
+        tail_counts = np.zeros(n_terms, dtype=np.int64)
+        for term_id, (tail_docs, _) in self.pending.items():
+            tail_counts[term_id] = len(tail_docs)
+
+        offsets = np.zeros(n_terms + 1, dtype=np.int64)
+        np.cumsum(counts + tail_counts, out=offsets[1:])
+        docs = np.empty(offsets[-1], dtype=np.int32)
+        tfs = np.empty(offsets[-1], dtype=np.uint16)
+
+        # Existing postings move as one block per term; tails are appended after them
+        old_terms = len(self.offsets) - 1
+        term_of_posting = np.repeat(np.arange(old_terms), counts[:old_terms])
+        rank_in_term = np.arange(len(self.docs)) - self.offsets[:-1][term_of_posting]
+        destination = offsets[:-1][term_of_posting] + rank_in_term
+        docs[destination] = self.docs
+        tfs[destination] = self.tfs
+        for term_id, (tail_docs, tail_tfs) in self.pending.items():
+            start = offsets[term_id] + counts[term_id]
+            docs[start:start + len(tail_docs)] = tail_docs
+            tfs[start:start + len(tail_tfs)] = tail_tfs
+
+        max_tf = np.zeros(n_terms, dtype=np.uint16)
+        max_tf[:len(self.max_tf)] = self.max_tf
+        for term_id, (_, tail_tfs) in self.pending.items():
+            max_tf[term_id] = max(max_tf[term_id], max(tail_tfs))
+
+        if self.dead_postings:
+            live = ~self.deleted[docs]
+            if not live.all():
+                term_of_posting = np.repeat(np.arange(n_terms), np.diff(offsets))
+                np.cumsum(np.bincount(term_of_posting[live], minlength=n_terms), out=offsets[1:])
+                docs, tfs = docs[live], tfs[live]
+        if self.unordered:
+            term_of_posting = np.repeat(np.arange(n_terms), np.diff(offsets))
+            order = np.lexsort((docs, term_of_posting))
+            docs, tfs = docs[order], tfs[order]
+
+        self.offsets, self.docs, self.tfs, self.max_tf = offsets, docs, tfs, max_tf
+        # Every posting left is live, so the document frequencies are the list lengths
+        self.df = np.diff(offsets)
+        self.pending = {}
+        self.pending_count = 0
+        self.dead_postings = False
+        self.unordered = False
+
+    def is_ordered(self) -> bool:
+        """Whether every merged posting list is in ascending chunk ID order."""
+        steps = np.diff(self.docs.astype(np.int64))
+        starts = self.offsets[1:-1]
+        # A step into the first posting of the next term is not an ordering step
+        steps[starts[(starts > 0) & (starts < len(self.docs))] - 1] = 1
+        return bool((steps > 0).all())
+
+    def count_df(self):
+        """Recount the live document frequency of every term from the postings."""
+        n_terms = len(self.terms)
+        term_of_posting = np.repeat(np.arange(len(self.offsets) - 1), np.diff(self.offsets))
+        df = np.bincount(term_of_posting[~self.deleted[self.docs]], minlength=n_terms).astype(np.int64)
+        for term_id, (tail_docs, _) in self.pending.items():
+            df[term_id] += int((~self.deleted[tail_docs]).sum())
+        self.df = df
+
+    def delete(self, doc_ids, texts: Optional[List[str]] = None):
+        """Tombstone chunks; their postings are skipped at query time and dropped at the next merge.
+
+        Pass the chunks' `texts` to update the document frequencies from just their
+        terms; without them, the frequencies are recounted from all postings.
+        """
+        deleted = 0
+        for i, doc_id in enumerate(doc_ids):
+            if doc_id < len(self.deleted) and not self.deleted[doc_id]:
+                self.deleted[doc_id] = True
+                self.total_length -= int(self.doc_lengths[doc_id])
+                self.live_docs -= 1
+                deleted += 1
+                if texts is not None:
+                    term_ids = [self.vocab[term] for term in set(tokenize(texts[i])) if term in self.vocab]
+                    self.df[term_ids] -= 1
+        if deleted:
+            self.dead_postings = True
+            if texts is None:
+                self.count_df()
+
+    # ---- querying -------------------------------------------------------------
+
+    def postings(self, term_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        if term_id < len(self.offsets) - 1:
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            docs, tfs = self.docs[start:end], self.tfs[start:end]
+        else:
+            docs, tfs = np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.uint16)
+        if term_id in self.pending:
+            tail_docs, tail_tfs = self.pending[term_id]
+            docs = np.concatenate([docs, np.asarray(tail_docs, dtype=np.int32)])
+            tfs = np.concatenate([tfs, np.asarray(tail_tfs, dtype=np.uint16)])
+            if self.unordered:
+                order = np.argsort(docs, kind='stable')
+                docs, tfs = docs[order], tfs[order]
+        return docs, tfs
+
+    def term_max_tf(self, term_id: int) -> int:
+        best = int(self.max_tf[term_id]) if term_id < len(self.max_tf) else 0
+        if term_id in self.pending:
+            best = max(best, max(self.pending[term_id][1]))
+        return best
+
+    def search(self, query: str, top_k: int = 10, prune: bool = True,
+               mask: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (chunk_ids, bm25_scores) of the top_k chunks, best first.
+
+        With `mask` (one bool per chunk ID), only chunks whose entry is True are
+        scored; score bounds still cover all chunks, so pruning stays exact.
+
+        Terms are scored one at a time from the highest to the lowest score upper
+        bound (max-score). Once the k-th best score so far beats the combined upper
+        bound of the remaining terms, no unseen chunk can reach the top-k, so the
+        remaining (usually long, low-idf) posting lists are only probed for the
+        existing candidates with a binary search instead of being scanned.
+        """
+        empty = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32))
+        if self.live_docs == 0:
+            return empty
+        term_ids = list(dict.fromkeys(self.vocab[t] for t in tokenize(query) if t in self.vocab))
+        if not term_ids:
+            return empty
+
+        k1, b = self.k1, self.b
+        avgdl = self.total_length / self.live_docs if self.live_docs else 1.0
+        min_norm = k1 * (1 - b + b * self.doc_lengths[~self.deleted].min() / avgdl) if avgdl else k1
+        terms = []
+        for term_id in term_ids:
+            docs, tfs = self.postings(term_id)
+            df = int(self.df[term_id])
+            idf = math.log(1 + (self.live_docs - df + 0.5) / (df + 0.5))
+            max_tf = self.term_max_tf(term_id)
+            upper_bound = idf * max_tf * (k1 + 1) / (max_tf + min_norm)
+            terms.append((upper_bound, idf, docs, tfs))
+        terms.sort(key=lambda term: term[0], reverse=True)
+        remaining = np.cumsum([term[0] for term in terms][::-1])[::-1]
+
+        def term_scores(idf, docs, tfs):
+            tf = tfs.astype(np.float32)
+            norm = k1 * (1 - b + b * self.doc_lengths[docs] / avgdl)
+            return idf * tf * (k1 + 1) / (tf + norm)
+
+        candidates = np.zeros(0, dtype=np.int64)
+        scores = np.zeros(0, dtype=np.float32)
+        for i, (_, idf, docs, tfs) in enumerate(terms):
+            if prune and len(candidates) >= top_k:
+                threshold = np.partition(scores, len(scores) - top_k)[len(scores) - top_k]
+                if threshold >= remaining[i]:
+                    # Only existing candidates can still make the top-k
+                    if not len(docs):
+                        continue
+                    positions = np.searchsorted(docs, candidates)
+                    positions[positions >= len(docs)] = 0
+                    hit = docs[positions] == candidates
+                    if hit.any():
+                        scores[hit] += term_scores(idf, docs[positions[hit]], tfs[positions[hit]])
+                    continue
+
+            live = ~self.deleted[docs]
+            if mask is not None:
+                live &= mask[docs]
+            docs, tfs = docs[live], tfs[live]
+            merged, inverse = np.unique(np.concatenate([candidates, docs]), return_inverse=True)
+            weights = np.concatenate([scores, term_scores(idf, docs, tfs)])
+            scores = np.bincount(inverse, weights=weights, minlength=len(merged)).astype(np.float32)
+            candidates = merged
+
+        if len(candidates) > top_k:
+            top = np.argpartition(-scores, top_k)[:top_k]
+            candidates, scores = candidates[top], scores[top]
+        order = np.argsort(-scores, kind='stable')
+        return candidates[order], scores[order]
+
+    # ---- persistence ----------------------------------------------------------
+
+    def save(self, directory: str):
+        """Write the index as .npy arrays next to the embeddings."""
+        self.merge()
+        for name in ('offsets', 'docs', 'tfs', 'max_tf', 'doc_lengths', 'deleted'):
+            np.save(os.path.join(directory, f'lexical_{name}.npy'), getattr(self, name))
+        with open(os.path.join(directory, 'lexical_terms.json'), 'w', encoding='utf-8') as f:
+            json.dump({'k1': self.k1, 'b': self.b, 'terms': self.terms, 'compacted': True, 'ordered': True}, f,
+                      ensure_ascii=False)
+
+    @classmethod
+    def exists(cls, directory: str) -> bool:
+        return os.path.exists(os.path.join(directory, 'lexical_terms.json'))
+
+    @classmethod
+    def load(cls, directory: str, mmap: bool = True) -> 'LexicalIndex':
+        with open(os.path.join(directory, 'lexical_terms.json'), encoding='utf-8') as f:
+            meta = json.load(f)
+        index = cls(k1=meta['k1'], b=meta['b'])
+        index.terms = meta['terms']
+        index.vocab = {term: i for i, term in enumerate(index.terms)}
+        mmap_mode = 'r' if mmap else None
+        for name in ('offsets', 'docs', 'tfs', 'max_tf'):
+            setattr(index, name, np.load(os.path.join(directory, f'lexical_{name}.npy'), mmap_mode=mmap_mode))
+        # Small per-chunk arrays stay writable for incremental updates
+        index.doc_lengths = np.load(os.path.join(directory, 'lexical_doc_lengths.npy'))
+        index.deleted = np.load(os.path.join(directory, 'lexical_deleted.npy'))
+        index.total_length = int(index.doc_lengths[~index.deleted].sum())
+        index.live_docs = int((~index.deleted).sum())
+        if meta.get('compacted'):
+            index.df = np.diff(index.offsets)
+        else:
+            # Saved before deleted postings were dropped: count live ones, and drop them at the next merge
+            index.count_df()
+            index.dead_postings = bool(index.deleted.any())
+        if not meta.get('ordered') and not index.is_ordered():
+            # Saved with a promoted duplicate appended out of order: sort in memory
+            index.unordered = True
+            index.merge()
+        return index
+
+
+def reciprocal_rank_fusion(rankings: List[np.ndarray], k: int = 60,
+                           weights: Optional[List[float]] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Fuse ranked ID lists with RRF: score(d) = sum_i w_i / (k + rank_i(d))."""
+    fused: Dict[int, float] = {}
+    for i, ranking in enumerate(rankings):
+        weight = weights[i] if weights else 1.0
+        for rank, doc_id in enumerate(ranking):
+            fused[int(doc_id)] = fused.get(int(doc_id), 0.0) + weight / (k + rank + 1)
+    ordered = sorted(fused.items(), key=lambda item: item[1], reverse=True)
+    return (np.array([doc_id for doc_id, _ in ordered], dtype=np.int64),
+            np.array([score for _, score in ordered], dtype=np.float32))
+
+
+def weighted_fusion(rankings: List[Tuple[np.ndarray, np.ndarray]],
+                    weights: List[float]) -> Tuple[np.ndarray, np.ndarray]:
+    """Fuse (ids, scores) lists by a weighted sum of min-max normalized scores."""
+    fused: Dict[int, float] = {}
+    for (ids, scores), weight in zip(rankings, weights):
+        if not len(ids):
+            continue
+        low, high = float(np.min(scores)), float(np.max(scores))
+        spread = high - low or 1.0
+        for doc_id, score in zip(ids, scores):
+            fused[int(doc_id)] = fused.get(int(doc_id), 0.0) + weight * (float(score) - low) / spread
+    ordered = sorted(fused.items(), key=lambda item: item[1], reverse=True)
+    return (np.array([doc_id for doc_id, _ in ordered], dtype=np.int64),
+            np.array([score for _, score in ordered], dtype=np.float32))
+
+
+def synthetic_texts(n_docs: int, vocab_size: int = 50_000, doc_length: int = 300, seed: int = 0) -> List[str]:
+    """Zipf-distributed pseudo-documents, roughly matching the term skew of real chunks."""
+    rng = np.random.default_rng(seed)
+    words = [f"w{i}" for i in range(vocab_size)]
+    ids = np.minimum(rng.zipf(1.1, size=n_docs * doc_length), vocab_size) - 1
+    return [" ".join(words[j] for j in ids[i * doc_length:(i + 1) * doc_length]) for i in range(n_docs)]
+
+
+def benchmark(sizes: List[int], n_queries: int = 200, k: int = 10, dimension: int = 384) -> List[Dict]:
+    """Compare dense-only, BM25 (pruned and exhaustive) and hybrid query latency."""
+    import faiss
+    from index_factory import synthetic_corpus
+
+    results = []
+    for n_docs in sizes:
+        print(f"Building {n_docs}-chunk synthetic corpus...")
+        texts = synthetic_texts(n_docs)
+        lexical = LexicalIndex()
+        start = time.perf_counter()
+        lexical.add_documents(list(range(n_docs)), texts)
+        lexical.merge()
+        build_seconds = time.perf_counter() - start
+
+        dense = faiss.IndexFlatIP(dimension)
+        dense.add(synthetic_corpus(n_docs, dimension))
+        query_vectors = synthetic_corpus(n_queries, dimension, seed=1)
+        rng = np.random.default_rng(2)
+        queries = [" ".join(rng.choice(texts[int(rng.integers(n_docs))].split(), 4)) for _ in range(n_queries)]
+
+        timings = {'dense': [], 'bm25': [], 'bm25_exhaustive': [], 'hybrid': []}
+        mismatches = 0
+        for query, vector in zip(queries, query_vectors):
+            t0 = time.perf_counter()
+            _, dense_ids = dense.search(vector[None, :], k)
+            timings['dense'].append(time.perf_counter() - t0)
+
+            t0 = time.perf_counter()
+            _, scores = lexical.search(query, k)
+            timings['bm25'].append(time.perf_counter() - t0)
+
+            t0 = time.perf_counter()
+            _, exact_scores = lexical.search(query, k, prune=False)
+            timings['bm25_exhaustive'].append(time.perf_counter() - t0)
+            # Compare scores rather than IDs: equal-score ties may be broken differently
+            mismatches += not np.allclose(scores, exact_scores, rtol=1e-4)
+
+            t0 = time.perf_counter()
+            _, dense_ids = dense.search(vector[None, :], 4 * k)
+            lexical_ids, _ = lexical.search(query, 4 * k)
+            reciprocal_rank_fusion([dense_ids[0], lexical_ids])
+            timings['hybrid'].append(time.perf_counter() - t0)
+
+        row = {'chunks': n_docs, 'build_seconds': round(build_seconds, 2),
+               'postings': int(len(lexical.docs)), 'pruned_mismatches': mismatches}
+        for name, values in timings.items():
+            row[f'{name}_p50_ms'] = round(float(np.percentile(values, 50)) * 1000, 3)
+            row[f'{name}_p99_ms'] = round(float(np.percentile(values, 99)) * 1000, 3)
+        row['hybrid_over_dense'] = round(row['hybrid_p50_ms'] / row['dense_p50_ms'], 2)
+        results.append(row)
+        print(json.dumps(row))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="BM25 / hybrid retrieval latency benchmark")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--output", default="lexical_benchmark.json")
+    args = parser.parse_args()
+
+    rows = benchmark(args.sizes, args.queries, args.k)
+    with open(args.output, "w") as f:
+        json.dump(rows, f, indent=2)
+    print(f"Results written to {args.output}")
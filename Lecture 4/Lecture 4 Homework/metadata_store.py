@@ -0,0 +1,207 @@
+import bisect
+import sys
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+import numpy as np
+
+PAPER_FIELDS = ['title', 'authors', 'summary', 'pdf_url', 'published', 'arxiv_id']
+
+# Values that repeat across many papers are interned so each distinct string is stored once
+INTERNED_FIELDS = {'published'}
+
+
+class ChunkStore:
+    """Chunk text stored as packed UTF-8 segments, each one blob plus an offsets array.
+
+    The first segment may be memory-mapped from disk; every `extend` packs its batch
+    into a new in-memory segment, so each chunk costs its UTF-8 bytes plus one int64
+    offset instead of a Python str object. Strings are decoded on access. In-place
+    edits (used when papers are removed) are kept in a small overrides dict.
+    """
+
+    def __init__(self, blob: Optional[np.ndarray] = None, offsets: Optional[np.ndarray] = None):
+        self.segments: List[Tuple[np.ndarray, np.ndarray]] = []
+        self.starts: List[int] = [0]  # Index of the first chunk of each segment, plus the total
+        self.overrides: Dict[int, str] = {}
+        if offsets is not None:
+            self.add_segment(blob, offsets)
+
+    @staticmethod
+    def pack(texts: Iterable[str]) -> Tuple[np.ndarray, np.ndarray]:
+        encoded = [text.encode('utf-8') for text in texts]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(data) for data in encoded], out=offsets[1:])
+        return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+    @classmethod
+    def from_strings(cls, texts: Iterable[str]) -> 'ChunkStore':
+        return cls(*cls.pack(texts))
+
+    def add_segment(self, blob: np.ndarray, offsets: np.ndarray):
+        if len(offsets) > 1:
+            self.segments.append((blob, offsets))
+            self.starts.append(self.starts[-1] + len(offsets) - 1)
+
+    def __len__(self) -> int:
+        return self.starts[-1]
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        i = int(i)
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        if i in self.overrides:
+            return self.overrides[i]
+        segment = bisect.bisect_right(self.starts, i) - 1
+        blob, offsets = self.segments[segment]
+        j = i - self.starts[segment]
+        return blob[offsets[j]:offsets[j + 1]].tobytes().decode('utf-8')
+
+    def __setitem__(self, i: int, text: str):
+        self.overrides[int(i)] = text
+
+    def __iter__(self) -> Iterator[str]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def append(self, text: str):
+        self.extend([text])
+
+    def extend(self, texts: Iterable[str]):
+        self.add_segment(*self.pack(texts))
+
+    def nbytes(self) -> int:
+        return int(sum(blob.nbytes + offsets.nbytes for blob, offsets in self.segments))
+
+
+class PaperTable:
+    """Column-oriented paper metadata addressed by paper ID (row number).
+
+    Authors are stored as tuples of interned strings, so an author who appears on
+    many papers is kept once. Rows are never deleted: removed papers are flagged so
+    existing paper IDs stay valid. Indexing a row returns a fresh dict for
+    compatibility with code that expects paper dicts.
+    """
+
+    def __init__(self, papers: Optional[Iterable[Dict[str, Any]]] = None):
+        self.columns: Dict[str, list] = {field: [] for field in PAPER_FIELDS}
+        self.removed = bytearray()  # One byte per paper: 1 once removed
+        self.rows = 0
+        self.by_arxiv_id: Dict[str, int] = {}
+        if papers:
+            self.extend(papers)
+
+    def __len__(self) -> int:
+        return self.rows
+
+    def __getitem__(self, paper_id: int) -> Dict[str, Any]:
+        paper_id = int(paper_id)
+        if paper_id < 0:
+            paper_id += self.rows
+        paper = {field: values[paper_id] for field, values in self.columns.items()}
+        paper['authors'] = list(paper['authors'] or [])
+        if self.removed[paper_id]:
+            paper['removed'] = True
+        return paper
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        for paper_id in range(self.rows):
+            yield self[paper_id]
+
+    def value(self, paper_id: int, field: str):
+        """Read one field without building the whole row."""
+        return self.columns[field][int(paper_id)]
+
+    def append(self, paper: Dict[str, Any]) -> int:
+        paper_id = self.rows
+        for field in set(self.columns) | (set(paper) - {'removed'}):
+            if field not in self.columns:
+                # New optional field: back-fill earlier rows
+                self.columns[field] = [None] * self.rows
+            value = paper.get(field)
+            if field == 'authors':
+                value = tuple(sys.intern(name) for name in (value or []))
+            elif field in INTERNED_FIELDS and isinstance(value, str):
+                value = sys.intern(value)
+            self.columns[field].append(value)
+        self.removed.append(bool(paper.get('removed')))
+        self.rows += 1
+        if not paper.get('removed'):
+            self.by_arxiv_id[paper['arxiv_id']] = paper_id
+        return paper_id
+
+    def extend(self, papers: Iterable[Dict[str, Any]]):
+        for paper in papers:
+            self.append(paper)
+
+    def mark_removed(self, paper_id: int):
+        paper_id = int(paper_id)
+        self.removed[paper_id] = 1
+        arxiv_id = self.columns['arxiv_id'][paper_id]
+        if self.by_arxiv_id.get(arxiv_id) == paper_id:
+            del self.by_arxiv_id[arxiv_id]
+
+    def live_count(self) -> int:
+        return self.rows - sum(self.removed)
+
+    def metadata(self, paper_id: int) -> Dict[str, Any]:
+        """The fields returned to API clients for one paper."""
+        return {
+            'paper_id': int(paper_id),
+            'title': self.value(paper_id, 'title'),
+            'authors': list(self.value(paper_id, 'authors') or []),
+            'summary': self.value(paper_id, 'summary'),
+            'pdf_url': self.value(paper_id, 'pdf_url'),
+            'arxiv_id': self.value(paper_id, 'arxiv_id'),
+            'published': self.value(paper_id, 'published')
+        }
+
+    def to_columns(self) -> Dict[str, list]:
+        columns = {field: list(values) for field, values in self.columns.items()}
+        columns['authors'] = [list(authors or []) for authors in self.columns['authors']]
+        columns['removed'] = [bool(flag) for flag in self.removed]
+        return columns
+
+    @classmethod
+    def from_columns(cls, columns: Dict[str, list]) -> 'PaperTable':
+        table = cls()
+        rows = len(columns['arxiv_id'])
+        removed = columns.get('removed') or [False] * rows
+        for i in range(rows):
+            paper = {field: values[i] for field, values in columns.items() if field != 'removed'}
+            paper['removed'] = bool(removed[i])
+            table.append(paper)
+        return table
+
+
+def append_array(array: np.ndarray, values) -> np.ndarray:
+    """Append rows to a numpy array (one copy per call, so callers should batch)."""
+    values = np.asarray(values, dtype=array.dtype).reshape((-1,) + array.shape[1:])
+    return np.concatenate([array, values])
+
+
+def group_hits(hits: List[Dict], metadata: Callable[[Any], Dict[str, Any]], offset: int = 0,
+               limit: int = 10) -> Dict[str, Any]:
+    """Group ranked hits by paper (ordered by each paper's best hit) and return one page.
+
+    `metadata(paper_id)` is only called for the papers on the page. A hit's
+    `also_in` paper IDs are resolved to their ID, title and arXiv ID.
+    """
+    groups = {}
+    for hit in hits:
+        groups.setdefault(hit['paper_id'], []).append(
+            {key: value for key, value in hit.items() if key != 'paper_id'})
+    page = list(groups.items())[offset:offset + limit]
+    for _, paper_hits in page:
+        for hit in paper_hits:
+            if 'also_in' in hit:
+                hit['also_in'] = [{key: metadata(paper_id)[key] for key in ('paper_id', 'title', 'arxiv_id')}
+                                  for paper_id in hit['also_in']]
+    return {
+        'total': len(groups),
+        'offset': offset,
+        'limit': limit,
+        'papers': [{**metadata(paper_id), 'hits': paper_hits} for paper_id, paper_hits in page]
+    }
@@ -0,0 +1,242 @@
+import bisect
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# Latency buckets (seconds) for search stages and HTTP requests
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Build stages run for seconds to hours
+BUILD_BUCKETS = (0.1, 0.5, 1.0, 5.0, 15.0, 60.0, 300.0, 900.0, 3600.0, 14400.0)
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+# LLM prompt sizes (tokens) and answer latency (seconds, generation included)
+TOKEN_BUCKETS = (128, 256, 512, 1024, 2048, 3072, 4096, 6144, 8192, 16384, 32768)
+ANSWER_BUCKETS = (0.001, 0.005, 0.025, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(names: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """Monotonic counter with optional labels."""
+
+    kind = 'counter'
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values: Dict[Tuple, float] = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(labels.get(name, '') for name in self.labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+    def samples(self) -> List[str]:
+        with self.lock:
+            items = list(self.values.items())
+        return [f"{self.name}{format_labels(self.labels, key)} {value}" for key, value in items]
+
+
+class Histogram:
+    """Fixed-bucket histogram; `observe` is a bisect and a few additions under a lock."""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.series: Dict[Tuple, List] = {}  # label values -> [bucket counts..., sum, count]
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(name, '') for name in self.labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [0] * (len(self.buckets) + 2)
+            if i < len(self.buckets):
+                series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self) -> List[str]:
+        with self.lock:
+            items = [(key, list(series)) for key, series in self.series.items()]
+        lines = []
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                bucket = format_labels(self.labels, key, 'le="%s"' % bound)
+                lines.append(f"{self.name}_bucket{bucket} {cumulative}")
+            bucket = format_labels(self.labels, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{bucket} {series[-1]}")
+            lines.append(f"{self.name}_sum{format_labels(self.labels, key)} {series[-2]}")
+            lines.append(f"{self.name}_count{format_labels(self.labels, key)} {series[-1]}")
+        return lines
+
+
+class Collected:
+    """A gauge or counter whose samples are computed at scrape time by `collect()`.
+
+    `collect` returns [(labels dict, value), ...]; nothing is tracked between scrapes,
+    so sizes and cache counters owned by other objects cost nothing until /metrics is read.
+    """
+
+    def __init__(self, name: str, help: str, collect: Callable[[], List[Tuple[Dict[str, str], float]]],
+                 kind: str = 'gauge'):
+        self.name = name
+        self.help = help
+        self.collect = collect
+        self.kind = kind
+
+    def samples(self) -> List[str]:
+        lines = []
+        for labels, value in self.collect():
+            if value is not None:
+                lines.append(f"{self.name}{format_labels(tuple(labels), tuple(labels.values()))} {value}")
+        return lines
+
+
+class Registry:
+    """The metrics exposed at /metrics, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self.metrics: Dict[str, object] = {}
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        with self.lock:
+            self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labels: Iterable[str] = ()) -> Counter:
+        return self.register(Counter(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: Iterable[str] = (),
+                  buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def collected(self, name: str, help: str, collect: Callable, kind: str = 'gauge') -> Collected:
+        return self.register(Collected(name, help, collect, kind))
+
+    def render(self) -> str:
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            try:
+                samples = metric.samples()
+            except Exception as e:
+                # A failing collector must not take the whole endpoint down
+                lines.append(f"# {metric.name} collection failed: {e}")
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+SEARCH_STAGE_SECONDS = REGISTRY.histogram(
+    'rag_search_stage_seconds', 'Time per search stage (encode, filter, faiss, lexical, fusion, hydrate, rerank, merge)',
+    ['stage'])
+SEARCH_QUEUE_SECONDS = REGISTRY.histogram('rag_search_queue_seconds', 'Time a query waited for its batch')
+SEARCH_BATCH_SIZE = REGISTRY.histogram('rag_search_batch_size', 'Queries per search batch', buckets=BATCH_BUCKETS)
+HTTP_REQUEST_SECONDS = REGISTRY.histogram('rag_http_request_seconds', 'HTTP request latency', ['method', 'path'])
+HTTP_REQUESTS = REGISTRY.counter('rag_http_requests_total', 'HTTP requests', ['method', 'path', 'status'])
+BUILD_STAGE_SECONDS = REGISTRY.histogram('rag_build_stage_seconds', 'Time per build stage', ['job', 'stage'],
+                                         buckets=BUILD_BUCKETS)
+BUILDS = REGISTRY.counter('rag_builds_total', 'Finished builds', ['job', 'state'])
+RESULT_CACHE_REQUESTS = REGISTRY.counter('rag_result_cache_requests_total',
+                                         'Searches served by the result cache per level (exact, semantic) or missed',
+                                         ['level'])
+SEARCH_STREAM_SECONDS = REGISTRY.histogram('rag_search_stream_seconds',
+                                           'Streamed /search: time to the first byte, the first result and the end',
+                                           ['milestone'])
+RESULT_CACHE_SAVED_SECONDS = REGISTRY.counter('rag_result_cache_saved_seconds_total',
+                                              'Search time saved by result cache hits (as measured when cached)',
+                                              ['level'])
+ANSWER_PROMPT_TOKENS = REGISTRY.histogram('rag_answer_prompt_tokens', 'Prompt tokens per generated answer',
+                                          buckets=TOKEN_BUCKETS)
+ANSWER_SECONDS = REGISTRY.histogram('rag_answer_seconds', 'Answer generation time per stage (pack, generate, total)',
+                                    ['stage'], buckets=ANSWER_BUCKETS)
+
+
+class Trace:
+    """Per-batch stage timings, shared by every request in the batch."""
+
+    def __init__(self):
+        self.seconds: Dict[str, float] = {}
+        self.lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float):
+        with self.lock:
+            self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+
+    def snapshot(self) -> Dict[str, float]:
+        with self.lock:
+            return dict(self.seconds)
+
+
+current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar('current_trace', default=None)
+
+
+@contextmanager
+def stage(name: str):
+    """Time a search stage into the stage histogram and the current trace, if any.
+
+    Stages that run in parallel (e.g. one per shard) add up in the trace.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        SEARCH_STAGE_SECONDS.observe(seconds, stage=name)
+        trace = current_trace.get()
+        if trace is not None:
+            trace.add(name, seconds)
+
+
+def server_timing(timings: Dict[str, float]) -> str:
+    """Format stage seconds as a Server-Timing header value (milliseconds)."""
+    return ", ".join(f"{name};dur={seconds * 1000:.2f}" for name, seconds in timings.items())
+
+
+def hit_ratio(hits: int, misses: int) -> Optional[float]:
+    return hits / (hits + misses) if hits + misses else None
+
+
+def resident_memory_bytes() -> Optional[int]:
+    """Current resident set size of this process (Linux), or None where unavailable."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
@@ -0,0 +1,138 @@
+import argparse
+import json
+import time
+from typing import Dict, List, Optional
+import numpy as np
+
+
+def paper_text(papers, paper_id: int) -> str:
+    """The text a paper is embedded by for coarse retrieval: its title and abstract."""
+    title = papers.value(paper_id, 'title') or ''
+    summary = papers.value(paper_id, 'summary') or ''
+    return f"{title}. {' '.join(summary.split())}" if summary else title
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.array(vectors, dtype=np.float32, ndmin=2)
+    vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    return vectors
+
+
+def select_papers(paper_vectors: np.ndarray, query_embeddings: np.ndarray, top_papers: int,
+                  allowed: Optional[np.ndarray] = None) -> List[np.ndarray]:
+    """The sorted IDs of each query's `top_papers` most similar papers (cosine over unit `paper_vectors`).
+
+    Papers where `allowed` is False (removed, unindexed or filtered out) are never
+    selected, so a query may get fewer than `top_papers` papers. Papers past the
+    end of `allowed` (e.g. added after the mask was built) count as not allowed.
+    """
+    scores = normalize_rows(query_embeddings) @ np.asarray(paper_vectors, dtype=np.float32).T
+    if allowed is not None:
+        mask = np.zeros(scores.shape[1], dtype=bool)
+        mask[:min(len(allowed), len(mask))] = allowed[:len(mask)]
+        scores[:, ~mask] = -np.inf
+    selected = []
+    for row in scores:
+        top = np.argpartition(-row, top_papers - 1)[:top_papers] if len(row) > top_papers else np.arange(len(row))
+        selected.append(np.sort(top[np.isfinite(row[top])]))
+    return selected
+
+
+def synthetic_papers_with_chunks(n_papers: int, chunks_per_paper: int, dimension: int = 384, seed: int = 0):
+    """Paper (abstract) vectors and chunk vectors scattered around them, both unit-normalized.
+
+    Papers are drawn from the clustered `synthetic_corpus`, so neighbouring papers
+    share topics, and an abstract sits closer to its paper's topic than any one chunk.
+    """
+    from index_factory import synthetic_corpus
+
+    topics = synthetic_corpus(n_papers, dimension, seed=seed)
+    rng = np.random.default_rng(seed + 1)
+    abstracts = normalize_rows(topics + 0.02 * rng.standard_normal(topics.shape, dtype=np.float32))
+    chunks = np.repeat(topics, chunks_per_paper, axis=0)
+    chunks += 0.04 * rng.standard_normal(chunks.shape, dtype=np.float32)
+    return abstracts, normalize_rows(chunks)
+
+
+def benchmark(corpus_sizes: List[int] = (1000, 3000, 10000), chunks_per_paper: int = 20,
+              paper_counts: List[int] = (5, 20, 50), n_queries: int = 200, k: int = 10,
+              dimension: int = 384) -> List[Dict]:
+    """Recall and latency of two-tier (paper -> chunk) search against flat chunk search as the corpus grows.
+
+    Flat search scans every chunk vector with a FAISS flat index. Two-tier search
+    scores the abstracts, keeps the top P papers and scans only their chunks, the
+    way `ArxivRAGSystem.search_embeddings(top_papers=P)` does below
+    `exact_filter_limit` chunks. Queries are perturbed chunk vectors; recall@k is
+    against the exact top-k over all chunks. `coarse_ms` is the abstract scoring,
+    linear in the number of papers; `fine_ms` is the chunk search, linear in P.
+    """
+    from filter_index import FilterIndex, synthetic_papers
+    from index_factory import build_index, resolve_params
+    from metadata_store import PaperTable
+
+    results = []
+    for n_papers in corpus_sizes:
+        abstracts, vectors = synthetic_papers_with_chunks(n_papers, chunks_per_paper, dimension)
+        chunk_to_paper = np.repeat(np.arange(n_papers, dtype=np.int32), chunks_per_paper)
+        n_chunks = len(vectors)
+        filter_index = FilterIndex(PaperTable(synthetic_papers(n_papers)), chunk_to_paper,
+                                   np.arange(n_chunks, dtype=np.int64))
+        index = build_index('flat_ip', vectors, params=resolve_params({}))
+        rng = np.random.default_rng(2)
+        queries = normalize_rows(vectors[rng.integers(0, n_chunks, n_queries)]
+                                 + 0.05 * rng.standard_normal((n_queries, dimension), dtype=np.float32))
+
+        flat = []
+        truth = []
+        for query in queries:
+            t0 = time.perf_counter()
+            _, ids = index.search(query[None, :], k)
+            flat.append(time.perf_counter() - t0)
+            truth.append(set(ids[0].tolist()))
+        row = {'papers': n_papers, 'chunks': n_chunks, 'method': 'flat',
+               'p50_ms': round(float(np.percentile(flat, 50)) * 1000, 3), f'recall@{k}': 1.0}
+        results.append(row)
+        print(json.dumps(row))
+
+        for top_papers in paper_counts:
+            coarse, fine, recall = [], [], []
+            for query, expected in zip(queries, truth):
+                t0 = time.perf_counter()
+                papers = select_papers(abstracts, query[None, :], top_papers)[0]
+                t1 = time.perf_counter()
+                ids = filter_index.chunks_of(papers)
+                scores = vectors[ids] @ query
+                top = np.argpartition(-scores, k - 1)[:k] if len(scores) > k else np.arange(len(scores))
+                found = ids[top[np.argsort(-scores[top])]]
+                t2 = time.perf_counter()
+                coarse.append(t1 - t0)
+                fine.append(t2 - t1)
+                recall.append(len(expected & set(found.tolist())) / k)
+            total = np.add(coarse, fine)
+            row = {'papers': n_papers, 'chunks': n_chunks, 'method': f'two_tier_p{top_papers}',
+                   'scanned_chunks': top_papers * chunks_per_paper,
+                   'p50_ms': round(float(np.percentile(total, 50)) * 1000, 3),
+                   'coarse_ms': round(float(np.percentile(coarse, 50)) * 1000, 3),
+                   'fine_ms': round(float(np.percentile(fine, 50)) * 1000, 3),
+                   f'recall@{k}': round(float(np.mean(recall)), 4)}
+            results.append(row)
+            print(json.dumps(row))
+        del index
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Two-tier paper -> chunk search vs flat chunk search")
+    parser.add_argument("--papers", type=int, nargs="+", default=[1000, 3000, 10000])
+    parser.add_argument("--chunks-per-paper", type=int, default=20)
+    parser.add_argument("--top-papers", type=int, nargs="+", default=[5, 20, 50])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--dimension", type=int, default=384)
+    parser.add_argument("--output", default="paper_index_benchmark.json")
+    args = parser.parse_args()
+
+    rows = benchmark(args.papers, args.chunks_per_paper, args.top_papers, args.queries, args.k, args.dimension)
+    with open(args.output, "w") as f:
+        json.dump(rows, f, indent=2)
+    print(f"Results written to {args.output}")
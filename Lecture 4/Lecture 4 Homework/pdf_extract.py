@@ -0,0 +1,65 @@
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple, Union
+import numpy as np
+
+
+def extract_pages(pdf: Union[bytes, str]) -> List[str]:
+    """Text of every page of a PDF given as bytes (opened from memory) or as a file path."""
+    import fitz  # PyMuPDF, imported on first extraction
+    if isinstance(pdf, (bytes, bytearray, memoryview)):
+        doc = fitz.open(stream=pdf, filetype="pdf")
+    else:
+        doc = fitz.open(pdf)
+    with doc:
+        return [page.get_text().replace('\x00', '') for page in doc]
+
+
+def join_pages(pages: List[str]) -> Tuple[str, np.ndarray]:
+    """Concatenate page texts; also return each page's first character offset, plus the total length."""
+    page_starts = np.zeros(len(pages) + 1, dtype=np.int64)
+    np.cumsum([len(page) for page in pages], out=page_starts[1:])
+    return "".join(pages), page_starts
+
+
+def span_pages(spans, page_starts: np.ndarray) -> np.ndarray:
+    """(first, last) zero-based page of each (start, end) character span."""
+    spans = np.asarray(spans, dtype=np.int64).reshape(-1, 2)
+    last_page = max(len(page_starts) - 2, 0)
+    first = np.searchsorted(page_starts, spans[:, 0], side='right') - 1
+    last = np.searchsorted(page_starts, np.maximum(spans[:, 1] - 1, spans[:, 0]), side='right') - 1
+    return np.clip(np.stack([first, last], axis=1), 0, last_page).astype(np.int32)
+
+
+class PageExtractor:
+    """Run `extract_pages` in the calling thread or on a pool of `processes` workers.
+
+    PyMuPDF holds the GIL while it parses, so with many extract threads the pool
+    lets page extraction use more than one core. The PDF bytes are sent to the
+    worker and only the page texts come back; nothing touches the disk.
+    """
+
+    def __init__(self, processes: int = 0):
+        self.processes = processes
+        self.pool: Optional[ProcessPoolExecutor] = None
+        # Extract threads start the pool on first use; only one of them may create it
+        self.lock = threading.Lock()
+
+    def start_pool(self) -> ProcessPoolExecutor:
+        with self.lock:
+            if self.pool is None:
+                # Spawn rather than fork: the parent runs download and FAISS threads
+                self.pool = ProcessPoolExecutor(self.processes, mp_context=multiprocessing.get_context('spawn'))
+            return self.pool
+
+    def extract(self, pdf: Union[bytes, str]) -> List[str]:
+        if self.processes <= 0:
+            return extract_pages(pdf)
+        return self.start_pool().submit(extract_pages, pdf).result()
+
+    def close(self):
+        with self.lock:
+            pool, self.pool = self.pool, None
+        if pool is not None:
+            pool.shutdown()
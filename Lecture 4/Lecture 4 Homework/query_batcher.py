@@ -0,0 +1,246 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import numpy as np
+from metrics import SEARCH_BATCH_SIZE, SEARCH_QUEUE_SECONDS, Trace, current_trace, stage
+from result_cache import ResultCache
+
+
+class LRUCache:
+    """Small thread-safe LRU map used for query embeddings."""
+
+    def __init__(self, max_size: int = 1024):
+        self.max_size = max_size
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            if key in self.data:
+                self.data.move_to_end(key)
+                self.hits += 1
+                return self.data[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        if self.max_size <= 0:
+            return
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            while len(self.data) > self.max_size:
+                self.data.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+
+class QueryBatcher:
+    """Coalesce concurrent /search requests into batched encode + FAISS calls.
+
+    Requests wait on an asyncio queue for at most `max_wait_ms` (or until
+    `max_batch_size` queries are collected); the batch is then encoded with one
+    `model.encode` call and searched with one `faiss_index.search` call on a
+    bounded thread pool, so the event loop stays free for other routes. While all
+    `max_workers` threads are busy the queue keeps filling, so batches grow with
+    load. `get_system` is called per batch, so a swapped-in system is picked up
+    automatically. With a `result_cache`, repeated queries are answered before
+    queueing and paraphrases right after encoding (see result_cache.py).
+    """
+
+    def __init__(self, get_system: Callable[[], Any], max_batch_size: int = 32,
+                 max_wait_ms: float = 2.0, max_workers: int = 2, cache_size: int = 1024,
+                 result_cache: Optional[ResultCache] = None):
+        self.get_system = get_system
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(max_workers, thread_name_prefix="search")
+        self.embedding_cache = LRUCache(cache_size)
+        self.result_cache = result_cache
+        self.queue: Optional[asyncio.Queue] = None
+        self.worker: Optional[asyncio.Task] = None
+        self.slots: Optional[asyncio.Semaphore] = None
+        self.batches = 0
+        self.queries = 0
+
+    def start(self):
+        """Start the collector task on the running event loop (done lazily on first use)."""
+        if self.worker is None or self.worker.done():
+            self.queue = asyncio.Queue()
+            self.slots = asyncio.Semaphore(self.max_workers)
+            self.worker = asyncio.get_running_loop().create_task(self.collect())
+
+    async def search(self, query: str, top_k: int = 5, mode: str = "dense", rerank: bool = False,
+                     shards: Optional[Tuple[str, ...]] = None, filters: Optional[Tuple] = None,
+                     top_papers: int = 0) -> List[Dict]:
+        """Queue a query and wait for its results."""
+        _, hits = await self.search_with_system(query, top_k, mode, rerank, shards, filters, top_papers)
+        return hits
+
+    async def search_with_system(self, query: str, top_k: int = 5, mode: str = "dense", rerank: bool = False,
+                                 shards: Optional[Tuple[str, ...]] = None,
+                                 filters: Optional[Tuple] = None, top_papers: int = 0) -> Tuple[Any, List[Dict]]:
+        """Like `search`, but also return the system that answered, so chunk and paper IDs
+        in the hits can be resolved against the same index even if it is swapped meanwhile."""
+        system, hits, _ = await self.search_traced(query, top_k, mode, rerank, shards, filters, top_papers)
+        return system, hits
+
+    async def search_traced(self, query: str, top_k: int = 5, mode: str = "dense", rerank: bool = False,
+                            shards: Optional[Tuple[str, ...]] = None,
+                            filters: Optional[Tuple] = None,
+                            top_papers: int = 0) -> Tuple[Any, List[Dict], Dict[str, float]]:
+        """Like `search_with_system`, plus the seconds spent per stage (queue wait, then the
+        stages of the batch this query ran in) and the batch size. `filters` are normalized
+        search filters (see filter_index.py); queries with different filters never share a search.
+        `top_papers` > 0 makes the search two-tier (paper abstracts first, then their chunks)."""
+        context = (mode, rerank, shards, filters, top_papers or 0)
+        if self.result_cache is not None:
+            start = time.perf_counter()
+            system = self.get_system()
+            hits = self.result_cache.get(query, context, top_k, system)
+            if hits is not None:
+                return system, hits, {'result_cache': time.perf_counter() - start}
+        self.start()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        await self.queue.put((query, top_k, context, future, loop.time()))
+        return await future
+
+    async def collect(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                # Take whatever is already queued, then wait out the rest of the window
+                if not self.queue.empty():
+                    batch.append(self.queue.get_nowait())
+                    continue
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            # Bound in-flight batches; while we wait here, new queries keep queueing
+            await self.slots.acquire()
+            loop.create_task(self.dispatch(batch))
+
+    async def dispatch(self, batch):
+        try:
+            queries = [query for query, _, _, _, _ in batch]
+            modes = [mode for _, _, mode, _, _ in batch]
+            top_k = max(k for _, k, _, _, _ in batch)
+            loop = asyncio.get_running_loop()
+            started = loop.time()
+            system = self.get_system()
+            trace = Trace()
+            results = await loop.run_in_executor(self.executor, self.search_batch, queries, top_k, modes, system,
+                                                 trace)
+            timings = {**trace.snapshot(), 'batch_size': len(batch)}
+            for (_, k, _, future, queued_at), hits in zip(batch, results):
+                SEARCH_QUEUE_SECONDS.observe(started - queued_at)
+                if not future.done():
+                    future.set_result((system, hits[:k], {'queue': started - queued_at, **timings}))
+        except Exception as e:
+            for _, _, _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            self.slots.release()
+
+    def search_batch(self, queries: List[str], top_k: int, modes: Optional[List] = None,
+                     system: Any = None, trace: Optional[Trace] = None) -> List[List[Dict]]:
+        """Encode (with the embedding cache) and search a batch; runs on the thread pool.
+
+        Each entry of `modes` is a search mode or a (mode, rerank[, shards[, filters[, top_papers]]]) tuple;
+        `shards` is only passed on to sharded systems. Stage timings go to `trace`.
+        """
+        token = current_trace.set(trace)
+        try:
+            return self.run_batch(queries, top_k, modes, system)
+        finally:
+            current_trace.reset(token)
+
+    def run_batch(self, queries: List[str], top_k: int, modes: Optional[List], system: Any) -> List[List[Dict]]:
+        system = system or self.get_system()
+        SEARCH_BATCH_SIZE.observe(len(queries))
+        modes = [(mode + (None, None, 0))[:5] if isinstance(mode, tuple) else (mode, False, None, None, 0)
+                 for mode in modes or ["dense"] * len(queries)]
+        unique = list(dict.fromkeys(queries))
+        vectors = {}
+        misses = []
+        for query in unique:
+            vector = self.embedding_cache.get(query)
+            if vector is None:
+                misses.append(query)
+            else:
+                vectors[query] = vector
+        if misses:
+            with stage('encode'):
+                encoded = system.encode_queries(misses)
+            for query, vector in zip(misses, encoded):
+                self.embedding_cache.put(query, vector)
+                vectors[query] = vector
+
+        # One FAISS call (and one reranker pass) per search mode, shard selection and filter present in the batch
+        cache = self.result_cache
+        if cache is not None:
+            cache.use(system)
+        results = {}
+        for mode in dict.fromkeys(modes):
+            mode_queries = list(dict.fromkeys(q for q, m in zip(queries, modes) if m == mode))
+            if cache is not None:
+                pending = []
+                with stage('result_cache'):
+                    for query in mode_queries:
+                        # BM25 results hinge on the exact terms, so lexical queries only match exactly
+                        hits = cache.get_similar(vectors[query], mode, top_k, system) if mode[0] != "lexical" \
+                            else cache.record_miss()
+                        if hits is None:
+                            pending.append(query)
+                        else:
+                            results[(query, mode)] = hits
+                mode_queries = pending
+            if not mode_queries:
+                continue
+            options = {'shards': mode[2]} if mode[2] else {}
+            if mode[3]:
+                options['filters'] = mode[3]
+            if mode[4]:
+                options['top_papers'] = mode[4]
+            start = time.perf_counter()
+            hits = system.search_embeddings(np.stack([vectors[q] for q in mode_queries]), top_k,
+                                            queries=mode_queries, mode=mode[0], rerank=mode[1], **options)
+            cost = (time.perf_counter() - start) / len(mode_queries)
+            for query, query_hits in zip(mode_queries, hits):
+                results[(query, mode)] = query_hits
+                if cache is not None:
+                    cache.put(query, mode, top_k, query_hits, cost, system, vectors[query])
+        self.batches += 1
+        self.queries += len(queries)
+        return [results[(query, mode)] for query, mode in zip(queries, modes)]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'batches': self.batches,
+            'queries': self.queries,
+            'avg_batch_size': self.queries / self.batches if self.batches else 0.0,
+            'embedding_cache_size': len(self.embedding_cache),
+            'embedding_cache_hits': self.embedding_cache.hits,
+            'embedding_cache_misses': self.embedding_cache.misses,
+            'result_cache': self.result_cache.stats() if self.result_cache is not None else None
+        }
@@ -0,0 +1,188 @@
+import argparse
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+import numpy as np
+from embedding_cache import content_hash
+from query_batcher import LRUCache
+
+DEFAULT_RERANK_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+
+
+class Reranker:
+    """Second-stage cross-encoder reranking with a score cache and a latency budget.
+
+    All (query, chunk) pairs of a batch of queries are scored in one batched forward
+    pass. Scores are cached per (query, chunk text), so a repeated query costs
+    nothing. The per-pair cost is tracked as a moving average; when a batch would
+    exceed `budget_ms`, each query's candidate list is truncated so the uncached
+    pairs fit, which is what happens when the CPU is busy and every pair gets slower.
+    Candidates beyond the reranked prefix keep their first-stage order.
+    """
+
+    def __init__(self, model_name: str = DEFAULT_RERANK_MODEL, depth: int = 20, budget_ms: float = 100.0,
+                 cache_size: int = 10000, batch_size: int = 64, min_depth: int = 5):
+        self.model_name = model_name
+        from sentence_transformers import CrossEncoder
+        self.model = CrossEncoder(model_name)
+        self.depth = depth
+        self.budget_ms = budget_ms
+        self.min_depth = min_depth
+        self.batch_size = batch_size
+        self.cache = LRUCache(cache_size)
+        self.pair_ms = 1.0  # Moving average of the cost of one uncached pair
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.pairs_scored = 0
+        self.truncated = 0
+        self.added_ms_total = 0.0
+
+    def plan_depth(self, n_queries: int, budget_ms: Optional[float]) -> int:
+        """Candidates per query whose uncached pairs fit in the budget (never below `min_depth`)."""
+        if budget_ms is None:
+            return self.depth
+        affordable = int(budget_ms / max(self.pair_ms, 1e-3) / max(n_queries, 1))
+        return max(self.min_depth, min(self.depth, affordable))
+
+    def rerank_batch(self, queries: List[str], hit_lists: List[List[Dict]],
+                     budget_ms: Optional[float] = None) -> List[List[Dict]]:
+        """Rerank each query's hits; hits gain a `rerank_score` and are re-ranked in place."""
+        start = time.perf_counter()
+        budget_ms = self.budget_ms if budget_ms is None else budget_ms
+        depth = self.plan_depth(len(queries), budget_ms)
+
+        keys, pairs, scores, missing = [], [], [], []
+        for query, hits in zip(queries, hit_lists):
+            for hit in hits[:depth]:
+                key = (query, content_hash(hit['chunk'], self.model_name))
+                score = self.cache.get(key)
+                if score is None:
+                    missing.append(len(pairs))
+                    score = 0.0
+                keys.append(key)
+                pairs.append((query, hit['chunk']))
+                scores.append(score)
+        scores = np.array(scores, dtype='float32')
+        if missing:
+            t0 = time.perf_counter()
+            fresh = self.model.predict([pairs[i] for i in missing], batch_size=self.batch_size,
+                                       show_progress_bar=False)
+            seconds = time.perf_counter() - t0
+            for i, score in zip(missing, fresh):
+                scores[i] = float(score)
+                self.cache.put(keys[i], float(score))
+            with self.lock:
+                self.pair_ms = 0.8 * self.pair_ms + 0.2 * (seconds * 1000 / len(missing))
+
+        results = []
+        position = 0
+        for hits in hit_lists:
+            head, tail = hits[:depth], hits[depth:]
+            for hit in head:
+                hit['rerank_score'] = float(scores[position])
+                position += 1
+            head = sorted(head, key=lambda hit: -hit['rerank_score'])
+            reranked = head + tail
+            for rank, hit in enumerate(reranked, 1):
+                hit['rank'] = rank
+            results.append(reranked)
+
+        added_ms = (time.perf_counter() - start) * 1000
+        with self.lock:
+            self.calls += 1
+            self.pairs_scored += len(missing)
+            self.truncated += depth < self.depth
+            self.added_ms_total += added_ms
+        return results
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'model': self.model_name,
+            'depth': self.depth,
+            'budget_ms': self.budget_ms,
+            'calls': self.calls,
+            'pairs_scored': self.pairs_scored,
+            'cache_hits': self.cache.hits,
+            'truncated_batches': self.truncated,
+            'pair_ms': round(self.pair_ms, 3),
+            'avg_added_ms': round(self.added_ms_total / self.calls, 2) if self.calls else 0.0
+        }
+
+
+def title_fixture(system, n_queries: int = 50, seed: int = 0) -> List[Dict]:
+    """Known-item queries: a paper's title, with that paper as the only relevant result."""
+    papers = [system.papers[i] for i in range(len(system.papers)) if not system.papers.removed[i]]
+    rng = np.random.default_rng(seed)
+    picked = rng.choice(len(papers), min(n_queries, len(papers)), replace=False)
+    return [{'query': papers[i]['title'], 'relevant': [papers[i]['arxiv_id']]} for i in picked]
+
+
+def evaluate(system, fixture: List[Dict], k: int = 10, mode: str = "dense", rerank: bool = False) -> Dict[str, Any]:
+    """Paper-level recall@k and MRR@k of `system.search` on a labelled fixture.
+
+    Each fixture entry is {"query": ..., "relevant": [arxiv_id, ...]}.
+    """
+    hits_at_k, reciprocal_ranks, latencies = [], [], []
+    for item in fixture:
+        start = time.perf_counter()
+        hits = system.search(item['query'], k, mode=mode, rerank=rerank)
+        latencies.append(time.perf_counter() - start)
+        relevant = set(item['relevant'])
+        ranks = [rank for rank, hit in enumerate(hits, 1)
+                 if system.papers.value(hit['paper_id'], 'arxiv_id') in relevant]
+        hits_at_k.append(1.0 if ranks else 0.0)
+        reciprocal_ranks.append(1.0 / ranks[0] if ranks else 0.0)
+    return {
+        'mode': mode,
+        'rerank': rerank,
+        f'recall@{k}': round(float(np.mean(hits_at_k)), 4),
+        f'mrr@{k}': round(float(np.mean(reciprocal_ranks)), 4),
+        'latency_p50_ms': round(float(np.percentile(latencies, 50)) * 1000, 2),
+        'latency_p99_ms': round(float(np.percentile(latencies, 99)) * 1000, 2)
+    }
+
+
+if __name__ == "__main__":
+    from benchmark import load_app_module
+
+    parser = argparse.ArgumentParser(description="Recall/MRR and added latency of cross-encoder reranking")
+    parser.add_argument("--index", default="rag_index", help="Saved index directory")
+    parser.add_argument("--fixture", default="rerank_fixture.json",
+                        help="Labelled queries (created from paper titles if the file does not exist)")
+    parser.add_argument("--model", default=DEFAULT_RERANK_MODEL)
+    parser.add_argument("--depth", type=int, default=20)
+    parser.add_argument("--budget-ms", type=float, default=100.0)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--output", default="rerank_benchmark.json")
+    args = parser.parse_args()
+
+    app = load_app_module()
+    system = app.ArxivRAGSystem(cache_path=None)
+    if not system.load_system(args.index):
+        raise SystemExit(f"No index at {args.index}; initialize the system first")
+    system.reranker = Reranker(args.model, depth=args.depth, budget_ms=args.budget_ms)
+
+    if os.path.exists(args.fixture):
+        with open(args.fixture, encoding="utf-8") as f:
+            fixture = json.load(f)
+    else:
+        fixture = title_fixture(system)
+        with open(args.fixture, "w", encoding="utf-8") as f:
+            json.dump(fixture, f, indent=2, ensure_ascii=False)
+        print(f"Wrote {len(fixture)} title queries to {args.fixture}")
+
+    rows = []
+    for mode in ("dense", "hybrid"):
+        for rerank in (False, True):
+            row = evaluate(system, fixture, args.k, mode, rerank)
+            rows.append(row)
+            print(f"{mode:<7} rerank={str(rerank):<5} recall@{args.k}={row[f'recall@{args.k}']:.3f} "
+                  f"MRR@{args.k}={row[f'mrr@{args.k}']:.3f} p50={row['latency_p50_ms']:.1f}ms")
+        base, reranked = rows[-2], rows[-1]
+        print(f"{mode}: rerank adds {reranked['latency_p50_ms'] - base['latency_p50_ms']:.1f}ms p50, "
+              f"MRR {reranked[f'mrr@{args.k}'] - base[f'mrr@{args.k}']:+.3f}")
+    with open(args.output, "w") as f:
+        json.dump({'rows': rows, 'reranker': system.reranker.stats()}, f, indent=2)
+    print(f"Results written to {args.output}")
@@ -0,0 +1,188 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+import numpy as np
+from metrics import RESULT_CACHE_REQUESTS, RESULT_CACHE_SAVED_SECONDS
+
+# Characters trimmed from both ends of a query before exact matching
+TRIM = " \t\n?!.,;:\"'"
+
+
+def normalize_query(query: str) -> str:
+    """Case-fold, collapse whitespace and trim punctuation so trivial variants share a cache entry."""
+    return " ".join(query.lower().split()).strip(TRIM)
+
+
+class ResultCache:
+    """Two-level cache of search results, bounded in size and age.
+
+    Level one matches the normalized query text exactly and is checked before a
+    query is even queued. Level two keeps the (unit-normalized) embeddings of the
+    cached queries in a fixed-size matrix and serves a cached result when a new
+    query's embedding has cosine similarity >= `threshold` with one of them; it
+    runs after encoding and saves the index search, fusion and reranking. A
+    cached result only serves requests for the same context (mode, rerank, shard
+    selection, filters, paper tier) and at most the `top_k` it was computed for.
+    Hits are copied on the way in and out, so callers may annotate theirs.
+
+    Entries are LRU-evicted beyond `max_size` entries or `max_hits` cached hits
+    in total, and expire after `ttl` seconds. Every entry belongs to the system
+    that produced it: when a different system is passed in (a rebuild or update
+    was swapped in), the whole cache is dropped.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = 300.0, threshold: float = 0.95, max_hits: int = 20000):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.threshold = threshold
+        self.max_hits = max_hits
+        self.lock = threading.Lock()
+        self.entries: OrderedDict = OrderedDict()  # (normalized query, context) -> entry dict
+        self.vectors: Optional[np.ndarray] = None  # One row per slot, allocated on the first put
+        self.slot_keys: List[Optional[Tuple[str, Hashable]]] = [None] * max_size
+        self.free_slots = list(range(max_size - 1, -1, -1))
+        self.system = None
+        self.cached_hits = 0
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+        self.invalidations = 0
+
+    @property
+    def hits(self) -> int:
+        return self.exact_hits + self.semantic_hits
+
+    def bind(self, system: Any):
+        """Drop every entry if `system` is not the one the entries came from (lock held)."""
+        if system is not self.system:
+            if self.entries:
+                self.invalidations += 1
+            self.entries.clear()
+            self.slot_keys = [None] * self.max_size
+            self.free_slots = list(range(self.max_size - 1, -1, -1))
+            self.cached_hits = 0
+            self.system = system
+
+    def use(self, system: Any):
+        """Make `system` the one being served, dropping the entries of any other."""
+        with self.lock:
+            self.bind(system)
+
+    def clear(self):
+        self.use(None)
+
+    def evict(self, key):
+        entry = self.entries.pop(key)
+        self.cached_hits -= len(entry['hits'])
+        if entry['slot'] is not None:
+            self.slot_keys[entry['slot']] = None
+            self.free_slots.append(entry['slot'])
+
+    def lookup(self, key, top_k: int, now: float) -> Optional[Dict[str, Any]]:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if now - entry['created'] > self.ttl:
+            self.evict(key)
+            return None
+        if entry['top_k'] < top_k:
+            return None
+        self.entries.move_to_end(key)
+        return entry
+
+    def serve(self, entry: Dict[str, Any], level: str, top_k: int) -> List[Dict]:
+        if level == 'exact':
+            self.exact_hits += 1
+        else:
+            self.semantic_hits += 1
+        self.saved_seconds += entry['cost']
+        RESULT_CACHE_REQUESTS.inc(level=level)
+        RESULT_CACHE_SAVED_SECONDS.inc(entry['cost'], level=level)
+        # Copies, so a caller annotating its hits can't change the cached ones
+        return [dict(hit) for hit in entry['hits'][:top_k]]
+
+    def get(self, query: str, context: Hashable, top_k: int, system: Any) -> Optional[List[Dict]]:
+        """Level one: cached hits for exactly this (normalized) query, or None."""
+        with self.lock:
+            self.bind(system)
+            entry = self.lookup((normalize_query(query), context), top_k, time.monotonic())
+            return self.serve(entry, 'exact', top_k) if entry else None
+
+    def get_similar(self, vector: np.ndarray, context: Hashable, top_k: int, system: Any) -> Optional[List[Dict]]:
+        """Level two: cached hits of the most similar cached query above the threshold, or None (a miss)."""
+        vector = np.asarray(vector, dtype=np.float32)
+        vector = vector / max(float(np.linalg.norm(vector)), 1e-12)
+        with self.lock:
+            self.bind(system)
+            if self.vectors is not None and self.entries:
+                now = time.monotonic()
+                similarities = self.vectors @ vector
+                for slot in np.argsort(-similarities):
+                    if similarities[slot] < self.threshold:
+                        break
+                    key = self.slot_keys[slot]
+                    if key is None or key[1] != context:
+                        continue
+                    entry = self.lookup(key, top_k, now)
+                    if entry:
+                        return self.serve(entry, 'semantic', top_k)
+        self.record_miss()
+        return None
+
+    def record_miss(self):
+        """Count a query that neither level could serve."""
+        with self.lock:
+            self.misses += 1
+        RESULT_CACHE_REQUESTS.inc(level='miss')
+
+    def put(self, query: str, context: Hashable, top_k: int, hits: List[Dict], cost: float, system: Any,
+            vector: Optional[np.ndarray] = None):
+        """Cache the hits of a query; `cost` is the search time a later hit saves.
+
+        Results computed on a system that has since been replaced are not cached.
+        """
+        if self.max_size <= 0:
+            return
+        key = (normalize_query(query), context)
+        with self.lock:
+            if system is not self.system:
+                return
+            if key in self.entries:
+                if self.entries[key]['top_k'] > top_k:
+                    return
+                self.evict(key)
+            slot = None
+            if vector is not None:
+                vector = np.asarray(vector, dtype=np.float32)
+                if self.vectors is None:
+                    self.vectors = np.zeros((self.max_size, len(vector)), dtype=np.float32)
+                while not self.free_slots:
+                    self.evict(next(iter(self.entries)))
+                slot = self.free_slots.pop()
+                self.vectors[slot] = vector / max(float(np.linalg.norm(vector)), 1e-12)
+                self.slot_keys[slot] = key
+            self.entries[key] = {'hits': [dict(hit) for hit in hits], 'top_k': top_k, 'created': time.monotonic(), 'cost': cost,
+                                 'slot': slot}
+            self.cached_hits += len(hits)
+            while len(self.entries) > self.max_size or (self.cached_hits > self.max_hits and len(self.entries) > 1):
+                self.evict(next(iter(self.entries)))
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def stats(self) -> Dict[str, Any]:
+        requests = self.hits + self.misses
+        return {
+            'size': len(self.entries),
+            'cached_hits': self.cached_hits,
+            'exact_hits': self.exact_hits,
+            'semantic_hits': self.semantic_hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / requests if requests else None,
+            'saved_seconds': round(self.saved_seconds, 3),
+            'invalidations': self.invalidations,
+            'ttl': self.ttl,
+            'threshold': self.threshold
+        }
@@ -0,0 +1,302 @@
+import contextvars
+import heapq
+import itertools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from index_versions import current_dir
+from lexical_index import reciprocal_rank_fusion, weighted_fusion
+from metadata_store import group_hits
+from metrics import stage
+
+# One shard per category by default; add entries (or split a category by date) to grow the corpus
+DEFAULT_SHARDS = [{'name': category, 'category': category} for category in ('cs.CL', 'cs.LG', 'cs.AI', 'stat.ML')]
+
+
+def shard_spec(name: str, category: str, date_from: Optional[str] = None, date_to: Optional[str] = None,
+               max_results: int = 50) -> Dict[str, Any]:
+    """A shard definition: an arXiv category, optionally restricted to a submission date range (YYYY-MM-DD)."""
+    return {'name': name, 'category': category, 'date_from': date_from, 'date_to': date_to,
+            'max_results': max_results}
+
+
+def arxiv_query(spec: Dict[str, Any]) -> str:
+    """The arXiv API query listing the papers of a shard."""
+    query = f"cat:{spec['category']}"
+    if spec.get('date_from') or spec.get('date_to'):
+        start = (spec.get('date_from') or '1991-01-01').replace('-', '')
+        end = (spec.get('date_to') or '2999-12-31').replace('-', '')
+        query += f" AND submittedDate:[{start}0000 TO {end}2359]"
+    return query
+
+
+def score_key(mode: str) -> str:
+    """The hit field results of a search mode are ranked by."""
+    return {'hybrid': 'fusion_score', 'lexical': 'bm25_score'}.get(mode, 'similarity_score')
+
+
+def split_id(global_id: str) -> Tuple[str, int]:
+    """Split a "<shard>:<local id>" chunk or paper ID."""
+    shard, _, local_id = global_id.rpartition(':')
+    return shard, int(local_id)
+
+
+class ShardedRAGSystem:
+    """Serve several independently built and persisted indexes as one.
+
+    Each shard is a full `ArxivRAGSystem` (sharing `base`'s model, caches and
+    reranker) published as versions under `<root>/<name>/` (see index_versions.py).
+    A search batch fans out to the selected
+    shards on a thread pool (FAISS and numpy release the GIL, so shards are
+    searched in parallel) and each query's per-shard rankings are k-way merged by
+    score. Hits carry their `shard`, and chunk and paper IDs become
+    "<shard>:<local id>" strings. Instances are never mutated once serving:
+    `with_shard` returns a new one, so a rebuilt shard is swapped in with one
+    reference assignment.
+
+    Dense scores are directly comparable across shards. BM25 scores use per-shard
+    document statistics, so lexical merges are approximate. Fused scores (RRF
+    ranks, min-max normalized weights) only mean something within one candidate
+    pool, so a hybrid search over several shards merges the shards' dense and
+    BM25 candidates first and fuses the two global lists once (see `fuse`).
+    """
+
+    def __init__(self, base, specs: Iterable[Dict[str, Any]] = DEFAULT_SHARDS, root: str = "rag_shards",
+                 max_workers: Optional[int] = None, shards: Optional[Dict[str, Any]] = None,
+                 executor: Optional[ThreadPoolExecutor] = None):
+        self.base = base
+        self.specs = {spec['name']: {**shard_spec(spec['name'], spec['category']), **spec} for spec in specs}
+        self.root = root
+        self.shards: Dict[str, Any] = dict(shards or {})
+        self.executor = executor or ThreadPoolExecutor(max_workers or max(len(self.specs), 1),
+                                                       thread_name_prefix="shard")
+
+    def shard_dir(self, name: str) -> str:
+        return os.path.join(self.root, name)
+
+    def with_shard(self, name: str, system) -> 'ShardedRAGSystem':
+        """A copy serving `system` as shard `name` (sharing the thread pool)."""
+        return ShardedRAGSystem(self.base, self.specs.values(), self.root, shards={**self.shards, name: system},
+                                executor=self.executor)
+
+    def load(self, mmap: bool = True) -> int:
+        """Load the published version of every shard saved under `root`; returns the number loaded."""
+        for name in self.specs:
+            directory = current_dir(self.shard_dir(name))
+            system = self.base.spawn()
+            if directory and system.load_system(directory, mmap=mmap):
+                self.shards[name] = system
+        return len(self.shards)
+
+    def refresh(self, mmap: bool = True) -> 'ShardedRAGSystem':
+        """A copy serving the newly published version of every shard whose version changed on
+        disk (e.g. rebuilt by another process), or self if none did."""
+        sharded = self
+        for name in self.specs:
+            directory = current_dir(self.shard_dir(name))
+            current = self.shards.get(name)
+            if directory is None or (current is not None and current.index_dir == directory):
+                continue
+            system = self.base.spawn()
+            if system.load_system(directory, mmap=mmap):
+                sharded = sharded.with_shard(name, system)
+        return sharded
+
+    def select(self, names: Optional[Iterable[str]] = None) -> List[str]:
+        """Validate a shard selection (None or empty means all shards)."""
+        names = list(names or self.specs)
+        unknown = [name for name in names if name not in self.specs]
+        if unknown:
+            raise ValueError(f"Unknown shards: {', '.join(unknown)} (available: {', '.join(self.specs)})")
+        return names
+
+    def is_initialized(self) -> bool:
+        return any(system.is_initialized() for system in self.shards.values())
+
+    @property
+    def reranker(self):
+        return self.base.reranker
+
+    def list_shard(self, name: str) -> List[Dict]:
+        """List a shard's papers, leaving cross-listed papers to the shard of their primary category."""
+        spec = self.specs[name]
+        papers = self.base.list_arxiv_papers(spec['category'], spec['max_results'], query=arxiv_query(spec))
+        elsewhere = {other['category'] for other in self.specs.values()} - {spec['category']}
+        return [paper for paper in papers if paper.get('primary_category') not in elsewhere]
+
+    def shard_for(self, paper: Dict[str, Any]) -> str:
+        """The shard a paper belongs in: its primary category (and date range) first, then any listed category."""
+        published = paper.get('published') or ''
+        for categories in ([paper.get('primary_category')], paper.get('categories') or []):
+            for name, spec in self.specs.items():
+                if spec['category'] in categories and (spec.get('date_from') or '') <= published \
+                        and (not spec.get('date_to') or published <= spec['date_to']):
+                    return name
+        return next(iter(self.specs))
+
+    def shards_containing(self, arxiv_ids: Iterable[str]) -> Dict[str, List[str]]:
+        """Group arXiv IDs by the shards that hold them."""
+        found = {}
+        for arxiv_id in arxiv_ids:
+            for name, system in self.shards.items():
+                if arxiv_id in system.papers.by_arxiv_id:
+                    found.setdefault(name, []).append(arxiv_id)
+        return found
+
+    def encode_queries(self, queries: List[str]) -> np.ndarray:
+        return self.base.encode_queries(queries)
+
+    def search_embeddings(self, query_embeddings: np.ndarray, top_k: int = 5, queries: Optional[List[str]] = None,
+                          mode: str = "dense", fusion: str = "rrf", alpha: float = 0.5, rerank: bool = False,
+                          shards: Optional[Iterable[str]] = None, filters: Optional[Tuple] = None,
+                          top_papers: int = 0) -> List[List[Dict]]:
+        """Search the selected shards in parallel and merge each query's hits by score.
+
+        Reranking runs once over the merged candidates, not per shard. `filters` are
+        applied by every shard against its own filter indexes; with `top_papers`, every
+        shard searches the chunks of its own `top_papers` best matching papers.
+        A hybrid search over several shards fetches every shard's dense and BM25
+        candidates separately and fuses the merged lists, as one index would.
+        """
+        names = [name for name in self.select(shards) if name in self.shards]
+        reranker = self.base.get_reranker() if rerank and queries is not None else None
+        depth = max(top_k, reranker.depth) if reranker else top_k
+
+        fuse = mode == "hybrid" and queries is not None and len(names) > 1
+        if fuse:
+            # Same candidate pool per list as a single index fuses over
+            searches = [(name, search_mode, max(4 * depth, 50))
+                        for name in names for search_mode in ("dense", "lexical")]
+        else:
+            searches = [(name, mode, depth) for name in names]
+        options = {'filters': filters, 'top_papers': top_papers}
+        if len(searches) == 1:
+            name, search_mode, k = searches[0]
+            per_search = [self.shards[name].search_embeddings(query_embeddings, k, queries, search_mode, fusion, alpha,
+                                                              **options)]
+        else:
+            # Run each shard in a copy of this context so its stage timings reach the caller's trace
+            futures = [self.executor.submit(contextvars.copy_context().run, self.shards[name].search_embeddings,
+                                            query_embeddings, k, queries, search_mode, fusion, alpha, **options)
+                       for name, search_mode, k in searches]
+            per_search = [future.result() for future in futures]
+
+        results = []
+        with stage('merge'):
+            for i in range(len(query_embeddings)):
+                lists = {}
+                for (name, search_mode, k), hit_lists in zip(searches, per_search):
+                    lists.setdefault(search_mode, []).append([self.globalize(name, hit) for hit in hit_lists[i]])
+                if fuse:
+                    merged = self.fuse(self.merge(lists['dense'], 'dense'), self.merge(lists['lexical'], 'lexical'),
+                                       fusion, alpha)[:depth]
+                else:
+                    merged = self.merge(lists.get(mode, []), mode, depth)
+                for rank, hit in enumerate(merged, 1):
+                    hit['rank'] = rank
+                results.append(merged)
+        if reranker:
+            with stage('rerank'):
+                results = [hits[:top_k] for hits in reranker.rerank_batch(queries, results)]
+        return results
+
+    @staticmethod
+    def merge(streams: List[List[Dict]], mode: str, depth: Optional[int] = None) -> List[Dict]:
+        """K-way merge ranked hit lists by their `mode` score (every list is already sorted)."""
+        key = score_key(mode)
+        return list(itertools.islice(heapq.merge(*streams, key=lambda hit: -hit.get(key, hit['similarity_score'])),
+                                     depth))
+
+    @staticmethod
+    def fuse(dense: List[Dict], lexical: List[Dict], fusion: str, alpha: float) -> List[Dict]:
+        """Fuse one query's global dense and BM25 rankings like `ArxivRAGSystem.search_filtered` does."""
+        positions: Dict[str, int] = {}
+        hits: Dict[str, Dict] = {}
+        for hit in lexical + dense:
+            positions.setdefault(hit['chunk_id'], len(positions))
+            # Hits of the dense search win: they carry no BM25 score, like fused hits
+            hits[hit['chunk_id']] = hit
+        dense_ids = np.array([positions[hit['chunk_id']] for hit in dense], dtype=np.int64)
+        lexical_ids = np.array([positions[hit['chunk_id']] for hit in lexical], dtype=np.int64)
+        if fusion == "weighted":
+            ids, fused = weighted_fusion(
+                [(dense_ids, np.array([hit['similarity_score'] for hit in dense], dtype=np.float32)),
+                 (lexical_ids, np.array([hit.get('bm25_score', hit['similarity_score']) for hit in lexical],
+                                        dtype=np.float32))], [alpha, 1 - alpha])
+        else:
+            ids, fused = reciprocal_rank_fusion([dense_ids, lexical_ids])
+        chunk_ids = list(positions)
+        results = []
+        for position, score in zip(ids.tolist(), fused.tolist()):
+            hit = hits[chunk_ids[position]]
+            hit.pop('bm25_score', None)
+            hit['fusion_score'] = float(score)
+            results.append(hit)
+        return results
+
+    @staticmethod
+    def globalize(name: str, hit: Dict) -> Dict:
+        hit['shard'] = name
+        hit['chunk_id'] = f"{name}:{hit['chunk_id']}"
+        hit['paper_id'] = f"{name}:{hit['paper_id']}"
+        if 'also_in' in hit:
+            hit['also_in'] = [f"{name}:{paper_id}" for paper_id in hit['also_in']]
+        return hit
+
+    def search(self, query: str, top_k: int = 5, mode: str = "dense", fusion: str = "rrf",
+               rerank: bool = False, shards: Optional[Iterable[str]] = None,
+               filters: Optional[Tuple] = None, top_papers: int = 0) -> List[Dict]:
+        return self.search_embeddings(self.encode_queries([query]), top_k, [query], mode, fusion,
+                                      rerank=rerank, shards=shards, filters=filters, top_papers=top_papers)[0]
+
+    def paper_metadata(self, paper_id: str) -> Dict[str, Any]:
+        name, local_id = split_id(paper_id)
+        return {**self.shards[name].papers.metadata(local_id), 'paper_id': paper_id, 'shard': name}
+
+    def papers_for(self, hits: List[Dict]) -> Dict[str, Dict]:
+        """Metadata of each paper referenced by `hits` (including `also_in`), keyed by global paper ID."""
+        paper_ids = [paper_id for hit in hits for paper_id in [hit['paper_id'], *hit.get('also_in', ())]]
+        return {paper_id: self.paper_metadata(paper_id) for paper_id in paper_ids}
+
+    def spans_for(self, hits: List[Dict]) -> List[Optional[Tuple[int, int]]]:
+        spans = []
+        for hit in hits:
+            name, local_id = split_id(hit['chunk_id'])
+            spans.extend(self.shards[name].spans_for([{'chunk_id': local_id}]))
+        return spans
+
+    def group_by_paper(self, hits: List[Dict], offset: int = 0, limit: int = 10) -> Dict[str, Any]:
+        return group_hits(hits, self.paper_metadata, offset, limit)
+
+    def paper_count(self) -> int:
+        return sum(system.paper_count() for system in self.shards.values())
+
+    def chunk_count(self) -> int:
+        return sum(system.chunk_count() for system in self.shards.values())
+
+    def duplicate_count(self) -> int:
+        return sum(system.duplicate_count() for system in self.shards.values())
+
+    def memory_usage(self) -> Dict[str, Dict[str, int]]:
+        return {name: system.memory_usage() for name, system in self.shards.items()}
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Per-shard definition, size and location."""
+        stats = {}
+        for name, spec in self.specs.items():
+            system = self.shards.get(name)
+            stats[name] = {
+                'category': spec['category'],
+                'date_from': spec.get('date_from'),
+                'date_to': spec.get('date_to'),
+                'loaded': system is not None,
+                'papers': system.paper_count() if system else 0,
+                'chunks': system.chunk_count() if system else 0,
+                'duplicates': system.duplicate_count() if system else 0,
+                'index_dir': system.index_dir if system else None,
+                # None for an index saved before versioning
+                'version': os.path.basename(system.index_dir)
+                if system and system.index_dir and system.index_dir != self.shard_dir(name) else None
+            }
+        return stats
@@ -0,0 +1,67 @@
+import importlib.util
+import os
+import sys
+import zlib
+import numpy as np
+import pytest
+
+# The homework modules sit next to the main script rather than in a package
+HOMEWORK_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, HOMEWORK_DIR)
+
+
+@pytest.fixture(scope="session")
+def byte_encoding():
+    """A byte-level tiktoken encoding, built locally so tests run without downloading cl100k_base."""
+    import tiktoken
+
+    return tiktoken.Encoding(name="bytes", pat_str=r"""'s|'t|'re|'ve|'m|'ll|'d| ?\p{L}+| ?\p{N}+| ?[^\s\p{L}\p{N}]+|\s+(?!\S)|\s+""",
+                             mergeable_ranks={bytes([i]): i for i in range(256)}, special_tokens={})
+
+
+def load_app_module(path: str = os.path.join(HOMEWORK_DIR, "RAG with arXiv Papers.py")):
+    """Import the app script, whose file name is not a valid module name."""
+    spec = importlib.util.spec_from_file_location("rag_app", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class HashingModel:
+    """Stands in for the sentence-transformers model: unit bag-of-hashed-words vectors, and a log of
+    the batches it encoded."""
+
+    def __init__(self, dimension: int = 64):
+        self.dimension = dimension
+        self.batches = []
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dimension
+
+    def encode(self, texts, batch_size: int = 32, **kwargs):
+        self.batches.append(list(texts))
+        vectors = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in text.lower().split():
+                vectors[row, zlib.crc32(word.encode()) % self.dimension] += 1
+        return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+    @property
+    def encoded(self):
+        return [text for batch in self.batches for text in batch]
+
+
+@pytest.fixture(scope="session")
+def app():
+    """The main script loaded as a module."""
+    return load_app_module()
+
+
+@pytest.fixture(scope="session")
+def pdf_server():
+    """Synthetic PDFs served over local HTTP (see benchmark.PDFServer)."""
+    import benchmark
+
+    server = benchmark.PDFServer(benchmark.synthetic_pdfs(6, pages=3))
+    yield server
+    server.close()
@@ -0,0 +1,86 @@
+import re
+import numpy as np
+from answer import AnswerGenerator, ContextPacker, StubLLM, merge_passages
+from benchmark import WORDS
+
+
+def paper_text(rng, n_sentences=30):
+    return " ".join(" ".join(rng.choice(WORDS, int(rng.integers(6, 16)))).capitalize() + "."
+                    for _ in range(n_sentences))
+
+
+def retrieval(seed=0, n_papers=4, chunk_chars=400, overlap=100):
+    """Ranked hits over overlapping chunks of a few papers, with their spans and paper metadata."""
+    rng = np.random.default_rng(seed)
+    texts = {paper_id: paper_text(rng) for paper_id in range(n_papers)}
+    chunks = []
+    for paper_id, text in texts.items():
+        for start in range(0, len(text), chunk_chars - overlap):
+            chunks.append((paper_id, (start, min(start + chunk_chars, len(text)))))
+    order = rng.permutation(len(chunks))[:12]
+    hits = [{'paper_id': chunks[i][0], 'chunk_id': int(i), 'chunk': texts[chunks[i][0]][slice(*chunks[i][1])],
+             'pages': [1, 1]} for i in order]
+    spans = [chunks[i][1] for i in order]
+    papers = {paper_id: {'title': f"Paper {paper_id}", 'arxiv_id': f"2401.{paper_id:05d}",
+                         'pdf_url': f"http://localhost/{paper_id}.pdf"} for paper_id in texts}
+    return texts, hits, spans, papers
+
+
+def test_overlapping_chunks_merge_into_paper_text():
+    texts, hits, spans, _ = retrieval()
+    passages = merge_passages(hits, spans)
+    assert len(passages) < len(hits)
+    for passage in passages:
+        assert passage['text'] == texts[passage['paper_id']][slice(*passage['span'])]
+    assert sorted(chunk_id for passage in passages for chunk_id in passage['chunk_ids']) == \
+        sorted(hit['chunk_id'] for hit in hits)
+
+
+def test_pack_never_exceeds_budget(byte_encoding):
+    packer = ContextPacker(byte_encoding)
+    question = "Which retrieval method improves translation?"
+    empty_prompt = packer.count(packer.template.format(context="", question=question))
+    for seed in range(3):
+        _, hits, spans, papers = retrieval(seed)
+        for budget in range(empty_prompt + 20, empty_prompt + 6000, 137):
+            packed = packer.pack(question, hits, spans, papers, budget_tokens=budget)
+            stats = packed['stats']
+            assert stats['prompt_tokens'] == packer.count(packed['prompt']) <= budget
+            assert stats['budget_tokens'] == budget
+            if not stats['truncated']:
+                break
+        else:
+            raise AssertionError("the largest budget should fit every retrieved sentence")
+
+
+def test_sources_are_numbered_by_best_hit(byte_encoding):
+    _, hits, spans, papers = retrieval()
+    packed = ContextPacker(byte_encoding).pack("question", hits, spans, papers, budget_tokens=100000)
+    best = list(dict.fromkeys(hit['paper_id'] for hit in hits))
+    assert [source['paper_id'] for source in packed['sources']] == best
+    assert [source['number'] for source in packed['sources']] == list(range(1, len(best) + 1))
+    for source in packed['sources']:
+        assert f"[{source['number']}] {source['title']}" in packed['context']
+
+
+def test_stub_llm_is_deterministic_and_cites_every_source(byte_encoding):
+    _, hits, spans, papers = retrieval()
+    packed = ContextPacker(byte_encoding).pack("question", hits, spans, papers, budget_tokens=100000)
+    llm = StubLLM()
+    answer = "".join(llm.generate(packed['prompt']))
+    assert answer == "".join(StubLLM().generate(packed['prompt']))
+    assert [int(n) for n in re.findall(r"\[(\d+)\]", answer)] == \
+        [source['number'] for source in packed['sources']]
+    assert len("".join(llm.generate(packed['prompt'], max_tokens=5)).split(" ")) == 5
+    assert "".join(llm.generate("Sources:\n\n\nQuestion: q\nAnswer:")) == "The sources do not answer the question."
+
+
+def test_answer_records_usage(byte_encoding):
+    _, hits, spans, papers = retrieval()
+    generator = AnswerGenerator(StubLLM(), budget_tokens=800)
+    # Use the local encoding instead of downloading cl100k_base
+    generator._packer = ContextPacker(byte_encoding, generator.budget_tokens)
+    result = generator.answer("question", hits, spans, papers)
+    assert result['usage']['prompt_tokens'] <= 800
+    assert result['usage']['completion_tokens'] == len(byte_encoding.encode(result['answer']))
+    assert generator.stats()['answers'] == 1
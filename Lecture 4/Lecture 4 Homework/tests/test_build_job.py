@@ -0,0 +1,101 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from build_job import BuildCancelled, BuildJob, BuildRunner
+
+
+def test_progress_is_reported_while_the_build_runs():
+    runner = BuildRunner()
+    halfway, resume = threading.Event(), threading.Event()
+    installed = []
+
+    def build(job):
+        job.stage('download', 40)
+        # Worker threads report progress concurrently
+        with ThreadPoolExecutor(4) as pool:
+            list(pool.map(lambda _: job.advance(), range(40)))
+        job.stage('embed')
+        job.set_total(10)
+        job.advance(5)
+        halfway.set()
+        resume.wait(5)
+        job.advance(5)
+        return "new system"
+
+    def install(result):
+        installed.append(result)
+        return {'papers': 3}
+
+    job = runner.start("rebuild", ['download', 'embed'], build, install)
+    assert halfway.wait(5)
+    status = runner.status()
+    assert (status['state'], status['stage'], status['stage_index']) == ('running', 'embed', 2)
+    assert (status['done'], status['total'], status['stage_progress']) == (5, 10, 0.5)
+    assert 'download' in status['stage_seconds'] and status['eta_seconds'] is not None
+    assert not installed
+
+    resume.set()
+    runner.wait(5)
+    status = job.status()
+    assert status['state'] == 'succeeded' and installed == ["new system"]
+    assert status['result'] == {'papers': 3} and status['stages'] == ['download', 'embed', 'swap']
+    assert set(status['stage_seconds']) == {'download', 'embed', 'swap'} and status['eta_seconds'] is None
+
+
+def test_cancelled_build_is_never_installed():
+    runner = BuildRunner()
+    started = threading.Event()
+    installed = []
+
+    def build(job):
+        job.stage('embed', 1000)
+        started.set()
+        for _ in range(1000):
+            job.advance()
+            job.check()
+            time.sleep(0.01)
+        return "new system"
+
+    job = runner.start("rebuild", ['embed'], build, installed.append)
+    assert started.wait(5)
+    with pytest.raises(RuntimeError, match="already running"):
+        runner.start("update", [], build, installed.append)
+    assert runner.cancel()
+    runner.wait(5)
+    assert job.state == 'cancelled' and job.status()['cancel_requested']
+    assert not installed and job.done < 1000
+    assert not runner.cancel()
+
+    # The next build may start once the cancelled one is done
+    runner.start("update", [], lambda job: "update", installed.append)
+    runner.wait(5)
+    assert installed == ["update"] and runner.job.state == 'succeeded'
+
+
+def test_failed_build_reports_its_error():
+    runner = BuildRunner()
+    installed = []
+
+    def build(job):
+        job.prefix = 'cs.CL/'
+        job.stage('ingest', 2)
+        raise OSError("arXiv unreachable")
+
+    job = runner.start("rebuild", [], build, installed.append)
+    runner.wait(5)
+    status = job.status()
+    assert (status['state'], status['error']) == ('failed', "arXiv unreachable")
+    assert status['stage'] == 'cs.CL/ingest' and 'cs.CL/ingest' in status['stage_seconds']
+    assert not installed
+
+
+def test_check_raises_once_cancelled():
+    job = BuildJob("rebuild", ['embed'])
+    job.check()
+    job.cancel()
+    with pytest.raises(BuildCancelled):
+        job.check()
+    with pytest.raises(BuildCancelled):
+        job.stage('index')
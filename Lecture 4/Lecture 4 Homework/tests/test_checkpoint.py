@@ -0,0 +1,103 @@
+import numpy as np
+from benchmark import fixture_papers
+from checkpoint import BuildCheckpoint
+from metadata_store import PaperTable
+
+CONFIG = {'model_name': 'test', 'chunking': 'spans'}
+
+
+def open_checkpoint(directory, papers, **kwargs):
+    checkpoint = BuildCheckpoint(str(directory), CONFIG, **kwargs)
+    checkpoint.open(papers)
+    return checkpoint
+
+
+def tear_last_record(path):
+    """Cut the journal in the middle of its last record, as a kill during a write would."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    start = data.rstrip(b'\n').rfind(b'\n') + 1
+    with open(path, 'wb') as f:
+        f.write(data[:start + (len(data) - start) // 2])
+    return data[:start]
+
+
+def test_torn_record_is_cut_off_on_resume(tmp_path):
+    papers = fixture_papers(3, "http://localhost")
+    checkpoint = open_checkpoint(tmp_path / "build", papers)
+    checkpoint.record(0, 'fetched')
+    checkpoint.record_chunks(0, ["a b", "c"], [(0, 3), (4, 5)], np.array([[0, 0], [0, 1]]))
+    checkpoint.record(1, 'fetched')
+    checkpoint.record_chunks(1, ["d"], [(0, 1)], np.array([[0, 0]]))
+    checkpoint.close()
+    intact = tear_last_record(checkpoint.journal_path)
+
+    resumed = open_checkpoint(tmp_path / "build", papers)
+    with open(resumed.journal_path, 'rb') as f:
+        assert f.read() == intact
+    assert resumed.status == {0: 'chunked', 1: 'fetched'}
+    assert resumed.pending() == [1, 2]
+    chunks, spans, pages = resumed.chunked[0]
+    assert chunks == ["a b", "c"] and spans == [(0, 3), (4, 5)]
+    np.testing.assert_array_equal(pages, [[0, 0], [0, 1]])
+
+    # Records appended after the cut start on a fresh line and replay cleanly
+    resumed.record_chunks(1, ["d"], [(0, 1)], np.array([[0, 0]]))
+    resumed.close()
+    again = open_checkpoint(tmp_path / "build", papers)
+    assert again.pending() == [2]
+    assert again.resumed['fetched'] == 0 and again.resumed['chunked'] == 2
+    again.close()
+
+
+def test_paper_in_flight_too_often_is_failed(tmp_path):
+    papers = fixture_papers(2, "http://localhost")
+    for _ in range(2):
+        checkpoint = open_checkpoint(tmp_path / "build", papers, max_attempts=2)
+        checkpoint.record(0, 'fetched')
+        checkpoint.close()
+    checkpoint = open_checkpoint(tmp_path / "build", papers, max_attempts=2)
+    assert checkpoint.status[0] == 'failed'
+    assert checkpoint.pending() == [1]
+    checkpoint.close()
+
+
+def test_other_configuration_starts_over(tmp_path):
+    papers = fixture_papers(2, "http://localhost")
+    checkpoint = open_checkpoint(tmp_path / "build", papers)
+    checkpoint.record(0, 'empty')
+    checkpoint.close()
+    other = BuildCheckpoint(str(tmp_path / "build"), {**CONFIG, 'chunking': 'legacy'})
+    other.open(papers)
+    assert other.status == {} and other.pending() == [0, 1]
+    other.close()
+
+
+def test_pipelined_ingestion_resumes_from_torn_journal(app, byte_encoding, pdf_server, tmp_path):
+    papers = fixture_papers(6, pdf_server.url)
+
+    def system():
+        rag = app.ArxivRAGSystem(cache_path=str(tmp_path / "embedding_cache.sqlite"), rerank_model=None)
+        rag.resources['encoder'] = byte_encoding
+        rag.papers = PaperTable(papers)
+        return rag
+
+    fresh = system()
+    fresh.process_papers()
+
+    first = open_checkpoint(tmp_path / "build", papers)
+    system().process_papers_pipelined(max_downloads=2, extract_workers=2, checkpoint=first)
+    first.close()
+    tear_last_record(first.journal_path)
+
+    resumed = open_checkpoint(tmp_path / "build", papers)
+    assert 0 < len(resumed.chunked) < len(papers)
+    rebuilt = system()
+    rebuilt.process_papers_pipelined(max_downloads=2, extract_workers=2, checkpoint=resumed)
+    assert resumed.pending() == []
+    assert [rebuilt.chunks[i] for i in range(len(rebuilt.chunks))] == \
+        [fresh.chunks[i] for i in range(len(fresh.chunks))]
+    np.testing.assert_array_equal(rebuilt.chunk_to_paper, fresh.chunk_to_paper)
+    np.testing.assert_array_equal(rebuilt.chunk_spans, fresh.chunk_spans)
+    np.testing.assert_array_equal(rebuilt.chunk_pages, fresh.chunk_pages)
+    resumed.close()
@@ -0,0 +1,134 @@
+import numpy as np
+from benchmark import fixture_papers
+from dedup import NearDuplicateIndex, SimHasher
+from lexical_index import LexicalIndex, synthetic_texts
+from metadata_store import PaperTable
+
+
+def paper_chunks(texts):
+    return (list(texts), [(0, len(text)) for text in texts], np.zeros((len(texts), 2), dtype=np.int32))
+
+
+def make_system(app, tmp_path, papers=3):
+    system = app.ArxivRAGSystem(cache_path=str(tmp_path / "embedding_cache.sqlite"), rerank_model=None)
+    system.papers = PaperTable(fixture_papers(papers, "http://localhost"))
+    return system
+
+
+def test_removal_promoting_duplicates_keeps_bm25_exact(app, tmp_path):
+    texts = synthetic_texts(90, vocab_size=5000, doc_length=60, seed=3)
+    system = make_system(app, tmp_path)
+    # Paper 1 repeats half of paper 0's chunks, so removing paper 0 promotes them
+    # below the IDs of paper 2, which are already indexed
+    system.append_chunks({0: paper_chunks(texts[:30]), 1: paper_chunks(texts[30:45] + texts[:15]),
+                          2: paper_chunks(texts[45:90])})
+    assert len(system.duplicates) == 15
+    system.build_lexical_index()
+
+    system.remove_papers(["bench.00000"])
+    assert (system.chunk_canonical[45:60] == np.arange(45, 60)).all()
+    ids = system.indexed_chunk_ids()
+    fresh = LexicalIndex()
+    fresh.add_documents(ids.tolist(), [system.chunks[i] for i in ids])
+    fresh.merge()
+    rng = np.random.default_rng(0)
+    for _ in range(50):
+        query = " ".join(f"w{i}" for i in rng.integers(0, 40, 4))
+        pruned_ids, pruned = system.lexical_index.search(query, 3, prune=True)
+        exact_ids, exact = system.lexical_index.search(query, 3, prune=False)
+        np.testing.assert_allclose(pruned, exact, rtol=1e-5)
+        np.testing.assert_allclose(pruned, fresh.search(query, 3)[1], rtol=1e-5)
+    system.lexical_index.merge()
+    assert system.lexical_index.is_ordered()
+
+
+def flip(fingerprint, bits):
+    for bit in bits:
+        fingerprint ^= 1 << bit
+    return fingerprint
+
+
+def test_simhash_distance_follows_text_overlap():
+    hasher = SimHasher()
+    texts = synthetic_texts(2, vocab_size=5000, doc_length=200, seed=1)
+    edited = texts[0].replace(texts[0].split()[100], "edited", 1)
+    assert hasher.fingerprint(texts[0]) == hasher.fingerprint(texts[0].upper())
+    assert (hasher.fingerprint(texts[0]) ^ hasher.fingerprint(edited)).bit_count() <= 3
+    assert (hasher.fingerprint(texts[0]) ^ hasher.fingerprint(texts[1])).bit_count() > 10
+    assert hasher.fingerprint("") == 0
+
+
+def test_band_lookup_finds_exactly_max_distance():
+    index = NearDuplicateIndex(max_distance=3)
+    base = 0x0123456789ABCDEF
+    index.add(7, base)
+    # One flipped bit in each of three of the four 16-bit bands: only the last band still matches
+    assert index.find(flip(base, [0, 16, 32])) == 7
+    assert index.find(flip(base, [0, 1, 2])) == 7
+    # A fourth flipped bit (even inside matching bands) is over the distance
+    assert index.find(flip(base, [0, 16, 32, 48])) is None
+    assert index.find(flip(base, [0, 1, 2, 3])) is None
+
+    # Ties go to the lowest chunk ID, closer matches win
+    index.add(3, flip(base, [60]))
+    index.add(5, flip(base, [61, 62]))
+    assert index.find(flip(base, [60, 61])) == 3
+    index.remove(3)
+    index.remove(3)
+    assert index.find(flip(base, [60, 61])) in (5, 7)
+    assert index.find(flip(base, [61, 62])) == 5
+    assert len(index) == 2
+
+    exact = NearDuplicateIndex(max_distance=0)
+    exact.add(1, base)
+    assert exact.find(base) == 1 and exact.find(flip(base, [5])) is None
+
+
+def test_near_duplicate_chunks_map_to_earlier_representative(app, tmp_path):
+    texts = synthetic_texts(6, vocab_size=5000, doc_length=300, seed=2)
+    near = texts[1].replace(texts[1].split()[150], "edited", 1)
+    assert 0 < (SimHasher().fingerprint(near) ^ SimHasher().fingerprint(texts[1])).bit_count() <= 3
+    system = make_system(app, tmp_path)
+    system.append_chunks({0: paper_chunks(texts[:3]), 1: paper_chunks([texts[0], near, texts[3]])})
+    assert system.chunk_canonical.tolist() == [0, 1, 2, 0, 1, 5]
+    assert system.duplicates == {0: [3], 1: [4]}
+    assert system.last_dedup_stats['duplicates'] == 2 and system.last_dedup_stats['exact'] == 1
+    # Duplicates keep their own row and paper but are not indexed
+    assert system.chunks[4] == near and system.chunk_to_paper[4] == 1
+    assert system.indexed_chunk_ids().tolist() == [0, 1, 2, 5]
+
+    # Within one batch, a later chunk maps to an earlier one of the same batch
+    system.append_chunks({2: paper_chunks([texts[4], texts[4]])})
+    assert system.chunk_canonical[6:].tolist() == [6, 6]
+
+    off = make_system(app, tmp_path)
+    off.dedup_distance = None
+    off.append_chunks({0: paper_chunks([texts[0], texts[0]])})
+    assert off.chunk_canonical.tolist() == [0, 1]
+
+
+def test_removing_a_representative_promotes_its_first_duplicate(app, tmp_path):
+    texts = synthetic_texts(4, vocab_size=5000, doc_length=80, seed=4)
+    system = make_system(app, tmp_path, papers=4)
+    system.append_chunks({0: paper_chunks([texts[0], texts[1]]), 1: paper_chunks([texts[0]]),
+                          2: paper_chunks([texts[0], texts[2]]), 3: paper_chunks([texts[1]])})
+    assert system.duplicates == {0: [2, 3], 1: [5]}
+
+    system.remove_papers(["bench.00000"])
+    # Chunk 2 takes over from 0 and keeps 3 as its duplicate; 5 is promoted on its own
+    assert system.chunk_canonical[[2, 3, 5]].tolist() == [2, 2, 5]
+    assert system.duplicates == {2: [3]}
+    assert system.indexed_chunk_ids().tolist() == [2, 4, 5]
+    # New copies now map to the promoted chunks
+    system.append_chunks({1: paper_chunks([texts[0], texts[1]])})
+    assert system.chunk_canonical[6:].tolist() == [2, 5]
+
+    # Removing a duplicate's paper only drops it from its representative's list
+    system.remove_papers(["bench.00002"])
+    assert system.duplicates == {2: [6], 5: [7]}
+    assert system.indexed_chunk_ids().tolist() == [2, 5]
+
+    # The map is rebuilt the same from chunk_canonical after a load
+    duplicates = system.duplicates
+    system.restore_duplicates()
+    assert system.duplicates == duplicates
@@ -0,0 +1,54 @@
+import numpy as np
+from conftest import HashingModel
+from embedding_engine import EmbeddingEngine, length_buckets
+
+
+def texts_of_random_length(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return [" ".join(f"w{rng.integers(1000)}" for _ in range(rng.integers(1, 60))) for _ in range(n)]
+
+
+def padded_size(batches):
+    """Characters encoded when every text is padded to the longest one in its batch."""
+    return sum(len(batch) * max(len(text) for text in batch) for batch in batches)
+
+
+def test_length_buckets_group_similar_lengths():
+    texts = texts_of_random_length(103)
+    buckets = length_buckets(texts, 8)
+    assert [len(bucket) for bucket in buckets] == [8] * 12 + [7]
+    assert sorted(np.concatenate(buckets).tolist()) == list(range(103))
+    lengths = [[len(texts[i]) for i in bucket] for bucket in buckets]
+    # Batches never overlap in length, so each is padded only to its own longest text
+    assert all(max(a) <= min(b) for a, b in zip(lengths, lengths[1:]))
+    unbucketed = [texts[start:start + 8] for start in range(0, 103, 8)]
+    assert padded_size([[texts[i] for i in bucket] for bucket in buckets]) < 0.7 * padded_size(unbucketed)
+    # Ties keep their input order
+    assert [bucket.tolist() for bucket in length_buckets(["bb", "a", "cc", "d"], 2)] == [[1, 3], [0, 2]]
+    assert length_buckets([], 8) == []
+
+
+def test_encode_writes_vectors_back_in_input_order():
+    texts = texts_of_random_length(50, seed=1)
+    model = HashingModel()
+    engine = EmbeddingEngine("test", batch_size=8, processes=0, model=model)
+    reported = []
+    vectors = engine.encode(texts, on_batch=lambda positions, batch: reported.append((positions, batch)))
+
+    np.testing.assert_allclose(vectors, HashingModel().encode(texts))
+    assert [len(batch) for batch in model.batches] == [8] * 6 + [2]
+    assert sorted(np.concatenate([positions for positions, _ in reported]).tolist()) == list(range(50))
+    for positions, batch in reported:
+        np.testing.assert_array_equal(vectors[positions], batch)
+
+
+def test_encode_fills_only_the_given_rows():
+    texts = texts_of_random_length(10, seed=2)
+    engine = EmbeddingEngine("test", batch_size=3, processes=4, model=HashingModel())
+    out = np.full((20, engine.dimension), 7.0, dtype=np.float32)
+    rows = np.arange(10) * 2 + 1
+    engine.encode(texts, out=out, rows=rows)
+    np.testing.assert_allclose(out[rows], HashingModel().encode(texts))
+    assert (out[::2] == 7.0).all()
+    # Too few texts to be worth a process pool: encoded in this process
+    assert engine.pool is None
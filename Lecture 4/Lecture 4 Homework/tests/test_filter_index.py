@@ -0,0 +1,116 @@
+import numpy as np
+import pytest
+
+from filter_index import FilterIndex, normalize_filters, synthetic_papers
+from index_factory import prepare_vectors, synthetic_corpus
+from metadata_store import PaperTable
+
+PAPERS = [
+    {'title': "A", 'authors': ["Ada Lovelace", "Alan Turing"], 'published': "2023-05-10",
+     'arxiv_id': "2305.00001v2", 'primary_category': 'cs.CL', 'categories': ['cs.CL', 'cs.AI']},
+    {'title': "B", 'authors': ["Alan Turing"], 'published': "2023-12-31",
+     'arxiv_id': "2312.00002v1", 'primary_category': 'cs.LG', 'categories': ['stat.ML']},
+    {'title': "C", 'authors': ["Grace Hopper"], 'published': "2024-06-01",
+     'arxiv_id': "2406.00003v1", 'primary_category': None, 'categories': ['cs.AI']},
+    {'title': "D", 'authors': ["Ada Lovelace"], 'published': "2024-06-30",
+     'arxiv_id': "2406.00004", 'primary_category': None, 'categories': None},
+    {'title': "E", 'authors': ["Ada Lovelace", "Alan Turing"], 'published': "2024-01-01",
+     'arxiv_id': "2401.00005v1", 'primary_category': 'cs.CL', 'categories': ['cs.CL', 'cs.AI', 'stat.ML']},
+]
+
+
+def filter_index(papers=PAPERS):
+    table = PaperTable(papers)
+    table.mark_removed(4)  # Matches every filter below, but is gone
+    # Two chunks per paper; paper 3's second chunk duplicates paper 0's first
+    chunk_to_paper = np.repeat(np.arange(len(papers), dtype=np.int32), 2)
+    canonical = np.arange(len(chunk_to_paper), dtype=np.int64)
+    canonical[7] = 0
+    return FilterIndex(table, chunk_to_paper, canonical)
+
+
+def matching(index, **filters):
+    return index.matching_papers(normalize_filters(**filters)).tolist()
+
+
+def test_normalize_filters():
+    assert normalize_filters() is None
+    assert normalize_filters(date_from=" ", authors=[" "]) is None
+    assert normalize_filters(date_from="2024", date_to="2024-02", authors=[" Ada LOVELACE", "ada lovelace"],
+                             categories=["cs.CL "], arxiv_ids=["2305.00001v3"]) == (
+        ('date_from', '2024-01-01'), ('date_to', '2024-02-29'), ('authors', ('ada lovelace',)),
+        ('categories', ('cs.CL',)), ('arxiv_ids', ('2305.00001',)))
+    with pytest.raises(ValueError):
+        normalize_filters(date_to="June 2024")
+
+
+def test_date_filters_are_inclusive_and_partial():
+    index = filter_index()
+    assert matching(index, date_from="2023-12", date_to="2024-06") == [1, 2, 3]
+    assert matching(index, date_to="2023") == [0, 1]
+    assert matching(index, date_from="2024-06-30") == [3]
+    assert matching(index, date_from="2025") == []
+
+
+def test_author_category_and_arxiv_id_filters():
+    index = filter_index()
+    assert matching(index, authors=["ADA LOVELACE"]) == [0, 3]
+    assert matching(index, authors=["Grace Hopper", "Alan Turing"]) == [0, 1, 2]
+    # Primary and cross-listed categories both match
+    assert matching(index, categories=["cs.LG"]) == [1]
+    assert matching(index, categories=["stat.ML"]) == [1]
+    assert matching(index, categories=["cs.AI"]) == [0, 2]
+    assert matching(index, arxiv_ids=["2305.00001", "2406.00004v1", "9999.99999"]) == [0, 3]
+    # Different fields must all match
+    assert matching(index, authors=["Ada Lovelace"], date_from="2024") == [3]
+    assert matching(index, authors=["Alan Turing"], categories=["cs.AI"], date_to="2023-06") == [0]
+    assert matching(index, authors=["Nobody"], categories=["cs.CL"]) == []
+
+
+def test_papers_without_primary_category():
+    # Listings that never had the column at all
+    papers = [{key: value for key, value in paper.items() if key != 'primary_category'} for paper in PAPERS]
+    index = filter_index(papers)
+    assert 'primary_category' not in PaperTable(papers).columns
+    assert matching(index, categories=["cs.CL"]) == [0]
+    assert matching(index, categories=["cs.LG"]) == []
+    assert matching(index, categories=["stat.ML"]) == [1]
+    # Papers with neither primary nor listed categories only match other fields
+    assert matching(filter_index(), authors=["Ada Lovelace"]) == [0, 3]
+
+
+def test_selected_chunks_are_representatives_of_matching_papers():
+    index = filter_index()
+    chunk_filter = index.select(normalize_filters(arxiv_ids=["2406.00004"]))
+    assert chunk_filter.ids.tolist() == [0, 6]
+    assert np.flatnonzero(chunk_filter.mask()).tolist() == [0, 6]
+    assert chunk_filter.allows_paper(3) and not chunk_filter.allows_paper(0)
+    assert not chunk_filter.allows_paper(-1)
+    assert len(index.select(normalize_filters(authors=["Nobody"]))) == 0
+
+
+@pytest.mark.parametrize("index_type", ['flat_ip', 'flat_l2'])
+def test_selector_search_matches_exact_scan(app, tmp_path, index_type):
+    papers = synthetic_papers(200, n_authors=50)
+    system = app.ArxivRAGSystem(cache_path=str(tmp_path / "embedding_cache.sqlite"), index_type=index_type,
+                                rerank_model=None)
+    system.papers = PaperTable(papers)
+    system.embeddings = synthetic_corpus(2000, 32, n_clusters=20)
+    system.chunk_to_paper = np.repeat(np.arange(len(papers), dtype=np.int32), 10)
+    system.chunk_canonical = np.arange(len(system.embeddings), dtype=np.int64)
+    system.build_faiss_index()
+    queries = prepare_vectors(synthetic_corpus(5, 32, seed=1), index_type)
+
+    for filters in (normalize_filters(authors=["Author 1"]), normalize_filters(arxiv_ids=[f"2000.{i:05d}" for i in range(0, 200, 7)]),
+                    normalize_filters(date_from="2022-03", date_to="2023"),
+                    normalize_filters(authors=["Author 2"], date_from="2021")):
+        chunk_filter = system.select_chunks(filters)
+        assert 10 < len(chunk_filter) < len(system.embeddings)
+        system.index_params['exact_filter_limit'] = 0
+        selected_scores, selected_ids = system.dense_search(queries, 10, chunk_filter)
+        assert chunk_filter.id_selector is not None  # The FAISS search ran with the bitmap selector
+        system.index_params['exact_filter_limit'] = len(system.embeddings)
+        exact_scores, exact_ids = system.dense_search(queries, 10, chunk_filter)
+        np.testing.assert_array_equal(selected_ids, exact_ids)
+        np.testing.assert_allclose(selected_scores, exact_scores, rtol=1e-4, atol=1e-5)
+        assert chunk_filter.mask()[exact_ids].all()
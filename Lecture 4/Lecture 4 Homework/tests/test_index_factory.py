@@ -0,0 +1,126 @@
+import faiss
+import numpy as np
+import pytest
+from index_factory import (INDEX_TYPES, build_index, create_index, index_memory_bytes, prepare_vectors, rescore,
+                           resolve_params, search_parameters, similarity_from_distance, supports_removal,
+                           supports_selector, synthetic_corpus)
+
+# Minimum recall@10 against exact search on the clustered corpus below, with default parameters
+MIN_RECALL = {'flat_l2': 1.0, 'flat_ip': 1.0, 'ivf_flat': 0.9, 'hnsw': 0.9, 'sq_fp16': 0.95, 'sq_int8': 0.9,
+              'ivf_pq': 0.4, 'pq': 0.4}
+
+
+@pytest.fixture(scope="module")
+def corpus():
+    vectors = synthetic_corpus(3000, 64, n_clusters=32)
+    queries = synthetic_corpus(50, 64, n_clusters=32, seed=1)
+    # Chunk IDs are sparse once chunks are removed, so the indexes are keyed by arbitrary IDs
+    ids = np.arange(len(vectors), dtype='int64') * 3 + 7
+    truth = ids[np.argsort(-(queries @ vectors.T), axis=1)[:, :10]]
+    return vectors, queries, ids, truth
+
+
+@pytest.fixture(scope="module")
+def indexes(corpus):
+    """One index per type over the corpus, built on first use; tests that modify one get a copy."""
+    vectors, _, ids, _ = corpus
+    built = {}
+
+    def get(index_type, copy=False):
+        if index_type not in built:
+            built[index_type] = build_index(index_type, prepare_vectors(vectors, index_type), ids)
+        return faiss.deserialize_index(faiss.serialize_index(built[index_type])) if copy else built[index_type]
+    return get
+
+
+def recall(found, truth):
+    return np.mean([len(set(row.tolist()) & set(expected.tolist())) / len(expected)
+                    for row, expected in zip(found, truth)])
+
+
+@pytest.mark.parametrize("index_type", INDEX_TYPES)
+def test_index_types_search_by_chunk_id(corpus, indexes, index_type):
+    vectors, queries, ids, truth = corpus
+    index = indexes(index_type)
+    assert index.ntotal == len(vectors)
+    distances, found = index.search(prepare_vectors(queries, index_type), 10)
+    assert np.isin(found, ids).all()
+    assert recall(found, truth) >= MIN_RECALL[index_type]
+    # Scores shown to users grow with similarity whatever the metric
+    scores = np.vectorize(lambda d: similarity_from_distance(d, index_type))(distances)
+    assert (np.diff(scores, axis=1) <= 1e-6).all()
+    # The estimate reads no vectors but stays close to the serialized size
+    assert 0.5 < index_memory_bytes(index) / faiss.serialize_index(index).size < 2
+
+    restored = faiss.deserialize_index(faiss.serialize_index(index))
+    np.testing.assert_array_equal(restored.search(prepare_vectors(queries, index_type), 10)[1], found)
+
+
+@pytest.mark.parametrize("index_type", [t for t in INDEX_TYPES if supports_removal(t)])
+def test_removed_ids_are_never_returned(corpus, indexes, index_type):
+    vectors, queries, _, truth = corpus
+    index = indexes(index_type, copy=True)
+    removed = np.unique(truth[:, :5])
+    index.remove_ids(removed)
+    assert index.ntotal == len(vectors) - len(removed)
+    _, found = index.search(prepare_vectors(queries, index_type), 10)
+    assert not np.isin(found, removed).any() and (found >= 0).all()
+
+
+@pytest.mark.parametrize("index_type", [t for t in INDEX_TYPES if supports_selector(t)])
+def test_selector_restricts_search(corpus, indexes, index_type):
+    _, queries, ids, _ = corpus
+    index = indexes(index_type)
+    allowed = ids[::10]
+    params = search_parameters(index, {}, faiss.IDSelectorBatch(allowed))
+    _, found = index.search(prepare_vectors(queries, index_type), 10, params=params)
+    assert np.isin(found[found >= 0], allowed).all()
+    assert (found >= 0).mean() > 0.5
+
+
+def test_invalid_index_configuration_is_rejected():
+    with pytest.raises(ValueError, match="Unknown index type"):
+        create_index('annoy', 64, 100)
+    with pytest.raises(ValueError, match="must divide"):
+        create_index('ivf_pq', 60, 100)
+    with pytest.raises(ValueError, match="Unknown index parameters"):
+        resolve_params({'nprobes': 4})
+    # Small corpora get fewer IVF lists and PQ bits than configured
+    index = create_index('ivf_pq', 64, 200)
+    assert index.nlist == 5 and index.pq.nbits == 7
+
+
+def test_rescore_orders_candidates_by_exact_similarity():
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((50, 16)).astype('float32') * 3
+    queries = prepare_vectors(rng.standard_normal((2, 16)), 'flat_ip')
+    candidates = np.array([[4, 9, 4, 30, -1, 7], [-1, -1, -1, -1, -1, -1]])
+    scores, ids = rescore(vectors, queries, candidates, 3, normalize=True)
+    unit = prepare_vectors(vectors, 'flat_ip')
+    exact = unit[[4, 9, 30, 7]] @ queries[0]
+    order = np.argsort(-exact)[:3]
+    assert ids[0].tolist() == np.array([4, 9, 30, 7])[order].tolist()
+    np.testing.assert_allclose(scores[0], exact[order], rtol=1e-5)
+    # Rows without candidates stay padded
+    assert ids[1].tolist() == [-1, -1, -1] and np.isneginf(scores[1]).all()
+
+
+def test_app_dense_search_rescores_quantized_results(app, tmp_path):
+    embeddings = synthetic_corpus(2000, 32, n_clusters=20) * 5  # Raw, unnormalized embeddings
+    system = app.ArxivRAGSystem(cache_path=str(tmp_path / "embedding_cache.sqlite"), index_type='sq_int8',
+                                index_params={'rescore': 4}, rerank_model=None)
+    system.embeddings = embeddings
+    system.chunk_to_paper = np.zeros(len(embeddings), dtype=np.int32)
+    system.chunk_canonical = np.arange(len(embeddings), dtype=np.int64)
+    system.build_faiss_index()
+    queries = prepare_vectors(embeddings[:5] + 0.1, 'sq_int8')
+
+    similarities, indices = system.dense_search(queries, 10)
+    _, candidates = system.faiss_index.search(queries, 40)
+    expected_scores, expected_ids = rescore(embeddings, queries, candidates, 10, normalize=True)
+    np.testing.assert_array_equal(indices, expected_ids)
+    np.testing.assert_allclose(similarities, expected_scores, rtol=1e-6)
+    # The scores are exact cosine similarities, not the int8 approximations
+    unit = prepare_vectors(embeddings, 'flat_ip')
+    for row, ids, scores in zip(queries, indices, similarities):
+        np.testing.assert_allclose(scores, unit[ids] @ row, rtol=1e-5)
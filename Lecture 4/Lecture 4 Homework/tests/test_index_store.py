@@ -0,0 +1,106 @@
+import json
+import os
+
+import numpy as np
+import pytest
+from benchmark import fixture_papers
+from conftest import HashingModel
+from index_store import MMAP_FLAGS, load_index
+
+QUERIES = ["page 2 of paper 3", "synthetic benchmark text", "retrieval"]
+
+
+def make_system(app, encoding, tmp_path, model):
+    system = app.ArxivRAGSystem(cache_path=str(tmp_path / "embedding_cache.sqlite"), rerank_model=None,
+                                embedding_processes=0)
+    system.resources['encoder'] = encoding
+    system.embedding_engine.loaded_model = model
+    return system
+
+
+def snapshot(system):
+    embeddings = system.encode_queries(QUERIES)
+    return {mode: system.search_embeddings(embeddings, top_k=6, queries=QUERIES, mode=mode)
+            for mode in ("dense", "lexical", "hybrid")}
+
+
+@pytest.fixture
+def saved(app, byte_encoding, pdf_server, tmp_path):
+    """A system over four papers, saved to tmp_path / "index"."""
+    model = HashingModel()
+    system = make_system(app, byte_encoding, tmp_path, model)
+    system.add_papers(fixture_papers(4, pdf_server.url))
+    directory = str(tmp_path / "index")
+    system.save_system(directory)
+    return system, directory, model
+
+
+def test_save_then_mmap_load_round_trip(app, byte_encoding, tmp_path, saved):
+    system, directory, model = saved
+    assert sorted(os.listdir(tmp_path)) == ["embedding_cache.sqlite", "index"]  # No .tmp or .old left
+
+    loaded = make_system(app, byte_encoding, tmp_path, model)
+    assert loaded.load_system(directory)
+    assert isinstance(loaded.embeddings, np.memmap)
+    assert isinstance(loaded.chunks.segments[0][0], np.memmap)
+    assert loaded.index_mmapped == (MMAP_FLAGS is not None)
+    np.testing.assert_array_equal(loaded.embeddings, system.embeddings)
+    assert [loaded.chunks[i] for i in range(len(loaded.chunks))] == \
+           [system.chunks[i] for i in range(len(system.chunks))]
+    for name in ('chunk_to_paper', 'chunk_spans', 'chunk_pages', 'chunk_fingerprints', 'chunk_canonical'):
+        np.testing.assert_array_equal(getattr(loaded, name), getattr(system, name))
+    assert list(loaded.papers) == list(system.papers)
+    assert loaded.index_type == system.index_type and loaded.faiss_index.ntotal == system.faiss_index.ntotal
+    assert snapshot(loaded) == snapshot(system)
+
+    in_memory = make_system(app, byte_encoding, tmp_path, model)
+    in_memory.load_system(directory, mmap=False)
+    assert not isinstance(in_memory.embeddings, np.memmap) and not in_memory.index_mmapped
+    assert snapshot(in_memory) == snapshot(system)
+
+
+def test_updating_a_loaded_index_leaves_its_files_untouched(app, byte_encoding, pdf_server, tmp_path, saved):
+    system, directory, model = saved
+    before = snapshot(system)
+    loaded = make_system(app, byte_encoding, tmp_path, model)
+    loaded.load_system(directory)
+    loaded.remove_papers(["bench.00000"])
+    loaded.add_papers(fixture_papers(6, pdf_server.url)[4:])
+    assert not loaded.index_mmapped
+    assert snapshot(loaded) != before
+
+    reloaded = make_system(app, byte_encoding, tmp_path, model)
+    reloaded.load_system(directory)
+    assert snapshot(reloaded) == before
+    assert (reloaded.chunk_to_paper >= 0).all() and len(reloaded.papers) == 4
+
+    # Saving over the directory replaces it as a whole
+    loaded.save_system(directory)
+    reloaded.load_system(directory)
+    assert snapshot(reloaded) == snapshot(loaded)
+    assert len(reloaded.papers) == 6 and reloaded.papers[0].get('removed')
+
+
+def test_unknown_format_version_is_refused(saved):
+    _, directory, _ = saved
+    path = os.path.join(directory, 'manifest.json')
+    with open(path) as f:
+        manifest = json.load(f)
+    manifest['format_version'] += 1
+    with open(path, 'w') as f:
+        json.dump(manifest, f)
+    with pytest.raises(ValueError, match="format version"):
+        load_index(directory)
+
+
+def test_files_missing_from_older_indexes_get_defaults(saved):
+    system, directory, _ = saved
+    for name in ('chunk_spans.npy', 'chunk_pages.npy', 'chunk_fingerprints.npy', 'chunk_canonical.npy',
+                 'paper_embeddings.npy'):
+        os.remove(os.path.join(directory, name))
+    data = load_index(directory)
+    n_chunks = len(system.chunks)
+    assert (data['chunk_spans'] == -1).all() and data['chunk_spans'].shape == (n_chunks, 2)
+    assert (data['chunk_pages'] == -1).all() and data['chunk_pages'].shape == (n_chunks, 2)
+    assert data['chunk_fingerprints'] is None and data['paper_embeddings'] is None
+    np.testing.assert_array_equal(data['chunk_canonical'], np.arange(n_chunks))
@@ -0,0 +1,126 @@
+import os
+import subprocess
+import sys
+import threading
+
+import pytest
+
+import index_versions
+from conftest import HOMEWORK_DIR
+from index_versions import (KEEP_VERSIONS, POINTER, BuildLock, current_dir, next_dir, prune, publish,
+                            read_pointer, versions)
+
+
+def save_version(root):
+    """Stand-in for `save_system`: create the next version directory with a manifest."""
+    directory = next_dir(root)
+    os.makedirs(directory)
+    with open(os.path.join(directory, 'manifest.json'), 'w') as f:
+        f.write('{}')
+    return directory
+
+
+def test_publish_swaps_the_pointer_atomically(tmp_path, monkeypatch):
+    root = str(tmp_path)
+    assert current_dir(root) is None
+    first = save_version(root)
+    publish(root, first)
+    assert current_dir(root) == first
+    assert sorted(os.listdir(root)) == [POINTER, 'versions']  # No temp pointer left behind
+
+    # A publish that dies before the rename leaves the previous version served
+    second = save_version(root)
+
+    def crash(src, dst):
+        raise OSError("killed")
+    monkeypatch.setattr(index_versions.os, 'replace', crash)
+    with pytest.raises(OSError):
+        publish(root, second)
+    monkeypatch.undo()
+    assert current_dir(root) == first
+
+    # Readers polling during publishes only ever see a whole version name
+    seen, stop = set(), threading.Event()
+
+    def poll():
+        while not stop.is_set():
+            seen.add(read_pointer(root))
+    reader = threading.Thread(target=poll)
+    reader.start()
+    try:
+        for _ in range(30):
+            publish(root, save_version(root))
+    finally:
+        stop.set()
+        reader.join()
+    assert None not in seen and all(name.startswith('v') and len(name) == 7 for name in seen)
+    assert current_dir(root) == os.path.join(root, 'versions', 'v000032')
+
+
+def test_prune_keeps_the_current_and_previous_versions(tmp_path):
+    root = str(tmp_path)
+    assert KEEP_VERSIONS == 2
+    for _ in range(4):
+        publish(root, save_version(root))
+    assert versions(root) == ['v000003', 'v000004']
+    assert current_dir(root).endswith('v000004')
+
+    # A version rolled back to is never pruned while it is published
+    publish(root, os.path.join(root, 'versions', 'v000003'))
+    save_version(root)
+    save_version(root)
+    prune(root)
+    assert versions(root) == ['v000003', 'v000005', 'v000006']
+    publish(root, save_version(root), keep=1)
+    assert versions(root) == ['v000007']
+    # Versions keep counting up after pruning
+    assert next_dir(root).endswith('v000008')
+
+
+def test_index_saved_before_versioning_is_served_from_root(tmp_path):
+    root = str(tmp_path)
+    with open(tmp_path / 'manifest.json', 'w') as f:
+        f.write('{}')
+    assert current_dir(root) == root
+    (tmp_path / POINTER).write_text("not-a-version\n")
+    assert current_dir(root) == root
+
+
+def try_lock_in_subprocess(path):
+    code = ("import sys; sys.path.insert(0, sys.argv[1]); from index_versions import BuildLock; "
+            "print(BuildLock(sys.argv[2]).acquire())")
+    result = subprocess.run([sys.executable, "-c", code, HOMEWORK_DIR, path], capture_output=True, text=True,
+                            check=True)
+    return result.stdout.strip() == "True"
+
+
+@pytest.mark.skipif(index_versions.fcntl is None, reason="builds are only locked with flock")
+def test_second_build_is_refused_while_the_lock_is_held(tmp_path):
+    path = str(tmp_path / "index" / ".build.lock")
+    lock = BuildLock(path)
+    assert lock.acquire()
+    assert lock.owner() == os.getpid()
+    assert not BuildLock(path).acquire()
+    assert not try_lock_in_subprocess(path)
+
+    lock.release()
+    assert try_lock_in_subprocess(path)  # Released again when that process exits
+    other = BuildLock(path)
+    assert other.acquire()
+    other.release()
+
+
+@pytest.mark.skipif(index_versions.fcntl is None, reason="builds are only locked with flock")
+def test_app_refuses_a_build_while_another_process_holds_the_lock(app, tmp_path, monkeypatch):
+    path = str(tmp_path / ".build.lock")
+    monkeypatch.setattr(app, 'build_lock', BuildLock(path))
+    monkeypatch.setattr(app, 'build_runner', app.BuildRunner())
+    other = BuildLock(path)
+    assert other.acquire()
+    ran = []
+    try:
+        response = app.start_build("rebuild", ["build"], ran.append)
+    finally:
+        other.release()
+    assert f"pid {os.getpid()}" in response['error']
+    assert not ran and app.build_runner.job is None
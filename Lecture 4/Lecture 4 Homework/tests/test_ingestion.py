@@ -0,0 +1,57 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from benchmark import fixture_papers
+from metadata_store import PaperTable
+
+
+def make_system(app, encoding, tmp_path, papers):
+    system = app.ArxivRAGSystem(cache_path=str(tmp_path / "embedding_cache.sqlite"), rerank_model=None)
+    system.resources['encoder'] = encoding
+    system.papers = PaperTable(papers)
+    return system
+
+
+def chunk_texts(system):
+    return [system.chunks[i] for i in range(len(system.chunks))]
+
+
+def test_pipelined_ingestion_matches_serial(app, byte_encoding, pdf_server, tmp_path):
+    papers = fixture_papers(6, pdf_server.url)
+    papers[2]['pdf_url'] = f"{pdf_server.url}/missing.pdf"
+
+    serial = make_system(app, byte_encoding, tmp_path, papers)
+    serial.process_papers()
+    pipelined = make_system(app, byte_encoding, tmp_path, papers)
+    stats = pipelined.process_papers_pipelined(max_downloads=3, extract_workers=2, max_pending=2)
+
+    # The 404 paper is skipped; the rest are appended in paper order
+    assert stats['papers'] == 5
+    assert chunk_texts(pipelined) == chunk_texts(serial)
+    np.testing.assert_array_equal(pipelined.chunk_to_paper, serial.chunk_to_paper)
+    np.testing.assert_array_equal(pipelined.chunk_spans, serial.chunk_spans)
+    np.testing.assert_array_equal(pipelined.chunk_pages, serial.chunk_pages)
+    assert sorted(set(pipelined.chunk_to_paper.tolist())) == [0, 1, 3, 4, 5]
+    assert pipelined.chunk_pages.min() >= 0 and pipelined.chunk_pages.max() <= 2
+    assert (pipelined.chunk_pages[:, 0] <= pipelined.chunk_pages[:, 1]).all()
+    assert all(f"Paper {paper_id}, page 1" in chunk_texts(pipelined)[first]
+               for paper_id, first in zip(*np.unique(pipelined.chunk_to_paper, return_index=True)))
+
+
+def test_failed_extract_submit_releases_slot(app, byte_encoding, pdf_server, tmp_path, monkeypatch):
+    class FailingPool(ThreadPoolExecutor):
+        def submit(self, fn, *args, **kwargs):
+            if fn.__name__ == 'extract':
+                raise RuntimeError("extract pool is shut down")
+            return super().submit(fn, *args, **kwargs)
+
+    monkeypatch.setattr(app, 'ThreadPoolExecutor', FailingPool)
+    system = make_system(app, byte_encoding, tmp_path, fixture_papers(6, pdf_server.url))
+    result = {}
+    # With one slot, a leaked slot would block the second download forever
+    worker = threading.Thread(target=lambda: result.update(
+        system.process_papers_pipelined(max_downloads=2, extract_workers=1, max_pending=1)), daemon=True)
+    worker.start()
+    worker.join(timeout=60)
+    assert not worker.is_alive()
+    assert result['papers'] == 0 and len(system.chunks) == 0
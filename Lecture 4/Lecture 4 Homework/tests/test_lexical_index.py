@@ -0,0 +1,103 @@
+import numpy as np
+from lexical_index import LexicalIndex, synthetic_texts
+
+
+def build(doc_ids, texts):
+    index = LexicalIndex()
+    index.add_documents(list(doc_ids), list(texts))
+    index.merge()
+    return index
+
+
+def frequencies(index):
+    """Document frequency per term (term IDs depend on insertion order)."""
+    return {term: int(df) for term, df in zip(index.terms, index.df) if df}
+
+
+def assert_same_results(index, fresh, queries, k=10):
+    for query in queries:
+        for prune in (True, False):
+            ids, scores = index.search(query, k, prune=prune)
+            fresh_ids, fresh_scores = fresh.search(query, k, prune=prune)
+            np.testing.assert_allclose(scores, fresh_scores, rtol=1e-5)
+            if len(np.unique(scores)) == len(scores):
+                assert set(ids.tolist()) == set(fresh_ids.tolist())
+
+
+def test_deleted_chunks_leave_document_frequencies():
+    texts = synthetic_texts(300, vocab_size=500, doc_length=50)
+    removed = list(range(0, 300, 3))
+    kept = [i for i in range(300) if i % 3]
+    queries = ["w0 w1 w7", "w2 w30", "w5 w11 w120"]
+
+    for with_texts in (True, False):
+        index = build(range(300), texts)
+        index.delete(removed, [texts[i] for i in removed] if with_texts else None)
+        fresh = build(kept, [texts[i] for i in kept])
+        assert frequencies(index) == frequencies(fresh)
+        assert_same_results(index, fresh, queries)
+        # Common terms keep a positive idf
+        assert (index.search("w0", 5)[1] > 0).all()
+
+        index.merge()
+        assert not np.isin(index.docs, removed).any()
+        assert frequencies(index) == frequencies(fresh)
+        assert_same_results(index, fresh, queries)
+
+
+def test_delete_then_add_then_save(tmp_path):
+    texts = synthetic_texts(200, vocab_size=300, doc_length=40)
+    index = build(range(150), texts[:150])
+    index.delete([3, 4, 5], texts[3:6])
+    index.add_documents(list(range(150, 200)), texts[150:])
+    index.save(str(tmp_path))
+    loaded = LexicalIndex.load(str(tmp_path))
+
+    kept = [i for i in range(200) if i not in (3, 4, 5)]
+    fresh = build(kept, [texts[i] for i in kept])
+    assert frequencies(loaded) == frequencies(fresh)
+    assert len(loaded.docs) == len(fresh.docs)
+    assert_same_results(loaded, fresh, ["w0 w1", "w3 w9 w40"])
+
+
+def assert_pruning_exact(index, queries, k=10):
+    for query in queries:
+        ids, scores = index.search(query, k, prune=True)
+        exact_ids, exact_scores = index.search(query, k, prune=False)
+        np.testing.assert_allclose(scores, exact_scores, rtol=1e-5)
+
+
+def test_ids_added_below_indexed_ones():
+    texts = synthetic_texts(300, vocab_size=400, doc_length=40)
+    queries = ["w0 w1 w7", "w2 w30", "w5 w11 w120", "w3 w4 w9 w60"]
+    index = build(range(100, 300), texts[100:])
+    # Like a promoted duplicate: IDs below the indexed ones, unsorted, left pending
+    index.merge_ratio = 1e9
+    late = list(range(99, -1, -1))
+    index.add_documents(late, [texts[i] for i in late])
+    assert index.pending
+    fresh = build(range(300), texts)
+    assert_pruning_exact(index, queries)
+    assert_same_results(index, fresh, queries)
+
+    index.merge()
+    assert index.is_ordered()
+    assert_same_results(index, fresh, queries)
+
+
+def test_unordered_index_saved_earlier_is_sorted_on_load(tmp_path):
+    texts = synthetic_texts(120, vocab_size=200, doc_length=30)
+    index = build(range(60, 120), texts[60:])
+    # Merge the out-of-order tail without sorting, as merges before the fix did
+    index.merge_ratio = 1e9
+    index.add_documents(list(range(60)), texts[:60])
+    index.unordered = False
+    index.merge()
+    assert not index.is_ordered()
+    index.save(str(tmp_path))
+    meta_path = tmp_path / "lexical_terms.json"
+    meta_path.write_text(meta_path.read_text().replace(', "ordered": true', ''))
+
+    loaded = LexicalIndex.load(str(tmp_path))
+    assert loaded.is_ordered()
+    assert_same_results(loaded, build(range(120), texts), ["w0 w1", "w3 w9 w40", "w2 w5"])
@@ -0,0 +1,72 @@
+import pytest
+from metadata_store import ChunkStore, PaperTable, group_hits
+
+
+def paper(i, **fields):
+    return {'title': f"Paper {i}", 'authors': ["Ada Lovelace", f"Author {i}"], 'summary': f"Summary {i}",
+            'pdf_url': f"http://localhost/{i}.pdf", 'published': "2024-01-01", 'arxiv_id': f"2401.{i:05d}",
+            **fields}
+
+
+def test_group_hits_orders_papers_by_best_hit_and_pages():
+    table = PaperTable([paper(i) for i in range(4)])
+    hits = [{'chunk_id': 10, 'paper_id': 2, 'similarity_score': 0.9},
+            {'chunk_id': 3, 'paper_id': 0, 'similarity_score': 0.8, 'also_in': [3]},
+            {'chunk_id': 11, 'paper_id': 2, 'similarity_score': 0.7},
+            {'chunk_id': 14, 'paper_id': 3, 'similarity_score': 0.6},
+            {'chunk_id': 4, 'paper_id': 0, 'similarity_score': 0.5}]
+    looked_up = []
+
+    def metadata(paper_id):
+        looked_up.append(paper_id)
+        return table.metadata(paper_id)
+
+    page = group_hits(hits, metadata, offset=0, limit=2)
+    assert (page['total'], page['offset'], page['limit']) == (3, 0, 2)
+    assert [group['paper_id'] for group in page['papers']] == [2, 0]
+    assert [hit['chunk_id'] for hit in page['papers'][0]['hits']] == [10, 11]
+    assert all('paper_id' not in hit for group in page['papers'] for hit in group['hits'])
+    assert page['papers'][1]['title'] == "Paper 0" and page['papers'][1]['authors'] == ["Ada Lovelace", "Author 0"]
+    # Copies of other papers are resolved; only papers on the page (or named by it) are looked up
+    assert page['papers'][1]['hits'][0]['also_in'] == [{'paper_id': 3, 'title': "Paper 3",
+                                                        'arxiv_id': "2401.00003"}]
+    assert sorted(set(looked_up)) == [0, 2, 3] and 1 not in looked_up
+    assert hits[1]['also_in'] == [3]  # The caller's hits are left as they were
+
+    page = group_hits(hits, table.metadata, offset=2, limit=2)
+    assert page['total'] == 3 and [group['paper_id'] for group in page['papers']] == [3]
+    assert group_hits([], table.metadata) == {'total': 0, 'offset': 0, 'limit': 10, 'papers': []}
+
+
+def test_paper_table_shares_authors_and_keeps_ids_of_removed_papers():
+    table = PaperTable([paper(i) for i in range(3)])
+    assert table.value(0, 'authors')[0] is table.value(2, 'authors')[0]
+    table.mark_removed(1)
+    assert len(table) == 3 and table.live_count() == 2
+    assert table[1]['removed'] and 'removed' not in table[2]
+    assert sorted(table.by_arxiv_id.items()) == [("2401.00000", 0), ("2401.00002", 2)]
+    assert table.metadata(2) == {'paper_id': 2, 'title': "Paper 2", 'authors': ["Ada Lovelace", "Author 2"],
+                                 'summary': "Summary 2", 'pdf_url': "http://localhost/2.pdf",
+                                 'arxiv_id': "2401.00002", 'published': "2024-01-01"}
+
+    # Optional fields appear for later papers and are back-filled with None
+    table.append(paper(3, primary_category='cs.CL'))
+    assert table.value(0, 'primary_category') is None and table[3]['primary_category'] == 'cs.CL'
+    restored = PaperTable.from_columns(table.to_columns())
+    assert list(restored) == list(table)
+    assert restored.by_arxiv_id == table.by_arxiv_id and restored.live_count() == 3
+
+
+def test_chunk_store_reads_across_segments():
+    store = ChunkStore.from_strings(["first", "zweite Straße", ""])
+    store.extend(["naïve — fourth"])
+    store.extend([])
+    store.append("fifth")
+    assert len(store) == 5 and len(store.segments) == 3
+    assert list(store) == ["first", "zweite Straße", "", "naïve — fourth", "fifth"]
+    assert store[-2] == "naïve — fourth" and store[1:3] == ["zweite Straße", ""]
+    store[0] = ""
+    assert store[0] == "" and store[1] == "zweite Straße"
+    with pytest.raises(IndexError):
+        store[5]
+    assert store.nbytes() == len("firstzweite Straßenaïve — fourthfifth".encode('utf-8')) + 8 * (4 + 2 + 2)
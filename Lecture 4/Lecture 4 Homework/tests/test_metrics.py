@@ -0,0 +1,19 @@
+import numpy as np
+from lexical_index import synthetic_texts
+
+
+def test_memory_usage_does_not_compute_fingerprints(app, tmp_path):
+    system = app.ArxivRAGSystem(cache_path=str(tmp_path / "embedding_cache.sqlite"), rerank_model=None)
+    system.chunks.extend(synthetic_texts(20, vocab_size=500, doc_length=30))
+    system.chunk_to_paper = np.zeros(20, dtype=np.int32)
+    system.chunk_canonical = np.arange(20, dtype=np.int64)
+    # As loaded from an index saved before fingerprints existed
+    system.chunk_fingerprints = None
+
+    usage = system.memory_usage()
+    assert system.chunk_fingerprints is None
+    assert usage['chunk_metadata'] == system.chunk_to_paper.nbytes + system.chunk_canonical.nbytes
+    assert usage['faiss'] == 0
+
+    system.ensure_fingerprints()
+    assert system.memory_usage()['chunk_metadata'] == usage['chunk_metadata'] + 20 * 8
@@ -0,0 +1,18 @@
+import numpy as np
+from paper_index import normalize_rows, select_papers
+
+
+def test_select_papers_respects_allowed_of_any_length():
+    rng = np.random.default_rng(0)
+    papers = normalize_rows(rng.standard_normal((10, 8)))
+    queries = papers[[3, 8]]
+
+    assert [selected.tolist() for selected in select_papers(papers, queries, 1)] == [[3], [8]]
+    # A mask shorter than the paper matrix leaves the papers past its end out
+    short = select_papers(papers, queries, 10, np.ones(5, dtype=bool))
+    assert [selected.tolist() for selected in short] == [[0, 1, 2, 3, 4]] * 2
+    # A longer one is cut to the papers that exist
+    allowed = np.ones(12, dtype=bool)
+    allowed[3] = False
+    selected = select_papers(papers, queries, 3, allowed)
+    assert 3 not in selected[0] and 8 in selected[1] and all(len(ids) == 3 for ids in selected)
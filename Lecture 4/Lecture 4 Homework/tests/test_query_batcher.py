@@ -0,0 +1,83 @@
+import asyncio
+
+import numpy as np
+
+from query_batcher import LRUCache, QueryBatcher
+
+
+class FakeSystem:
+    """Records every encode and search call; hits name the query, options and rank they came from."""
+
+    def __init__(self):
+        self.encoded = []
+        self.searches = []
+
+    def encode_queries(self, queries):
+        self.encoded.append(list(queries))
+        return np.ones((len(queries), 4), dtype=np.float32)
+
+    def search_embeddings(self, query_embeddings, top_k, queries, mode, rerank, **options):
+        self.searches.append({'queries': list(queries), 'top_k': top_k, 'mode': mode, **options})
+        return [[{'query': query, 'mode': mode, 'filters': options.get('filters'), 'rank': rank + 1}
+                 for rank in range(top_k)] for query in queries]
+
+
+def run_concurrently(batcher, requests):
+    async def main():
+        return await asyncio.gather(*(batcher.search(query, **options) for query, options in requests))
+    return asyncio.run(main())
+
+
+def test_shared_batch_returns_each_query_its_own_top_k():
+    system = FakeSystem()
+    batcher = QueryBatcher(lambda: system, max_wait_ms=50)
+    few, many = run_concurrently(batcher, [("first", {'top_k': 2}), ("second", {'top_k': 7})])
+
+    assert len(system.searches) == 1
+    assert system.searches[0]['queries'] == ["first", "second"]
+    assert system.searches[0]['top_k'] == 7
+    assert [hit['rank'] for hit in few] == [1, 2]
+    assert [hit['rank'] for hit in many] == list(range(1, 8))
+    assert {hit['query'] for hit in few} == {"first"} and {hit['query'] for hit in many} == {"second"}
+    assert batcher.stats()['batches'] == 1 and batcher.stats()['queries'] == 2
+
+
+def test_queries_with_different_mode_or_filters_never_share_a_search():
+    system = FakeSystem()
+    batcher = QueryBatcher(lambda: system, max_wait_ms=50)
+    recent = (('published_after', '2023-01-01'),)
+    older = (('published_before', '2020-01-01'),)
+    requests = [("q", {'mode': "dense"}), ("q", {'mode': "lexical"}),
+                ("q", {'filters': recent}), ("q", {'filters': older}), ("other", {'filters': recent})]
+    results = run_concurrently(batcher, requests)
+
+    # One batch and one encode, but a separate search per (mode, filters)
+    assert batcher.stats()['batches'] == 1
+    assert system.encoded == [["q", "other"]]
+    searched = sorted((search['mode'], search.get('filters') or ()) for search in system.searches)
+    assert searched == sorted([("dense", ()), ("lexical", ()), ("dense", recent), ("dense", older)])
+    filtered = [search for search in system.searches if search.get('filters') == recent]
+    assert filtered[0]['queries'] == ["q", "other"]
+    for (query, options), hits in zip(requests, results):
+        assert {(hit['query'], hit['mode'], hit['filters']) for hit in hits} == \
+               {(query, options.get('mode', "dense"), options.get('filters'))}
+
+
+def test_repeated_queries_reuse_cached_embeddings():
+    system = FakeSystem()
+    batcher = QueryBatcher(lambda: system, max_wait_ms=0)
+    run_concurrently(batcher, [("q", {})])
+    run_concurrently(batcher, [("q", {'mode': "lexical"})])
+    assert system.encoded == [["q"]]
+    assert batcher.embedding_cache.hits == 1
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(max_size=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+    assert len(cache) == 2 and (cache.hits, cache.misses) == (3, 1)
@@ -0,0 +1,78 @@
+import numpy as np
+
+from result_cache import ResultCache
+
+DENSE = ("dense", False, None, None, 0)
+
+
+def hits_for(label, n=3):
+    return [{'chunk_id': f"{label}:{i}", 'similarity_score': 1.0 - i / 10} for i in range(n)]
+
+
+def at_cosine(cosine):
+    """A unit vector with the given cosine similarity to the first axis."""
+    return np.array([cosine, np.sqrt(1 - cosine ** 2), 0.0, 0.0], dtype=np.float32)
+
+
+def test_context_separates_entries():
+    system = object()
+    cache = ResultCache()
+    cache.use(system)
+    vector = np.array([1.0, 0.0, 0.0, 0.0], dtype=np.float32)
+    contexts = [DENSE, ("lexical", False, None, None, 0), ("dense", True, None, None, 0),
+                ("dense", False, ("cs.CL",), None, 0), ("dense", False, None, (('categories', ('cs.CL',)),), 0),
+                ("dense", False, None, None, 5)]
+    for i, context in enumerate(contexts):
+        cache.put("What is attention?", context, 3, hits_for(i), 0.1, system, vector)
+    for i, context in enumerate(contexts):
+        assert cache.get("what is  attention", context, 3, system) == hits_for(i)
+        assert cache.get_similar(vector, context, 3, system) == hits_for(i)
+    assert cache.get("what is attention", ("hybrid", False, None, None, 0), 3, system) is None
+    assert cache.get_similar(vector, ("hybrid", False, None, None, 0), 3, system) is None
+
+
+def test_swapping_the_system_drops_entries():
+    old, new = object(), object()
+    cache = ResultCache()
+    cache.use(old)
+    cache.put("q", DENSE, 3, hits_for("old"), 0.1, old)
+    assert cache.get("q", DENSE, 3, old) == hits_for("old")
+
+    assert cache.get("q", DENSE, 3, new) is None
+    assert len(cache) == 0 and cache.stats()['invalidations'] == 1
+    # Results computed on the replaced system are not cached for the new one
+    cache.put("q", DENSE, 3, hits_for("old"), 0.1, old)
+    assert cache.get("q", DENSE, 3, new) is None
+    cache.put("q", DENSE, 3, hits_for("new"), 0.1, new)
+    assert cache.get("q", DENSE, 3, new) == hits_for("new")
+
+
+def test_semantic_hits_respect_threshold_and_top_k():
+    system = object()
+    cache = ResultCache(threshold=0.9)
+    cache.use(system)
+    vector = np.array([1.0, 0.0, 0.0, 0.0], dtype=np.float32)
+    cache.put("q", DENSE, 3, hits_for("q"), 0.1, system, vector * 5)
+
+    assert cache.get_similar(at_cosine(0.95), DENSE, 3, system) == hits_for("q")
+    assert cache.get_similar(at_cosine(0.95), DENSE, 2, system) == hits_for("q")[:2]
+    assert cache.get_similar(at_cosine(0.85), DENSE, 3, system) is None
+    # A cached result never serves a deeper request
+    assert cache.get_similar(vector, DENSE, 4, system) is None
+    stats = cache.stats()
+    assert (stats['semantic_hits'], stats['misses']) == (2, 2)
+
+
+def test_callers_can_mutate_their_hits():
+    system = object()
+    cache = ResultCache()
+    cache.use(system)
+    original = hits_for("q")
+    cache.put("q", DENSE, 3, original, 0.1, system)
+    # The first caller gets the hits it cached, and annotates them
+    original[0]['also_in'] = [{'paper_id': 7}]
+    served = cache.get("q", DENSE, 3, system)
+    assert served == hits_for("q")
+    served[0]['rank'] = 99
+    served.pop()
+    assert cache.get("q", DENSE, 3, system) == hits_for("q")
@@ -0,0 +1,113 @@
+import json
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+from answer import AnswerGenerator, ContextPacker, StubLLM
+from benchmark import fixture_papers
+from conftest import HashingModel
+from lexical_index import synthetic_texts
+from metadata_store import PaperTable
+from query_batcher import QueryBatcher
+from sharded_index import ShardedRAGSystem, shard_spec
+
+TEXTS = synthetic_texts(40, vocab_size=5000, doc_length=40, seed=5)
+QUERY = TEXTS[0]
+
+
+@pytest.fixture
+def client(app, byte_encoding, tmp_path, monkeypatch):
+    """The app serving one small shard: four papers of ten chunks each, embedded with the hashing model."""
+    system = app.ArxivRAGSystem(cache_path=str(tmp_path / "embedding_cache.sqlite"), rerank_model=None,
+                                embedding_processes=0)
+    system.resources['encoder'] = byte_encoding
+    system.embedding_engine.loaded_model = HashingModel()
+    system.papers = PaperTable(fixture_papers(4, "http://localhost"))
+    chunks = {}
+    for paper in range(4):
+        texts = TEXTS[10 * paper:10 * paper + 10]
+        chunks[paper] = (texts, [(0, len(text)) for text in texts], np.zeros((10, 2), dtype=np.int32))
+    system.append_chunks(chunks)
+    system.create_embeddings()
+    system.build_faiss_index()
+    system.build_lexical_index()
+    sharded = ShardedRAGSystem(system, [shard_spec('cs.CL', 'cs.CL')], root=str(tmp_path), shards={'cs.CL': system})
+    monkeypatch.setattr(app, 'rag_system', sharded)
+    monkeypatch.setattr(app, 'query_batcher', QueryBatcher(lambda: sharded, max_wait_ms=0))
+    generator = AnswerGenerator(StubLLM())
+    generator._packer = ContextPacker(byte_encoding, generator.budget_tokens)
+    monkeypatch.setattr(app, 'answer_generator', generator)
+    # Not entered as a context manager, so startup doesn't load the shards from disk
+    return TestClient(app.app)
+
+
+def ndjson_events(response):
+    assert response.headers['content-type'].startswith("application/x-ndjson")
+    assert response.text.endswith("\n") and "\n\n" not in response.text
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+def sse_events(response):
+    """Parse server-sent events into the NDJSON form ({"event": name, **data})."""
+    assert response.headers['content-type'].startswith("text/event-stream")
+    assert response.text.endswith("\n\n")
+    events = []
+    for frame in response.text[:-2].split("\n\n"):
+        name, data = frame.split("\n")
+        assert name.startswith("event: ") and data.startswith("data: ")
+        events.append({'event': name[len("event: "):], **json.loads(data[len("data: "):])})
+    return events
+
+
+def stream(client, **form):
+    return client.post("/search/stream", data={'query': QUERY, 'limit': 4, **form})
+
+
+def without_timings(events):
+    return [{key: value for key, value in event.items() if not key.endswith('_ms')} for event in events]
+
+
+def test_ndjson_stream_sends_each_hit_with_its_new_papers(client):
+    response = stream(client, mode="dense")
+    assert response.headers['cache-control'] == "no-cache" and response.headers['x-accel-buffering'] == "no"
+    events = ndjson_events(response)
+    assert [event['event'] for event in events] == ["start"] + ["hit"] * 4 + ["done"]
+    assert events[0]['query'] == QUERY and events[0]['mode'] == "dense"
+    hits = [event['hit'] for event in events[1:-1]]
+    assert [hit['rank'] for hit in hits] == [1, 2, 3, 4] and all(event['final'] for event in events[1:-1])
+    assert hits[0]['chunk'] == TEXTS[0]
+    # Every paper's metadata is sent once, with its first hit
+    sent = [paper_id for event in events[1:-1] for paper_id in event['papers']]
+    assert len(sent) == len(set(sent)) and set(sent) == {hit['paper_id'] for hit in hits}
+    assert events[-1]['hits'] == 4 and events[-1]['first_result_ms'] is not None
+
+
+def test_sse_frames_carry_the_same_events(client):
+    for form in ({'mode': "hybrid"}, {'mode': "lexical", 'group': "true"}):
+        ndjson = ndjson_events(stream(client, **form))
+        sse = sse_events(stream(client, format="sse", **form))
+        assert without_timings(sse) == without_timings(ndjson)
+    assert [event['event'] for event in sse] == ["start"] + ["group"] * (len(sse) - 2) + ["done"]
+    assert sse[-1]['total'] >= len(sse) - 2
+
+
+def test_answer_events_follow_the_hits(client):
+    events = ndjson_events(stream(client, mode="dense", answer="true"))
+    names = [event['event'] for event in events]
+    assert names[:5] == ["start"] + ["hit"] * 4 and names[5] == "sources"
+    assert names[6:-2] == ["token"] * (len(names) - 8) and names[-2:] == ["answer", "done"]
+    assert "".join(event['text'] for event in events[6:-2]) == events[-2]['answer']
+
+
+def test_invalid_requests_get_a_plain_error_and_failures_end_the_stream(app, client, monkeypatch):
+    response = stream(client, format="xml")
+    assert response.json() == {"error": "Unknown stream format: xml (ndjson or sse)"}
+    assert "error" in stream(client, published_from="last week").json()
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("index unavailable")
+    monkeypatch.setattr(app.rag_system, 'search_embeddings', fail)
+    events = sse_events(stream(client, format="sse"))
+    assert [event['event'] for event in events] == ["start", "error"]
+    assert events[-1]['error'] == "index unavailable"
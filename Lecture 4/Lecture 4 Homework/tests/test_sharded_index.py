@@ -0,0 +1,71 @@
+from sharded_index import ShardedRAGSystem, shard_spec
+
+
+class FakeShard:
+    """Returns canned, already ranked dense and BM25 hits for every query."""
+
+    def __init__(self, similarities, bm25=None):
+        self.similarities = similarities
+        self.bm25 = bm25 or {}
+
+    def is_initialized(self):
+        return True
+
+    def search_embeddings(self, query_embeddings, top_k, queries, mode, fusion, alpha, filters=None, top_papers=0):
+        if mode == "lexical":
+            ranked = sorted(self.bm25.items(), key=lambda item: -item[1])[:top_k]
+            hits = [{'chunk_id': i, 'paper_id': i, 'similarity_score': self.similarities[i], 'bm25_score': score}
+                    for i, score in ranked]
+        else:
+            hits = [{'chunk_id': i, 'paper_id': i, 'similarity_score': score}
+                    for i, score in enumerate(self.similarities[:top_k])]
+            if mode == "hybrid":
+                # Per-shard RRF: depends on the rank within this shard only
+                for rank, hit in enumerate(hits):
+                    hit['fusion_score'] = 1 / (61 + rank)
+        return [[dict(hit) for hit in hits] for _ in query_embeddings]
+
+
+def sharded(**shards):
+    specs = [shard_spec(name, name) for name in shards]
+    return ShardedRAGSystem(None, specs, shards=shards)
+
+
+def chunk_ids(hits):
+    return [hit['chunk_id'] for hit in hits]
+
+
+def test_dense_hits_are_merged_by_score_across_shards():
+    system = sharded(a=FakeShard([0.9, 0.5, 0.1]), b=FakeShard([0.8, 0.7]))
+    hits = system.search_embeddings([[0.0]], top_k=4, queries=["q"])[0]
+    assert chunk_ids(hits) == ["a:0", "b:0", "b:1", "a:1"]
+    assert [hit['rank'] for hit in hits] == [1, 2, 3, 4]
+
+
+def test_hybrid_fuses_global_rankings_across_shards():
+    # Shard a holds the relevant chunks for both retrievers, shard b weak matches
+    relevant = FakeShard([0.9, 0.85, 0.8], {0: 12.0, 1: 11.0, 2: 10.0})
+    weak = FakeShard([0.3, 0.2], {0: 1.0, 1: 0.5})
+    system = sharded(a=relevant, b=weak)
+    for fusion in ("rrf", "weighted"):
+        hits = system.search_embeddings([[0.0]], top_k=5, queries=["q"], mode="hybrid", fusion=fusion)[0]
+        # Merging per-shard fused scores would alternate a:0, b:0, a:1, b:1, ...
+        assert chunk_ids(hits) == ["a:0", "a:1", "a:2", "b:0", "b:1"]
+        assert all('bm25_score' not in hit and 'fusion_score' in hit for hit in hits)
+        assert [hit['fusion_score'] for hit in hits] == sorted((hit['fusion_score'] for hit in hits), reverse=True)
+
+
+def test_hybrid_rrf_matches_a_single_index():
+    system = sharded(a=FakeShard([0.9, 0.6], {1: 5.0}), b=FakeShard([0.7], {0: 9.0}))
+    hits = system.search_embeddings([[0.0]], top_k=3, queries=["q"], mode="hybrid")[0]
+    # Dense: a:0, b:0, a:1; BM25: b:0, a:1. b:0 ranks 2nd and 1st, a:1 3rd and 2nd, a:0 1st only
+    scores = {"b:0": 1 / 62 + 1 / 61, "a:1": 1 / 63 + 1 / 62, "a:0": 1 / 61}
+    assert chunk_ids(hits) == ["b:0", "a:1", "a:0"]
+    assert all(abs(hit['fusion_score'] - scores[hit['chunk_id']]) < 1e-6 for hit in hits)
+
+
+def test_single_shard_keeps_its_own_fusion():
+    system = sharded(a=FakeShard([0.9, 0.5], {1: 3.0}), b=FakeShard([1.0]))
+    hits = system.search_embeddings([[0.0]], top_k=2, queries=["q"], mode="hybrid", shards=["a"])[0]
+    assert chunk_ids(hits) == ["a:0", "a:1"]
+    assert hits[0]['fusion_score'] == 1 / 61
@@ -0,0 +1,18 @@
+from fastapi.testclient import TestClient
+
+
+def test_lifespan_loads_nothing_heavy_and_closes_resources(app, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    base = app.rag_system.base
+    monkeypatch.setattr(base, 'embedding_cache', app.EmbeddingCache(str(tmp_path / "embedding_cache.sqlite")))
+    with TestClient(app.app) as client:
+        status = client.get("/status").json()
+        assert status['startup']['shards_loaded'] == 0
+        assert (tmp_path / "templates" / "index.html").exists()
+        # Nothing heavy is loaded by startup alone
+        assert not status['startup']['model_loaded'] and 'encoder' not in base.resources
+        assert base.embedding_cache.conn is None
+        with base.embedding_cache.lock:
+            base.embedding_cache.connection()
+    assert base.embedding_cache.conn is None
+    assert base.page_extractor.pool is None
@@ -0,0 +1,61 @@
+import numpy as np
+from benchmark import fixture_papers
+from conftest import HashingModel
+
+QUERIES = ["page 2 of paper 3", "synthetic benchmark text", "paper 5 page 1", "retrieval"]
+
+
+def make_system(app, encoding, tmp_path, model, cache="embedding_cache.sqlite"):
+    system = app.ArxivRAGSystem(cache_path=str(tmp_path / cache), rerank_model=None, embedding_processes=0)
+    system.resources['encoder'] = encoding
+    system.embedding_engine.loaded_model = model
+    return system
+
+
+def results(system, mode):
+    """Hits as (arXiv ID, chunk text, score), which don't depend on chunk ID assignment."""
+    hit_lists = system.search_embeddings(system.encode_queries(QUERIES), top_k=8, queries=QUERIES, mode=mode)
+    score = 'bm25_score' if mode == "lexical" else 'similarity_score'
+    return [[(system.papers.value(hit['paper_id'], 'arxiv_id'), hit['chunk'], round(hit[score], 4))
+             for hit in hits] for hits in hit_lists]
+
+
+def test_add_and_remove_match_a_full_build(app, byte_encoding, pdf_server, tmp_path):
+    papers = fixture_papers(6, pdf_server.url)
+    model = HashingModel()
+    system = make_system(app, byte_encoding, tmp_path, model)
+    assert system.add_papers(papers[:4])['papers'] == 4
+    indexed = system.faiss_index.ntotal
+    stats = system.add_papers(papers[2:])
+    # Already indexed papers are skipped; only the new chunks are embedded and added
+    assert stats['papers'] == 2
+    assert system.faiss_index.ntotal == indexed + stats['chunks'] - stats['duplicates']
+    assert len(model.encoded) == len(system.indexed_chunk_ids())
+    removed = system.remove_papers(["bench.00001", "not.indexed"])
+    assert removed['papers'] == 1 and removed['chunks'] > 0
+    assert "bench.00001" not in system.papers.by_arxiv_id
+    assert (system.chunk_to_paper[system.indexed_chunk_ids()] != 1).all()
+
+    # A build of the remaining papers from scratch, sharing the embedding cache, encodes nothing
+    fresh_model = HashingModel()
+    fresh = make_system(app, byte_encoding, tmp_path, fresh_model)
+    fresh.add_papers([paper for paper in papers if paper['arxiv_id'] != "bench.00001"])
+    assert fresh_model.encoded == []
+    assert system.faiss_index.ntotal == fresh.faiss_index.ntotal
+    for mode in ("dense", "lexical", "hybrid"):
+        assert results(system, mode) == results(fresh, mode)
+    np.testing.assert_allclose(system.embeddings[system.indexed_chunk_ids()],
+                               fresh.embeddings[fresh.indexed_chunk_ids()])
+
+
+def test_sync_removes_missing_and_adds_new_papers(app, byte_encoding, pdf_server, tmp_path):
+    papers = fixture_papers(6, pdf_server.url)
+    system = make_system(app, byte_encoding, tmp_path, HashingModel())
+    system.add_papers(papers[:3])
+    stats = system.sync_papers(papers[1:5])
+    assert stats['removed']['papers'] == 1 and stats['added']['papers'] == 2
+    assert sorted(system.papers.by_arxiv_id) == [paper['arxiv_id'] for paper in papers[1:5]]
+    live = set(system.chunk_to_paper[system.live_chunk_ids()].tolist())
+    assert live == {1, 2, 3, 4}
+    assert not any(hit['paper_id'] == 0 for hits in system.search_embeddings(
+        system.encode_queries(QUERIES), top_k=20, queries=QUERIES, mode="hybrid") for hit in hits)